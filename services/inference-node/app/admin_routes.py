@@ -7,6 +7,7 @@ Provides real-time metrics and analytics for translation operations:
 - Model performance metrics
 - Error tracking and analysis
 - Per-user translation statistics
+- Authentication principal cache statistics
 """
 
 from typing import Dict, Any, Optional, List
@@ -14,7 +15,7 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from loguru import logger
 
-from .auth import User, get_current_user
+from .auth import User, get_current_user, principal_cache
 from .translation_integration import get_translation_service
 from .translation_audit import get_audit_logger
 
@@ -410,3 +411,24 @@ async def admin_health(
             "error": str(e),
             "timestamp": datetime.utcnow().isoformat(),
         }
+
+
+@router.get("/auth/principal-cache")
+async def get_principal_cache_stats(
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Get authenticated-principal cache statistics.
+    
+    Hits are authenticated requests served without a users lookup.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    
+    return {
+        **principal_cache.get_stats(),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
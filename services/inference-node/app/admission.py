@@ -0,0 +1,326 @@
+"""
+Token-budget admission control for LLM backends.
+
+Each backend (llama.cpp replica, keyed by its URL) gets a budget of in-flight estimated tokens
+(prompt + max_tokens). Requests beyond the budget wait in a priority queue;
+when the queue is full or a request waits too long it is shed with a
+Retry-After hint instead of piling up inside llama-server until httpx times out.
+
+Shedding:
+- 429 when the backend queue is full (client should back off)
+- 503 when a queued request exceeds ADMISSION_MAX_QUEUE_WAIT_S (backend saturated)
+- 503 immediately when the latency model predicts the queue wait would exceed
+  ADMISSION_MAX_QUEUE_WAIT_S anyway (callers pass the request's predicted
+  service time; non-CRITICAL requests only)
+A full queue sheds its lowest-priority waiter to make room for a higher-priority
+request, and CRITICAL requests (Clinical) may use ADMISSION_CRITICAL_HEADROOM
+beyond the budget.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from loguru import logger
+
+from .replica_pool import normalize_url
+from .task_queue import TaskPriority
+
+
+def _parse_budgets(value: str) -> Dict[str, int]:
+    """Parse "8080=16384,10.0.0.2:8080=4096" into {"http://127.0.0.1:8080": 16384, "http://10.0.0.2:8080": 4096}."""
+    budgets: Dict[str, int] = {}
+    for item in value.split(","):
+        if "=" in item:
+            address, budget = item.rsplit("=", 1)
+            budgets[normalize_url(address)] = int(budget)
+    return budgets
+
+
+# In-flight token budget per backend (override per replica, "port" or "host:port", with ADMISSION_TOKEN_BUDGETS)
+ADMISSION_TOKEN_BUDGET = int(os.getenv("ADMISSION_TOKEN_BUDGET", "8192"))
+ADMISSION_TOKEN_BUDGETS = _parse_budgets(os.getenv("ADMISSION_TOKEN_BUDGETS", ""))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "32"))
+ADMISSION_MAX_QUEUE_WAIT_S = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_S", "20"))
+# Fraction of the budget CRITICAL requests may exceed it by
+ADMISSION_CRITICAL_HEADROOM = float(os.getenv("ADMISSION_CRITICAL_HEADROOM", "0.25"))
+
+# Agent priorities (agents not listed are NORMAL)
+AGENT_PRIORITIES: Dict[str, TaskPriority] = {
+    "Clinical": TaskPriority.CRITICAL,  # Clinical decision support
+    "AIDoctor": TaskPriority.HIGH,
+    "MedicalQA": TaskPriority.HIGH,
+    "Billing": TaskPriority.LOW,
+    "Claims": TaskPriority.LOW,
+    "Documentation": TaskPriority.LOW,
+    "Monitoring": TaskPriority.LOW,
+}
+
+
+def agent_priority(agent_type: str) -> TaskPriority:
+    return AGENT_PRIORITIES.get(agent_type, TaskPriority.NORMAL)
+
+
+class AdmissionRejected(Exception):
+    """Request shed by admission control."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+@dataclass(order=True)
+class _Waiter:
+    sort_key: tuple  # (-priority, sequence): highest priority first, FIFO within a priority
+    tokens: int = field(compare=False)
+    priority: TaskPriority = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    predicted_s: Optional[float] = field(default=None, compare=False)
+
+
+@dataclass
+class BackendState:
+    """Admission state and counters for one backend."""
+    budget: int
+    in_flight_tokens: int = 0
+    in_flight_requests: int = 0
+    queue: List[_Waiter] = field(default_factory=list)  # heap
+    admitted: int = 0
+    queued: int = 0
+    shed_queue_full: int = 0
+    shed_timeout: int = 0
+    shed_predicted: int = 0
+    service_time_ewma_s: float = 0.0
+    queue_waits_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+    def fits(self, tokens: int, priority: TaskPriority) -> bool:
+        if self.in_flight_requests == 0:
+            return True  # Always admit one request, however large
+        budget = self.budget
+        if priority == TaskPriority.CRITICAL:
+            budget = int(budget * (1 + ADMISSION_CRITICAL_HEADROOM))
+        return self.in_flight_tokens + tokens <= budget
+
+
+@dataclass
+class AdmissionTicket:
+    backend: str
+    tokens: int
+    admitted_at: float
+    queue_wait_ms: float
+
+
+class AdmissionController:
+    """Per-backend token budgets with a priority wait queue."""
+
+    def __init__(
+        self,
+        default_budget: int = ADMISSION_TOKEN_BUDGET,
+        budgets: Optional[Dict[str, int]] = None,
+        max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+        max_queue_wait_s: float = ADMISSION_MAX_QUEUE_WAIT_S,
+    ):
+        self.default_budget = default_budget
+        self.budgets = budgets if budgets is not None else ADMISSION_TOKEN_BUDGETS
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait_s = max_queue_wait_s
+        self.backends: Dict[str, BackendState] = {}
+        self._sequence = itertools.count()
+
+    def _state(self, backend: str) -> BackendState:
+        if backend not in self.backends:
+            self.backends[backend] = BackendState(budget=self.budgets.get(backend, self.default_budget))
+        return self.backends[backend]
+
+    def _retry_after(self, state: BackendState) -> float:
+        """Rough time until capacity frees up: queued requests x typical service time."""
+        service = state.service_time_ewma_s or 1.0
+        queued = sum(w.predicted_s or service for w in state.queue)
+        return (queued + service) / max(1, state.in_flight_requests)
+
+    def _predicted_wait(self, state: BackendState, priority: TaskPriority, predicted_s: float) -> float:
+        """Expected queue wait: predicted service time of waiters ahead, spread over in-flight slots."""
+        service = state.service_time_ewma_s or predicted_s
+        ahead = sum(w.predicted_s or service for w in state.queue if w.priority >= priority)
+        return (ahead + service) / max(1, state.in_flight_requests)
+
+    async def acquire(
+        self,
+        backend: str,
+        tokens: int,
+        priority: TaskPriority = TaskPriority.NORMAL,
+        predicted_s: Optional[float] = None,
+    ) -> AdmissionTicket:
+        """Admit a request or wait for budget; raises AdmissionRejected when shed.
+
+        predicted_s is the latency model's expected service time for the request (p50);
+        with it, a request that would time out in the queue anyway is shed immediately.
+        """
+        state = self._state(backend)
+        start = time.monotonic()
+
+        if not state.queue and state.fits(tokens, priority):
+            return self._admit(state, backend, tokens, start)
+
+        if predicted_s is not None and priority < TaskPriority.CRITICAL:
+            expected_wait = self._predicted_wait(state, priority, predicted_s)
+            if expected_wait > self.max_queue_wait_s:
+                state.shed_predicted += 1
+                logger.warning(
+                    f"Admission: {backend} predicted wait {expected_wait:.1f}s, shedding {priority.name} request"
+                )
+                raise AdmissionRejected(503, f"Backend {backend} is overloaded", expected_wait)
+
+        if len(state.queue) >= self.max_queue_depth:
+            lowest = max(state.queue)  # lowest priority, newest
+            if lowest.priority >= priority:
+                state.shed_queue_full += 1
+                logger.warning(f"Admission: {backend} queue full, shedding {priority.name} request")
+                raise AdmissionRejected(429, f"Backend {backend} is at capacity", self._retry_after(state))
+            # Make room for the higher-priority request
+            state.queue.remove(lowest)
+            heapq.heapify(state.queue)
+            state.shed_queue_full += 1
+            lowest.future.set_exception(
+                AdmissionRejected(429, f"Backend {backend} is at capacity", self._retry_after(state))
+            )
+
+        waiter = _Waiter(
+            sort_key=(-int(priority), next(self._sequence)),
+            tokens=tokens,
+            priority=priority,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=start,
+            predicted_s=predicted_s,
+        )
+        heapq.heappush(state.queue, waiter)
+        state.queued += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_queue_wait_s)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.exception():
+                return self._ticket(backend, tokens, start)  # Admitted at the deadline
+            self._drop_waiter(state, waiter)
+            state.shed_timeout += 1
+            logger.warning(f"Admission: {backend} {priority.name} request waited {self.max_queue_wait_s}s, shedding")
+            raise AdmissionRejected(503, f"Backend {backend} is overloaded", self._retry_after(state))
+        except asyncio.CancelledError:
+            # Client went away: give back budget if we were admitted meanwhile
+            if waiter.future.done() and not waiter.future.cancelled() and not waiter.future.exception():
+                self.release(self._ticket(backend, tokens, start))
+            else:
+                self._drop_waiter(state, waiter)
+            raise
+
+        return self._ticket(backend, tokens, start)
+
+    def release(self, ticket: AdmissionTicket):
+        """Return a request's tokens to its backend budget and wake waiters."""
+        state = self._state(ticket.backend)
+        state.in_flight_tokens -= ticket.tokens
+        state.in_flight_requests -= 1
+        service_s = time.monotonic() - ticket.admitted_at
+        state.service_time_ewma_s = (
+            service_s if state.service_time_ewma_s == 0 else 0.8 * state.service_time_ewma_s + 0.2 * service_s
+        )
+        self._wake(state)
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        backend: str,
+        tokens: int,
+        priority: TaskPriority = TaskPriority.NORMAL,
+        predicted_s: Optional[float] = None,
+    ):
+        ticket = await self.acquire(backend, tokens, priority, predicted_s)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _admit(self, state: BackendState, backend: str, tokens: int, start: float) -> AdmissionTicket:
+        state.in_flight_tokens += tokens
+        state.in_flight_requests += 1
+        state.admitted += 1
+        return self._ticket(backend, tokens, start)
+
+    def _ticket(self, backend: str, tokens: int, start: float) -> AdmissionTicket:
+        now = time.monotonic()
+        wait_ms = (now - start) * 1000
+        self._state(backend).queue_waits_ms.append(wait_ms)
+        return AdmissionTicket(backend=backend, tokens=tokens, admitted_at=now, queue_wait_ms=wait_ms)
+
+    def _wake(self, state: BackendState):
+        """Admit queued requests in priority order while the budget allows."""
+        while state.queue:
+            head = state.queue[0]
+            if head.future.done():
+                heapq.heappop(state.queue)
+                continue
+            if not state.fits(head.tokens, head.priority):
+                break
+            heapq.heappop(state.queue)
+            state.in_flight_tokens += head.tokens
+            state.in_flight_requests += 1
+            state.admitted += 1
+            head.future.set_result(True)
+
+    @staticmethod
+    def _drop_waiter(state: BackendState, waiter: _Waiter):
+        if waiter in state.queue:
+            state.queue.remove(waiter)
+            heapq.heapify(state.queue)
+        if not waiter.future.done():
+            waiter.future.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-backend budget usage, queue depth, shedding and queue-wait percentiles."""
+        backends = {}
+        for name, state in self.backends.items():
+            waits = sorted(state.queue_waits_ms)
+            backends[name] = {
+                "budget_tokens": state.budget,
+                "in_flight_tokens": state.in_flight_tokens,
+                "in_flight_requests": state.in_flight_requests,
+                "queue_depth": len(state.queue),
+                "admitted": state.admitted,
+                "queued": state.queued,
+                "shed_queue_full": state.shed_queue_full,
+                "shed_timeout": state.shed_timeout,
+                "shed_predicted": state.shed_predicted,
+                "queue_wait_p50_ms": round(waits[len(waits) // 2], 2) if waits else 0.0,
+                "queue_wait_p95_ms": round(waits[max(0, int(len(waits) * 0.95) - 1)], 2) if waits else 0.0,
+                "queue_wait_max_ms": round(waits[-1], 2) if waits else 0.0,
+                "service_time_ewma_s": round(state.service_time_ewma_s, 3),
+            }
+        return {
+            "default_budget_tokens": self.default_budget,
+            "max_queue_depth": self.max_queue_depth,
+            "max_queue_wait_s": self.max_queue_wait_s,
+            "backends": backends,
+        }
+
+
+# Global admission controller
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController()
+    return _admission_controller
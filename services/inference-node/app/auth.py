@@ -2,16 +2,21 @@
 JWT Authentication Module with Database Integration
 Handles token generation, validation, and user authentication against PostgreSQL.
 """
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import select, event
 from sqlalchemy.ext.asyncio import AsyncSession
+from loguru import logger
 
 from app.database import get_db, User as DBUser
 
@@ -20,6 +25,11 @@ JWT_SECRET = os.getenv("JWT_SECRET", "INSECURE_DEV_SECRET_CHANGE_IN_PRODUCTION")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRY_HOURS = int(os.getenv("JWT_EXPIRY_HOURS", "24"))
 
+# Authenticated-principal cache: repeat requests with the same token skip JWT
+# decoding and the users lookup for up to AUTH_CACHE_TTL_SECONDS (0 disables)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -39,6 +49,135 @@ class User(BaseModel):
     username: str
     location_id: str
     disabled: bool = False
+    is_admin: bool = False
+
+
+class PrincipalCache:
+    """
+    Short-TTL cache of authenticated users, keyed by SHA-256 of the bearer token.
+    
+    Entries never outlive the token's own expiry. Password changes and
+    deactivations call invalidate_user(); the cache is per process, so other
+    workers see the change within the TTL.
+    """
+    
+    def __init__(self, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()  # token hash -> (user, expires_at)
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+        self._invalidations = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+    
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    def get(self, token: str) -> Optional[User]:
+        """Cached principal for a token, or None on miss/expiry."""
+        if not self.enabled:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            user, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key, user.username)
+                self._expired += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return user
+    
+    def put(self, token: str, user: User, token_expires: Optional[datetime] = None):
+        """Cache a principal until the TTL or the token's expiry, whichever is first."""
+        if not self.enabled:
+            return
+        ttl = self.ttl_seconds
+        if token_expires is not None:
+            ttl = min(ttl, token_expires.timestamp() - time.time())
+            if ttl <= 0:
+                return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            self._tokens_by_user.setdefault(user.username, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_user, _) = self._entries.popitem(last=False)
+                self._discard_user_token(old_user.username, old_key)
+                self._evictions += 1
+    
+    def invalidate_user(self, username: str):
+        """Drop every cached token for a user (password change, deactivation)."""
+        with self._lock:
+            keys = self._tokens_by_user.pop(username, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                self._invalidations += 1
+        if keys:
+            logger.debug(f"Invalidated {len(keys)} cached token(s) for {username}")
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+    
+    def _remove(self, key: str, username: str):
+        self._entries.pop(key, None)
+        self._discard_user_token(username, key)
+    
+    def _discard_user_token(self, username: str, key: str):
+        keys = self._tokens_by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tokens_by_user[username]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache statistics"""
+        total = self._hits + self._misses
+        hit_rate = (self._hits / total * 100) if total > 0 else 0
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "cache_hits": self._hits,
+            "cache_misses": self._misses,
+            "hit_rate_percent": round(hit_rate, 2),
+            "expired": self._expired,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+            "cache_size": len(self._entries),
+        }
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate_cached_user(username: str):
+    """Drop cached principals for a user; call after changing credentials or status."""
+    principal_cache.invalidate_user(username)
+
+
+@event.listens_for(DBUser.hashed_password, "set")
+@event.listens_for(DBUser.is_active, "set")
+def _invalidate_on_credential_change(target, value, oldvalue, initiator):
+    """ORM attribute changes (e.g. user.is_active = False) invalidate cached tokens."""
+    if target.username:
+        principal_cache.invalidate_user(target.username)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -110,7 +249,9 @@ async def get_current_user(
 ) -> User:
     """
     FastAPI dependency to extract and validate current user from JWT token.
-    Verifies user exists in database and is active.
+    Verifies user exists in database and is active. Verified principals are
+    cached per token for AUTH_CACHE_TTL_SECONDS, so repeat requests skip JWT
+    decoding and the users lookup.
     
     Args:
         credentials: HTTP Bearer credentials from request header
@@ -123,6 +264,10 @@ async def get_current_user(
         HTTPException: If authentication fails
     """
     token = credentials.credentials
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached
+    
     token_data = verify_token(token)
     
     # Look up user in database
@@ -145,8 +290,10 @@ async def get_current_user(
     user = User(
         username=db_user.username,
         location_id=db_user.location_id,
-        disabled=not db_user.is_active
+        disabled=not db_user.is_active,
+        is_admin=db_user.is_admin,
     )
+    principal_cache.put(token, user, token_data.expires)
     
     return user
 
@@ -0,0 +1,180 @@
+"""
+Circuit breakers per LLM backend replica (keyed by URL, so replicas of
+different hosts serving on the same port fail independently).
+
+A backend that keeps failing is short-circuited instead of being retried by
+every request (MAX_RETRIES attempts with sleeps, then the same again for each
+FALLBACK_CHAIN model):
+
+- CLOSED: requests pass; CIRCUIT_FAILURE_THRESHOLD consecutive failures open it
+- OPEN: requests fail immediately for CIRCUIT_COOLDOWN_S
+- HALF_OPEN: after the cool-down, CIRCUIT_HALF_OPEN_MAX_CALLS trial requests
+  pass; a success closes the breaker, a failure opens it again
+
+State is exported on /healthz and as the Prometheus gauge
+llm_circuit_breaker_state (0 closed, 1 half-open, 2 open).
+"""
+import os
+import time
+from enum import Enum
+from typing import Any, Dict, Optional
+from loguru import logger
+
+from .replica_pool import normalize_url
+
+try:
+    from prometheus_client import Counter, Gauge
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN_S = float(os.getenv("CIRCUIT_COOLDOWN_S", "30"))
+CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_MAX_CALLS", "1"))
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+
+_STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+if PROMETHEUS_AVAILABLE:
+    BREAKER_STATE = Gauge(
+        "llm_circuit_breaker_state", "Circuit breaker state per LLM backend (0 closed, 1 half-open, 2 open)", ["backend"]
+    )
+    BREAKER_TRANSITIONS = Counter(
+        "llm_circuit_breaker_transitions_total", "Circuit breaker state changes per LLM backend", ["backend", "state"]
+    )
+    BREAKER_REJECTED = Counter(
+        "llm_circuit_breaker_rejected_total", "Requests short-circuited by an open breaker", ["backend"]
+    )
+
+
+class CircuitOpenError(Exception):
+    """Backend skipped because its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one backend."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        cooldown_s: float = CIRCUIT_COOLDOWN_S,
+        half_open_max_calls: int = CIRCUIT_HALF_OPEN_MAX_CALLS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.times_opened = 0
+        self.rejected = 0
+        if PROMETHEUS_AVAILABLE:
+            BREAKER_STATE.labels(backend=name).set(0)
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and time.monotonic() - self.opened_at >= self.cooldown_s:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def allow_request(self) -> bool:
+        """True if a request may be sent now (counts half-open trial calls)."""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and self.half_open_calls < self.half_open_max_calls:
+            self.half_open_calls += 1
+            return True
+        self.rejected += 1
+        if PROMETHEUS_AVAILABLE:
+            BREAKER_REJECTED.labels(backend=self.name).inc()
+        return False
+
+    def is_open(self) -> bool:
+        """Open and not yet due for a trial request (does not consume a trial call)."""
+        state = self.state
+        return state == CircuitState.OPEN or (
+            state == CircuitState.HALF_OPEN and self.half_open_calls >= self.half_open_max_calls
+        )
+
+    def cancel_trial(self):
+        """Give back a half-open trial call whose request was cancelled before completing."""
+        if self._state == CircuitState.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self._state != CircuitState.CLOSED:
+            self._transition(CircuitState.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._state == CircuitState.HALF_OPEN or (
+            self._state == CircuitState.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState):
+        self._state = state
+        self.half_open_calls = 0
+        if state == CircuitState.OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            logger.warning(f"Circuit breaker {self.name} OPEN for {self.cooldown_s:.0f}s")
+        elif state == CircuitState.CLOSED:
+            self.consecutive_failures = 0
+            logger.info(f"Circuit breaker {self.name} closed")
+        if PROMETHEUS_AVAILABLE:
+            BREAKER_STATE.labels(backend=self.name).set(_STATE_VALUES[state])
+            BREAKER_TRANSITIONS.labels(backend=self.name, state=state.value).inc()
+
+    def get_stats(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "state": state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in_s": (
+                round(max(0.0, self.cooldown_s - (time.monotonic() - self.opened_at)), 1)
+                if state == CircuitState.OPEN else 0.0
+            ),
+        }
+
+
+class CircuitBreakerRegistry:
+    """One breaker per backend replica URL, created on first use (a bare port means the local server)."""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, replica: str) -> CircuitBreaker:
+        url = normalize_url(replica)
+        if url not in self.breakers:
+            self.breakers[url] = CircuitBreaker(url)
+        return self.breakers[url]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Breaker state per backend replica URL."""
+        return {url: breaker.get_stats() for url, breaker in self.breakers.items()}
+
+
+# Global breaker registry
+_circuit_breakers: Optional[CircuitBreakerRegistry] = None
+
+
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    global _circuit_breakers
+    if _circuit_breakers is None:
+        _circuit_breakers = CircuitBreakerRegistry()
+    return _circuit_breakers
@@ -0,0 +1,117 @@
+"""
+Single-flight request coalescing for LLM generation.
+
+Concurrent identical requests (same agent, prompt including persona and RAG
+context, model, backend and sampling parameters) share one upstream call: the first caller starts it, later callers
+await the same result. The upstream call runs in its own task, so a leader
+whose client disconnects does not cancel the generation for the others.
+
+Only agents in COALESCE_AGENTS are coalesced, and by default only
+deterministic (temperature 0) requests, where every caller would receive the
+same completion anyway.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+COALESCE_AGENTS = {
+    a.strip() for a in os.getenv("COALESCE_AGENTS", "Claims,ClaimsOCR,Billing,Triage,Scribe").split(",")
+    if a.strip()
+}
+# Coalesce only temperature 0 requests; false also shares sampled completions
+COALESCE_DETERMINISTIC_ONLY = os.getenv("COALESCE_DETERMINISTIC_ONLY", "true").lower() in {"1", "true", "yes"}
+
+
+class RequestCoalescer:
+    """Shares one in-flight upstream call among identical concurrent requests."""
+
+    def __init__(self, agents=None, deterministic_only: bool = COALESCE_DETERMINISTIC_ONLY):
+        self.agents = set(COALESCE_AGENTS if agents is None else agents)
+        self.deterministic_only = deterministic_only
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def enabled_for(self, agent_type: str, temperature: float) -> bool:
+        if agent_type not in self.agents:
+            return False
+        return temperature == 0 or not self.deterministic_only
+
+    @staticmethod
+    def make_key(
+        agent_type: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        backend: Any,
+        temperature: float,
+        max_tokens: int,
+    ) -> str:
+        """Hash of the agent and the prompt it sends upstream (persona / RAG system messages included)."""
+        raw = json.dumps([agent_type, messages, model, str(backend), temperature, max_tokens])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run `fn` once per key among concurrent callers.
+
+        Returns:
+            (result, shared) - shared is True when another caller's call was reused
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.upstream_calls += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        self.max_waiters = max(self.max_waiters, self._waiters[key])
+        try:
+            # shield: one caller's cancellation must not cancel the shared call
+            return await asyncio.shield(task), shared
+        finally:
+            remaining = self._waiters.get(key, 1) - 1
+            if remaining > 0:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Coalesced upstream call failed: {type(task.exception()).__name__}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Coalescing statistics"""
+        total = self.upstream_calls + self.coalesced
+        return {
+            "agents": sorted(self.agents),
+            "deterministic_only": self.deterministic_only,
+            "requests": total,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "coalesced_percent": round(self.coalesced / total * 100, 2) if total else 0.0,
+            "in_flight": len(self._in_flight),
+            "max_waiters": self.max_waiters,
+        }
+
+
+# Global coalescer
+_request_coalescer: Optional[RequestCoalescer] = None
+
+
+def get_request_coalescer() -> RequestCoalescer:
+    global _request_coalescer
+    if _request_coalescer is None:
+        _request_coalescer = RequestCoalescer()
+    return _request_coalescer
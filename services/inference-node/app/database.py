@@ -8,13 +8,16 @@ PostgreSQL chosen for:
 - Battle-tested: Industry standard for AI/ML applications
 """
 import os
-from typing import Optional, List, Dict, Any
+import re
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, DateTime, Text, Boolean, Integer, func, select, text
+from sqlalchemy import String, DateTime, Text, Boolean, Integer, Float, func, select, text, literal, literal_column, cast
 from sqlalchemy.dialects.postgresql import JSONB
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
 from loguru import logger
 
 
@@ -27,6 +30,48 @@ DATABASE_URL = os.getenv(
 # Vector dimension for embeddings (BGE-large: 1024, OpenAI: 1536, etc.)
 VECTOR_DIM = int(os.getenv("VECTOR_DIM", "1024"))
 
+# Embedding storage and index layout (halfvec / binary / matryoshka need pgvector >= 0.7)
+# VECTOR_STORAGE: column type - "vector" (float32) or "halfvec" (float16, half the heap and index size)
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()
+# VECTOR_INDEX_MODE: what the HNSW indexes are built over
+#   full        the stored embedding
+#   binary      binary_quantize(embedding), Hamming distance (1 bit per dimension)
+#   matryoshka  the first MATRYOSHKA_DIM dimensions (needs a Matryoshka-trained embedding model)
+# Quantized modes re-rank their candidates against the full-precision column.
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "full").lower()
+MATRYOSHKA_DIM = int(os.getenv("MATRYOSHKA_DIM", "256"))
+# Candidates taken from a quantized index per requested row before re-ranking
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+
+if VECTOR_STORAGE not in ("vector", "halfvec"):
+    raise ValueError(f"VECTOR_STORAGE must be 'vector' or 'halfvec', got '{VECTOR_STORAGE}'")
+if VECTOR_INDEX_MODE not in ("full", "binary", "matryoshka"):
+    raise ValueError(f"VECTOR_INDEX_MODE must be 'full', 'binary' or 'matryoshka', got '{VECTOR_INDEX_MODE}'")
+
+EmbeddingType = HALFVEC if VECTOR_STORAGE == "halfvec" else Vector
+
+# HNSW search tuning (pgvector)
+# ef_search is the candidate list size walked per query; filtered queries need a
+# larger list because rows rejected by the WHERE clause still consume candidates.
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+HNSW_FILTERED_EF_SEARCH = int(os.getenv("HNSW_FILTERED_EF_SEARCH", "200"))
+# Iterative index scans (pgvector >= 0.8): off, strict_order, relaxed_order
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+HNSW_MAX_SCAN_TUPLES = int(os.getenv("HNSW_MAX_SCAN_TUPLES", "20000"))
+
+# High-volume filter values that get their own partial HNSW index
+PARTIAL_INDEX_SPECIALTIES = [
+    s.strip() for s in os.getenv("PARTIAL_INDEX_SPECIALTIES", "cardiology,oncology,general_medicine").split(",")
+    if s.strip()
+]
+PARTIAL_INDEX_DOCUMENT_TYPES = [
+    s.strip() for s in os.getenv("PARTIAL_INDEX_DOCUMENT_TYPES", "clinical_guideline").split(",")
+    if s.strip()
+]
+
+# Characters of content returned with each search hit (citation excerpt length)
+EXCERPT_CHARS = int(os.getenv("SEARCH_EXCERPT_CHARS", "200"))
+
 
 class Base(DeclarativeBase):
     """Base class for all database models."""
@@ -106,7 +151,7 @@ class MedicalDocument(Base):
     
     # Vector embedding for semantic search (pgvector)
     # Use BGE-large-en-v1.5 (1024 dim) or similar medical embedding model
-    embedding: Mapped[List[float]] = mapped_column(Vector(VECTOR_DIM))
+    embedding: Mapped[List[float]] = mapped_column(EmbeddingType(VECTOR_DIM))
     
     source_url: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
     
@@ -134,7 +179,7 @@ class PatientContext(Base):
     content: Mapped[str] = mapped_column(Text)
     
     # Vector embedding for patient-specific semantic search
-    embedding: Mapped[List[float]] = mapped_column(Vector(VECTOR_DIM))
+    embedding: Mapped[List[float]] = mapped_column(EmbeddingType(VECTOR_DIM))
     
     location_id: Mapped[str] = mapped_column(String(50), index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -182,27 +227,59 @@ async def init_db():
         # Create all tables
         await conn.run_sync(Base.metadata.create_all)
         
-        # Create HNSW index for fast vector similarity search on medical documents
-        await conn.execute(text(
-            f"""
-            CREATE INDEX IF NOT EXISTS idx_medical_docs_embedding 
-            ON medical_documents 
-            USING hnsw (embedding vector_cosine_ops)
-            WITH (m = 16, ef_construction = 64)
-            """
-        ))
+        # HNSW indexes for fast vector similarity search (full-table and
+        # partial per high-volume specialty / document type)
+        for statement in hnsw_index_statements():
+            await conn.execute(text(statement))
         
-        # Create HNSW index for patient context
-        await conn.execute(text(
-            f"""
-            CREATE INDEX IF NOT EXISTS idx_patient_context_embedding 
-            ON patient_context 
-            USING hnsw (embedding vector_cosine_ops)
-            WITH (m = 16, ef_construction = 64)
-            """
-        ))
-        
-    logger.info("Database initialized with pgvector extension and HNSW indexes")
+    logger.info(
+        f"Database initialized with pgvector extension and HNSW indexes "
+        f"(storage={VECTOR_STORAGE}, index={VECTOR_INDEX_MODE})"
+    )
+
+
+def hnsw_index_target() -> Tuple[str, str]:
+    """Indexed expression and operator class for the configured storage/index mode."""
+    if VECTOR_INDEX_MODE == "binary":
+        return f"(binary_quantize(embedding)::bit({VECTOR_DIM}))", "bit_hamming_ops"
+    if VECTOR_INDEX_MODE == "matryoshka":
+        return (
+            f"(subvector(embedding, 1, {MATRYOSHKA_DIM})::{VECTOR_STORAGE}({MATRYOSHKA_DIM}))",
+            f"{VECTOR_STORAGE}_cosine_ops",
+        )
+    return "embedding", f"{VECTOR_STORAGE}_cosine_ops"
+
+
+def hnsw_index_statements() -> List[str]:
+    """CREATE INDEX statements for every HNSW index (used by init_db and migrations)."""
+    expression, opclass = hnsw_index_target()
+    using = f"USING hnsw ({expression} {opclass}) WITH (m = 16, ef_construction = 64)"
+    
+    statements = [
+        f"CREATE INDEX IF NOT EXISTS idx_medical_docs_embedding ON medical_documents {using}",
+        f"CREATE INDEX IF NOT EXISTS idx_patient_context_embedding ON patient_context {using}",
+    ]
+    
+    # Partial HNSW indexes for high-volume specialties / document types.
+    # A filtered query on one of these values walks a graph that only
+    # contains matching rows, so it never runs out of candidates.
+    for column, values in (
+        ("specialty", PARTIAL_INDEX_SPECIALTIES),
+        ("document_type", PARTIAL_INDEX_DOCUMENT_TYPES),
+    ):
+        for value in values:
+            quoted = value.replace("'", "''")
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {partial_index_name(column, value)} "
+                f"ON medical_documents {using} WHERE {column} = '{quoted}'"
+            )
+    return statements
+
+
+def partial_index_name(column: str, value: str) -> str:
+    """Name of the partial HNSW index for a filter value (Postgres caps identifiers at 63 chars)."""
+    slug = re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+    return f"idx_medical_docs_embedding_{column}_{slug}"[:63]
 
 
 async def create_admin_user(username: str, password: str, email: str):
@@ -237,30 +314,319 @@ async def create_admin_user(username: str, password: str, email: str):
 
 
 # Vector search functions for RAG
+_pgvector_version: Optional[Tuple[int, ...]] = None
+
+
+async def _get_pgvector_version(session: AsyncSession) -> Tuple[int, ...]:
+    """Installed pgvector extension version (cached per process)."""
+    global _pgvector_version
+    if _pgvector_version is None:
+        result = await session.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        )
+        version = result.scalar_one_or_none() or "0"
+        _pgvector_version = tuple(int(p) for p in re.findall(r"\d+", version))
+    return _pgvector_version
+
+
+async def _configure_hnsw_scan(
+    session: AsyncSession,
+    limit: int,
+    filtered: bool,
+    ef_search: Optional[int] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Apply transaction-local HNSW settings for the next vector query.
+    
+    Filtered queries get a larger ef_search and, on pgvector >= 0.8, an
+    iterative scan so the index keeps walking until `limit` rows pass the filter.
+    All settings are applied in a single statement (one round-trip); returns
+    the values they replaced.
+    """
+    ef = ef_search or (HNSW_FILTERED_EF_SEARCH if filtered else HNSW_EF_SEARCH)
+    ef = min(max(ef, limit), 1000)  # pgvector accepts 1..1000
+    settings = {"hnsw.ef_search": str(ef)}
+    
+    if filtered and HNSW_ITERATIVE_SCAN != "off" and await _get_pgvector_version(session) >= (0, 8):
+        settings["hnsw.iterative_scan"] = HNSW_ITERATIVE_SCAN
+        settings["hnsw.max_scan_tuples"] = str(HNSW_MAX_SCAN_TUPLES)
+    
+    return await _set_local(session, settings)
+
+
+async def _set_local(session: AsyncSession, settings: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """
+    SET LOCAL several parameters in one statement; returns their previous values.
+    
+    The target list is evaluated left to right, so every current_setting()
+    reads the value from before the set_config() calls.
+    """
+    priors = ", ".join(f"current_setting(:n{i}, true)" for i in range(len(settings)))
+    calls = ", ".join(f"set_config(:n{i}, :v{i}, true)" for i in range(len(settings)))
+    params: Dict[str, str] = {}
+    for i, (name, value) in enumerate(settings.items()):
+        params[f"n{i}"] = name
+        params[f"v{i}"] = value
+    row = (await session.execute(text(f"SELECT {priors}, {calls}"), params)).one()
+    return dict(zip(settings, row[:len(settings)]))
+
+
+async def _restore_settings(session: AsyncSession, priors: Dict[str, Optional[str]]) -> None:
+    """Put back values replaced by _set_local (unset placeholders have no value to restore)."""
+    settings = {name: value for name, value in priors.items() if value is not None}
+    if settings:
+        await _set_local(session, settings)
+
+
+@asynccontextmanager
+async def _session_scope(session: Optional[AsyncSession] = None):
+    """Use the caller's session if given, otherwise check one out of the pool."""
+    if session is not None:
+        yield session
+    else:
+        async with AsyncSessionLocal() as own_session:
+            yield own_session
+
+
+def _filter_value(value: str, indexed_values: List[str]):
+    """
+    Render filter values that have a partial index inline, so the planner can
+    match the index predicate even when asyncpg switches to a generic plan.
+    """
+    if value in indexed_values:
+        return literal(value, literal_execute=True)
+    return value
+
+
+def _apply_document_filters(query, specialty: Optional[str], document_type: Optional[str]):
+    """Add specialty/document_type filters to a medical_documents query."""
+    if specialty:
+        query = query.where(
+            MedicalDocument.specialty == _filter_value(specialty, PARTIAL_INDEX_SPECIALTIES)
+        )
+    if document_type:
+        query = query.where(
+            MedicalDocument.document_type == _filter_value(document_type, PARTIAL_INDEX_DOCUMENT_TYPES)
+        )
+    return query
+
+
+def _index_distance(column, query_embedding: List[float]):
+    """
+    Distance expression that matches hnsw_index_target(), so the planner can
+    use the HNSW index. Sizes are rendered inline for the same reason.
+    """
+    if VECTOR_INDEX_MODE == "binary":
+        query_vector = cast(literal(query_embedding, EmbeddingType(VECTOR_DIM)), EmbeddingType(VECTOR_DIM))
+        return cast(func.binary_quantize(column), BIT(VECTOR_DIM)).op("<~>", return_type=Float)(
+            func.binary_quantize(query_vector)
+        )
+    if VECTOR_INDEX_MODE == "matryoshka":
+        prefix = cast(
+            func.subvector(column, literal_column("1"), literal_column(str(MATRYOSHKA_DIM))),
+            EmbeddingType(MATRYOSHKA_DIM),
+        )
+        # Cosine distance is scale-invariant, so the truncated query needs no re-normalization
+        return prefix.cosine_distance(query_embedding[:MATRYOSHKA_DIM])
+    return column.cosine_distance(query_embedding)
+
+
+def _nearest(query, model, query_embedding: List[float], limit: int):
+    """
+    Order a query by cosine distance to `query_embedding` and apply `limit`.
+    
+    With a quantized index (binary / matryoshka) the index supplies
+    limit * VECTOR_RERANK_FACTOR candidates, which are re-ranked by exact
+    distance on the full-precision embedding.
+    """
+    if VECTOR_INDEX_MODE != "full":
+        candidates = (
+            query.with_only_columns(model.id)
+            .order_by(_index_distance(model.embedding, query_embedding))
+            .limit(limit * VECTOR_RERANK_FACTOR)
+        )
+        query = query.where(model.id.in_(candidates))
+    return query.order_by(model.embedding.cosine_distance(query_embedding)).limit(limit)
+
+
+async def _execute_document_search(
+    db: AsyncSession,
+    query,
+    limit: int,
+    filtered: bool,
+    ef_search: Optional[int],
+    orm_rows: bool,
+    restore: bool = False,
+) -> list:
+    """
+    Run a medical_documents vector query with HNSW tuning.
+    
+    If a filtered index scan returns fewer than `limit` rows, the query is
+    re-run as an exact scan over the filtered rows. With `restore` (the
+    caller's session), the settings in effect before the search are put back
+    so they do not leak into the rest of the caller's transaction.
+    """
+    priors = await _configure_hnsw_scan(db, limit, filtered, ef_search)
+    result = await db.execute(query)
+    rows = result.scalars().all() if orm_rows else result.all()
+    
+    if filtered and len(rows) < limit:
+        # Index scan exhausted its candidates before enough rows matched the
+        # filter: fall back to exact distance ordering over the filtered rows.
+        logger.debug(f"Filtered ANN returned {len(rows)}/{limit} rows, using exact scan")
+        priors.update(await _set_local(db, {"enable_indexscan": "off"}))
+        result = await db.execute(query)
+        rows = result.scalars().all() if orm_rows else result.all()
+    
+    if restore:
+        await _restore_settings(db, priors)
+    return rows
+
+
 async def search_medical_documents(
     query_embedding: List[float],
     limit: int = 5,
     specialty: Optional[str] = None,
     document_type: Optional[str] = None,
+    ef_search: Optional[int] = None,
+    session: Optional[AsyncSession] = None,
 ) -> List[MedicalDocument]:
     """
     Search medical documents using vector similarity.
     Uses pgvector's cosine similarity with HNSW index for fast retrieval.
+    
+    Returns full ORM rows (including the embedding); retrieval paths that only
+    need text and scores should use search_document_hits instead.
+    
+    Filtered searches use a partial HNSW index when one exists for the
+    specialty/document_type, otherwise a widened ef_search plus iterative scan.
+    If the index still returns fewer than `limit` rows, the query is re-run as
+    an exact scan over the filtered rows.
+    
+    Pass `session` to run on the caller's connection instead of checking out
+    a new one from the pool.
     """
-    async with AsyncSessionLocal() as session:
-        query = select(MedicalDocument).order_by(
-            MedicalDocument.embedding.cosine_distance(query_embedding)
+    query = _apply_document_filters(select(MedicalDocument), specialty, document_type)
+    query = _nearest(query, MedicalDocument, query_embedding, limit)
+    
+    async with _session_scope(session) as db:
+        return await _execute_document_search(
+            db, query, limit, bool(specialty or document_type), ef_search, orm_rows=True,
+            restore=session is not None,
         )
-        
-        if specialty:
-            query = query.where(MedicalDocument.specialty == specialty)
-        if document_type:
-            query = query.where(MedicalDocument.document_type == document_type)
-        
-        query = query.limit(limit)
-        
-        result = await session.execute(query)
-        return result.scalars().all()
+
+
+@dataclass
+class DocumentSearchHit:
+    """Projected vector search result: no embedding, no full JSONB payload."""
+    id: int
+    document_id: str
+    title: str
+    content: str  # First `content_chars` characters (full text if content_chars=None)
+    document_type: str
+    specialty: Optional[str]
+    source_url: Optional[str]
+    quality_score: float
+    distance: float
+    page_number: Optional[int] = None
+    created_at: Optional[datetime] = None
+    
+    @property
+    def similarity(self) -> float:
+        """Cosine similarity (1 - cosine distance)."""
+        return 1.0 - self.distance
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize for API responses."""
+        return {
+            "document_id": self.document_id,
+            "title": self.title,
+            "content": self.content,
+            "document_type": self.document_type,
+            "specialty": self.specialty,
+            "source_url": self.source_url,
+            "quality_score": self.quality_score,
+            "similarity": self.similarity,
+            "page_number": self.page_number,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+async def search_document_hits(
+    query_embedding: List[float],
+    limit: int = 5,
+    specialty: Optional[str] = None,
+    document_type: Optional[str] = None,
+    content_chars: Optional[int] = EXCERPT_CHARS,
+    ef_search: Optional[int] = None,
+    session: Optional[AsyncSession] = None,
+) -> List[DocumentSearchHit]:
+    """
+    Vector search that projects only the columns retrieval needs.
+    
+    Skips the embedding vector and extra_data JSONB on the wire and avoids ORM
+    hydration; content is sliced server-side to `content_chars` (None returns
+    the full text). Use fetch_document_content for on-demand full text.
+    """
+    distance = MedicalDocument.embedding.cosine_distance(query_embedding)
+    content = (
+        MedicalDocument.content if content_chars is None
+        else func.left(MedicalDocument.content, content_chars)
+    )
+    query = select(
+        MedicalDocument.id,
+        MedicalDocument.document_id,
+        MedicalDocument.title,
+        content.label("content"),
+        MedicalDocument.document_type,
+        MedicalDocument.specialty,
+        MedicalDocument.source_url,
+        MedicalDocument.quality_score,
+        distance.label("distance"),
+        MedicalDocument.extra_data["page_number"].astext.label("page_number"),
+        MedicalDocument.created_at,
+    )
+    query = _apply_document_filters(query, specialty, document_type)
+    query = _nearest(query, MedicalDocument, query_embedding, limit)
+    
+    async with _session_scope(session) as db:
+        rows = await _execute_document_search(
+            db, query, limit, bool(specialty or document_type), ef_search, orm_rows=False,
+            restore=session is not None,
+        )
+    
+    return [
+        DocumentSearchHit(
+            id=row.id,
+            document_id=row.document_id,
+            title=row.title,
+            content=row.content,
+            document_type=row.document_type,
+            specialty=row.specialty,
+            source_url=row.source_url,
+            quality_score=row.quality_score,
+            distance=float(row.distance),
+            page_number=int(row.page_number) if row.page_number and row.page_number.isdigit() else None,
+            created_at=row.created_at,
+        )
+        for row in rows
+    ]
+
+
+async def fetch_document_content(
+    document_ids: List[str],
+    session: Optional[AsyncSession] = None,
+) -> Dict[str, str]:
+    """Full content for search hits, keyed by document_id."""
+    if not document_ids:
+        return {}
+    
+    async with _session_scope(session) as db:
+        result = await db.execute(
+            select(MedicalDocument.document_id, MedicalDocument.content)
+            .where(MedicalDocument.document_id.in_(document_ids))
+        )
+        return {row.document_id: row.content for row in result.all()}
 
 
 async def search_patient_context(
@@ -268,22 +634,63 @@ async def search_patient_context(
     patient_id: str,
     limit: int = 3,
     context_type: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
 ) -> List[PatientContext]:
     """
     Search patient-specific context using vector similarity.
     Used for personalized RAG retrieval.
+    
+    Pass `session` to run on the caller's connection instead of checking out
+    a new one from the pool.
     """
-    async with AsyncSessionLocal() as session:
-        query = select(PatientContext).where(
-            PatientContext.patient_id == patient_id
-        ).order_by(
-            PatientContext.embedding.cosine_distance(query_embedding)
-        )
-        
-        if context_type:
-            query = query.where(PatientContext.context_type == context_type)
-        
-        query = query.limit(limit)
-        
-        result = await session.execute(query)
+    query = select(PatientContext).where(PatientContext.patient_id == patient_id)
+    
+    if context_type:
+        query = query.where(PatientContext.context_type == context_type)
+    
+    query = _nearest(query, PatientContext, query_embedding, limit)
+    
+    async with _session_scope(session) as db:
+        result = await db.execute(query)
         return result.scalars().all()
+
+
+async def search_rag_context(
+    query_embedding: List[float],
+    patient_id: Optional[str] = None,
+    document_limit: int = 5,
+    patient_limit: int = 3,
+    specialty: Optional[str] = None,
+    document_type: Optional[str] = None,
+    context_type: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
+) -> Tuple[List[DocumentSearchHit], List[PatientContext]]:
+    """
+    Fetch medical knowledge and patient context for one RAG call.
+    
+    Both searches run back-to-back on a single connection (one pool checkout
+    instead of two); asyncpg caches each prepared statement per connection.
+    Documents come back as projected hits with their full content.
+    
+    Returns:
+        (document hits, patient contexts) - contexts are empty without patient_id
+    """
+    async with _session_scope(session) as db:
+        documents = await search_document_hits(
+            query_embedding=query_embedding,
+            limit=document_limit,
+            specialty=specialty,
+            document_type=document_type,
+            content_chars=None,
+            session=db,
+        )
+        contexts: List[PatientContext] = []
+        if patient_id:
+            contexts = await search_patient_context(
+                query_embedding=query_embedding,
+                patient_id=patient_id,
+                limit=patient_limit,
+                context_type=context_type,
+                session=db,
+            )
+        return documents, contexts
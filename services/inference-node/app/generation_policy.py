@@ -0,0 +1,352 @@
+"""
+Generation policies per agent: adaptive max_tokens and streaming early stop.
+
+AGENT_TOKEN_LIMITS (middleware) are ceilings. Below them, an agent's
+max_tokens follows its observed completion lengths: the GENERATION_QUANTILE
+of the last GENERATION_WINDOW completions times GENERATION_HEADROOM, once
+GENERATION_MIN_SAMPLES are known. A smaller max_tokens reserves less of the
+admission token budget and KV cache per request. Completions that hit the cap
+are censored observations (the model wanted more); while more than
+GENERATION_MAX_CAPPED_RATE of recent completions hit it, the cap doubles
+back towards the ceiling.
+
+ResponseCutoff replays ModelRouter._clean_response incrementally over the
+streamed text and reports the point after which everything would be thrown
+away (a line repeated more than RESPONSE_MAX_REPEATS times, or more than
+RESPONSE_MAX_CHARS of cleaned text). Callers then close the stream, which makes
+llama-server cancel the slot's generation (vLLM: abort), so decode time is only
+spent on tokens that are returned.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter as CountMap, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+try:
+    from prometheus_client import Counter
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+GENERATION_ADAPTIVE_MAX_TOKENS = os.getenv("GENERATION_ADAPTIVE_MAX_TOKENS", "true").lower() == "true"
+GENERATION_EARLY_STOP = os.getenv("GENERATION_EARLY_STOP", "true").lower() == "true"
+GENERATION_WINDOW = int(os.getenv("GENERATION_WINDOW", "500"))
+GENERATION_MIN_SAMPLES = int(os.getenv("GENERATION_MIN_SAMPLES", "50"))
+GENERATION_QUANTILE = float(os.getenv("GENERATION_QUANTILE", "0.99"))
+GENERATION_HEADROOM = float(os.getenv("GENERATION_HEADROOM", "1.25"))
+GENERATION_MIN_TOKENS = int(os.getenv("GENERATION_MIN_TOKENS", "64"))
+GENERATION_MAX_CAPPED_RATE = float(os.getenv("GENERATION_MAX_CAPPED_RATE", "0.02"))
+RESPONSE_MAX_CHARS = int(os.getenv("RESPONSE_MAX_CHARS", "1500"))
+RESPONSE_MAX_REPEATS = int(os.getenv("RESPONSE_MAX_REPEATS", "2"))
+
+if PROMETHEUS_AVAILABLE:
+    EARLY_STOPS = Counter("llm_early_stops_total", "Generations cancelled once the rest would be discarded", ["agent", "reason"])
+    EARLY_STOP_TOKENS_SAVED = Counter("llm_early_stop_tokens_saved_total", "max_tokens not decoded due to early stop", ["agent"])
+
+# Social media handles and promotional content (training artifacts); all are line-local
+_NOISE_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r'Follow me on Twitter.*?(?=\n|$)',
+        r'@\w+',                               # Twitter handles
+        r'#\w+',                               # Hashtags
+        r'Contact Email:.*?(?=\n|$)',
+        r'Website\s*:.*?(?=\n|$)',
+        r'Address\s*:.*?(?=\n|$)',
+        r'Phone:.*?(?=\n|$)',
+        r'Instagram\s*@.*?(?=\n|$)',
+        r'DM or message me.*?(?=\n|$)',
+        r'www\.\S+',                           # URLs
+        r'\S+@\S+\.\S+',                       # Emails
+    )
+]
+
+# Trailing characters of a line still streaming whose cleaning may change (longest noise phrase + slack)
+_SETTLE_CHARS = 32
+
+
+def _strip_noise(line: str) -> str:
+    for pattern in _NOISE_PATTERNS:
+        line = pattern.sub('', line)
+    return line
+
+
+def _collapse(lines: List[str]) -> str:
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+class ResponseCutoff:
+    """
+    Incremental _clean_response: feed() streamed text, stop once the rest would be discarded.
+
+    result() is exactly what _clean_response returns for the full text (minus
+    its empty-response fallback), whether or not the stream was cut.
+    """
+
+    def __init__(self, max_chars: int = RESPONSE_MAX_CHARS, max_repeats: int = RESPONSE_MAX_REPEATS):
+        self.max_chars = max_chars
+        self.max_repeats = max_repeats
+        self.reason: Optional[str] = None
+        self._lines: List[str] = []
+        self._partial = ""
+        self._seen: set = set()
+        self._longest_seen = 0
+        self._repeats = 0
+        self._chars = 0
+        self._collapsed_chars: Optional[int] = 0
+
+    @property
+    def stopped(self) -> bool:
+        return self.reason is not None
+
+    def feed(self, delta: str) -> bool:
+        """Add streamed text; True once nothing after it would be returned."""
+        if self.stopped:
+            return True
+        *complete, self._partial = (self._partial + delta).split('\n')
+        for line in complete:
+            if self._add_line(line):
+                return True
+        if self._chars + len(self._partial) > self.max_chars and self._partial_overflows():
+            self.reason = "max_chars"
+        return self.stopped
+
+    def _add_line(self, line: str) -> bool:
+        line = _strip_noise(line)
+        stripped = line.strip()
+        if not stripped:
+            self._lines.append(line)
+            self._chars += 1
+            self._collapsed_chars = None
+            return False
+        # Repeated lines are dropped; more than max_repeats in a row ends the response
+        if stripped in self._seen:
+            self._repeats += 1
+            if self._repeats > self.max_repeats:
+                self.reason = "repetition"
+            return self.stopped
+        self._seen.add(stripped)
+        self._longest_seen = max(self._longest_seen, len(stripped))
+        self._repeats = 0
+        self._lines.append(line)
+        self._chars += len(line) + 1
+        self._collapsed_chars = None
+        if self._chars > self.max_chars and self._collapsed_len() > self.max_chars:
+            self.reason = "max_chars"
+        return self.stopped
+
+    def _collapsed_len(self) -> int:
+        if self._collapsed_chars is None:
+            self._collapsed_chars = len(_collapse(self._lines))
+        return self._collapsed_chars
+
+    def _partial_overflows(self) -> bool:
+        """A long line still streaming: its settled head alone pushes the response past max_chars."""
+        settled = self._partial.rfind(' ', 0, len(self._partial) - _SETTLE_CHARS)
+        if settled <= self._longest_seen or self._collapsed_len() + settled <= self.max_chars:
+            return False  # Cheap bounds first: cleaning only removes characters
+        # A noise phrase that straddles the settled point is only removed when the whole line is seen
+        head = os.path.commonprefix([_strip_noise(self._partial[:settled]), _strip_noise(self._partial)]).strip()
+        if len(head) <= self._longest_seen:
+            return False  # Could still turn out to be a repeated line
+        return self._collapsed_len() + len(head) > self.max_chars  # Lower bound of the cleaned length
+
+    def result(self) -> str:
+        """Cleaned response: noise removed, cut at repetition, at most max_chars (sentence boundary)."""
+        if self._partial:
+            tail, self._partial = self._partial, ""
+            if not self.stopped:
+                self._add_line(tail)
+            elif self.reason == "max_chars":
+                self._lines.append(_strip_noise(tail))
+        content = _collapse(self._lines)
+        if len(content) > self.max_chars:
+            # Find a good break point
+            sentences = content[:self.max_chars].rsplit('.', 1)
+            if len(sentences) > 1:
+                content = sentences[0] + '.'
+            else:
+                content = content[:self.max_chars] + '...'
+        return content
+
+
+def clean_response(content: str, max_chars: int = RESPONSE_MAX_CHARS, max_repeats: int = RESPONSE_MAX_REPEATS) -> str:
+    """Remove noise, cut at the first run of repeated lines and at max_chars."""
+    cutoff = ResponseCutoff(max_chars, max_repeats)
+    cutoff.feed(content)
+    return cutoff.result()
+
+
+async def stream_chat_completion(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    cutoff: Optional[ResponseCutoff] = None,
+) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    POST an OpenAI-compatible chat completion with stream=true and assemble the reply.
+
+    Returns (status_code, body); body has the non-streaming response shape
+    (choices[0].message.content / finish_reason, model, usage, timings) and is
+    None unless the status is 200. When `cutoff` stops, the connection is
+    closed (llama-server then cancels the generation) and finish_reason is
+    "early_stop"; completion_tokens counts the chunks decoded so far.
+    """
+    request = client.build_request("POST", url, json={**payload, "stream": True}, headers=headers)
+    resp = await client.send(request, stream=True)
+    try:
+        if resp.status_code != 200:
+            return resp.status_code, None
+        if not resp.headers.get("content-type", "").startswith("text/event-stream"):
+            await resp.aread()
+            return resp.status_code, resp.json()  # Server ignored stream=true
+
+        body: Dict[str, Any] = {}
+        parts: List[str] = []
+        finish_reason = None
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            for key in ("model", "usage", "timings"):
+                if chunk.get(key):
+                    body[key] = chunk[key]
+            choice = (chunk.get("choices") or [{}])[0]
+            finish_reason = choice.get("finish_reason") or finish_reason
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                parts.append(delta)
+                if cutoff is not None and cutoff.feed(delta):
+                    finish_reason = "early_stop"
+                    break
+    finally:
+        await resp.aclose()
+
+    usage = body.setdefault("usage", {})
+    usage.setdefault("completion_tokens", len(parts))  # llama-server streams one token per chunk
+    body["choices"] = [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "".join(parts)},
+        "finish_reason": finish_reason,
+    }]
+    return resp.status_code, body
+
+
+@dataclass
+class AgentGenerationState:
+    completion_tokens: Deque[int] = field(default_factory=lambda: deque(maxlen=GENERATION_WINDOW))
+    capped: Deque[bool] = field(default_factory=lambda: deque(maxlen=GENERATION_WINDOW))
+    max_tokens: Optional[int] = None
+    early_stops: CountMap = field(default_factory=CountMap)
+    tokens_saved: int = 0
+
+
+class GenerationPolicy:
+    """Per-agent max_tokens from observed completion lengths, and early-stop bookkeeping."""
+
+    def __init__(
+        self,
+        adaptive: bool = GENERATION_ADAPTIVE_MAX_TOKENS,
+        early_stop: bool = GENERATION_EARLY_STOP,
+        min_samples: int = GENERATION_MIN_SAMPLES,
+        quantile: float = GENERATION_QUANTILE,
+        headroom: float = GENERATION_HEADROOM,
+        min_tokens: int = GENERATION_MIN_TOKENS,
+        max_capped_rate: float = GENERATION_MAX_CAPPED_RATE,
+        max_chars: int = RESPONSE_MAX_CHARS,
+        max_repeats: int = RESPONSE_MAX_REPEATS,
+    ):
+        self.adaptive = adaptive
+        self.early_stop = early_stop
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self.max_capped_rate = max_capped_rate
+        self.max_chars = max_chars
+        self.max_repeats = max_repeats
+        self.agents: Dict[str, AgentGenerationState] = {}
+
+    def _state(self, agent_type: str) -> AgentGenerationState:
+        return self.agents.setdefault(agent_type, AgentGenerationState())
+
+    def max_tokens(self, agent_type: str, ceiling: int) -> int:
+        """max_tokens for the agent's next request (never above the policy ceiling)."""
+        state = self.agents.get(agent_type)
+        if not self.adaptive or state is None or state.max_tokens is None:
+            return ceiling
+        return min(ceiling, state.max_tokens)
+
+    def cutoff(self) -> Optional[ResponseCutoff]:
+        """A fresh ResponseCutoff for one generation, or None when early stop is disabled."""
+        return ResponseCutoff(self.max_chars, self.max_repeats) if self.early_stop else None
+
+    def observe(self, agent_type: str, completion_tokens: int, max_tokens: int, finish_reason: Optional[str] = None):
+        """Record a completion and re-derive the agent's cap."""
+        state = self._state(agent_type)
+        state.completion_tokens.append(completion_tokens)
+        state.capped.append(finish_reason == "length" or (finish_reason is None and completion_tokens >= max_tokens))
+        if len(state.completion_tokens) < self.min_samples:
+            return
+        lengths = sorted(state.completion_tokens)
+        observed = lengths[min(len(lengths) - 1, int(self.quantile * len(lengths)))]
+        cap = max(self.min_tokens, math.ceil(observed * self.headroom))
+        if sum(state.capped) / len(state.capped) > self.max_capped_rate:
+            cap = max(cap, max_tokens * 2)  # Too many replies cut by the cap: widen
+        if cap != state.max_tokens:
+            logger.debug(f"Generation policy {agent_type}: max_tokens {state.max_tokens} -> {cap}")
+        state.max_tokens = cap
+
+    def early_stopped(self, agent_type: str, reason: str, completion_tokens: int, max_tokens: int):
+        """Record a generation cancelled by its ResponseCutoff."""
+        state = self._state(agent_type)
+        saved = max(0, max_tokens - completion_tokens)
+        state.early_stops[reason] += 1
+        state.tokens_saved += saved
+        if PROMETHEUS_AVAILABLE:
+            EARLY_STOPS.labels(agent=agent_type, reason=reason).inc()
+            EARLY_STOP_TOKENS_SAVED.labels(agent=agent_type).inc(saved)
+        logger.info(f"Early stop for {agent_type} ({reason}) after {completion_tokens} tokens, {saved} not decoded")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {}
+        for agent_type, state in self.agents.items():
+            lengths = sorted(state.completion_tokens)
+            n = len(lengths)
+            stats[agent_type] = {
+                "samples": n,
+                "max_tokens": state.max_tokens,
+                "p50_tokens": lengths[n // 2] if n else None,
+                "p99_tokens": lengths[min(n - 1, int(0.99 * n))] if n else None,
+                "capped_rate": round(sum(state.capped) / n, 4) if n else 0.0,
+                "early_stops": dict(state.early_stops),
+                "tokens_saved": state.tokens_saved,
+            }
+        return {
+            "adaptive": self.adaptive,
+            "early_stop": self.early_stop,
+            "quantile": self.quantile,
+            "headroom": self.headroom,
+            "agents": stats,
+        }
+
+
+_generation_policy: Optional[GenerationPolicy] = None
+
+
+def get_generation_policy() -> GenerationPolicy:
+    global _generation_policy
+    if _generation_policy is None:
+        _generation_policy = GenerationPolicy()
+    return _generation_policy
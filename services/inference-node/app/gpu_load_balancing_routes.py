@@ -2,15 +2,23 @@
 GPU Load Balancing Routes
 Monitor and control GPU memory allocation and model selection
 """
+import time
+
+import httpx
 from fastapi import APIRouter, HTTPException, Depends, Header
 from typing import Dict, Any, Optional
 from loguru import logger
 
 from .auth import get_current_user, User
-from .gpu_orchestrator import get_load_balancer
+from .gpu_orchestrator import GPU_SYSTEM_OVERHEAD_GB, get_load_balancer
+from .model_lifecycle import ModelCapacityError
+from .multi_model_manager import get_multi_model_manager
 
 router = APIRouter(prefix="/v1/gpu", tags=["GPU Management"])
 
+# Fixed short clinical prompt so benchmark runs are comparable
+BENCHMARK_PROMPT = "List three common symptoms of iron-deficiency anaemia in one sentence each."
+
 # Public GPU monitoring endpoint (no auth required)
 @router.get("/status")
 async def get_gpu_status():
@@ -34,21 +42,37 @@ async def get_memory_forecast(
     hours: int = 1
 ):
     """
-    Forecast GPU memory usage for next N hours
+    Forecast GPU memory usage for next N hours, per device and in total
     """
     try:
         balancer = get_load_balancer()
+        states = await balancer.get_device_states()
         
-        # Get historical memory usage
-        avg_memory = balancer.gpu_monitor.get_average_memory_usage_gb(seconds=300)
-        total_memory = 24.0  # RTX 3090
+        devices = {}
+        for gpu_id, state in states.items():
+            # Historical memory usage (5 min) against the device's real capacity
+            avg_memory = balancer.gpu_monitors[gpu_id].get_average_memory_usage_gb(seconds=300) or state.used_memory_gb
+            total_memory = state.total_memory_gb
+            devices[str(gpu_id)] = {
+                "current_usage_gb": avg_memory,
+                "total_gb": total_memory,
+                "utilization_percent": (avg_memory / total_memory) * 100 if total_memory else 0.0,
+                "pressure": balancer.device_pressure(state),
+                "projected_headroom_gb": total_memory - avg_memory,
+                "estimated_available_for_inference_gb": max(0, total_memory - avg_memory - GPU_SYSTEM_OVERHEAD_GB),
+            }
         
+        total_memory = sum(d["total_gb"] for d in devices.values())
+        avg_memory = sum(d["current_usage_gb"] for d in devices.values())
         forecast = {
             "current_usage_gb": avg_memory,
-            "utilization_percent": (avg_memory / total_memory) * 100,
+            "utilization_percent": (avg_memory / total_memory) * 100 if total_memory else 0.0,
             "projected_headroom_gb": total_memory - avg_memory,
-            "estimated_available_for_inference_gb": max(0, total_memory - avg_memory - 3.0),  # 3GB system overhead
+            "estimated_available_for_inference_gb": sum(
+                d["estimated_available_for_inference_gb"] for d in devices.values()
+            ),
             "forecast_hours": hours,
+            "devices": devices,
         }
         
         return {"status": "ok", "forecast": forecast}
@@ -58,40 +82,110 @@ async def get_memory_forecast(
 
 
 @router.post("/rebalance")
-async def trigger_rebalance():
+async def trigger_rebalance(current_user: User = Depends(get_current_user)):
     """
-    Force GPU load rebalancing (move models between backends if needed)
+    Force GPU load rebalancing (stops idle on-demand instances). Requires admin privileges.
     """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
     try:
         balancer = get_load_balancer()
         
-        # Get current state
-        gpu_state = await balancer.get_memory_state()
+        # Get current state of every GPU
+        states = await balancer.get_device_states()
         
         action_taken = []
+        for gpu_id, gpu_state in states.items():
+            # If high memory pressure, consider unloading least-used models
+            if gpu_state.memory_utilization_percent > 85:
+                action_taken.append(f"GPU {gpu_id}: High memory pressure detected - recommending model reduction")
+            
+            # If thermal throttling, reduce load
+            if gpu_state.is_thermal_throttled:
+                action_taken.append(
+                    f"GPU {gpu_id}: Thermal throttling detected ({gpu_state.temperature_c:.0f}°C) - recommend load reduction"
+                )
         
-        # If high memory pressure, consider unloading least-used models
-        if gpu_state.memory_utilization_percent > 85:
-            action_taken.append("High memory pressure detected - recommending model reduction")
-        
-        # If thermal throttling, reduce load
-        if gpu_state.is_thermal_throttled:
-            action_taken.append(f"Thermal throttling detected ({gpu_state.temperature_c:.0f}°C) - recommend load reduction")
+        # Stop idle on-demand instances so their VRAM is actually released
+        stopped = []
+        scheduler = get_multi_model_manager().scheduler
+        if scheduler:
+            stopped = await scheduler.evict_idle()
+            action_taken.extend(f"Stopped idle instance {name}" for name in stopped)
         
         if not action_taken:
             action_taken.append("GPU load is optimal - no rebalancing needed")
         
+        primary = states[min(states)]
         return {
             "status": "ok",
             "actions": action_taken,
-            "gpu_utilization_percent": gpu_state.memory_utilization_percent,
-            "temperature_c": gpu_state.temperature_c,
+            "stopped_instances": stopped,
+            "gpu_utilization_percent": primary.memory_utilization_percent,
+            "temperature_c": primary.temperature_c,
+            "devices": {
+                str(gpu_id): {
+                    "utilization_percent": state.memory_utilization_percent,
+                    "pressure": balancer.device_pressure(state),
+                    "temperature_c": state.temperature_c,
+                }
+                for gpu_id, state in states.items()
+            },
         }
     except Exception as e:
         logger.error(f"Load rebalancing failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/lifecycle")
+async def get_model_lifecycle():
+    """
+    On-demand model loading: per-GPU VRAM reservation and per-instance demand
+    """
+    manager = get_multi_model_manager()
+    if not manager.scheduler:
+        return {"status": "disabled", "instances": manager.get_status()["instances"]}
+    return {"status": "ok", **manager.scheduler.get_stats()}
+
+
+@router.post("/lifecycle/{instance_name}/load")
+async def load_model_instance(instance_name: str, current_user: User = Depends(get_current_user)):
+    """
+    Start an instance now (evicting idle instances on its GPU if needed). Requires admin privileges.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    manager = get_multi_model_manager()
+    if instance_name not in manager.instances:
+        raise HTTPException(status_code=404, detail=f"Instance {instance_name} not found")
+    if not manager.scheduler:
+        raise HTTPException(status_code=409, detail="On-demand model loading is disabled")
+    try:
+        instance = await manager.scheduler.ensure_loaded(instance_name)
+    except ModelCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": instance.status, "instance": instance_name, "gpu_id": instance.gpu_id}
+
+
+@router.post("/lifecycle/{instance_name}/unload")
+async def unload_model_instance(instance_name: str, current_user: User = Depends(get_current_user)):
+    """
+    Stop an instance and release its VRAM. Requires admin privileges.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    manager = get_multi_model_manager()
+    if instance_name not in manager.instances:
+        raise HTTPException(status_code=404, detail=f"Instance {instance_name} not found")
+    if manager.scheduler and manager.scheduler.demand[instance_name].in_flight:
+        raise HTTPException(status_code=409, detail=f"Instance {instance_name} has requests in flight")
+    await manager.stop_instance(instance_name)
+    return {"status": "stopped", "instance": instance_name}
+
+
 @router.get("/models-optimal")
 async def get_optimal_models(
     agent_type: str
@@ -101,21 +195,25 @@ async def get_optimal_models(
     """
     try:
         balancer = get_load_balancer()
-        gpu_state = await balancer.get_memory_state()
+        states = await balancer.get_device_states()
         
-        # Get available models
+        # Get available models, each judged against the GPUs it is placed on
         models_ranked = []
         for name, model in balancer.models.items():
-            fits_in_memory = balancer._calculate_model_fit(model, gpu_state.available_memory_gb)
-            priority = model.priority_score if fits_in_memory else float('inf')
+            fits_in_memory = balancer.model_fits(model, states)
+            priority = balancer.routing_score(model, agent_type) if fits_in_memory else float('inf')
+            prediction = balancer.predict_latency(model, agent_type)
             
             models_ranked.append({
                 "model_name": name,
                 "vram_gb": model.vram_gb,
                 "backend": model.backend,
+                "gpu_ids": model.gpu_ids,
                 "fits_in_memory": fits_in_memory,
                 "priority_score": priority,
                 "avg_latency_ms": model.avg_latency_ms,
+                "predicted_p50_ms": round(prediction.p50_s * 1000, 1) if prediction else None,
+                "predicted_p95_ms": round(prediction.p95_s * 1000, 1) if prediction else None,
                 "failure_count": model.failure_count,
             })
         
@@ -125,7 +223,8 @@ async def get_optimal_models(
         return {
             "status": "ok",
             "agent_type": agent_type,
-            "gpu_available_gb": gpu_state.available_memory_gb,
+            "gpu_available_gb": states[min(states)].available_memory_gb,
+            "devices_available_gb": {str(g): state.available_memory_gb for g, state in states.items()},
             "models_ranked": models_ranked,
         }
     except Exception as e:
@@ -133,13 +232,19 @@ async def get_optimal_models(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _benchmark_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=120.0)
+
+
 @router.post("/benchmark-model")
 async def benchmark_model(
     model_name: str,
-    num_iterations: int = 5
+    num_iterations: int = 5,
+    agent_type: Optional[str] = None,
+    max_tokens: int = 128,
 ):
     """
-    Benchmark a specific model for latency and throughput
+    Benchmark a specific model for latency and seed the online latency model with the results
     """
     try:
         balancer = get_load_balancer()
@@ -148,22 +253,62 @@ async def benchmark_model(
             raise HTTPException(status_code=404, detail=f"Model {model_name} not found")
         
         model = balancer.models[model_name]
+        num_iterations = max(1, min(num_iterations, 50))
+        prompt_tokens = max(1, len(BENCHMARK_PROMPT) // 4)
+        payload = {
+            "messages": [{"role": "user", "content": BENCHMARK_PROMPT}],
+            "max_tokens": max_tokens,
+            "temperature": 0.0,
+        }
         
-        # Note: This is a placeholder - actual benchmarking would require
-        # sending inference requests through the model
+        # Sequential requests so each latency is an unloaded service time
+        latencies = []
+        errors = []
+        async with _benchmark_client() as client:
+            for _ in range(num_iterations):
+                start = time.monotonic()
+                try:
+                    resp = await client.post(
+                        f"http://127.0.0.1:{model.port}/v1/chat/completions",
+                        json=payload,
+                        headers={"Authorization": "Bearer dev-key"},
+                    )
+                    resp.raise_for_status()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                latencies.append(time.monotonic() - start)
+        
+        if latencies:
+            balancer.latency.seed(model_name, latencies, prompt_tokens, agent=agent_type)
+        prediction = balancer.predict_latency(model, agent_type, prompt_tokens)
+        measured = sorted(latencies)
         
         return {
-            "status": "ok",
+            "status": "ok" if latencies else "failed",
             "model_name": model_name,
             "backend": model.backend,
             "vram_gb": model.vram_gb,
-            "note": "Benchmark would run actual inference tests (not implemented in stub)",
+            "iterations": num_iterations,
+            "succeeded": len(latencies),
+            "errors": errors[:5],
+            "latency_ms": {
+                "p50": round(measured[len(measured) // 2] * 1000, 1) if measured else None,
+                "max": round(measured[-1] * 1000, 1) if measured else None,
+            },
+            "predicted": {
+                "p50_ms": round(prediction.p50_s * 1000, 1),
+                "p95_ms": round(prediction.p95_s * 1000, 1),
+                "samples": prediction.samples,
+            } if prediction else None,
             "recent_metrics": {
                 "avg_latency_ms": model.avg_latency_ms,
                 "queue_size": model.queue_size,
                 "failure_count": model.failure_count,
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Model benchmarking failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,16 +3,28 @@ GPU-Aware Load Balancing Orchestrator
 Manages RTX 3090 (24GB) memory efficiently with smart switching between llama.cpp and vLLM
 """
 import asyncio
+import os
 import time
-import subprocess
 import json
 import re
-from typing import Dict, List, Optional, Tuple, Any
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass, field
 from enum import Enum
 from loguru import logger
 from datetime import datetime, timedelta
 
+from .gpu_telemetry import GPUMemoryState, GPUTelemetryProvider, get_telemetry_provider
+from .latency_estimator import LatencyEstimator, LatencyPrediction, get_latency_estimator
+
+
+GPU_POLL_INTERVAL_S = float(os.getenv("GPU_POLL_INTERVAL_S", "2"))
+GPU_TELEMETRY_HISTORY = int(os.getenv("GPU_TELEMETRY_HISTORY", "300"))  # samples kept (10 min at 2s)
+GPU_TELEMETRY_STALE_S = float(os.getenv("GPU_TELEMETRY_STALE_S", "10"))  # resample on demand after this
+# Devices to monitor, e.g. "0,1" (default: every device the telemetry provider reports)
+GPU_DEVICES = [int(d) for d in os.getenv("GPU_DEVICES", "").split(",") if d.strip()]
+GPU_SYSTEM_OVERHEAD_GB = 3.0  # 1GB system overhead + 2GB buffer per device
+
 
 class BackendType(str, Enum):
     """Available inference backends"""
@@ -20,30 +32,6 @@ class BackendType(str, Enum):
     VLLM = "vllm"
 
 
-@dataclass
-class GPUMemoryState:
-    """Current GPU memory state"""
-    gpu_id: int
-    total_memory_gb: float
-    used_memory_gb: float
-    available_memory_gb: float
-    temperature_c: float
-    power_draw_w: float
-    timestamp: datetime = field(default_factory=datetime.now)
-
-    @property
-    def memory_utilization_percent(self) -> float:
-        """GPU memory utilization percentage"""
-        if self.total_memory_gb == 0:
-            return 0.0
-        return (self.used_memory_gb / self.total_memory_gb) * 100
-
-    @property
-    def is_thermal_throttled(self) -> bool:
-        """Check if GPU is overheating"""
-        return self.temperature_c > 80  # RTX 3090 throttles around 80°C
-
-
 @dataclass
 class ModelLoadInfo:
     """Information about a model's memory requirements and performance"""
@@ -51,17 +39,27 @@ class ModelLoadInfo:
     backend: BackendType
     vram_gb: float
     port: int
+    gpu_ids: List[int] = field(default_factory=lambda: [0])
     is_active: bool = False
     avg_latency_ms: float = 0.0
     queue_size: int = 0
     failure_count: int = 0
     last_used: Optional[datetime] = None
 
+    @property
+    def vram_per_device_gb(self) -> float:
+        """VRAM needed on each device (layers split evenly across gpu_ids)"""
+        return self.vram_gb / max(1, len(self.gpu_ids))
+
     @property
     def priority_score(self) -> float:
         """Score for prioritizing model based on perf & reliability"""
+        return self.score(self.avg_latency_ms)
+
+    def score(self, latency_ms: float) -> float:
+        """Priority score for a given expected latency"""
         # Lower is better
-        base_score = self.avg_latency_ms + (self.failure_count * 100)
+        base_score = latency_ms + (self.failure_count * 100)
         if self.queue_size > 5:
             base_score += 50  # Penalize overloaded models
         return base_score
@@ -77,89 +75,76 @@ class LoadBalancingDecision:
     gpu_id: int
     estimated_duration_ms: float
     will_exceed_memory: bool = False
+    estimated_p95_ms: float = 0.0
 
 
 class GPUMonitor:
-    """Real-time GPU memory and performance monitoring"""
+    """Background GPU sampling into a ring buffer; readers get the latest sample without I/O"""
 
-    def __init__(self, gpu_id: int = 0, poll_interval_s: float = 2.0):
+    def __init__(
+        self,
+        gpu_id: int = 0,
+        poll_interval_s: float = GPU_POLL_INTERVAL_S,
+        provider: Optional[GPUTelemetryProvider] = None,
+    ):
         self.gpu_id = gpu_id
         self.poll_interval = poll_interval_s
-        self.memory_history: List[GPUMemoryState] = []
-        self.max_history = 100
+        self._provider = provider
+        self.max_history = GPU_TELEMETRY_HISTORY
+        self.memory_history: Deque[GPUMemoryState] = deque(maxlen=self.max_history)
         self.is_running = False
+        self.samples = 0
+        self.sample_errors = 0
+        self.last_sample_ms = 0.0
+        self._last_error: Optional[str] = None
+
+    @property
+    def provider(self) -> GPUTelemetryProvider:
+        if self._provider is None:
+            self._provider = get_telemetry_provider()
+        return self._provider
 
     async def start_monitoring(self):
         """Start background GPU monitoring"""
         self.is_running = True
         while self.is_running:
-            try:
-                state = await self.get_current_state()
-                self.memory_history.append(state)
-                if len(self.memory_history) > self.max_history:
-                    self.memory_history.pop(0)
-            except Exception as e:
-                logger.warning(f"GPU monitoring error: {e}")
+            await self.sample()
             await asyncio.sleep(self.poll_interval)
 
-    async def get_current_state(self) -> GPUMemoryState:
-        """Get current GPU memory and thermal state"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._get_nvidia_smi_state)
-
-    def _get_nvidia_smi_state(self) -> GPUMemoryState:
-        """Query nvidia-smi for GPU state"""
+    async def sample(self) -> Optional[GPUMemoryState]:
+        """Take one reading off the event loop and append it to the ring buffer"""
+        start = time.perf_counter()
         try:
-            cmd = (
-                "nvidia-smi "
-                f"--id={self.gpu_id} "
-                "--query-gpu=memory.total,memory.used,temperature.gpu,power.draw "
-                "--format=csv,nounits,noheader"
-            )
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-            
-            if result.returncode != 0:
-                logger.error(f"nvidia-smi failed: {result.stderr}")
-                # Return conservative estimate
-                return GPUMemoryState(
-                    gpu_id=self.gpu_id,
-                    total_memory_gb=24.0,
-                    used_memory_gb=12.0,  # Conservative
-                    available_memory_gb=12.0,
-                    temperature_c=50.0,
-                    power_draw_w=100.0,
-                )
-
-            parts = result.stdout.strip().split(",")
-            if len(parts) >= 4:
-                total_mb = float(parts[0].strip())
-                used_mb = float(parts[1].strip())
-                temp_c = float(parts[2].strip())
-                power_w = float(parts[3].strip())
-
-                total_gb = total_mb / 1024
-                used_gb = used_mb / 1024
-                available_gb = total_gb - used_gb
-
-                return GPUMemoryState(
-                    gpu_id=self.gpu_id,
-                    total_memory_gb=total_gb,
-                    used_memory_gb=used_gb,
-                    available_memory_gb=available_gb,
-                    temperature_c=temp_c,
-                    power_draw_w=power_w,
-                )
+            state = await asyncio.to_thread(self.provider.sample, self.gpu_id)
         except Exception as e:
-            logger.error(f"Failed to get GPU state: {e}")
-            # Return safe default
-            return GPUMemoryState(
-                gpu_id=self.gpu_id,
-                total_memory_gb=24.0,
-                used_memory_gb=18.0,
-                available_memory_gb=6.0,
-                temperature_c=75.0,
-                power_draw_w=250.0,
-            )
+            self.sample_errors += 1
+            if str(e) != self._last_error:  # Log once per distinct failure, not every poll
+                logger.warning(f"GPU monitoring error (gpu {self.gpu_id}): {e}")
+                self._last_error = str(e)
+            return None
+        self._last_error = None
+        self.last_sample_ms = (time.perf_counter() - start) * 1000
+        self.samples += 1
+        self.memory_history.append(state)
+        return state
+
+    async def get_current_state(self) -> GPUMemoryState:
+        """Latest sample; only samples inline if the background monitor is not keeping it fresh"""
+        latest = self.get_latest_state()
+        if latest and (datetime.now() - latest.timestamp).total_seconds() <= GPU_TELEMETRY_STALE_S:
+            return latest
+        state = await self.sample()
+        if state:
+            return state
+        # No reading: assume a busy, warm GPU so routing stays conservative
+        return GPUMemoryState(
+            gpu_id=self.gpu_id,
+            total_memory_gb=24.0,
+            used_memory_gb=18.0,
+            available_memory_gb=6.0,
+            temperature_c=75.0,
+            power_draw_w=250.0,
+        )
 
     def get_latest_state(self) -> Optional[GPUMemoryState]:
         """Get most recent GPU state"""
@@ -173,16 +158,39 @@ class GPUMonitor:
             return 0.0
         return sum(m.used_memory_gb for m in recent) / len(recent)
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Telemetry provider, sample count/cost and age of the latest sample"""
+        latest = self.get_latest_state()
+        return {
+            "provider": self.provider.name,
+            "running": self.is_running,
+            "samples": self.samples,
+            "sample_errors": self.sample_errors,
+            "history": len(self.memory_history),
+            "last_sample_ms": round(self.last_sample_ms, 3),
+            "sample_age_s": round((datetime.now() - latest.timestamp).total_seconds(), 1) if latest else None,
+        }
+
     def stop_monitoring(self):
         """Stop background monitoring"""
         self.is_running = False
 
 
 class SmartLoadBalancer:
-    """Intelligent load balancing between llama.cpp and vLLM backends"""
+    """Intelligent load balancing between llama.cpp and vLLM backends across GPUs"""
 
-    def __init__(self):
-        self.gpu_monitor = GPUMonitor(gpu_id=0)
+    def __init__(
+        self,
+        telemetry: Optional[GPUTelemetryProvider] = None,
+        devices: Optional[List[int]] = None,
+        latency: Optional[LatencyEstimator] = None,
+    ):
+        self._telemetry = telemetry
+        self.latency = latency or get_latency_estimator()
+        self.gpu_monitors: Dict[int, GPUMonitor] = {}
+        self._monitor_tasks: Dict[int, asyncio.Task] = {}
+        for gpu_id in devices or GPU_DEVICES or self._detect_devices():
+            self._monitor(gpu_id)
         self.models: Dict[str, ModelLoadInfo] = {}
         self.backend_config: Dict[BackendType, Dict[str, Any]] = {
             BackendType.LLAMA_CPP: {
@@ -205,38 +213,90 @@ class SmartLoadBalancer:
             "low": 0.50,       # 50% = can use large models
         }
 
+    def _detect_devices(self) -> List[int]:
+        try:
+            provider = self._telemetry or get_telemetry_provider()
+            return list(range(provider.device_count())) or [0]
+        except Exception as e:
+            logger.info(f"GPU device count unavailable ({e}), monitoring GPU 0")
+            return [0]
+
+    def _monitor(self, gpu_id: int) -> GPUMonitor:
+        if gpu_id not in self.gpu_monitors:
+            monitor = GPUMonitor(gpu_id=gpu_id, provider=self._telemetry)
+            self.gpu_monitors[gpu_id] = monitor
+            if self._monitor_tasks:  # Already started: sample the new device too
+                self._monitor_tasks[gpu_id] = asyncio.create_task(monitor.start_monitoring())
+        return self.gpu_monitors[gpu_id]
+
+    @property
+    def gpu_monitor(self) -> GPUMonitor:
+        """Monitor of the primary device (lowest gpu_id)"""
+        return self.gpu_monitors[min(self.gpu_monitors)]
+
     def register_model(
         self,
         model_name: str,
         backend: BackendType,
         vram_gb: float,
         port: int,
+        gpu_ids: Optional[List[int]] = None,
     ):
         """Register a model for load balancing"""
+        gpu_ids = list(gpu_ids or [0])
+        for gpu_id in gpu_ids:
+            self._monitor(gpu_id)
         self.models[model_name] = ModelLoadInfo(
             model_name=model_name,
             backend=backend,
             vram_gb=vram_gb,
             port=port,
+            gpu_ids=gpu_ids,
         )
-        logger.info(f"Registered model: {model_name} ({backend}) on port {port} - {vram_gb}GB VRAM")
+        logger.info(f"Registered model: {model_name} ({backend}) on port {port}, GPU {gpu_ids} - {vram_gb}GB VRAM")
 
     async def get_memory_state(self) -> GPUMemoryState:
-        """Get current GPU memory state"""
+        """Get current state of the primary GPU"""
         return await self.gpu_monitor.get_current_state()
 
+    async def get_device_states(self) -> Dict[int, GPUMemoryState]:
+        """Latest state of every monitored GPU"""
+        gpu_ids = sorted(self.gpu_monitors)
+        states = await asyncio.gather(*(self.gpu_monitors[g].get_current_state() for g in gpu_ids))
+        return dict(zip(gpu_ids, states))
+
     def _get_memory_pressure_level(self, utilization: float) -> str:
-        """Determine memory pressure level"""
+        """Determine memory pressure level from utilization in percent"""
         for level, threshold in sorted(self.memory_thresholds.items(), key=lambda x: x[1]):
-            if utilization <= threshold:
+            if utilization / 100 <= threshold:
                 return level
         return "critical"
 
+    def device_pressure(self, state: GPUMemoryState) -> str:
+        return self._get_memory_pressure_level(state.memory_utilization_percent)
+
     def _calculate_model_fit(self, model: ModelLoadInfo, available_gb: float) -> bool:
         """Check if model can fit in available memory with overhead"""
-        # Account for 1GB system overhead + 2GB buffer
-        safe_available = available_gb - 3.0
-        return safe_available >= model.vram_gb
+        safe_available = available_gb - GPU_SYSTEM_OVERHEAD_GB
+        return safe_available >= model.vram_per_device_gb
+
+    def model_fits(self, model: ModelLoadInfo, states: Dict[int, GPUMemoryState]) -> bool:
+        """Model's share of VRAM fits on every device it is placed on"""
+        return all(
+            g in states and self._calculate_model_fit(model, states[g].available_memory_gb) for g in model.gpu_ids
+        )
+
+    def _model_blocked(self, model: ModelLoadInfo, states: Dict[int, GPUMemoryState]) -> Optional[str]:
+        """Reason the model's devices cannot take load right now (critical pressure or thermal throttle)"""
+        for g in model.gpu_ids:
+            state = states.get(g)
+            if state is None:
+                continue
+            if self.device_pressure(state) == "critical":
+                return f"GPU {g} memory critical ({state.memory_utilization_percent:.1f}%)"
+            if state.is_thermal_throttled:
+                return f"GPU {g} thermal throttled ({state.temperature_c:.0f}°C)"
+        return None
 
     async def decide_model_and_backend(
         self,
@@ -244,6 +304,7 @@ class SmartLoadBalancer:
         preferred_model: Optional[str] = None,
         min_context_tokens: int = 2048,
         prefer_llama_cpp: bool = True,
+        prompt_tokens: int = 0,
     ) -> LoadBalancingDecision:
         """
         Make intelligent decision on which model/backend to use
@@ -253,132 +314,146 @@ class SmartLoadBalancer:
             preferred_model: Preferred model name (may fall back if memory constrained)
             min_context_tokens: Minimum context requirement
             prefer_llama_cpp: Prefer llama.cpp for lower latency if available
+            prompt_tokens: Estimated prompt length (selects the latency model's bucket)
             
         Returns:
             LoadBalancingDecision with routing info
         """
-        gpu_state = await self.get_memory_state()
-        utilization = gpu_state.memory_utilization_percent
-        pressure_level = self._get_memory_pressure_level(utilization)
+        states = await self.get_device_states()
 
         logger.info(
-            f"Load balancing decision: agent={agent_type}, "
-            f"GPU util={utilization:.1f}%, pressure={pressure_level}, "
-            f"mem_avail={gpu_state.available_memory_gb:.1f}GB, "
-            f"temp={gpu_state.temperature_c:.0f}°C"
+            f"Load balancing decision: agent={agent_type}, " + ", ".join(
+                f"GPU{g} util={s.memory_utilization_percent:.1f}% ({self.device_pressure(s)}) "
+                f"avail={s.available_memory_gb:.1f}GB temp={s.temperature_c:.0f}°C"
+                for g, s in states.items()
+            )
         )
 
-        # Under critical pressure, only allow smallest models
-        if pressure_level == "critical":
-            logger.warning(f"CRITICAL memory pressure ({utilization:.1f}%) - restricting to smallest models")
-            return await self._fallback_to_smallest_model(agent_type)
-
-        # Under high pressure, prefer memory-efficient backends
-        if pressure_level == "high":
-            logger.info(f"HIGH memory pressure ({utilization:.1f}%) - switching to llama.cpp (more efficient)")
-            prefer_llama_cpp = True
-
-        # Check thermal throttling
-        if gpu_state.is_thermal_throttled:
-            logger.warning(f"GPU thermal throttled ({gpu_state.temperature_c:.0f}°C) - reducing load")
-            return await self._fallback_to_smallest_model(agent_type)
-
-        # Try preferred model first
+        # Try preferred model first, judged only by the devices it runs on
         if preferred_model and preferred_model in self.models:
             model = self.models[preferred_model]
-            if self._calculate_model_fit(model, gpu_state.available_memory_gb):
+            blocked = self._model_blocked(model, states)
+            if blocked:
+                logger.warning(f"Preferred model {preferred_model} unavailable: {blocked}")
+            elif self.model_fits(model, states):
                 decision = await self._make_backend_decision(
-                    model, gpu_state, prefer_llama_cpp, agent_type
+                    model, states, prefer_llama_cpp, agent_type, prompt_tokens
                 )
                 decision.reason = f"Using preferred model {preferred_model}"
                 return decision
 
         # Find best available model based on memory and performance
-        candidates = self._get_candidate_models(
-            gpu_state.available_memory_gb, prefer_llama_cpp, agent_type
-        )
+        candidates = self._get_candidate_models(states, prefer_llama_cpp, agent_type)
 
         if not candidates:
-            logger.error("No models available that fit in memory!")
-            raise RuntimeError("No available models within memory constraints")
+            logger.warning("No model fits on an unconstrained GPU - falling back to smallest model")
+            return await self._fallback_to_smallest_model(agent_type, prompt_tokens)
 
-        best_model = min(candidates, key=lambda m: m[1].priority_score)
+        # Rank by predicted p95 latency for this agent and prompt length (plus reliability)
+        best_model = min(candidates, key=lambda m: self.routing_score(m[1], agent_type, prompt_tokens))
         model = best_model[1]
 
-        decision = await self._make_backend_decision(model, gpu_state, prefer_llama_cpp, agent_type)
-        decision.reason = f"Selected {model.model_name} (pressure={pressure_level})"
+        pressure = self._model_pressure(model, states)
+        decision = await self._make_backend_decision(model, states, prefer_llama_cpp, agent_type, prompt_tokens)
+        decision.reason = f"Selected {model.model_name} (GPU {model.gpu_ids}, pressure={pressure})"
         return decision
 
+    def _model_pressure(self, model: ModelLoadInfo, states: Dict[int, GPUMemoryState]) -> str:
+        """Worst memory pressure level across the model's devices"""
+        order = ["low", "normal", "high", "critical"]
+        levels = [self.device_pressure(states[g]) for g in model.gpu_ids if g in states]
+        return max(levels, key=order.index) if levels else "unknown"
+
     async def _make_backend_decision(
         self,
         model: ModelLoadInfo,
-        gpu_state: GPUMemoryState,
+        states: Dict[int, GPUMemoryState],
         prefer_llama_cpp: bool,
         agent_type: str,
+        prompt_tokens: int = 0,
     ) -> LoadBalancingDecision:
         """Decide backend for a specific model"""
         backend = model.backend
+        available_gb = min(
+            (states[g].available_memory_gb for g in model.gpu_ids if g in states), default=0.0
+        )
+
+        # Under high pressure on the model's GPU, prefer memory-efficient backends
+        if self._model_pressure(model, states) == "high":
+            prefer_llama_cpp = True
 
         # If model is dual-backend capable, choose based on conditions
         if model.backend == BackendType.LLAMA_CPP and prefer_llama_cpp:
             backend = BackendType.LLAMA_CPP
             reason = "llama.cpp (low latency, memory efficient)"
-        elif model.backend == BackendType.VLLM and gpu_state.available_memory_gb > 10:
+        elif model.backend == BackendType.VLLM and available_gb > 10:
             backend = BackendType.VLLM
             reason = "vLLM (throughput optimized)"
         else:
             reason = f"Primary backend ({backend})"
 
         # Estimate processing time
-        estimated_ms = self._estimate_inference_time(model, agent_type)
+        estimated_ms = self._estimate_inference_time(model, agent_type, prompt_tokens)
+        prediction = self.predict_latency(model, agent_type, prompt_tokens)
 
         return LoadBalancingDecision(
             model_name=model.model_name,
             backend=backend,
             port=model.port,
             reason=reason,
-            gpu_id=0,
+            gpu_id=model.gpu_ids[0],
             estimated_duration_ms=estimated_ms,
-            will_exceed_memory=not self._calculate_model_fit(model, gpu_state.available_memory_gb),
+            will_exceed_memory=not self.model_fits(model, states),
+            estimated_p95_ms=prediction.p95_s * 1000 if prediction else estimated_ms,
         )
 
     def _get_candidate_models(
         self,
-        available_gb: float,
+        states: Dict[int, GPUMemoryState],
         prefer_llama_cpp: bool,
         agent_type: str,
     ) -> List[Tuple[str, ModelLoadInfo]]:
-        """Get models that fit in available memory, sorted by suitability"""
+        """Models that fit on their own (unconstrained) devices"""
         candidates = []
         for name, model in self.models.items():
-            if self._calculate_model_fit(model, available_gb):
-                # Prefer requested backend if possible
-                if prefer_llama_cpp and model.backend == BackendType.LLAMA_CPP:
-                    candidates.append((name, model))
-                elif not prefer_llama_cpp and model.backend == BackendType.VLLM:
-                    candidates.append((name, model))
-                else:
-                    candidates.append((name, model))
+            if self.model_fits(model, states) and not self._model_blocked(model, states):
+                candidates.append((name, model))
 
         return candidates
 
-    async def _fallback_to_smallest_model(self, agent_type: str) -> LoadBalancingDecision:
-        """Fall back to smallest available model"""
-        smallest = min(self.models.values(), key=lambda m: m.vram_gb)
-        gpu_state = await self.get_memory_state()
+    async def _fallback_to_smallest_model(self, agent_type: str, prompt_tokens: int = 0) -> LoadBalancingDecision:
+        """Fall back to the smallest model, preferring one whose GPUs are not critical or throttled"""
+        states = await self.get_device_states()
+        unblocked = [m for m in self.models.values() if not self._model_blocked(m, states)]
+        smallest = min(unblocked or self.models.values(), key=lambda m: m.vram_gb)
 
         return LoadBalancingDecision(
             model_name=smallest.model_name,
             backend=smallest.backend,
             port=smallest.port,
-            reason=f"FALLBACK: Memory critical, using smallest model {smallest.model_name}",
-            gpu_id=0,
-            estimated_duration_ms=self._estimate_inference_time(smallest, agent_type),
-            will_exceed_memory=not self._calculate_model_fit(smallest, gpu_state.available_memory_gb),
+            reason=f"FALLBACK: Memory constrained, using smallest model {smallest.model_name} (GPU {smallest.gpu_ids})",
+            gpu_id=smallest.gpu_ids[0],
+            estimated_duration_ms=self._estimate_inference_time(smallest, agent_type, prompt_tokens),
+            will_exceed_memory=not self.model_fits(smallest, states),
         )
 
-    def _estimate_inference_time(self, model: ModelLoadInfo, agent_type: str) -> float:
-        """Estimate inference time based on model history and type"""
+    def predict_latency(
+        self, model: ModelLoadInfo, agent_type: str, prompt_tokens: int = 0
+    ) -> Optional[LatencyPrediction]:
+        """Online latency model prediction for this model, agent and prompt length"""
+        return self.latency.predict(model.model_name, agent_type, prompt_tokens)
+
+    def routing_score(self, model: ModelLoadInfo, agent_type: str, prompt_tokens: int = 0) -> float:
+        """Priority score using predicted p95 latency when the latency model has enough samples"""
+        prediction = self.predict_latency(model, agent_type, prompt_tokens)
+        return model.score(prediction.p95_s * 1000) if prediction else model.priority_score
+
+    def _estimate_inference_time(self, model: ModelLoadInfo, agent_type: str, prompt_tokens: int = 0) -> float:
+        """Estimate inference time: predicted p50, else latency history, else size class"""
+        prediction = self.predict_latency(model, agent_type, prompt_tokens)
+        if prediction:
+            return prediction.p50_s * 1000
+
         # Use historical latency if available
         if model.avg_latency_ms > 0:
             return model.avg_latency_ms
@@ -416,11 +491,20 @@ class SmartLoadBalancer:
 
         return estimated_ms
 
-    def update_model_metrics(self, model_name: str, latency_ms: float, queue_size: int):
+    def update_model_metrics(
+        self,
+        model_name: str,
+        latency_ms: float,
+        queue_size: int,
+        agent_type: Optional[str] = None,
+        prompt_tokens: int = 0,
+    ):
         """Update metrics for a model after inference"""
         if model_name not in self.models:
             return
 
+        self.latency.observe(model_name, agent_type, prompt_tokens, latency_ms / 1000)
+
         model = self.models[model_name]
         # Exponential moving average for latency
         if model.avg_latency_ms == 0:
@@ -438,43 +522,62 @@ class SmartLoadBalancer:
             logger.warning(f"Model {model_name} failure reported (total: {self.models[model_name].failure_count})")
 
     async def start(self):
-        """Start the load balancer"""
-        await self.gpu_monitor.start_monitoring()
-        logger.info("GPU Load Balancer started")
+        """Start the load balancer (GPU sampling runs as one background task per device)"""
+        for gpu_id, monitor in self.gpu_monitors.items():
+            task = self._monitor_tasks.get(gpu_id)
+            if task is None or task.done():
+                self._monitor_tasks[gpu_id] = asyncio.create_task(monitor.start_monitoring())
+        logger.info(
+            f"GPU Load Balancer started (GPUs {sorted(self.gpu_monitors)}, telemetry: {self.gpu_monitor.provider.name})"
+        )
 
     def stop(self):
         """Stop the load balancer"""
-        self.gpu_monitor.stop_monitoring()
+        for monitor in self.gpu_monitors.values():
+            monitor.stop_monitoring()
+        for task in self._monitor_tasks.values():
+            task.cancel()
+        self._monitor_tasks.clear()
         logger.info("GPU Load Balancer stopped")
 
+    def _device_summary(self, state: GPUMemoryState) -> Dict[str, Any]:
+        return {
+            "id": state.gpu_id,
+            "memory_used_gb": state.used_memory_gb,
+            "memory_total_gb": state.total_memory_gb,
+            "memory_available_gb": state.available_memory_gb,
+            "utilization_percent": state.memory_utilization_percent,
+            "pressure": self.device_pressure(state),
+            "temperature_c": state.temperature_c,
+            "power_draw_w": state.power_draw_w,
+            "gpu_utilization_percent": state.gpu_utilization_percent,
+            "is_throttled": state.is_thermal_throttled,
+            "models": sorted(name for name, m in self.models.items() if state.gpu_id in m.gpu_ids),
+        }
+
     def get_status_summary(self) -> Dict[str, Any]:
-        """Get status summary for monitoring"""
-        latest_state = self.gpu_monitor.get_latest_state()
-        if not latest_state:
+        """Get status summary for monitoring (per-device memory pressure)"""
+        latest = {g: m.get_latest_state() for g, m in sorted(self.gpu_monitors.items())}
+        primary = latest.get(min(self.gpu_monitors))
+        if not primary:
             return {"status": "initializing"}
 
         return {
-            "gpu": {
-                "id": latest_state.gpu_id,
-                "memory_used_gb": latest_state.used_memory_gb,
-                "memory_total_gb": latest_state.total_memory_gb,
-                "memory_available_gb": latest_state.available_memory_gb,
-                "utilization_percent": latest_state.memory_utilization_percent,
-                "temperature_c": latest_state.temperature_c,
-                "power_draw_w": latest_state.power_draw_w,
-                "is_throttled": latest_state.is_thermal_throttled,
-            },
+            "gpu": self._device_summary(primary),
+            "gpus": {str(g): self._device_summary(state) for g, state in latest.items() if state},
             "models": {
                 name: {
                     "vram_gb": model.vram_gb,
                     "backend": model.backend,
+                    "gpu_ids": model.gpu_ids,
                     "avg_latency_ms": model.avg_latency_ms,
                     "queue_size": model.queue_size,
                     "failure_count": model.failure_count,
                 }
                 for name, model in self.models.items()
             },
-            "timestamp": latest_state.timestamp.isoformat(),
+            "telemetry": {str(g): m.get_stats() for g, m in sorted(self.gpu_monitors.items())},
+            "timestamp": primary.timestamp.isoformat(),
         }
 
 
@@ -494,10 +597,13 @@ async def initialize_load_balancer():
     """Initialize load balancer with registered models"""
     balancer = get_load_balancer()
 
-    # Register llama.cpp models
-    balancer.register_model("tiny-llama-1b", BackendType.LLAMA_CPP, 2.3, 8080)
-    balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8081)
-    balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084)
+    from .model_router import ModelRegistry
+    gpu_ids = {key: config.gpu_ids for key, config in ModelRegistry.MODELS.items()}
+
+    # Register llama.cpp models on the GPUs ModelRegistry places them on
+    balancer.register_model("tiny-llama-1b", BackendType.LLAMA_CPP, 2.3, 8080, gpu_ids["tiny-llama-1b"])
+    balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8081, gpu_ids["bi-medix2"])
+    balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084, gpu_ids["openins-llama3-8b"])
 
     # Register vLLM models (when available)
     # balancer.register_model("biomistral-7b-fp16", BackendType.VLLM, 14.0, 9000)
@@ -0,0 +1,223 @@
+"""
+GPU telemetry providers.
+
+The background GPUMonitor samples a provider every GPU_POLL_INTERVAL_S into a
+ring buffer; routing decisions read the latest sample instead of querying the
+driver themselves.
+
+- nvml: NVML through nvidia-ml-py (pynvml), no subprocess per sample
+- nvidia-smi: CSV query of the nvidia-smi binary (hosts without nvidia-ml-py)
+- fake: fixed, settable readings for tests and GPU-less machines
+
+GPU_TELEMETRY_PROVIDER=auto picks nvml when it initializes, else nvidia-smi.
+"""
+import os
+import shutil
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional
+from loguru import logger
+
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
+
+GPU_TELEMETRY_PROVIDER = os.getenv("GPU_TELEMETRY_PROVIDER", "auto").lower()  # auto | nvml | nvidia-smi | fake
+
+
+@dataclass
+class GPUMemoryState:
+    """Current GPU memory state"""
+    gpu_id: int
+    total_memory_gb: float
+    used_memory_gb: float
+    available_memory_gb: float
+    temperature_c: float
+    power_draw_w: float
+    gpu_utilization_percent: float = 0.0
+    timestamp: datetime = field(default_factory=datetime.now)
+
+    @property
+    def memory_utilization_percent(self) -> float:
+        """GPU memory utilization percentage"""
+        if self.total_memory_gb == 0:
+            return 0.0
+        return (self.used_memory_gb / self.total_memory_gb) * 100
+
+    @property
+    def is_thermal_throttled(self) -> bool:
+        """Check if GPU is overheating"""
+        return self.temperature_c > 80  # RTX 3090 throttles around 80°C
+
+
+class GPUTelemetryProvider(ABC):
+    """Source of GPU readings; sample() may block and is run off the event loop."""
+
+    name = "base"
+
+    @abstractmethod
+    def device_count(self) -> int:
+        ...
+
+    @abstractmethod
+    def sample(self, gpu_id: int) -> GPUMemoryState:
+        ...
+
+    def close(self):
+        pass
+
+
+class NVMLTelemetryProvider(GPUTelemetryProvider):
+    """Direct NVML queries (a few microseconds each, no process spawn)."""
+
+    name = "nvml"
+
+    def __init__(self):
+        if not NVML_AVAILABLE:
+            raise RuntimeError("nvidia-ml-py is not installed")
+        pynvml.nvmlInit()
+        self._handles: Dict[int, object] = {}
+        self._lock = threading.Lock()
+
+    def _handle(self, gpu_id: int):
+        with self._lock:
+            if gpu_id not in self._handles:
+                self._handles[gpu_id] = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
+            return self._handles[gpu_id]
+
+    def device_count(self) -> int:
+        return pynvml.nvmlDeviceGetCount()
+
+    def sample(self, gpu_id: int) -> GPUMemoryState:
+        handle = self._handle(gpu_id)
+        memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        total_gb = memory.total / 1024 ** 3
+        used_gb = memory.used / 1024 ** 3
+        try:
+            power_w = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000  # milliwatts
+        except pynvml.NVMLError:
+            power_w = 0.0  # Not supported on every board
+        return GPUMemoryState(
+            gpu_id=gpu_id,
+            total_memory_gb=total_gb,
+            used_memory_gb=used_gb,
+            available_memory_gb=total_gb - used_gb,
+            temperature_c=float(pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)),
+            power_draw_w=power_w,
+            gpu_utilization_percent=float(pynvml.nvmlDeviceGetUtilizationRates(handle).gpu),
+        )
+
+    def close(self):
+        try:
+            pynvml.nvmlShutdown()
+        except Exception:
+            pass
+
+
+class NvidiaSmiTelemetryProvider(GPUTelemetryProvider):
+    """nvidia-smi CSV query; one process per sample, only ever run by the background monitor."""
+
+    name = "nvidia-smi"
+    QUERY = "memory.total,memory.used,temperature.gpu,power.draw,utilization.gpu"
+
+    def device_count(self) -> int:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            capture_output=True, text=True, timeout=5,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"nvidia-smi failed: {result.stderr.strip()}")
+        return len(result.stdout.split())
+
+    def sample(self, gpu_id: int) -> GPUMemoryState:
+        result = subprocess.run(
+            ["nvidia-smi", f"--id={gpu_id}", f"--query-gpu={self.QUERY}", "--format=csv,nounits,noheader"],
+            capture_output=True, text=True, timeout=5,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"nvidia-smi failed: {result.stderr.strip()}")
+
+        def number(value: str) -> float:
+            try:
+                return float(value.strip())
+            except ValueError:  # "[N/A]"
+                return 0.0
+
+        total_mb, used_mb, temp_c, power_w, util = (number(p) for p in result.stdout.strip().split(",")[:5])
+        return GPUMemoryState(
+            gpu_id=gpu_id,
+            total_memory_gb=total_mb / 1024,
+            used_memory_gb=used_mb / 1024,
+            available_memory_gb=(total_mb - used_mb) / 1024,
+            temperature_c=temp_c,
+            power_draw_w=power_w,
+            gpu_utilization_percent=util,
+        )
+
+
+class FakeTelemetryProvider(GPUTelemetryProvider):
+    """Settable readings per device (tests, development on GPU-less machines)."""
+
+    name = "fake"
+
+    def __init__(self, devices: int = 1, total_memory_gb: float = 24.0, used_memory_gb: float = 8.0):
+        self.samples = 0
+        self.readings: Dict[int, Dict[str, float]] = {
+            gpu_id: {
+                "total_memory_gb": total_memory_gb,
+                "used_memory_gb": used_memory_gb,
+                "temperature_c": 50.0,
+                "power_draw_w": 150.0,
+                "gpu_utilization_percent": 0.0,
+            }
+            for gpu_id in range(devices)
+        }
+
+    def set(self, gpu_id: int = 0, **readings: float):
+        self.readings[gpu_id].update(readings)
+
+    def device_count(self) -> int:
+        return len(self.readings)
+
+    def sample(self, gpu_id: int) -> GPUMemoryState:
+        self.samples += 1
+        r = self.readings[gpu_id]
+        return GPUMemoryState(
+            gpu_id=gpu_id,
+            available_memory_gb=r["total_memory_gb"] - r["used_memory_gb"],
+            **r,
+        )
+
+
+def create_telemetry_provider(name: str = GPU_TELEMETRY_PROVIDER) -> GPUTelemetryProvider:
+    """Provider by name; "auto" prefers NVML and falls back to nvidia-smi."""
+    if name == "fake":
+        return FakeTelemetryProvider()
+    if name == "nvidia-smi":
+        return NvidiaSmiTelemetryProvider()
+    try:
+        return NVMLTelemetryProvider()
+    except Exception as e:
+        if name == "nvml":
+            raise
+        logger.info(f"NVML unavailable ({e}), GPU telemetry via nvidia-smi")
+        if not shutil.which("nvidia-smi"):
+            logger.warning("nvidia-smi not found: GPU telemetry will report conservative defaults")
+        return NvidiaSmiTelemetryProvider()
+
+
+# Global telemetry provider
+_telemetry_provider: Optional[GPUTelemetryProvider] = None
+
+
+def get_telemetry_provider() -> GPUTelemetryProvider:
+    global _telemetry_provider
+    if _telemetry_provider is None:
+        _telemetry_provider = create_telemetry_provider()
+    return _telemetry_provider
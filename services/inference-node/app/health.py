@@ -0,0 +1,204 @@
+"""
+Background health prober.
+
+Every HEALTH_PROBE_INTERVAL_S all registered checks (llama.cpp replicas,
+database, embedding model, translation engine) run concurrently, each bounded
+by HEALTH_PROBE_TIMEOUT_S. The result is cached, so /healthz answers instantly
+and never blocks the event loop on a slow backend.
+
+- /livez: the process is up (no backend checks)
+- /readyz: every HEALTH_READINESS_CHECKS check is ok or degraded and the last
+  probe is fresher than HEALTH_STALE_AFTER_S
+"""
+import asyncio
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+
+HEALTH_PROBE_INTERVAL_S = float(os.getenv("HEALTH_PROBE_INTERVAL_S", "10"))
+HEALTH_PROBE_TIMEOUT_S = float(os.getenv("HEALTH_PROBE_TIMEOUT_S", "3"))
+HEALTH_STALE_AFTER_S = float(os.getenv("HEALTH_STALE_AFTER_S", str(3 * HEALTH_PROBE_INTERVAL_S)))
+HEALTH_READINESS_CHECKS = [
+    c.strip() for c in os.getenv("HEALTH_READINESS_CHECKS", "llama_cpp,database").split(",") if c.strip()
+]
+
+OK = "ok"
+DEGRADED = "degraded"
+DOWN = "down"
+
+# A check receives the prober's HTTP client and returns at least {"status": ok|degraded|down}
+HealthCheck = Callable[[httpx.AsyncClient], Awaitable[Dict[str, Any]]]
+
+
+@dataclass
+class _RegisteredCheck:
+    fn: HealthCheck
+    critical: bool
+
+
+class HealthProber:
+    """Runs registered checks concurrently in the background and caches the result."""
+
+    def __init__(
+        self,
+        interval_s: float = HEALTH_PROBE_INTERVAL_S,
+        timeout_s: float = HEALTH_PROBE_TIMEOUT_S,
+        stale_after_s: float = HEALTH_STALE_AFTER_S,
+        readiness_checks: Optional[List[str]] = None,
+    ):
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.stale_after_s = stale_after_s
+        self.readiness_checks = set(HEALTH_READINESS_CHECKS if readiness_checks is None else readiness_checks)
+        self.checks: Dict[str, _RegisteredCheck] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.last_probe_at = 0.0  # wall clock, 0 = never probed
+        self.probes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, fn: HealthCheck, critical: Optional[bool] = None):
+        """Add a check; critical checks gate readiness (default: listed in HEALTH_READINESS_CHECKS)."""
+        self.checks[name] = _RegisteredCheck(fn, name in self.readiness_checks if critical is None else critical)
+
+    async def _run_check(self, name: str, check: _RegisteredCheck, client: httpx.AsyncClient) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            result = dict(await asyncio.wait_for(check.fn(client), timeout=self.timeout_s))
+        except asyncio.TimeoutError:
+            result = {"status": DOWN, "error": f"timed out after {self.timeout_s:.0f}s"}
+        except Exception as e:
+            result = {"status": DOWN, "error": str(e)}
+        result.setdefault("status", OK)
+        result["latency_ms"] = round((time.monotonic() - start) * 1000, 1)
+        if result["status"] != self.results.get(name, {}).get("status", OK):
+            logger.info(f"Health check {name}: {result['status']}")
+        return result
+
+    async def probe_once(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        """Run every check concurrently and update the cached snapshot."""
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(n, self.checks[n], client) for n in names))
+        self.results = dict(zip(names, results))
+        self.last_probe_at = time.time()
+        self.probes += 1
+        return self.snapshot()
+
+    async def _loop(self):
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    await self.probe_once(client)
+                except Exception as e:
+                    logger.error(f"Health probe failed: {e}")
+                await asyncio.sleep(self.interval_s)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"✓ Health prober started ({len(self.checks)} checks every {self.interval_s:.0f}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def age_s(self) -> Optional[float]:
+        return round(time.time() - self.last_probe_at, 1) if self.last_probe_at else None
+
+    def ready(self) -> bool:
+        age = self.age_s()
+        if age is None or age > self.stale_after_s:
+            return False
+        return all(
+            self.results.get(name, {}).get("status") in (OK, DEGRADED)
+            for name, check in self.checks.items()
+            if check.critical
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cached result of the last probe: overall status, age and per-check results."""
+        if not self.last_probe_at:
+            status = "starting"
+        elif all(r["status"] == OK for r in self.results.values()):
+            status = OK
+        else:
+            status = DEGRADED
+        return {
+            "status": status,
+            "ts": int(self.last_probe_at or time.time()),
+            "age_s": self.age_s(),
+            "ready": self.ready(),
+            "backends": dict(self.results),
+        }
+
+
+def llama_cpp_check(registry) -> HealthCheck:
+    """GET /health on every replica of every model (also feeds replica selection)."""
+    async def check(client: httpx.AsyncClient) -> Dict[str, Any]:
+        pools = await registry.probe_all(client)
+        replicas = {url: healthy for urls in pools.values() for url, healthy in urls.items()}
+        healthy = sum(replicas.values())
+        status = OK if healthy == len(replicas) else DEGRADED if healthy else DOWN
+        return {
+            "status": status,
+            "healthy_replicas": healthy,
+            "replicas": len(replicas),
+            "models": {
+                model: {"healthy": sum(urls.values()), "replicas": len(urls)} for model, urls in pools.items()
+            },
+        }
+    return check
+
+
+def database_check(engine) -> HealthCheck:
+    """SELECT 1 over a pooled connection."""
+    async def check(client: httpx.AsyncClient) -> Dict[str, Any]:
+        from sqlalchemy import text
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return {"status": OK}
+    return check
+
+
+def embeddings_check(rag_engine) -> HealthCheck:
+    """Embedding model loaded (stub embeddings keep RAG up but are not semantic)."""
+    async def check(client: httpx.AsyncClient) -> Dict[str, Any]:
+        embeddings = rag_engine.embeddings_engine
+        if embeddings.model is None:
+            return {"status": DEGRADED, "model": embeddings.model_name, "mode": "stub"}
+        return {"status": OK, "model": embeddings.model_name}
+    return check
+
+
+def translation_check() -> HealthCheck:
+    """IndicTrans2 state, read without importing (and loading) the engine."""
+    async def check(client: httpx.AsyncClient) -> Dict[str, Any]:
+        module = sys.modules.get("app.translation_integration")
+        service = getattr(module, "_translation_service", None)
+        if service is None:
+            return {"status": OK, "mode": "not_loaded"}
+        loaded = sorted(getattr(service.engine, "_loaded_models", ()))
+        demo = [m for m in loaded if m.endswith("_demo")]
+        return {"status": DEGRADED if demo else OK, "loaded_models": loaded, "demo_models": demo}
+    return check
+
+
+# Global health prober
+_health_prober: Optional[HealthProber] = None
+
+
+def get_health_prober() -> HealthProber:
+    global _health_prober
+    if _health_prober is None:
+        _health_prober = HealthProber()
+    return _health_prober
@@ -0,0 +1,136 @@
+"""
+Hedged requests for latency-sensitive agents.
+
+If the primary model has not answered within the agent's hedge deadline, the
+same request is also sent to the next healthy FALLBACK_CHAIN model; the first
+successful response wins and the other request is cancelled. This applies to
+the direct replica call in /v1/chat/completions as well as ModelRouter.generate
+(both go through ModelRouter.hedge).
+
+The deadline is the agent's observed p95 latency (over the last
+HEDGE_WINDOW successful generations, floored at HEDGE_MIN_DELAY_S), or
+HEDGE_DEFAULT_DELAY_S until HEDGE_MIN_SAMPLES latencies are known. Hedges are
+capped at HEDGE_BUDGET_PERCENT of the agent's requests so a slow backend
+cannot double the load on the fleet.
+"""
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+from loguru import logger
+
+try:
+    from prometheus_client import Counter
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+HEDGE_AGENTS = {a.strip() for a in os.getenv("HEDGE_AGENTS", "Triage,Chat").split(",") if a.strip()}
+HEDGE_BUDGET_PERCENT = float(os.getenv("HEDGE_BUDGET_PERCENT", "10"))
+HEDGE_DEFAULT_DELAY_S = float(os.getenv("HEDGE_DEFAULT_DELAY_S", "8"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+if PROMETHEUS_AVAILABLE:
+    HEDGES_ISSUED = Counter("llm_hedged_requests_total", "Hedge requests sent to a fallback model", ["agent"])
+    HEDGES_WON = Counter("llm_hedge_wins_total", "Hedge requests that answered before the primary", ["agent"])
+
+
+@dataclass
+class AgentHedgeState:
+    latencies_s: Deque[float] = field(default_factory=lambda: deque(maxlen=HEDGE_WINDOW))
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    budget_exhausted: int = 0
+
+
+class HedgePolicy:
+    """Per-agent hedge deadlines (from observed p95 latency) and hedge budget."""
+
+    def __init__(
+        self,
+        agents=None,
+        budget_percent: float = HEDGE_BUDGET_PERCENT,
+        default_delay_s: float = HEDGE_DEFAULT_DELAY_S,
+        min_delay_s: float = HEDGE_MIN_DELAY_S,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+    ):
+        self.agents = set(HEDGE_AGENTS if agents is None else agents)
+        self.budget_percent = budget_percent
+        self.default_delay_s = default_delay_s
+        self.min_delay_s = min_delay_s
+        self.min_samples = min_samples
+        self._agents: Dict[str, AgentHedgeState] = {}
+
+    def _state(self, agent_type: str) -> AgentHedgeState:
+        if agent_type not in self._agents:
+            self._agents[agent_type] = AgentHedgeState()
+        return self._agents[agent_type]
+
+    def enabled_for(self, agent_type: str) -> bool:
+        return agent_type in self.agents
+
+    def observe(self, agent_type: str, latency_s: float):
+        """Record a successful generation latency."""
+        self._state(agent_type).latencies_s.append(latency_s)
+
+    def hedge_delay(self, agent_type: str) -> float:
+        """Seconds to wait for the primary before hedging: observed p95 latency."""
+        latencies = sorted(self._state(agent_type).latencies_s)
+        if len(latencies) < self.min_samples:
+            return self.default_delay_s
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        return max(self.min_delay_s, p95)
+
+    def start_request(self, agent_type: str):
+        self._state(agent_type).requests += 1
+
+    def try_acquire(self, agent_type: str) -> bool:
+        """Take a hedge from the agent's budget (HEDGE_BUDGET_PERCENT of its requests)."""
+        state = self._state(agent_type)
+        if (state.hedged + 1) > state.requests * self.budget_percent / 100:
+            state.budget_exhausted += 1
+            logger.debug(f"Hedge budget exhausted for {agent_type}")
+            return False
+        state.hedged += 1
+        if PROMETHEUS_AVAILABLE:
+            HEDGES_ISSUED.labels(agent=agent_type).inc()
+        return True
+
+    def record_win(self, agent_type: str):
+        self._state(agent_type).hedge_wins += 1
+        if PROMETHEUS_AVAILABLE:
+            HEDGES_WON.labels(agent=agent_type).inc()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hedge deadline, rate and win rate per agent"""
+        return {
+            "agents": sorted(self.agents),
+            "budget_percent": self.budget_percent,
+            "per_agent": {
+                agent: {
+                    "hedge_delay_s": round(self.hedge_delay(agent), 3),
+                    "latency_samples": len(state.latencies_s),
+                    "requests": state.requests,
+                    "hedged": state.hedged,
+                    "hedge_rate_percent": round(state.hedged / state.requests * 100, 2) if state.requests else 0.0,
+                    "hedge_wins": state.hedge_wins,
+                    "budget_exhausted": state.budget_exhausted,
+                }
+                for agent, state in self._agents.items()
+            },
+        }
+
+
+# Global hedge policy
+_hedge_policy: Optional[HedgePolicy] = None
+
+
+def get_hedge_policy() -> HedgePolicy:
+    global _hedge_policy
+    if _hedge_policy is None:
+        _hedge_policy = HedgePolicy()
+    return _hedge_policy
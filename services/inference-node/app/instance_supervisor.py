@@ -0,0 +1,332 @@
+"""
+Asyncio process supervision for llama-server instances.
+
+MultiModelManager starts instances through an InstanceSupervisor, which:
+
+- Gates readiness: an instance is only "running" (routable) once /health
+  answers 200, and a start fails fast if the process exits while loading
+- Watches child exits: a crash marks the instance "error" immediately and
+  restarts it with exponential backoff (reset after LLAMA_STABLE_AFTER_S
+  of uptime)
+- Probes liveness: LLAMA_LIVENESS_FAILURES failed /health checks in a row
+  kill a hung server so it is restarted like a crash
+- Captures stdout/stderr into a rotating log per instance under LLAMA_LOG_DIR
+- Drains on stop: the instance is marked "draining" (no new traffic), in-flight
+  requests get up to LLAMA_DRAIN_TIMEOUT_S, then SIGTERM and SIGKILL. Router
+  requests count as in flight through MultiModelManager.serve(), and replica
+  selection skips draining / failed instances (ModelRouter.accepting)
+"""
+import asyncio
+import logging
+import os
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from logging.handlers import RotatingFileHandler
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+
+LLAMA_LOG_DIR = os.getenv("LLAMA_LOG_DIR", "/tmp/llama-instances")
+LLAMA_LOG_MAX_BYTES = int(os.getenv("LLAMA_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LLAMA_LOG_BACKUPS = int(os.getenv("LLAMA_LOG_BACKUPS", "3"))
+LLAMA_READY_TIMEOUT_S = float(os.getenv("LLAMA_READY_TIMEOUT_S", "60"))
+LLAMA_RESTART_BACKOFF_S = float(os.getenv("LLAMA_RESTART_BACKOFF_S", "1"))
+LLAMA_RESTART_BACKOFF_MAX_S = float(os.getenv("LLAMA_RESTART_BACKOFF_MAX_S", "60"))
+LLAMA_STABLE_AFTER_S = float(os.getenv("LLAMA_STABLE_AFTER_S", "60"))
+LLAMA_LIVENESS_INTERVAL_S = float(os.getenv("LLAMA_LIVENESS_INTERVAL_S", "5"))
+LLAMA_LIVENESS_FAILURES = int(os.getenv("LLAMA_LIVENESS_FAILURES", "3"))
+LLAMA_DRAIN_TIMEOUT_S = float(os.getenv("LLAMA_DRAIN_TIMEOUT_S", "30"))
+LLAMA_STOP_TIMEOUT_S = float(os.getenv("LLAMA_STOP_TIMEOUT_S", "10"))
+
+
+@dataclass
+class SupervisedProcess:
+    """Supervision state for one instance."""
+    name: str
+    process: Optional[asyncio.subprocess.Process] = None
+    wanted: bool = False  # Should be running; False once stop() is requested
+    started_at: float = 0.0
+    restarts: int = 0
+    crashes: int = 0  # Consecutive crashes, drives the backoff
+    liveness_failures: int = 0
+    last_exit_code: Optional[int] = None
+    restart_task: Optional[asyncio.Task] = None
+    tasks: List[asyncio.Task] = field(default_factory=list)
+    tail: Deque[str] = field(default_factory=lambda: deque(maxlen=20))
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class InstanceSupervisor:
+    """Starts, watches, restarts and drains the manager's llama-server processes.
+
+    `manager` provides `instances` (name -> ModelInstance), `command(name)`,
+    `process_env(name)` and `in_flight` (name -> active requests).
+    """
+
+    def __init__(
+        self,
+        manager,
+        log_dir: str = LLAMA_LOG_DIR,
+        ready_timeout_s: float = LLAMA_READY_TIMEOUT_S,
+        backoff_s: float = LLAMA_RESTART_BACKOFF_S,
+        backoff_max_s: float = LLAMA_RESTART_BACKOFF_MAX_S,
+        stable_after_s: float = LLAMA_STABLE_AFTER_S,
+        liveness_interval_s: float = LLAMA_LIVENESS_INTERVAL_S,
+        liveness_failures: int = LLAMA_LIVENESS_FAILURES,
+        drain_timeout_s: float = LLAMA_DRAIN_TIMEOUT_S,
+        stop_timeout_s: float = LLAMA_STOP_TIMEOUT_S,
+    ):
+        self.manager = manager
+        self.log_dir = log_dir
+        self.ready_timeout_s = ready_timeout_s
+        self.backoff_s = backoff_s
+        self.backoff_max_s = backoff_max_s
+        self.stable_after_s = stable_after_s
+        self.liveness_interval_s = liveness_interval_s
+        self.liveness_failures = liveness_failures
+        self.drain_timeout_s = drain_timeout_s
+        self.stop_timeout_s = stop_timeout_s
+        self.states: Dict[str, SupervisedProcess] = {}
+        self._liveness_task: Optional[asyncio.Task] = None
+
+    def _state(self, name: str) -> SupervisedProcess:
+        if name not in self.states:
+            self.states[name] = SupervisedProcess(name=name)
+        return self.states[name]
+
+    def log_path(self, name: str) -> str:
+        return os.path.join(self.log_dir, f"{name}.log")
+
+    def _process_log(self, name: str) -> logging.Logger:
+        """Rotating file logger for one instance's stdout/stderr."""
+        log = logging.getLogger(f"llama_server.{name}")
+        path = self.log_path(name)
+        if not any(getattr(h, "baseFilename", None) == os.path.abspath(path) for h in log.handlers):
+            for handler in list(log.handlers):
+                log.removeHandler(handler)
+                handler.close()
+            os.makedirs(self.log_dir, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=LLAMA_LOG_MAX_BYTES, backupCount=LLAMA_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            log.addHandler(handler)
+            log.setLevel(logging.INFO)
+            log.propagate = False
+        return log
+
+    async def _pump(self, state: SupervisedProcess, stream: asyncio.StreamReader):
+        log = self._process_log(state.name)
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            text = line.decode(errors="replace").rstrip()
+            state.tail.append(text)
+            log.info(text)
+
+    async def _spawn(self, state: SupervisedProcess):
+        instance = self.manager.instances[state.name]
+        process = await asyncio.create_subprocess_exec(
+            *self.manager.command(state.name),
+            env=self.manager.process_env(state.name),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,  # Own process group, so stop() reaches its children too
+        )
+        state.process = process
+        state.started_at = time.monotonic()
+        state.liveness_failures = 0
+        state.tasks = [
+            asyncio.create_task(self._pump(state, process.stdout)),
+            asyncio.create_task(self._watch(state, process)),
+        ]
+        instance.pid = process.pid
+        instance.endpoint = f"http://127.0.0.1:{instance.port}"
+        instance.status = "starting"
+        logger.info(
+            f"Started {state.name} (PID: {process.pid}, Port: {instance.port}, GPU: {instance.gpu_id})"
+        )
+
+    async def _wait_ready(self, state: SupervisedProcess) -> bool:
+        """Poll /health until 200; give up if the process exits or the timeout passes."""
+        instance = self.manager.instances[state.name]
+        process = state.process
+        deadline = time.monotonic() + self.ready_timeout_s
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            while time.monotonic() < deadline and process.returncode is None:
+                try:
+                    response = await client.get(f"{instance.endpoint}/health")
+                    if response.status_code == 200:
+                        instance.status = "running"
+                        logger.info(f"Instance ready: {instance.endpoint}")
+                        return True
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.25)
+        reason = f"exited with {process.returncode}" if process.returncode is not None else "timed out"
+        logger.warning(f"{state.name} not ready ({reason}); last output: {list(state.tail)[-3:]}")
+        return False
+
+    async def start(self, name: str) -> bool:
+        """Start the instance and wait until it is ready; supervise it from then on."""
+        state = self._state(name)
+        async with state.lock:
+            if state.process and state.process.returncode is None:
+                return self.manager.instances[name].status == "running"
+            if state.restart_task and not state.restart_task.done():
+                # Crashed and waiting out its backoff: start now instead. While we hold the
+                # lock the restart is still sleeping or queued on it, so cancelling is safe.
+                state.restart_task.cancel()
+                state.restart_task = None
+            try:
+                await self._spawn(state)
+            except OSError as e:
+                logger.error(f"Failed to start {name}: {e}")
+                self.manager.instances[name].status = "error"
+                return False
+            if await self._wait_ready(state):
+                state.wanted = True
+                return True
+            await self._terminate(state)
+            self.manager.instances[name].status = "error"
+            return False
+
+    async def _watch(self, state: SupervisedProcess, process: asyncio.subprocess.Process):
+        code = await process.wait()
+        if state.process is not process or not state.wanted:
+            return  # Replaced, or stopped on purpose
+        instance = self.manager.instances[state.name]
+        instance.status = "error"  # Stop routing to it right away
+        instance.pid = None
+        state.last_exit_code = code
+        if time.monotonic() - state.started_at >= self.stable_after_s:
+            state.crashes = 0
+        state.crashes += 1
+        delay = min(self.backoff_max_s, self.backoff_s * 2 ** (state.crashes - 1))
+        logger.error(
+            f"{state.name} exited with {code} (crash #{state.crashes}); restarting in {delay:.1f}s; "
+            f"last output: {list(state.tail)[-3:]}"
+        )
+        state.restart_task = asyncio.create_task(self._restart(state, delay))
+
+    async def _restart(self, state: SupervisedProcess, delay: float):
+        await asyncio.sleep(delay)
+        async with state.lock:
+            if not state.wanted or (state.process and state.process.returncode is None):
+                return  # Stopped on purpose, or already started again by start()
+            try:
+                await self._spawn(state)
+            except OSError as e:
+                logger.error(f"Restart of {state.name} failed: {e}")
+                state.restart_task = asyncio.create_task(
+                    self._restart(state, min(self.backoff_max_s, delay * 2))
+                )
+                return
+            state.restarts += 1
+            if not await self._wait_ready(state) and state.process.returncode is None:
+                # Hung while loading: kill it and let _watch schedule the next attempt
+                self._signal(state.process, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(process: asyncio.subprocess.Process, sig: int):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def _terminate(self, state: SupervisedProcess):
+        """SIGTERM the process group, SIGKILL after stop_timeout_s, then reap log pumping."""
+        process = state.process
+        if process and process.returncode is None:
+            self._signal(process, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.stop_timeout_s)
+            except asyncio.TimeoutError:
+                logger.warning(f"{state.name} ignored SIGTERM, killing")
+                self._signal(process, signal.SIGKILL)
+                await process.wait()
+        if state.tasks:
+            await asyncio.gather(*state.tasks, return_exceptions=True)
+            state.tasks = []
+        if process:
+            state.last_exit_code = process.returncode
+        state.process = None
+        self.manager.instances[state.name].pid = None
+
+    async def stop(self, name: str, drain: bool = True):
+        """Stop routing to the instance, let in-flight requests finish, then terminate it."""
+        state = self._state(name)
+        state.wanted = False
+        if state.restart_task:
+            state.restart_task.cancel()
+            state.restart_task = None
+        instance = self.manager.instances[name]
+        async with state.lock:
+            if drain and state.process and self.manager.in_flight.get(name, 0):
+                instance.status = "draining"
+                deadline = time.monotonic() + self.drain_timeout_s
+                while self.manager.in_flight.get(name, 0) and time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                if self.manager.in_flight.get(name, 0):
+                    logger.warning(f"{name}: {self.manager.in_flight[name]} requests still running after drain")
+            await self._terminate(state)
+            instance.status = "stopped"
+        logger.info(f"Stopped {name} (port {instance.port}, GPU {instance.gpu_id})")
+
+    async def _liveness_loop(self):
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            while True:
+                await asyncio.sleep(self.liveness_interval_s)
+                for name, state in list(self.states.items()):
+                    instance = self.manager.instances[name]
+                    if instance.status != "running" or not state.process or state.process.returncode is not None:
+                        continue
+                    try:
+                        response = await client.get(f"{instance.endpoint}/health")
+                        healthy = response.status_code == 200
+                    except httpx.HTTPError:
+                        healthy = False
+                    state.liveness_failures = 0 if healthy else state.liveness_failures + 1
+                    if state.liveness_failures >= self.liveness_failures:
+                        logger.error(f"{name} failed {state.liveness_failures} health checks; killing for restart")
+                        instance.status = "error"
+                        self._signal(state.process, signal.SIGKILL)
+
+    def start_monitoring(self):
+        if self._liveness_task is None or self._liveness_task.done():
+            self._liveness_task = asyncio.create_task(self._liveness_loop())
+
+    async def stop_monitoring(self):
+        if self._liveness_task:
+            self._liveness_task.cancel()
+            try:
+                await self._liveness_task
+            except asyncio.CancelledError:
+                pass
+            self._liveness_task = None
+
+    def running(self) -> List[str]:
+        return [name for name, s in self.states.items() if s.process and s.process.returncode is None]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-instance process state, restarts and log location."""
+        now = time.monotonic()
+        return {
+            "log_dir": self.log_dir,
+            "instances": {
+                name: {
+                    "pid": state.process.pid if state.process and state.process.returncode is None else None,
+                    "supervised": state.wanted,
+                    "uptime_s": round(now - state.started_at, 1) if state.process else None,
+                    "restarts": state.restarts,
+                    "consecutive_crashes": state.crashes,
+                    "last_exit_code": state.last_exit_code,
+                    "liveness_failures": state.liveness_failures,
+                    "log": self.log_path(name),
+                }
+                for name, state in self.states.items()
+            },
+        }
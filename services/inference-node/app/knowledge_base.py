@@ -37,7 +37,7 @@ except ImportError:
 try:
     from app.database import (
         MedicalDocument, AsyncSessionLocal, 
-        search_medical_documents, User
+        search_document_hits, User
     )
     from app.rag_engine import EmbeddingEngine
     DB_AVAILABLE = True
@@ -364,25 +364,26 @@ class SourceAttributionEngine:
         Returns:
             List of citations with source attribution
         """
-        # Search knowledge base
-        results = await search_medical_documents(
-            query=query,
+        # Search knowledge base (projected: excerpt only, no embedding/JSONB)
+        query_embedding = self.embedding_engine.encode_single(query)
+        hits = await search_document_hits(
+            query_embedding=query_embedding,
             specialty=specialty,
             limit=top_k
         )
         
         citations = []
-        for result in results:
-            if result['similarity'] >= min_score:
+        for hit in hits:
+            if hit.similarity >= min_score:
                 citations.append(Citation(
-                    document_id=result['document_id'],
-                    title=result['title'],
-                    source_url=result.get('source_url'),
-                    specialty=result['specialty'],
-                    relevance_score=result['similarity'],
-                    excerpt=result['content'][:200] + "...",
-                    page_number=result.get('metadata', {}).get('page_number'),
-                    published_date=result.get('created_at')
+                    document_id=hit.document_id,
+                    title=hit.title,
+                    source_url=hit.source_url,
+                    specialty=hit.specialty,
+                    relevance_score=hit.similarity,
+                    excerpt=hit.content + "...",
+                    page_number=hit.page_number,
+                    published_date=hit.created_at
                 ))
         
         logger.info(f"Generated {len(citations)} citations for query")
@@ -4,6 +4,7 @@ Knowledge Base & Self-Learning API Endpoints
 Routes:
 - POST /v1/knowledge/ingest - Ingest new document
 - GET /v1/knowledge/search - Search knowledge base
+- GET /v1/knowledge/documents/{id}/content - Full content for a search hit
 - POST /v1/knowledge/feedback - Submit user feedback
 - GET /v1/knowledge/citations - Get citations for query
 - GET /v1/knowledge/gaps - Identify knowledge gaps
@@ -236,26 +237,28 @@ async def search_knowledge_base(
 ):
     """Search knowledge base."""
     try:
-        from app.database import search_medical_documents
+        from app.database import search_document_hits
         
-        results = await search_medical_documents(
-            query=request.query,
+        query_embedding = get_attribution_engine().embedding_engine.encode_single(request.query)
+        hits = await search_document_hits(
+            query_embedding=query_embedding,
             specialty=request.specialty,
             document_type=request.document_type,
-            limit=request.limit
+            limit=request.limit,
+            session=db,
         )
         
         # Filter by minimum score
         filtered_results = [
-            r for r in results 
-            if r['similarity'] >= request.min_score
+            hit.to_dict() for hit in hits
+            if hit.similarity >= request.min_score
         ]
         
         return {
             "query": request.query,
             "results": filtered_results,
             "count": len(filtered_results),
-            "total_searched": len(results)
+            "total_searched": len(hits)
         }
     
     except Exception as e:
@@ -263,6 +266,22 @@ async def search_knowledge_base(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/documents/{document_id}/content")
+async def get_document_content(
+    document_id: str,
+    current_user: User = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full content of a document returned as an excerpt by /search."""
+    from app.database import fetch_document_content
+    
+    contents = await fetch_document_content([document_id], session=db)
+    if document_id not in contents:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return {"document_id": document_id, "content": contents[document_id]}
+
+
 @router.post("/citations")
 async def get_citations(
     request: CitationRequest,
@@ -0,0 +1,193 @@
+"""
+Online latency model for routing and admission.
+
+Completed generations are recorded per (model, agent, prompt-length bucket)
+as an EWMA plus a t-digest of latencies, so p50/p95 can be predicted without
+keeping every sample. Predictions fall back from the exact key to the model's
+bucket across agents, then to the model overall, and need at least
+LATENCY_MIN_SAMPLES observations.
+
+The digest forgets slowly: once it holds LATENCY_DIGEST_MAX_WEIGHT samples all
+weights are halved, so quantiles track backend changes (new quantization,
+other models sharing the GPU) within a few thousand requests.
+"""
+import bisect
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+LATENCY_EWMA_ALPHA = float(os.getenv("LATENCY_EWMA_ALPHA", "0.2"))
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", "5"))
+LATENCY_TDIGEST_COMPRESSION = float(os.getenv("LATENCY_TDIGEST_COMPRESSION", "100"))
+LATENCY_DIGEST_MAX_WEIGHT = float(os.getenv("LATENCY_DIGEST_MAX_WEIGHT", "2000"))
+
+# Prompt-length buckets (estimated prompt tokens, upper bounds)
+PROMPT_BUCKETS = (256, 1024, 4096)
+ANY = "*"
+
+
+def prompt_bucket(prompt_tokens: int) -> str:
+    """"0-256", "256-1024", "1024-4096" or "4096+"."""
+    i = bisect.bisect_left(PROMPT_BUCKETS, prompt_tokens)
+    if i == len(PROMPT_BUCKETS):
+        return f"{PROMPT_BUCKETS[-1]}+"
+    return f"{PROMPT_BUCKETS[i - 1] if i else 0}-{PROMPT_BUCKETS[i]}"
+
+
+class TDigest:
+    """Merging t-digest: bounded set of centroids with accurate tail quantiles."""
+
+    def __init__(self, compression: float = LATENCY_TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.centroids: List[List[float]] = []  # [mean, weight], sorted by mean
+        self._buffer: List[List[float]] = []
+        self.total_weight = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value: float, weight: float = 1.0):
+        self._buffer.append([value, weight])
+        self.total_weight += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.compression:
+            self._merge()
+
+    def _merge(self):
+        if not self._buffer:
+            return
+        items = sorted(self.centroids + self._buffer, key=lambda c: c[0])
+        self._buffer = []
+        total = self.total_weight
+        merged: List[List[float]] = [list(items[0])]
+        cumulative = 0.0
+        for mean, weight in items[1:]:
+            last = merged[-1]
+            q = (cumulative + (last[1] + weight) / 2) / total
+            # Centroids near the median may be large, tail centroids stay small
+            if last[1] + weight <= max(1.0, 4 * total * q * (1 - q) / self.compression):
+                last[0] += (mean - last[0]) * weight / (last[1] + weight)
+                last[1] += weight
+            else:
+                cumulative += last[1]
+                merged.append([mean, weight])
+        self.centroids = merged
+
+    def decay(self, factor: float = 0.5):
+        """Scale all weights down so new samples count more."""
+        self._merge()
+        for c in self.centroids:
+            c[1] *= factor
+        self.total_weight *= factor
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._merge()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        target = q * self.total_weight
+        cumulative = 0.0
+        previous_center, previous_mean = 0.0, self.min
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                span = center - previous_center
+                t = (target - previous_center) / span if span > 0 else 0.0
+                return previous_mean + t * (mean - previous_mean)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        span = self.total_weight - previous_center
+        t = (target - previous_center) / span if span > 0 else 1.0
+        return previous_mean + t * (self.max - previous_mean)
+
+
+@dataclass
+class LatencyStats:
+    """Streaming latency summary for one key."""
+    ewma_s: float = 0.0
+    count: int = 0
+    digest: TDigest = field(default_factory=TDigest)
+
+    def observe(self, latency_s: float, alpha: float):
+        self.ewma_s = latency_s if self.count == 0 else (1 - alpha) * self.ewma_s + alpha * latency_s
+        self.count += 1
+        self.digest.add(latency_s)
+        if self.digest.total_weight > LATENCY_DIGEST_MAX_WEIGHT:
+            self.digest.decay()
+
+
+@dataclass
+class LatencyPrediction:
+    p50_s: float
+    p95_s: float
+    ewma_s: float
+    samples: int
+    key: Tuple[str, str, str]  # (model, agent, bucket) the prediction came from
+
+
+class LatencyEstimator:
+    """EWMA + t-digest latency per (model, agent, prompt bucket), with fallbacks."""
+
+    def __init__(self, alpha: float = LATENCY_EWMA_ALPHA, min_samples: int = LATENCY_MIN_SAMPLES):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.stats: Dict[Tuple[str, str, str], LatencyStats] = {}
+
+    def _stats(self, key: Tuple[str, str, str]) -> LatencyStats:
+        if key not in self.stats:
+            self.stats[key] = LatencyStats()
+        return self.stats[key]
+
+    def observe(self, model: str, agent: Optional[str], prompt_tokens: int, latency_s: float):
+        """Record a completed generation (also feeds the per-model fallback keys)."""
+        bucket = prompt_bucket(prompt_tokens)
+        keys = {(model, agent or ANY, bucket), (model, ANY, bucket), (model, ANY, ANY)}
+        for key in keys:
+            self._stats(key).observe(latency_s, self.alpha)
+
+    def seed(self, model: str, latencies_s: Iterable[float], prompt_tokens: int, agent: Optional[str] = None):
+        """Prime the model's estimates (e.g. from a benchmark run)."""
+        for latency_s in latencies_s:
+            self.observe(model, agent, prompt_tokens, latency_s)
+
+    def predict(self, model: str, agent: Optional[str], prompt_tokens: int) -> Optional[LatencyPrediction]:
+        """Predicted p50/p95 from the most specific key with enough samples, else None."""
+        bucket = prompt_bucket(prompt_tokens)
+        for key in ((model, agent or ANY, bucket), (model, ANY, bucket), (model, ANY, ANY)):
+            stats = self.stats.get(key)
+            if stats and stats.count >= self.min_samples:
+                return LatencyPrediction(
+                    p50_s=stats.digest.quantile(0.5),
+                    p95_s=stats.digest.quantile(0.95),
+                    ewma_s=stats.ewma_s,
+                    samples=stats.count,
+                    key=key,
+                )
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per model / agent / prompt bucket: samples, EWMA and p50/p95/p99"""
+        per_key: Dict[str, Any] = {}
+        for (model, agent, bucket), stats in sorted(self.stats.items()):
+            per_key.setdefault(model, {}).setdefault(agent, {})[bucket] = {
+                "samples": stats.count,
+                "ewma_s": round(stats.ewma_s, 3),
+                "p50_s": round(stats.digest.quantile(0.5) or 0.0, 3),
+                "p95_s": round(stats.digest.quantile(0.95) or 0.0, 3),
+                "p99_s": round(stats.digest.quantile(0.99) or 0.0, 3),
+                "centroids": len(stats.digest.centroids),
+            }
+        return {"min_samples": self.min_samples, "buckets": list(PROMPT_BUCKETS), "models": per_key}
+
+
+# Global latency estimator
+_latency_estimator: Optional[LatencyEstimator] = None
+
+
+def get_latency_estimator() -> LatencyEstimator:
+    global _latency_estimator
+    if _latency_estimator is None:
+        _latency_estimator = LatencyEstimator()
+    return _latency_estimator
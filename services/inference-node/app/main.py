@@ -1,17 +1,19 @@
 import os
 import time
 import hashlib
+import json
 import uuid
 import io
 import asyncio
-from typing import List, Optional, Dict, Any, Tuple
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from datetime import timedelta
 from functools import lru_cache
 
 import httpx
 
 from fastapi import FastAPI, Header, HTTPException, status, Request, Depends, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
@@ -24,16 +26,18 @@ from .model_router import ModelRouter
 from .rag_engine import RAGEngine
 from .orchestrator import get_orchestrator, WorkflowType, AgentTask, WorkflowResult
 from .auth import get_current_user, create_access_token, verify_password, User
-from .database import get_db
-from .persona import get_system_prompt, AI_NAME, ISHA_SYSTEM_PROMPT
+from .database import get_db, engine as db_engine
+from .persona import AI_NAME, ISHA_SYSTEM_PROMPT, get_system_prompt
 from .services.external_llm import get_external_llm_client, close_external_llm_client
-from .middleware import (
-    RateLimitMiddleware,
-    PolicyEnforcementMiddleware,
-    AuditEnrichmentMiddleware,
-    ErrorHandlingMiddleware,
-    SecurityHeadersMiddleware,
-)
+from .middleware import RequestPipelineMiddleware
+from .admission import AdmissionRejected, agent_priority, get_admission_controller
+from .coalescing import get_request_coalescer
+from .semantic_cache import get_semantic_cache
+from .circuit_breaker import CircuitOpenError
+from .health import get_health_prober, llama_cpp_check, database_check, embeddings_check, translation_check
+from .prompt_builder import PROMPT_DEFAULT_CONTEXT_TOKENS, build_prompt, get_token_counters
+from .generation_policy import clean_response, stream_chat_completion
+from .multi_model_manager import MODEL_MANAGER_AUTOSTART, get_multi_model_manager
 
 # Import knowledge base routes
 try:
@@ -175,6 +179,35 @@ async def get_cached_rag_context(agent_type: str, query: str, rag_engine) -> Tup
         return "", False
 
 
+async def _translate_response(content: str, user_language: Optional[str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Translate an English response to user_language; returns (content, translation metadata)."""
+    if not user_language or user_language == "en":
+        return content, None
+    try:
+        from .translation_integration import get_translation_service, TranslationContext
+        
+        translation_service = get_translation_service()
+        result = await translation_service.translate_message(
+            content,
+            source_language="en",
+            target_language=user_language,
+            context=TranslationContext.CHAT
+        )
+        
+        if result.is_translated:
+            logger.info(f"Translated response to {user_language} (confidence: {result.confidence})")
+            return result.translated_text, {
+                "source_language": "en",
+                "target_language": user_language,
+                "confidence": result.confidence,
+                "model": result.model_used,
+                "original_content": content
+            }
+    except Exception as e:
+        logger.warning(f"Translation to {user_language} failed: {e}")
+    return content, None
+
+
 def guardrail_sanitize(text: str, max_chars: int = 1200) -> str:
     """Lightweight output guardrail: drop obvious references, collapse repeats, cap length."""
     if not text:
@@ -224,6 +257,22 @@ Instrumentator().instrument(app).expose(app, endpoint="/metrics")
 model_router = ModelRouter()
 rag_engine = RAGEngine()
 orchestrator = get_orchestrator(model_router)
+admission_controller = get_admission_controller()
+request_coalescer = get_request_coalescer()
+semantic_cache = get_semantic_cache()
+slot_affinity = model_router.slot_affinity
+replica_registry = model_router.replicas
+circuit_breakers = model_router.breakers
+latency_estimator = model_router.latency
+generation_policy = model_router.generation
+token_counters = get_token_counters()
+
+# Background health probes served from cache by /healthz and /readyz
+health_prober = get_health_prober()
+health_prober.register("llama_cpp", llama_cpp_check(replica_registry))
+health_prober.register("database", database_check(db_engine))
+health_prober.register("embeddings", embeddings_check(rag_engine))
+health_prober.register("translation", translation_check())
 
 # Initialize GPU-aware load balancer
 try:
@@ -308,12 +357,12 @@ async def favicon():
     """Return 204 for favicon requests"""
     return JSONResponse(status_code=204, content={})
 
-# Add middleware layers (order matters: first added = outermost)
-app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(ErrorHandlingMiddleware)
-app.add_middleware(AuditEnrichmentMiddleware)
-app.add_middleware(PolicyEnforcementMiddleware)
-app.add_middleware(RateLimitMiddleware, max_requests=100, window_seconds=60)
+# Rate limiting, policy, audit, error handling and security headers (single ASGI layer)
+app.add_middleware(
+    RequestPipelineMiddleware,
+    max_requests=int(os.getenv("RATE_LIMIT_REQUESTS", "100")),
+    window_seconds=int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60")),
+)
 
 JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_AUDIENCE = os.getenv("JWT_AUDIENCE")
@@ -412,6 +461,18 @@ class ChatRequest(BaseModel):
     )
     constraints: Optional[Dict[str, Any]] = None
     messages: List[Message]
+    temperature: Optional[float] = Field(
+        None,
+        description="Sampling temperature (default 0.7). 0 makes the request deterministic and eligible for coalescing."
+    )
+    stream: bool = Field(
+        False,
+        description=(
+            "Stream token deltas as server-sent events (chat.completion.chunk) when the agent is served by "
+            "an in-process vLLM engine; streamed text skips guardrails, semantic cache and translation. "
+            "Other agents return a regular response."
+        ),
+    )
     # Translation parameters
     user_language: Optional[str] = Field(
         None, 
@@ -460,7 +521,28 @@ def _compute_prompt_hash(messages: List[Message]) -> str:
     return _hash_text("|".join(parts))
 
 
-def _verify_jwt(token: Optional[str]) -> None:
+async def _sse_chat_chunks(resp_id: str, created: int, model: str, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+    """OpenAI chat.completion.chunk events for `deltas`, then [DONE] (a disconnect closes `deltas`)."""
+    def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+        event = {
+            "id": resp_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(event)}\n\n"
+
+    yield chunk({"role": "assistant"})
+    async with aclosing(deltas) as stream:
+        async for text in stream:
+            yield chunk({"content": text})
+    yield chunk({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+def _verify_jwt(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Validate the bearer token; returns its claims (None in insecure dev mode)."""
     if JWT_SECRET:
         if not token:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing bearer token")
@@ -469,11 +551,13 @@ def _verify_jwt(token: Optional[str]) -> None:
             # Minimal check: exp enforced by jose
             if not payload:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+            return payload
         except JWTError as e:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Unauthorized: {str(e)}")
     else:
         if not ALLOW_INSECURE_DEV:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="JWT not configured; set ALLOW_INSECURE_DEV=true for local testing")
+    return None
 
 
 def _first_value(source: Dict[str, Any], keys: List[str]) -> Optional[str]:
@@ -558,11 +642,13 @@ async def chat_completions(
     logger.info(f"ALLOW_INSECURE_DEV = {ALLOW_INSECURE_DEV}, JWT_SECRET = {bool(JWT_SECRET)}")
     
     # Legacy JWT verification for backward compatibility
+    claims = None
     if not ALLOW_INSECURE_DEV:
         bearer = None
         if authorization and authorization.lower().startswith("bearer "):
             bearer = authorization[7:].strip()
-        _verify_jwt(bearer)
+        claims = _verify_jwt(bearer)
+    location_id = (claims or {}).get("location_id") or "default"
 
     agent_type = agent_type_header or req.agent_type
     if agent_type not in ALLOWED_AGENTS:
@@ -584,6 +670,44 @@ async def chat_completions(
         "side_effects": False,
     }
 
+    # Semantic cache (opt-in agents): near-duplicate single-turn questions reuse a prior answer
+    last_user = next((m.content for m in reversed(req.messages) if m.role == "user"), "")
+    cache_embedding = None
+    if semantic_cache.enabled_for(agent_type, [{"role": m.role, "content": m.content} for m in req.messages]) and last_user:
+        embeddings_engine = rag_engine.embeddings_engine
+        if embeddings_engine.model is not None:  # Stub embeddings are not semantic
+            try:
+                cache_embedding = await asyncio.to_thread(embeddings_engine.encode_single, last_user)
+                cache_hit = semantic_cache.lookup(location_id, agent_type, cache_embedding)
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+                cache_embedding, cache_hit = None, None
+            if cache_embedding is not None and not cache_hit:
+                policy_flags["semantic_cache"] = {"hit": False}
+            if cache_hit:
+                semantic_cache.record_served(resp_id, cache_hit)
+                policy_flags["semantic_cache"] = {"hit": True, "similarity": round(cache_hit.similarity, 4)}
+                model_used = f"semantic_cache:{cache_hit.entry.model}"
+                content, translation_metadata = await _translate_response(cache_hit.entry.answer, req.user_language)
+                prompt_tokens = max(1, len(" ".join([m.content for m in req.messages])) // 4)
+                completion_tokens = max(1, len(cache_hit.entry.answer) // 4)
+                logger.info(
+                    f"AUDIT req_id={req.request_id} resp_id={resp_id} agent={agent_type} "
+                    f"prompt_hash={prompt_hash} model={model_used} created={created_ts} "
+                    f"source=semantic_cache similarity={cache_hit.similarity:.4f}\n"
+                )
+                return ChatResponse(
+                    id=resp_id,
+                    created=created_ts,
+                    model=model_used,
+                    choices=[
+                        Choice(index=0, finish_reason="stop", message=ChoiceMessage(role="assistant", content=content))
+                    ],
+                    usage=Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens),
+                    policy=policy_flags,
+                    translation=translation_metadata,
+                )
+
     # Try external LLM first if configured
     external_llm = await get_external_llm_client()
     if external_llm:
@@ -591,11 +715,13 @@ async def chat_completions(
             logger.info(f"Routing to external LLM ({external_llm.config.provider.value})")
             content = await external_llm.chat_completion(
                 messages=[{"role": m.role, "content": m.content} for m in req.messages],
-                temperature=getattr(req, 'temperature', 0.7),
+                temperature=req.temperature if req.temperature is not None else 0.7,
                 max_tokens=getattr(request.state, "max_tokens", 512),
             )
             model_used = f"{external_llm.config.provider.value}:{external_llm.config.model_name}"
             inference_time = 0.0  # External service doesn't report this
+            if cache_embedding is not None:
+                semantic_cache.store(location_id, agent_type, cache_embedding, last_user, content, model_used)
             
             prompt_tokens = max(1, len(" ".join([m.content for m in req.messages])) // 4)
             completion_tokens = max(1, len(content) // 4)
@@ -621,24 +747,19 @@ async def chat_completions(
             # Continue to local model router below
 
     # Get RAG context if applicable (with caching for repeated queries)
-    last_user = next((m.content for m in reversed(req.messages) if m.role == "user"), "")
     rag_context = ""
-    if agent_type in ["Documentation", "MedicalQA", "Claims", "Billing"]:
+    use_persona = agent_type in ["Documentation", "MedicalQA", "Claims", "Billing"]
+    if use_persona:
         try:
             # Use cached RAG if available (avoids redundant vector searches)
             rag_context, from_cache = await get_cached_rag_context(agent_type, last_user, rag_engine)
             if from_cache:
                 logger.debug(f"RAG context from cache for {agent_type}")
-            if rag_context:
-                # Prepend context as system message
-                req.messages.insert(0, Message(role="system", content=rag_context))
-            else:
-                # No RAG context - use Dr. iSHA persona system prompt
-                instruction = get_system_prompt(agent_type)
-                req.messages.insert(0, Message(role="system", content=instruction))
         except Exception as e:
             logger.warning(f"RAG retrieval failed: {e}")
             rag_context = ""
+    # Persona + RAG evidence + history are fitted to the target model's context in generate_upstream
+    usage: Optional[Dict[str, Any]] = None
 
     # Generate response using model router
     # If model_port is specified, route directly to that port; otherwise use agent_type routing
@@ -671,46 +792,234 @@ async def chat_completions(
             target_port = agent_to_port.get(agent_type, 8080)  # Default to 8080 (primary)
             logger.info(f"Routing agent_type '{agent_type}' to port {target_port}")
         
-        # Send request to target LLM port (direct HTTP), fallback to model_router on failure
-        if target_port:
-            # Route to specific port via direct HTTP call
+        temperature = req.temperature if req.temperature is not None else 0.7
+        # Agent ceiling from the policy middleware, tightened to the agent's observed output lengths
+        max_tokens = generation_policy.max_tokens(agent_type, getattr(request.state, "max_tokens", 512))
+        
+        # Agents mapped to an in-process vLLM engine (VLLM_AGENT_MODELS) join its continuous batch;
+        # an explicit model_port still pins the request to that llama-server
+        engine_key = None if req.model_port else model_router.engine_key_for(agent_type)
+        
+        async def start_engine() -> bool:
+            """Load the engine (first request only) so prompts are fitted with its tokenizer."""
             try:
-                llm_url = f"http://127.0.0.1:{target_port}/v1/chat/completions"
-                payload = {
-                    "model": model_name,
-                    "messages": [{"role": m.role, "content": m.content} for m in req.messages],
-                    "temperature": 0.7,
-                    "max_tokens": getattr(request.state, "max_tokens", 512),
-                }
-                headers = {"Authorization": "Bearer dev-key"}
-                
-                # Use persistent client with connection pooling for performance
-                client = await get_llm_client()
-                resp = await client.post(llm_url, json=payload, headers=headers)
-                if resp.status_code == 200:
-                    result = resp.json()
-                    content = result.get("choices", [{}])[0].get("message", {}).get("content", "No response")
-                    model_used = result.get("model", f"llama_cpp:{target_port}")
-                    inference_time = 0.0
-                    logger.info(f"LLM response from port {target_port}: {len(content)} chars")
-                else:
-                    logger.warning(f"LLM port {target_port} returned {resp.status_code}, falling back")
-                    raise Exception(f"LLM port returned {resp.status_code}")
+                await model_router.backends[engine_key].start()
+                return True
             except Exception as e:
-                logger.warning(f"Direct LLM call failed: {e}, using model_router fallback")
-                generation_result = await model_router.generate(
-                    agent_type=agent_type,
-                    messages=[{"role": m.role, "content": m.content} for m in req.messages],
-                    constraints=req.constraints,
-                    max_tokens=getattr(request.state, "max_tokens", 512),
-                    temperature=0.7,
-                )
-                content = generation_result["text"]
-                model_used = generation_result["model"]
-                inference_time = generation_result["inference_time_s"]
-            # Ensure inference_time is only read when generation_result exists
-            if 'generation_result' in locals():
-                inference_time = generation_result.get("inference_time_s", inference_time)
+                logger.warning(f"vLLM engine for {engine_key} unavailable: {e}")
+                return False
+        
+        async def build_engine_prompt():
+            """Persona, RAG evidence and history fitted to the engine model's context window."""
+            counter = token_counters.for_tokenizer(engine_key, model_router.backends[engine_key].tokenizer)
+            built = await build_prompt(
+                counter,
+                agent_type,
+                [{"role": m.role, "content": m.content} for m in req.messages],
+                context_tokens=model_router.registry.MODELS[engine_key].max_context,
+                max_tokens=max_tokens,
+                rag_context=rag_context,
+                use_persona=use_persona,
+            )
+            return built, counter
+        
+        async def generate_routed(built, counter) -> Tuple[str, str, float, Dict[str, Any]]:
+            """model_router.generate on the fitted prompt (vLLM engine or llama.cpp fallback chain)."""
+            generation_result = await model_router.generate(
+                agent_type=agent_type,
+                messages=built.messages,
+                constraints=req.constraints,
+                max_tokens=built.max_tokens,
+                temperature=temperature,
+            )
+            usage = generation_result.get("usage") or {
+                "prompt_tokens": built.prompt_tokens,
+                "completion_tokens": await counter.count(generation_result["text"]),
+            }
+            if not generation_result.get("stub"):
+                # Outage placeholders would drag every agent's max_tokens down to the floor
+                generation_policy.observe(agent_type, usage["completion_tokens"], built.max_tokens)
+            return (
+                generation_result["text"],
+                # A stub (every backend down) must not be cached as an answer
+                "fallback" if generation_result.get("stub") else generation_result["model"],
+                generation_result.get("inference_time_s", 0.0),
+                {**usage, "truncated": built.truncated},
+            )
+        
+        async def generate_in_engine() -> Tuple[str, str, float, Dict[str, Any]]:
+            """Completion from the agent's vLLM engine through model_router."""
+            await start_engine()
+            built, counter = await build_engine_prompt()
+            return await generate_routed(built, counter)
+        
+        if engine_key is not None and req.stream and await start_engine():
+            built, _ = await build_engine_prompt()
+            if built.truncated:
+                policy_flags["context_truncated"] = built.truncated
+            logger.info(
+                f"AUDIT req_id={req.request_id} resp_id={resp_id} agent={agent_type} "
+                f"prompt_hash={prompt_hash} model={engine_key} created={created_ts} "
+                f"source=vllm_stream rag_used={bool(rag_context)}\n"
+            )
+            deltas = model_router.stream(agent_type, built.messages, built.max_tokens, temperature)
+            return StreamingResponse(
+                _sse_chat_chunks(resp_id, created_ts, engine_key, deltas), media_type="text/event-stream"
+            )
+        
+        async def generate_upstream() -> Tuple[str, str, float, Dict[str, Any]]:
+            """Admission-controlled call to a replica of the target port's model, falling back to model_router."""
+            # Least-loaded healthy replica of the model served on target_port
+            pool = replica_registry.pool_for_port(target_port)
+            replica = pool.pick(exclude=[
+                r for r in pool.replicas if circuit_breakers.get(r.url).is_open() or not model_router.accepting(r.url)
+            ])
+            
+            # Fit persona, RAG evidence and history into the replica's per-slot context (model's own tokenizer)
+            counter = token_counters.for_llama_cpp(replica.url)
+            model_config = model_router.registry.MODELS.get(pool.name)
+            context_tokens = (
+                model_config.max_context if model_config else PROMPT_DEFAULT_CONTEXT_TOKENS
+            ) // slot_affinity.slot_count(replica.url)
+            built = await build_prompt(
+                counter,
+                agent_type,
+                [{"role": m.role, "content": m.content} for m in req.messages],
+                context_tokens=context_tokens,
+                max_tokens=max_tokens,
+                rag_context=rag_context,
+                use_persona=use_persona,
+            )
+            messages = built.messages
+            
+            # Admission control: queue or shed when the backend's in-flight token budget is spent
+            prompt_estimate = built.prompt_tokens
+            estimated_tokens = prompt_estimate + built.max_tokens
+            prediction = latency_estimator.predict(pool.name, agent_type, prompt_estimate)
+            async with admission_controller.admit(
+                replica.url, estimated_tokens, agent_priority(agent_type),
+                predicted_s=prediction.p50_s if prediction else None,
+            ) as ticket:
+                if ticket.queue_wait_ms > 0:
+                    logger.info(f"Admission wait {ticket.queue_wait_ms:.0f}ms for {agent_type} on {replica.url}")
+                
+                async def direct() -> Tuple[str, str, float, Dict[str, Any]]:
+                    """Direct HTTP call to the picked replica."""
+                    # Open breaker: go straight to model_router, which skips open backends
+                    breaker = circuit_breakers.get(replica.url)
+                    if not breaker.allow_request():
+                        raise CircuitOpenError(f"Circuit open for {replica.url}")
+                    llm_url = f"{replica.url}/v1/chat/completions"
+                    # Pin to the llama.cpp slot holding this prompt prefix (persona / RAG context)
+                    slot_id = slot_affinity.acquire(replica.url, slot_affinity.prefix_key(agent_type, messages))
+                    payload = {
+                        "model": model_name,
+                        "messages": messages,
+                        "temperature": temperature,
+                        "max_tokens": built.max_tokens,
+                        **slot_affinity.request_fields(slot_id),
+                    }
+                    headers = {"Authorization": "Bearer dev-key"}
+                    
+                    # Use persistent client with connection pooling for performance
+                    client = await get_llm_client()
+                    upstream_start = time.monotonic()
+                    # Streamed: closing early (repetition / length cut) stops llama-server decoding
+                    cutoff = generation_policy.cutoff()
+                    try:
+                        # Managed instances are loaded on demand (the request waits for a cold start);
+                        # transport errors and 5xx count against the replica's health
+                        async with model_router.serve(replica.url):
+                            with pool.track(replica):
+                                status_code, result = await stream_chat_completion(client, llm_url, payload, headers, cutoff)
+                                if status_code >= 500:
+                                    raise Exception(f"LLM replica returned {status_code}")
+                        breaker.record_success()
+                    except asyncio.CancelledError:
+                        breaker.cancel_trial()
+                        raise
+                    except Exception:
+                        breaker.record_failure()
+                        raise
+                    finally:
+                        slot_affinity.release(replica.url, slot_id)
+                    if status_code != 200:
+                        logger.warning(f"LLM replica {replica.url} returned {status_code}, falling back")
+                        raise Exception(f"LLM port returned {status_code}")
+                    upstream_s = time.monotonic() - upstream_start
+                    latency_estimator.observe(pool.name, agent_type, prompt_estimate, upstream_s)
+                    slot_affinity.record_timings(replica.url, result)
+                    choice = result.get("choices", [{}])[0]
+                    content = clean_response(choice.get("message", {}).get("content") or "") or "No response"
+                    logger.info(f"LLM response from {replica.url}: {len(content)} chars")
+                    reported = result.get("usage") or {}
+                    if reported.get("prompt_tokens") and not built.exact:
+                        counter.calibrate(sum(len(m["content"]) for m in messages), reported["prompt_tokens"])
+                    usage = {
+                        "prompt_tokens": reported.get("prompt_tokens") or built.prompt_tokens,
+                        "completion_tokens": reported.get("completion_tokens") or await counter.count(content),
+                        "truncated": built.truncated,
+                    }
+                    generation_policy.observe(
+                        agent_type, usage["completion_tokens"], built.max_tokens, choice.get("finish_reason")
+                    )
+                    if cutoff is not None and cutoff.stopped:
+                        generation_policy.early_stopped(
+                            agent_type, cutoff.reason, usage["completion_tokens"], built.max_tokens
+                        )
+                    model_router.hedging.observe(agent_type, upstream_s)
+                    return content, result.get("model", f"llama_cpp:{replica.port}"), upstream_s, usage
+
+                # Send request to the replica (direct HTTP), fallback to model_router on failure.
+                # Latency-sensitive agents are hedged to the next fallback model past their p95 deadline
+                try:
+                    hedge_start = time.monotonic()
+                    result, hedge_key = await model_router.hedge(
+                        agent_type, direct(), pool.name, messages, built.max_tokens, temperature
+                    )
+                    if hedge_key is None:
+                        return result
+                    content, hedge_model = result
+                    logger.info(f"Hedge to {hedge_key} answered {agent_type} before {replica.url}")
+                    usage = {
+                        "prompt_tokens": built.prompt_tokens,
+                        "completion_tokens": await counter.count(content),
+                        "truncated": built.truncated,
+                    }
+                    generation_policy.observe(agent_type, usage["completion_tokens"], built.max_tokens)
+                    return content, hedge_model, time.monotonic() - hedge_start, usage
+                except Exception as e:
+                    logger.warning(f"Direct LLM call failed: {e}, using model_router fallback")
+                    return await generate_routed(built, counter)
+        
+        upstream = generate_in_engine if engine_key is not None else generate_upstream
+        
+        # Identical concurrent requests share one upstream call (single-flight); the key
+        # covers everything build_prompt assembles, so agents with different personas
+        # or RAG evidence on the same port never share an answer
+        if request_coalescer.enabled_for(agent_type, temperature):
+            coalesce_key = request_coalescer.make_key(
+                agent_type,
+                [
+                    {"role": "system", "content": get_system_prompt(agent_type) if use_persona else ""},
+                    {"role": "system", "content": rag_context},
+                    *({"role": m.role, "content": m.content} for m in req.messages),
+                ],
+                model_name, engine_key or target_port, temperature, max_tokens,
+            )
+            (content, model_used, inference_time, usage), shared = await request_coalescer.do(
+                coalesce_key, upstream
+            )
+            if shared:
+                logger.info(f"Coalesced {agent_type} request {req.request_id} onto in-flight generation")
+        else:
+            content, model_used, inference_time, usage = await upstream()
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": e.retry_after_header},
+        )
     except Exception as e:
         logger.error(f"Model router error: {e}")
         # Fallback to stub
@@ -728,36 +1037,21 @@ async def chat_completions(
     # Apply lightweight guardrails before usage accounting
     content = guardrail_sanitize(content)
 
-    # Token usage: coarse estimate
-    prompt_tokens = max(1, len(" ".join([m.content for m in req.messages])) // 4)
-    completion_tokens = max(1, len(content) // 4)
+    # Token usage: reported by the backend or counted with its tokenizer (coarse estimate only for the stub)
+    if usage:
+        prompt_tokens, completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+        if usage.get("truncated"):
+            policy_flags["context_truncated"] = usage["truncated"]
+    else:
+        prompt_tokens = max(1, len(" ".join([m.content for m in req.messages])) // 4)
+        completion_tokens = max(1, len(content) // 4)
+
+    # Cache the English answer; translation is applied per request
+    if cache_embedding is not None and model_used != "fallback":
+        semantic_cache.store(location_id, agent_type, cache_embedding, last_user, content, model_used)
 
     # Handle translation if requested
-    translation_metadata = None
-    if req.user_language and req.user_language != "en":
-        try:
-            from .translation_integration import get_translation_service, TranslationContext
-            
-            translation_service = get_translation_service()
-            result = await translation_service.translate_message(
-                content,
-                source_language="en",
-                target_language=req.user_language,
-                context=TranslationContext.CHAT
-            )
-            
-            if result.is_translated:
-                translation_metadata = {
-                    "source_language": "en",
-                    "target_language": req.user_language,
-                    "confidence": result.confidence,
-                    "model": result.model_used,
-                    "original_content": content
-                }
-                content = result.translated_text
-                logger.info(f"Translated response to {req.user_language} (confidence: {result.confidence})")
-        except Exception as e:
-            logger.warning(f"Translation to {req.user_language} failed: {e}")
+    content, translation_metadata = await _translate_response(content, req.user_language)
 
     logger.info(
         f"AUDIT req_id={req.request_id} resp_id={resp_id} agent={agent_type} "
@@ -781,31 +1075,108 @@ async def chat_completions(
 
 @app.get("/healthz")
 async def healthz():
-    """Health check with backend connectivity status."""
-    import httpx
-    
-    health_status = {
-        "status": "ok",
-        "ts": int(time.time()),
-        "backends": {}
-    }
-    
-    # Check llama.cpp server connectivity
-    llama_server = model_router.LLAMA_CPP_SERVER
-    try:
-        with httpx.Client(timeout=5.0) as client:
-            resp = client.get(f"{llama_server}/health")
-            if resp.status_code == 200:
-                health_status["backends"]["llama_cpp"] = {"status": "connected", "url": llama_server}
-            else:
-                health_status["backends"]["llama_cpp"] = {"status": "unhealthy", "url": llama_server}
-    except Exception as e:
-        health_status["backends"]["llama_cpp"] = {"status": "disconnected", "url": llama_server, "error": str(e)}
+    """Cached backend health from the background prober (never blocks on a backend)."""
+    health_status = health_prober.snapshot()
+
+    # Circuit breakers per backend replica (also exported on /metrics)
+    health_status["circuit_breakers"] = circuit_breakers.get_stats()
+    if any(b["state"] != "closed" for b in health_status["circuit_breakers"].values()):
         health_status["status"] = "degraded"
-    
+
     return health_status
 
 
+@app.get("/livez")
+async def livez():
+    """Liveness: the process is serving requests (no backend checks)."""
+    return {"status": "alive", "ts": int(time.time())}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: critical backends healthy in a recent probe; 503 otherwise."""
+    snapshot = health_prober.snapshot()
+    ready = snapshot["ready"]
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "age_s": snapshot["age_s"],
+            "checks": {
+                name: snapshot["backends"].get(name, {}).get("status", "unknown")
+                for name, check in health_prober.checks.items()
+                if check.critical
+            },
+        },
+    )
+
+
+@app.get("/v1/admission/stats")
+async def admission_stats():
+    """Per-backend in-flight token budgets, queue depth, shedding and queue-wait percentiles."""
+    return admission_controller.get_stats()
+
+
+@app.get("/v1/coalescing/stats")
+async def coalescing_stats():
+    """Single-flight coalescing: upstream calls vs requests served from a shared call."""
+    return request_coalescer.get_stats()
+
+
+@app.get("/v1/hedging/stats")
+async def hedging_stats():
+    """Hedged requests per agent: hedge deadline (p95), hedge rate and hedge wins."""
+    return model_router.hedging.get_stats()
+
+
+@app.get("/v1/latency/stats")
+async def latency_stats():
+    """Online latency model: EWMA and t-digest p50/p95/p99 per model, agent and prompt-length bucket."""
+    return latency_estimator.get_stats()
+
+
+@app.get("/v1/prompt/tokenizers")
+async def tokenizer_stats():
+    """Token counters per backend: exact (model vocabulary) or estimated, cache hits, tokenizer errors."""
+    return token_counters.get_stats()
+
+
+@app.get("/v1/generation/policy")
+async def generation_policy_stats():
+    """Adaptive max_tokens per agent (observed output lengths) and early stops with tokens not decoded."""
+    return generation_policy.get_stats()
+
+
+@app.get("/v1/replicas")
+async def replica_stats():
+    """Replica pools: outstanding requests, health probes and passive ejections per replica."""
+    return replica_registry.get_stats()
+
+
+@app.get("/v1/llama/slots")
+async def llama_slot_stats():
+    """llama.cpp slot occupancy, prefix affinity hit rate and prefix-hit (KV cache reused) tokens."""
+    return slot_affinity.get_stats()
+
+
+class SemanticCacheFeedback(BaseModel):
+    response_id: str = Field(..., description="id of a chat completion served from the semantic cache")
+
+
+@app.get("/v1/semantic-cache/stats")
+async def semantic_cache_stats():
+    """Semantic cache hit rate, false hits and hit-similarity distribution."""
+    return semantic_cache.get_stats()
+
+
+@app.post("/v1/semantic-cache/feedback")
+async def semantic_cache_feedback(req: SemanticCacheFeedback, current_user: User = Depends(get_current_user)):
+    """Report a cached answer that did not fit the question; the entry is evicted. Requires a valid JWT."""
+    if not semantic_cache.report_false_hit(req.response_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Response was not served from the semantic cache")
+    return {"status": "evicted", "response_id": req.response_id}
+
+
 @app.post("/tpa/member-search")
 async def member_search(req: MemberSearchRequest):
     """Lookup member details via TPA (currently Heritage MobileApp API)."""
@@ -1477,6 +1848,14 @@ class WorkflowRequest(BaseModel):
     workflow_type: str
     context: Dict[str, Any]
     custom_tasks: Optional[List[Dict[str, Any]]] = None
+    timeout_s: Optional[float] = Field(
+        None,
+        description="Workflow deadline; unfinished tasks are cancelled and completed results returned."
+    )
+    refresh: bool = Field(
+        False,
+        description="Recompute every task instead of reusing memoized sub-task results."
+    )
 
 
 class WorkflowResponseModel(BaseModel):
@@ -1486,6 +1865,8 @@ class WorkflowResponseModel(BaseModel):
     aggregated_content: str
     total_latency_ms: float
     parallel_efficiency: float
+    speedup: float = 1.0
+    critical_path: List[str] = []
     metadata: Dict[str, Any]
     results: List[Dict[str, Any]]
 
@@ -1533,7 +1914,8 @@ async def execute_workflow(
                 max_tokens=t.get("max_tokens", 512),
                 temperature=t.get("temperature", 0.7),
                 dependencies=t.get("dependencies", []),
-                task_id=t.get("task_id")
+                task_id=t.get("task_id"),
+                timeout_s=t.get("timeout_s"),
             )
             for t in req.custom_tasks
         ]
@@ -1542,7 +1924,9 @@ async def execute_workflow(
     result = await orchestrator.execute_workflow(
         workflow_type=workflow_type,
         context=req.context,
-        custom_tasks=custom_tasks
+        custom_tasks=custom_tasks,
+        timeout_s=req.timeout_s,
+        refresh=req.refresh,
     )
     
     # Convert result to response
@@ -1552,6 +1936,8 @@ async def execute_workflow(
         aggregated_content=result.aggregated_content,
         total_latency_ms=result.total_latency_ms,
         parallel_efficiency=result.parallel_efficiency,
+        speedup=result.speedup,
+        critical_path=result.critical_path,
         metadata=result.metadata,
         results=[
             {
@@ -1563,13 +1949,21 @@ async def execute_workflow(
                 "latency_ms": r.latency_ms,
                 "tokens": r.tokens,
                 "error": r.error,
-                "metadata": r.metadata
+                "metadata": r.metadata,
+                "started_ms": r.started_ms,
+                "finished_ms": r.finished_ms,
             }
             for r in result.results
         ]
     )
 
 
+@app.get("/v1/workflows/stats")
+async def workflow_stats():
+    """Workflow scheduler: per-model concurrency limits and in-flight tasks, timeouts, task memo."""
+    return orchestrator.get_stats()
+
+
 @app.get("/v1/workflows/types")
 async def list_workflow_types():
     """List available workflow types and their descriptions."""
@@ -1635,6 +2029,7 @@ async def quick_discharge_summary(
     patient_data: str,
     admission_date: str,
     discharge_date: str,
+    refresh: bool = False,
     current_user: User = Depends(get_current_user) if not ALLOW_INSECURE_DEV else None,
     authorization: Optional[str] = Header(default=None, alias="Authorization"),
 ):
@@ -1651,14 +2046,16 @@ async def quick_discharge_summary(
             "patient_data": patient_data,
             "admission_date": admission_date,
             "discharge_date": discharge_date
-        }
+        },
+        refresh=refresh,
     )
     
     return {
         "success": result.success,
         "content": result.aggregated_content,
         "latency_ms": result.total_latency_ms,
-        "efficiency": result.parallel_efficiency
+        "efficiency": result.parallel_efficiency,
+        "memoized_tasks": result.metadata["memoized_tasks"],
     }
 
 
@@ -1745,7 +2142,7 @@ async def change_password(
     Change current user's password.
     Requires valid JWT token and current password verification.
     """
-    from app.auth import authenticate_user, pwd_context
+    from app.auth import authenticate_user, pwd_context, invalidate_cached_user
     from sqlalchemy import update
     from app.database import User as DBUser
     
@@ -1776,6 +2173,9 @@ async def change_password(
     await db.execute(stmt)
     await db.commit()
     
+    # Existing tokens must re-authenticate against the new credentials
+    invalidate_cached_user(current_user.username)
+    
     logger.info(f"Password changed for user: {current_user.username}")
     
     return {
@@ -1851,18 +2251,31 @@ async def simple_login(credentials: SimpleLoginRequest):
 async def startup_event():
     """Initialize GPU load balancer on startup"""
     global load_balancer
+    health_prober.start()
     try:
         if globals().get('LOAD_BALANCER_ENABLED', False):
             from .gpu_orchestrator import get_load_balancer
             load_balancer = get_load_balancer()
             # Register models
             from .gpu_orchestrator import BackendType
-            load_balancer.register_model("tiny-llama-1b", BackendType.LLAMA_CPP, 2.3, 8080)
-            load_balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8081)
-            load_balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084)
+            gpu_ids = {key: config.gpu_ids for key, config in model_router.registry.MODELS.items()}
+            load_balancer.register_model("tiny-llama-1b", BackendType.LLAMA_CPP, 2.3, 8080, gpu_ids["tiny-llama-1b"])
+            load_balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8081, gpu_ids["bi-medix2"])
+            load_balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084, gpu_ids["openins-llama3-8b"])
+            await load_balancer.start()  # Background GPU sampling; routing reads the cached sample
             logger.info("✓ GPU load balancer ready")
     except Exception as e:
         logger.info(f"GPU load balancer skipped: {e}")
+    
+    # Supervised llama-server instances: pinned models, idle reaper and liveness checks
+    if MODEL_MANAGER_AUTOSTART:
+        try:
+            manager = get_multi_model_manager()
+            model_router.instance_manager = manager  # Router traffic records demand and triggers cold starts
+            await manager.start_all()
+            logger.info("✓ Model instance manager started")
+        except Exception as e:
+            logger.error(f"Model instance manager failed to start: {e}")
 
 
 # Shutdown event: Stop GPU monitoring and close HTTP client
@@ -1871,6 +2284,8 @@ async def shutdown_event():
     """Cleanup on shutdown"""
     global llm_http_client
     
+    await health_prober.stop()
+    
     # Close persistent HTTP client
     if llm_http_client:
         await llm_http_client.aclose()
@@ -1882,3 +2297,10 @@ async def shutdown_event():
             logger.info("✓ GPU load balancer stopped")
         except Exception as e:
             logger.error(f"Error stopping GPU load balancer: {e}")
+    
+    if MODEL_MANAGER_AUTOSTART:
+        try:
+            await get_multi_model_manager().stop_all()
+            logger.info("✓ Model instances stopped")
+        except Exception as e:
+            logger.error(f"Error stopping model instances: {e}")
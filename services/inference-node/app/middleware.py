@@ -1,60 +1,48 @@
 """
 Middleware components for the inference node.
 Includes: rate limiting, policy enforcement, audit enrichment, error handling.
+
+All stages run in a single pure-ASGI middleware (RequestPipelineMiddleware):
+one layer per request instead of five BaseHTTPMiddleware wrappers, and the
+response body is passed straight through so streaming responses are not buffered.
 """
+import math
+import os
 import time
 import hashlib
-from typing import Dict, Any, Optional, Callable
-from collections import defaultdict
-from datetime import datetime, timedelta
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import List, Optional, Tuple
+from datetime import datetime
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from loguru import logger
 
+from .rate_limiter import RateLimiter, parse_quotas
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Rate limiting per agent type and source IP."""
-    
-    def __init__(self, app, max_requests: int = 100, window_seconds: int = 60):
-        super().__init__(app)
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.requests: Dict[str, list] = defaultdict(list)
-    
-    async def dispatch(self, request: Request, call_next):
-        # Skip healthz
-        if request.url.path == "/healthz":
-            return await call_next(request)
-        
-        # Rate limit key: IP + agent type
-        client_ip = request.client.host if request.client else "unknown"
-        agent_type = request.headers.get("X-Agent-Type", "default")
-        key = f"{client_ip}:{agent_type}"
-        
-        now = time.time()
-        cutoff = now - self.window_seconds
-        
-        # Clean old entries
-        self.requests[key] = [ts for ts in self.requests[key] if ts > cutoff]
-        
-        # Check limit
-        if len(self.requests[key]) >= self.max_requests:
-            logger.warning(f"Rate limit exceeded for {key}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Rate limit: {self.max_requests} requests per {self.window_seconds}s"
-            )
-        
-        # Track request
-        self.requests[key].append(now)
-        
-        response = await call_next(request)
-        return response
 
+# Requests that bypass rate limiting, policy and audit (load balancer probes)
+FAST_PATHS = {"/healthz", "/livez", "/readyz"}
+
+SECURITY_HEADERS: List[Tuple[str, str]] = [
+    ("X-Content-Type-Options", "nosniff"),
+    ("X-Frame-Options", "DENY"),
+    ("X-XSS-Protection", "1; mode=block"),
+    ("Referrer-Policy", "no-referrer"),
+    ("Strict-Transport-Security", "max-age=31536000; includeSubDomains"),
+]
+
+
+class RequestPipelineMiddleware:
+    """
+    Rate limiting, policy enforcement, audit enrichment, error handling and
+    security headers as one pure-ASGI middleware.
+
+    Stages run in the order the separate middlewares used to nest:
+    rate limit -> policy -> audit -> app, with errors sanitized and security
+    and audit headers added when the response starts.
+    """
 
-class PolicyEnforcementMiddleware(BaseHTTPMiddleware):
-    """Enforce agent-specific policies and constraints."""
-    
     ALLOWED_AGENTS = {
         "Chat",
         "Appointment",
@@ -65,7 +53,7 @@ class PolicyEnforcementMiddleware(BaseHTTPMiddleware):
         "MedicalQA",
         "Clinical",  # BioMistral Clinical decision support
     }
-    
+
     # Agent-specific token limits
     AGENT_TOKEN_LIMITS = {
         "Chat": 1024,
@@ -77,92 +65,125 @@ class PolicyEnforcementMiddleware(BaseHTTPMiddleware):
         "MedicalQA": 2048,
         "Clinical": 2048,  # Clinical decision support
     }
-    
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path == "/healthz":
-            return await call_next(request)
-        
-        if request.url.path == "/v1/chat/completions" and request.method == "POST":
-            # Attach policy context to request state
-            agent_type = request.headers.get("X-Agent-Type", "")
-            
-            if agent_type and agent_type not in self.ALLOWED_AGENTS:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Agent type '{agent_type}' not allowed"
-                )
-            
-            # Store policy limits in request state
-            request.state.max_tokens = self.AGENT_TOKEN_LIMITS.get(agent_type, 1024)
-            request.state.agent_type = agent_type
-        
-        response = await call_next(request)
-        return response
-
-
-class AuditEnrichmentMiddleware(BaseHTTPMiddleware):
-    """Enrich requests with audit metadata."""
-    
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path == "/healthz":
-            return await call_next(request)
-        
-        # Generate request tracking ID if not present
-        request_id = request.headers.get("X-Request-ID")
+
+    # Agent-specific request quotas per rate limit window; agents without one use
+    # max_requests. Set them with RATE_LIMIT_AGENT_QUOTAS="Chat=120,Claims=30"
+    AGENT_RATE_LIMITS = parse_quotas(os.getenv("RATE_LIMIT_AGENT_QUOTAS", ""))
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_requests: int = 100,
+        window_seconds: int = 60,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.app = app
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.limiter = limiter or RateLimiter()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] in FAST_PATHS:
+            await self.app(scope, receive, self._add_headers(send, SECURITY_HEADERS))
+            return
+
+        headers = Headers(scope=scope)
+        client_ip = scope["client"][0] if scope.get("client") else "unknown"
+        agent_type = headers.get("x-agent-type", "")
+
+        # Rate limiting per agent type and source IP
+        rejection = await self._check_rate_limit(client_ip, agent_type)
+
+        # Agent-specific policies for chat completions
+        if rejection is None and scope["path"] == "/v1/chat/completions" and scope["method"] == "POST":
+            rejection = self._apply_policy(scope, agent_type)
+
+        if rejection is not None:
+            await rejection(scope, receive, self._add_headers(send, SECURITY_HEADERS))
+            return
+
+        # Audit enrichment
+        request_id = headers.get("x-request-id")
         if not request_id:
             request_id = f"req-{int(time.time())}-{hashlib.sha256(str(time.time()).encode()).hexdigest()[:8]}"
-        
-        # Attach audit context
-        request.state.request_id = request_id
-        request.state.timestamp = datetime.utcnow().isoformat()
-        request.state.client_ip = request.client.host if request.client else "unknown"
-        
-        logger.info(
-            f"REQUEST {request_id} {request.method} {request.url.path} "
-            f"from {request.state.client_ip}"
-        )
-        
-        response = await call_next(request)
-        
-        # Add audit headers to response
-        response.headers["X-Request-ID"] = request_id
-        response.headers["X-Timestamp"] = request.state.timestamp
-        
-        return response
-
-
-class ErrorHandlingMiddleware(BaseHTTPMiddleware):
-    """Centralized error handling and sanitization."""
-    
-    async def dispatch(self, request: Request, call_next):
+        timestamp = datetime.utcnow().isoformat()
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        state["timestamp"] = timestamp
+        state["client_ip"] = client_ip
+
+        logger.info(f"REQUEST {request_id} {scope['method']} {scope['path']} from {client_ip}")
+
+        response_headers = [("X-Request-ID", request_id), ("X-Timestamp", timestamp)] + SECURITY_HEADERS
+        response_started = False
+
+        async def send_wrapper(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                headers = MutableHeaders(scope=message)
+                for name, value in response_headers:
+                    headers[name] = value
+            await send(message)
+
         try:
-            response = await call_next(request)
-            return response
-        except HTTPException:
-            # Let FastAPI handle HTTP exceptions
-            raise
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
             # Log full error but return sanitized response
-            request_id = getattr(request.state, "request_id", "unknown")
             logger.error(f"ERROR {request_id}: {type(e).__name__}: {str(e)}")
-            
+            if response_started:
+                # Mid-stream failure: nothing left to send, let the server close the connection
+                raise
+
             # Don't leak internal details
-            raise HTTPException(
+            response = JSONResponse(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error. Request logged for review."
+                content={"detail": "Internal server error. Request logged for review."},
+            )
+            await response(scope, receive, send_wrapper)
+
+    async def _check_rate_limit(self, client_ip: str, agent_type: str):
+        """GCRA limit per source IP and agent type; returns a 429 response when exceeded."""
+        key = f"{client_ip}:{agent_type or 'default'}"
+        limit = self.AGENT_RATE_LIMITS.get(agent_type, self.max_requests)
+        decision = await self.limiter.check(key, limit, self.window_seconds)
+        if decision.allowed:
+            return None
+
+        logger.warning(f"Rate limit exceeded for {key}")
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": f"Rate limit: {limit} requests per {self.window_seconds}s"},
+            headers={
+                "Retry-After": str(max(1, math.ceil(decision.retry_after))),
+                "X-RateLimit-Limit": str(limit),
+            },
+        )
+
+    def _apply_policy(self, scope: Scope, agent_type: str):
+        """Validate the agent and attach its limits to request state; returns a 400 on rejection."""
+        if agent_type and agent_type not in self.ALLOWED_AGENTS:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"detail": f"Agent type '{agent_type}' not allowed"},
             )
 
+        state = scope.setdefault("state", {})
+        state["max_tokens"] = self.AGENT_TOKEN_LIMITS.get(agent_type, 1024)
+        state["agent_type"] = agent_type
+        return None
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    """Add security headers to all responses."""
-    
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "no-referrer"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        return response
+    @staticmethod
+    def _add_headers(send: Send, extra: List[Tuple[str, str]]) -> Send:
+        """Wrap `send` to set headers on the response start message."""
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in extra:
+                    headers[name] = value
+            await send(message)
+        return send_wrapper
@@ -0,0 +1,268 @@
+"""
+Demand-driven model lifecycle for llama-server instances.
+
+Instead of pinning every model in VRAM, instances are started when a request
+needs them and stopped when idle:
+
+- Cold start: the first request starts the instance (plus a 1-token warm-up);
+  concurrent requests for it wait on the same start, up to
+  MODEL_COLD_START_TIMEOUT_S, instead of failing
+- Eviction: if the instance's GPU lacks VRAM headroom, idle instances on that
+  GPU are stopped least-recently-used first
+- Idle reaping: instances unused for MODEL_IDLE_TTL_S are stopped
+- MODEL_PINNED_INSTANCES are never evicted or reaped
+
+Headroom is accounted from each instance's vram_gb against
+MODEL_VRAM_CAPACITY_GB per GPU (usable VRAM after system overhead).
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+from loguru import logger
+
+
+def _parse_capacity(value: str) -> Dict[int, float]:
+    """Parse "0=21,1=9" into {0: 21.0, 1: 9.0}."""
+    capacity: Dict[int, float] = {}
+    for item in value.split(","):
+        if "=" in item:
+            gpu_id, gb = item.split("=", 1)
+            capacity[int(gpu_id)] = float(gb)
+    return capacity
+
+
+MODEL_ON_DEMAND = os.getenv("MODEL_ON_DEMAND", "true").lower() == "true"
+MODEL_PINNED_INSTANCES = [
+    n.strip() for n in os.getenv("MODEL_PINNED_INSTANCES", "medical_qa").split(",") if n.strip()
+]
+MODEL_IDLE_TTL_S = float(os.getenv("MODEL_IDLE_TTL_S", "900"))
+MODEL_COLD_START_TIMEOUT_S = float(os.getenv("MODEL_COLD_START_TIMEOUT_S", "120"))
+MODEL_LIFECYCLE_CHECK_S = float(os.getenv("MODEL_LIFECYCLE_CHECK_S", "30"))
+# Usable VRAM per GPU: RTX 3090 24GB and RTX 3060 12GB minus 3GB overhead each
+MODEL_VRAM_CAPACITY_GB = _parse_capacity(os.getenv("MODEL_VRAM_CAPACITY_GB", "0=21,1=9"))
+
+_LOADED = ("running", "starting")
+
+
+class ModelCapacityError(Exception):
+    """Instance could not be loaded (no evictable VRAM, start failure or cold-start timeout)."""
+
+
+@dataclass
+class ModelDemand:
+    """Demand and lifecycle counters for one instance."""
+    requests: int = 0
+    in_flight: int = 0
+    waiting: int = 0  # Requests queued behind a cold start
+    last_used: float = 0.0
+    cold_starts: int = 0
+    failed_starts: int = 0
+    evictions: int = 0
+    idle_stops: int = 0
+    last_cold_start_s: float = 0.0
+
+
+class ModelLifecycleScheduler:
+    """Starts instances on demand and evicts idle ones (LRU) to fit VRAM.
+
+    `manager` provides `instances` (name -> instance with status, gpu_id,
+    vram_gb) and async `start_instance`, `stop_instance` and `warm_up`.
+    """
+
+    def __init__(
+        self,
+        manager,
+        capacity_gb: Optional[Dict[int, float]] = None,
+        pinned: Optional[Iterable[str]] = None,
+        idle_ttl_s: float = MODEL_IDLE_TTL_S,
+        cold_start_timeout_s: float = MODEL_COLD_START_TIMEOUT_S,
+    ):
+        self.manager = manager
+        self.capacity_gb = dict(MODEL_VRAM_CAPACITY_GB if capacity_gb is None else capacity_gb)
+        self.pinned = set(MODEL_PINNED_INSTANCES if pinned is None else pinned)
+        self.idle_ttl_s = idle_ttl_s
+        self.cold_start_timeout_s = cold_start_timeout_s
+        self.demand: Dict[str, ModelDemand] = {name: ModelDemand() for name in manager.instances}
+        self._starting: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()  # Serializes eviction + start decisions
+        self._task: Optional[asyncio.Task] = None
+
+    def _demand(self, name: str) -> ModelDemand:
+        if name not in self.demand:
+            self.demand[name] = ModelDemand()
+        return self.demand[name]
+
+    def reserved_gb(self, gpu_id: int) -> float:
+        return sum(
+            inst.vram_gb for inst in self.manager.instances.values()
+            if inst.gpu_id == gpu_id and inst.status in _LOADED
+        )
+
+    def headroom_gb(self, gpu_id: int) -> float:
+        return self.capacity_gb.get(gpu_id, 0.0) - self.reserved_gb(gpu_id)
+
+    def _evictable(self, gpu_id: int) -> List[str]:
+        """Running, unpinned, unused instances on the GPU, least recently used first."""
+        names = [
+            name for name, inst in self.manager.instances.items()
+            if inst.gpu_id == gpu_id and inst.status == "running" and name not in self.pinned
+            and self._demand(name).in_flight == 0 and self._demand(name).waiting == 0
+        ]
+        return sorted(names, key=lambda n: self._demand(n).last_used)
+
+    async def ensure_loaded(self, name: str):
+        """Return the running instance, starting it (and evicting others) if needed."""
+        if name not in self.manager.instances:
+            raise ModelCapacityError(f"Unknown instance: {name}")
+        instance = self.manager.instances[name]
+        if instance.status == "running":
+            return instance
+
+        async with self._lock:
+            task = self._starting.get(name)
+            if task is None and instance.status != "running":
+                await self._make_room(name)
+                instance.status = "starting"  # Reserve its VRAM before the process exists
+                task = asyncio.create_task(self._cold_start(name))
+                self._starting[name] = task
+        if task is None:
+            return instance
+
+        demand = self._demand(name)
+        demand.waiting += 1
+        try:
+            ok = await asyncio.wait_for(asyncio.shield(task), timeout=self.cold_start_timeout_s)
+        except asyncio.TimeoutError:
+            raise ModelCapacityError(f"{name} did not start within {self.cold_start_timeout_s:.0f}s")
+        finally:
+            demand.waiting -= 1
+        if not ok:
+            raise ModelCapacityError(f"{name} failed to start")
+        return instance
+
+    async def _make_room(self, name: str):
+        instance = self.manager.instances[name]
+        while self.headroom_gb(instance.gpu_id) < instance.vram_gb:
+            candidates = self._evictable(instance.gpu_id)
+            if not candidates:
+                raise ModelCapacityError(
+                    f"No VRAM for {name} on GPU {instance.gpu_id}: "
+                    f"{self.headroom_gb(instance.gpu_id):.1f}GB free, {instance.vram_gb:.1f}GB needed"
+                )
+            victim = candidates[0]
+            logger.info(f"Evicting {victim} (LRU) from GPU {instance.gpu_id} to load {name}")
+            self._demand(victim).evictions += 1
+            await self.manager.stop_instance(victim)
+
+    async def _cold_start(self, name: str) -> bool:
+        demand = self._demand(name)
+        start = time.monotonic()
+        try:
+            ok = await self.manager.start_instance(name)
+            if ok:
+                await self.manager.warm_up(name)
+        except Exception as e:
+            logger.error(f"Cold start of {name} failed: {e}")
+            ok = False
+        finally:
+            self._starting.pop(name, None)
+        if ok:
+            demand.cold_starts += 1
+            demand.last_used = time.monotonic()  # Idle TTL counts from the load, not from boot
+            demand.last_cold_start_s = time.monotonic() - start
+            logger.info(f"Cold start of {name} took {demand.last_cold_start_s:.1f}s")
+        else:
+            demand.failed_starts += 1
+            await self.manager.stop_instance(name)  # Don't leave a half-started server holding VRAM
+            self.manager.instances[name].status = "error"
+        return ok
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """Hold an instance for one request, loading it on demand."""
+        demand = self._demand(name)
+        demand.requests += 1
+        demand.last_used = time.monotonic()
+        demand.in_flight += 1  # Keeps it from being evicted while we wait or run
+        try:
+            yield await self.ensure_loaded(name)
+        finally:
+            demand.in_flight -= 1
+            demand.last_used = time.monotonic()
+
+    async def evict_idle(self) -> List[str]:
+        """Stop unpinned instances idle for longer than idle_ttl_s (never-used ones have no idle time yet)."""
+        now = time.monotonic()
+        stopped = []
+        async with self._lock:
+            for name, instance in self.manager.instances.items():
+                demand = self._demand(name)
+                if (
+                    instance.status == "running" and name not in self.pinned
+                    and demand.in_flight == 0 and demand.waiting == 0 and demand.last_used > 0
+                    and now - demand.last_used >= self.idle_ttl_s
+                ):
+                    logger.info(f"Stopping idle instance {name} ({now - demand.last_used:.0f}s unused)")
+                    await self.manager.stop_instance(name)
+                    demand.idle_stops += 1
+                    stopped.append(name)
+        return stopped
+
+    async def _loop(self, interval_s: float):
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Idle model reaping failed: {e}")
+
+    def start(self, interval_s: float = MODEL_LIFECYCLE_CHECK_S):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(interval_s))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-GPU VRAM reservation and per-instance demand / lifecycle counters."""
+        now = time.monotonic()
+        gpus = sorted(set(self.capacity_gb) | {i.gpu_id for i in self.manager.instances.values()})
+        return {
+            "idle_ttl_s": self.idle_ttl_s,
+            "pinned": sorted(self.pinned),
+            "gpus": {
+                str(g): {
+                    "capacity_gb": self.capacity_gb.get(g, 0.0),
+                    "reserved_gb": round(self.reserved_gb(g), 2),
+                    "headroom_gb": round(self.headroom_gb(g), 2),
+                }
+                for g in gpus
+            },
+            "instances": {
+                name: {
+                    "status": instance.status,
+                    "gpu_id": instance.gpu_id,
+                    "vram_gb": instance.vram_gb,
+                    "pinned": name in self.pinned,
+                    "requests": self._demand(name).requests,
+                    "in_flight": self._demand(name).in_flight,
+                    "waiting": self._demand(name).waiting,
+                    "idle_s": round(now - self._demand(name).last_used, 1) if self._demand(name).last_used else None,
+                    "cold_starts": self._demand(name).cold_starts,
+                    "failed_starts": self._demand(name).failed_starts,
+                    "last_cold_start_s": round(self._demand(name).last_cold_start_s, 2),
+                    "evictions": self._demand(name).evictions,
+                    "idle_stops": self._demand(name).idle_stops,
+                }
+                for name, instance in self.manager.instances.items()
+            },
+        }
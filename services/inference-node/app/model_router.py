@@ -3,13 +3,32 @@ Model Router Backend
 Routes agent requests to appropriate models based on GPU capacity and model type.
 Supports vLLM, llama.cpp, and custom backends.
 """
+import asyncio
 import os
 import time
-from typing import Dict, List, Optional, Any, Tuple
+from contextlib import aclosing, nullcontext
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Any, Tuple
 from enum import Enum
 from dataclasses import dataclass
 from loguru import logger
 
+from .circuit_breaker import CircuitOpenError, get_circuit_breakers
+from .generation_policy import clean_response, get_generation_policy, stream_chat_completion
+from .hedging import get_hedge_policy
+from .latency_estimator import get_latency_estimator
+from .replica_pool import ReplicaPool, get_replica_registry
+from .slot_affinity import get_slot_affinity
+from .vllm_backend import USE_VLLM, create_vllm_backend
+
+
+def _parse_agent_models(value: str) -> Dict[str, str]:
+    """Parse "Chat=biomistral-7b-fp16,Scribe=..." into {agent: model key}."""
+    return dict(item.split("=", 1) for item in value.split(",") if "=" in item)
+
+
+# Agents routed to vLLM models instead of AGENT_MODEL_MAP (applied only when the engine is registered)
+VLLM_AGENT_MODELS = _parse_agent_models(os.getenv("VLLM_AGENT_MODELS", ""))
+
 
 class ModelBackend(str, Enum):
     VLLM = "vllm"
@@ -327,14 +346,46 @@ class ModelRouter:
     def __init__(self):
         self.registry = ModelRegistry()
         self.backends: Dict[str, Any] = {}
+        self.slot_affinity = get_slot_affinity()
+        self.replicas = get_replica_registry(self.MODEL_PORTS)
+        self.breakers = get_circuit_breakers()
+        self.hedging = get_hedge_policy()
+        self.latency = get_latency_estimator()
+        self.generation = get_generation_policy()
+        self.agent_overrides = dict(VLLM_AGENT_MODELS)
+        # MultiModelManager when this process owns the llama-servers (MODEL_MANAGER_AUTOSTART)
+        self.instance_manager = None
         self._load_backends()
     
     def _load_backends(self):
-        """Initialize model backends (stub for now)."""
-        logger.info("Model backends loading (stub mode)")
-        # In production, initialize vLLM engines here
-        # self.backends['vllm'] = VLLMEngine(...)
-        pass
+        """Register a vLLM backend for each vllm model when USE_VLLM is set (engines start on first use)."""
+        if not USE_VLLM:
+            logger.info("vLLM disabled (USE_VLLM unset); llama.cpp backends only")
+            return
+        for key, config in self.registry.MODELS.items():
+            if config.backend == ModelBackend.VLLM:
+                self.register_backend(key, create_vllm_backend(key, config))
+    
+    def register_backend(self, model_key: str, backend: Any):
+        """Serve `model_key` through an in-process engine (vLLMBackend)."""
+        self.backends[model_key] = backend
+        logger.info(f"Registered {type(backend).__name__} for {model_key}")
+    
+    def _model_for_agent(self, agent_type: str) -> Optional[ModelConfig]:
+        override = self.agent_overrides.get(agent_type)
+        if override in self.backends:
+            return self.registry.MODELS[override]
+        return self.registry.get_model_for_agent(agent_type)
+    
+    def model_key_for(self, agent_type: str) -> Optional[str]:
+        """Registry key of the model generate() routes `agent_type` to first."""
+        config = self._model_for_agent(agent_type) or self.registry.MODELS.get("bi-medix2")
+        return self._get_model_key(config) if config else None
+    
+    def engine_key_for(self, agent_type: str) -> Optional[str]:
+        """Model key of the in-process engine serving `agent_type` (VLLM_AGENT_MODELS), if any."""
+        key = self.model_key_for(agent_type)
+        return key if key in self.backends else None
     
     async def generate(
         self,
@@ -355,12 +406,14 @@ class ModelRouter:
             temperature: Sampling temperature
             
         Returns:
-            Generated response with metadata
+            Generated response with metadata; "stub" is True when every backend
+            failed and the text is a placeholder, not a model completion
         """
         start_time = time.time()
+        prompt_tokens = max(1, len(" ".join(m.get("content", "") for m in messages)) // 4)
         
         # Get model config
-        model_config = self.registry.get_model_for_agent(agent_type)
+        model_config = self._model_for_agent(agent_type)
         if not model_config:
             # Default to primary model (BiMediX2) if no mapping exists
             logger.warning(f"No model mapping for {agent_type}, using PRIMARY (bi-medix2)")
@@ -377,56 +430,77 @@ class ModelRouter:
         response_text: Optional[str] = None
         model_name = model_config.name
         fallback_used = False
+        usage: Optional[Dict[str, int]] = None
+
+        # In-process vLLM engine (continuous batching), falling back to the llama.cpp chain
+        if model_config.backend == ModelBackend.VLLM:
+            vllm_key = self._get_model_key(model_config)
+            try:
+                backend = self.backends.get(vllm_key)
+                if backend is None:
+                    raise RuntimeError(f"no vLLM engine registered for {vllm_key} (USE_VLLM unset?)")
+                cutoff = self.generation.cutoff()
+                result = await backend.generate(messages, max_tokens=max_tokens, temperature=temperature, cutoff=cutoff)
+                response_text, usage = self._clean_response(result["text"]), result["usage"]
+                if result["finish_reason"] == "early_stop":
+                    self.generation.early_stopped(agent_type, cutoff.reason, usage["completion_tokens"], max_tokens)
+                self.latency.observe(vllm_key, agent_type, usage["prompt_tokens"], time.time() - start_time)
+            except Exception as e:
+                logger.warning(f"vLLM model ({model_config.name}) failed: {e}")
+                text, fallback_name, fallback_backend = await self._fallback_generate(
+                    agent_type, messages, {vllm_key}, max_tokens, temperature, prompt_tokens,
+                )
+                if text is not None:
+                    response_text, model_name, backend_used = text, fallback_name, fallback_backend
+                    fallback_used = True
 
         # llama.cpp HTTP server path with fallback chain
         if model_config.backend == ModelBackend.LLAMA_CPP:
-            # Try primary model first
+            primary_key = self._get_model_key(model_config)
+            tried = {primary_key}  # The hedge model is added only if a hedge request was sent
+            # Try primary model first (hedged to the next fallback for latency-sensitive agents)
             try:
-                response_text, model_name = self._llama_cpp_generate(
-                    messages=messages,
-                    model_config=model_config,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
+                (response_text, model_name), hedge_key = await self.hedge(
+                    agent_type,
+                    self._llama_cpp_generate(
+                        messages=messages,
+                        model_config=model_config,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        agent_type=agent_type,
+                    ),
+                    primary_key,
+                    messages,
+                    max_tokens,
+                    temperature,
+                    tried=tried,
                 )
+                if hedge_key:
+                    fallback_used = True
+                    backend_used = self.registry.MODELS[hedge_key].backend
+                if not fallback_used:
+                    self.hedging.observe(agent_type, time.time() - start_time)
+                    self.latency.observe(primary_key, agent_type, prompt_tokens, time.time() - start_time)
             except Exception as e:
                 logger.warning(f"Primary model ({model_config.name}) failed: {e}")
                 
-                # Try fallback chain
-                for fallback_key in self.FALLBACK_CHAIN:
-                    if fallback_key == self._get_model_key(model_config):
-                        continue  # Skip the model that just failed
-                    
-                    fallback_config = self.registry.MODELS.get(fallback_key)
-                    if not fallback_config:
-                        continue
-                    
-                    logger.info(f"Attempting fallback to {fallback_config.name}")
-                    try:
-                        response_text, model_name = self._llama_cpp_generate(
-                            messages=messages,
-                            model_config=fallback_config,
-                            max_tokens=max_tokens,
-                            temperature=temperature,
-                        )
-                        fallback_used = True
-                        backend_used = fallback_config.backend
-                        logger.info(f"Fallback to {fallback_config.name} successful")
-                        break
-                    except Exception as fallback_error:
-                        logger.warning(f"Fallback {fallback_config.name} also failed: {fallback_error}")
-                        continue
-
-        # TODO: wire vLLM path when engines are initialized
+                text, fallback_name, fallback_backend = await self._fallback_generate(
+                    agent_type, messages, tried, max_tokens, temperature, prompt_tokens,
+                )
+                if text is not None:
+                    response_text, model_name, backend_used = text, fallback_name, fallback_backend
+                    fallback_used = True
 
         # Fallback stub if all backends unavailable
-        if response_text is None:
+        stub = response_text is None
+        if stub:
             logger.error("All models failed, using stub response")
             response_text = self._stub_generate(agent_type, messages, model_config)
 
         elapsed = time.time() - start_time
-        token_estimate = len(response_text.split())
+        token_estimate = usage["completion_tokens"] if usage else len(response_text.split())
 
-        return {
+        result = {
             "text": response_text,
             "model": model_name,
             "backend": backend_used,
@@ -434,8 +508,172 @@ class ModelRouter:
             "tokens_generated": token_estimate,
             "inference_time_s": elapsed,
             "fallback_used": fallback_used,
+            "stub": stub,
         }
+        if usage:
+            result["usage"] = usage
+        return result
     
+    async def stream(
+        self,
+        agent_type: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+    ) -> AsyncIterator[str]:
+        """
+        Yield the response incrementally. vLLM-served agents stream token deltas
+        (closing the iterator aborts the generation, as does the early-stop cutoff);
+        others yield generate()'s text once.
+        """
+        model_config = self._model_for_agent(agent_type)
+        key = self._get_model_key(model_config) if model_config else None
+        backend = self.backends.get(key)
+        if backend is None:
+            result = await self.generate(agent_type, messages, max_tokens=max_tokens, temperature=temperature)
+            yield result["text"]
+            return
+        cutoff = self.generation.cutoff()
+        async with aclosing(backend.stream(messages, max_tokens=max_tokens, temperature=temperature)) as deltas:
+            steps = 0
+            async for delta in deltas:
+                steps += 1  # About one token per engine step
+                yield delta
+                if cutoff is not None and cutoff.feed(delta):
+                    # Text already sent cannot be cleaned, but nothing more is decoded
+                    self.generation.early_stopped(agent_type, cutoff.reason, steps, max_tokens)
+                    break
+    
+    async def _fallback_generate(
+        self,
+        agent_type: str,
+        messages: List[Dict[str, str]],
+        tried: set,
+        max_tokens: int,
+        temperature: float,
+        prompt_tokens: int,
+    ) -> Tuple[Optional[str], Optional[str], Optional[ModelBackend]]:
+        """Walk FALLBACK_CHAIN (skipping `tried` and open circuits); (text, model, backend) or Nones."""
+        for fallback_key in self.FALLBACK_CHAIN:
+            if fallback_key in tried:
+                continue  # Skip the models that just failed
+            
+            fallback_config = self.registry.MODELS.get(fallback_key)
+            if not fallback_config:
+                continue
+            if self.circuit_open(fallback_key):
+                logger.info(f"Skipping fallback {fallback_config.name}: circuit open")
+                continue
+            
+            logger.info(f"Attempting fallback to {fallback_config.name}")
+            try:
+                fallback_start = time.time()
+                text, model_name = await self._llama_cpp_generate(
+                    messages=messages,
+                    model_config=fallback_config,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    agent_type=agent_type,
+                )
+                self.latency.observe(fallback_key, agent_type, prompt_tokens, time.time() - fallback_start)
+                logger.info(f"Fallback to {fallback_config.name} successful")
+                return text, model_name, fallback_config.backend
+            except Exception as fallback_error:
+                logger.warning(f"Fallback {fallback_config.name} also failed: {fallback_error}")
+        return None, None, None
+    
+    def _hedge_target(self, agent_type: str, primary_key: Optional[str]) -> Optional[str]:
+        """Next healthy FALLBACK_CHAIN model to hedge to, if the agent is hedged."""
+        if not self.hedging.enabled_for(agent_type):
+            return None
+        for key in self.FALLBACK_CHAIN:
+            config = self.registry.MODELS.get(key)
+            if key == primary_key or not config or config.backend != ModelBackend.LLAMA_CPP:
+                continue
+            if not self.circuit_open(key):
+                return key
+        return None
+
+    async def hedge(
+        self,
+        agent_type: str,
+        primary: Awaitable[Any],
+        primary_key: Optional[str],
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        tried: Optional[set] = None,
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        Await `primary` (a request to `primary_key`, e.g. a direct replica call),
+        plus a hedge to the next healthy FALLBACK_CHAIN model once the agent's
+        p95 deadline passes. Agents that are not hedged just await `primary`.
+
+        The hedge model's key is added to `tried` when the hedge request is
+        actually sent, so the fallback chain still tries it if the primary fails
+        before the deadline.
+
+        Returns:
+            (primary's result, None), or ((text, model name), hedge model key)
+            when the hedge answered first
+        """
+        hedge_key = self._hedge_target(agent_type, primary_key)
+        if not hedge_key:
+            return await primary, None
+        hedge_config = self.registry.MODELS[hedge_key]
+        self.hedging.start_request(agent_type)
+
+        primary = asyncio.ensure_future(primary)
+        pending = {primary}
+        try:
+            delay = self.hedging.hedge_delay(agent_type)
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.hedging.try_acquire(agent_type):
+                return await primary, None
+
+            logger.info(f"Hedging {agent_type}: {primary_key} exceeded {delay:.2f}s, also trying {hedge_config.name}")
+            hedge = asyncio.create_task(self._llama_cpp_generate(
+                messages=messages,
+                model_config=hedge_config,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                agent_type=agent_type,
+            ))
+            if tried is not None:
+                tried.add(hedge_key)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedging.record_win(agent_type)
+                            return task.result(), hedge_key
+                        return task.result(), None
+            # Both failed: surface the primary's error to the fallback chain
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()  # The loser, or both if the caller went away
+
+    def serve(self, url: str):
+        """Async context for one request to a replica: holds its managed llama-server instance, if any."""
+        if self.instance_manager is None:
+            return nullcontext()
+        return self.instance_manager.serve(url)
+
+    def accepting(self, url: str) -> bool:
+        """False while the managed instance behind a replica is draining or failed."""
+        return self.instance_manager is None or self.instance_manager.accepting(url)
+
+    def _model_pool(self, model_key: Optional[str]) -> ReplicaPool:
+        """Replica pool for a model (one replica per MODEL_PORTS entry unless configured)."""
+        return self.replicas.pool(model_key) or self.replicas.pool_for_port(self.MODEL_PORTS.get(model_key, 8080))
+
+    def circuit_open(self, model_key: str) -> bool:
+        """True if the breakers of all the model's replicas are open."""
+        return all(self.breakers.get(r.url).is_open() for r in self._model_pool(model_key).replicas)
+
     def _get_model_key(self, model_config: ModelConfig) -> Optional[str]:
         """Get the model key from config."""
         for key, config in self.registry.MODELS.items():
@@ -463,12 +701,13 @@ class ModelRouter:
             f"to enable real inference with {config.name}."
         )
 
-    def _llama_cpp_generate(
+    async def _llama_cpp_generate(
         self,
         messages: List[Dict[str, str]],
         model_config: ModelConfig,
         max_tokens: int,
         temperature: float,
+        agent_type: str = "",
     ) -> Tuple[str, str]:
         """Call a running llama.cpp HTTP server (OpenAI-compatible) with retry logic."""
         try:
@@ -476,13 +715,10 @@ class ModelRouter:
         except ImportError as e:
             raise RuntimeError("httpx not installed; pip install -r requirements.txt") from e
 
-        # Determine correct port for the model
         model_key = next((k for k, v in self.registry.MODELS.items() if v == model_config), None)
-        port = self.MODEL_PORTS.get(model_key, 8080)
+        pool = self._model_pool(model_key)
         api_key = self.MODEL_API_KEYS.get(model_key, None)
-        server_url = f"http://127.0.0.1:{port}"
         
-        url = f"{server_url.rstrip('/')}/v1/chat/completions"
         headers = {"Content-Type": "application/json"}
         # Only add auth header if API key is configured and not None
         if api_key and api_key != "none":
@@ -491,7 +727,7 @@ class ModelRouter:
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "stream": False,
+            "stream": True,               # Streamed so an early stop cancels decoding
             "top_p": 0.9,                 # Tighter nucleus sampling
             "frequency_penalty": 0.3,     # Penalize repeated tokens
             "presence_penalty": 0.3,      # Encourage topic diversity
@@ -505,13 +741,46 @@ class ModelRouter:
             ],
         }
 
+        prefix_key = self.slot_affinity.prefix_key(agent_type, messages)
+
         last_error = None
+        failed_replicas = []
         for attempt in range(self.MAX_RETRIES):
+            # Replicas behind an open breaker fail fast instead of being retried with sleeps
+            open_replicas = [r for r in pool.replicas if self.breakers.get(r.url).is_open()]
+            if len(open_replicas) == len(pool.replicas):
+                raise CircuitOpenError(f"Circuit open for {model_config.name}: {last_error or 'recent failures'}")
+            # Least-loaded healthy replica, avoiding replicas that already failed this request
+            # and managed instances that are draining or restarting
+            stopping = [r for r in pool.replicas if not self.accepting(r.url)]
+            replica = pool.pick(exclude=failed_replicas + open_replicas + stopping)
+            breaker = self.breakers.get(replica.url)
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit half-open for {model_config.name}, trial request in flight")
+            url = f"{replica.url}/v1/chat/completions"
+            # Pin to the slot holding this prompt prefix so llama.cpp reuses its KV cache
+            slot_id = self.slot_affinity.acquire(replica.url, prefix_key)
+            data = None
+            cutoff = self.generation.cutoff()
             try:
-                with httpx.Client(timeout=self.LLAMA_CPP_TIMEOUT) as client:
-                    resp = client.post(url, json=payload, headers=headers)
-                    resp.raise_for_status()
-                    data = resp.json()
+                payload.update(self.slot_affinity.request_fields(slot_id))
+                async with httpx.AsyncClient(timeout=self.LLAMA_CPP_TIMEOUT) as client:
+                    try:
+                        # Managed instances are loaded on demand (the request waits for a cold start)
+                        async with self.serve(replica.url):
+                            with pool.track(replica):
+                                status_code, body = await stream_chat_completion(client, url, payload, headers, cutoff)
+                                if status_code >= 500:
+                                    raise RuntimeError(f"llama.cpp returned {status_code}")
+                    except Exception:
+                        failed_replicas.append(replica)
+                        breaker.record_failure()
+                        raise
+                    breaker.record_success()
+                    if status_code != 200:
+                        raise RuntimeError(f"llama.cpp returned {status_code}")
+                    data = body
+                self.slot_affinity.release(replica.url, slot_id, data)
                 
                 choices = data.get("choices") or []
                 if not choices:
@@ -524,21 +793,34 @@ class ModelRouter:
 
                 model_name = data.get("model", model_config.name)
                 logger.info(f"llama.cpp generation successful (attempt {attempt + 1})")
+                if cutoff is not None and cutoff.stopped:
+                    self.generation.early_stopped(
+                        agent_type, cutoff.reason, data["usage"]["completion_tokens"], max_tokens
+                    )
                 
                 # Post-process to remove repetitive content
                 content = self._clean_response(content)
                 return content, model_name
                 
+            except asyncio.CancelledError:
+                if data is None:
+                    # Hedge loser or client gone: no outcome to record
+                    self.slot_affinity.release(replica.url, slot_id)
+                    breaker.cancel_trial()
+                raise
             except httpx.TimeoutException as e:
+                self.slot_affinity.release(replica.url, slot_id)
                 last_error = f"Timeout after {self.LLAMA_CPP_TIMEOUT}s: {e}"
                 logger.warning(f"Attempt {attempt + 1}/{self.MAX_RETRIES} failed: {last_error}")
-                if attempt < self.MAX_RETRIES - 1:
-                    time.sleep(1 * (attempt + 1))  # Exponential backoff
+                if attempt < self.MAX_RETRIES - 1 and not breaker.is_open():
+                    await asyncio.sleep(1 * (attempt + 1))  # Exponential backoff
             except Exception as e:
+                if data is None:
+                    self.slot_affinity.release(replica.url, slot_id)
                 last_error = str(e)
                 logger.warning(f"Attempt {attempt + 1}/{self.MAX_RETRIES} failed: {last_error}")
-                if attempt < self.MAX_RETRIES - 1:
-                    time.sleep(0.5)
+                if attempt < self.MAX_RETRIES - 1 and not breaker.is_open():
+                    await asyncio.sleep(0.5)
         
         raise RuntimeError(f"llama.cpp server call failed after {self.MAX_RETRIES} attempts: {last_error}")
     
@@ -546,69 +828,9 @@ class ModelRouter:
         """
         Post-process model output to remove repetitive/garbage content.
         Some models (like MedPalm2-imitate) have training artifacts.
+        Streamed generations stop where this would truncate (generation_policy.ResponseCutoff).
         """
-        import re
-        
-        # Remove social media handles and promotional content
-        patterns_to_remove = [
-            r'Follow me on Twitter.*?(?=\n|$)',
-            r'@\w+',                               # Twitter handles
-            r'#\w+',                               # Hashtags
-            r'Contact Email:.*?(?=\n|$)',
-            r'Website\s*:.*?(?=\n|$)',
-            r'Address\s*:.*?(?=\n|$)',
-            r'Phone:.*?(?=\n|$)',
-            r'Instagram\s*@.*?(?=\n|$)',
-            r'DM or message me.*?(?=\n|$)',
-            r'www\.\S+',                           # URLs
-            r'\S+@\S+\.\S+',                       # Emails
-        ]
-        
-        for pattern in patterns_to_remove:
-            content = re.sub(pattern, '', content, flags=re.IGNORECASE)
-        
-        # Detect and truncate at first repetition
-        lines = content.split('\n')
-        seen_lines = set()
-        clean_lines = []
-        repeat_count = 0
-        
-        for line in lines:
-            stripped = line.strip()
-            # Skip empty lines
-            if not stripped:
-                clean_lines.append(line)
-                continue
-                
-            # Check for repeating lines (allow some duplicates)
-            if stripped in seen_lines:
-                repeat_count += 1
-                if repeat_count > 2:  # Stop after 2 repeats
-                    break
-            else:
-                seen_lines.add(stripped)
-                repeat_count = 0
-                clean_lines.append(line)
-        
-        content = '\n'.join(clean_lines)
-        
-        # Remove excessive whitespace
-        content = re.sub(r'\n{3,}', '\n\n', content)
-        content = content.strip()
-        
-        # If response is still too long or empty, truncate/provide fallback
-        if len(content) > 1500:
-            # Find a good break point
-            sentences = content[:1500].rsplit('.', 1)
-            if len(sentences) > 1:
-                content = sentences[0] + '.'
-            else:
-                content = content[:1500] + '...'
-        
-        if not content:
-            content = "Hello! How can I assist you today?"
-            
-        return content
+        return clean_response(content) or "Hello! How can I assist you today?"
     
     def get_model_info(self) -> Dict[str, Any]:
         """Return model registry and GPU assignments."""
@@ -624,4 +846,6 @@ class ModelRouter:
                 for k, v in self.registry.MODELS.items()
             },
             "agent_mapping": self.registry.AGENT_MODEL_MAP,
+            "agent_overrides": {a: k for a, k in self.agent_overrides.items() if k in self.backends},
+            "engines": {k: b.get_stats() for k, b in self.backends.items()},
         }
@@ -4,12 +4,26 @@ Manages multiple GGUF models running simultaneously for parallel inference
 """
 import os
 import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from urllib.parse import urlparse
 from loguru import logger
 import httpx
 
+from .instance_supervisor import InstanceSupervisor
+from .model_lifecycle import MODEL_ON_DEMAND, ModelLifecycleScheduler
+
+# Let the API process own the llama-server instances: start_all() on startup
+# (pinned instances, idle reaper, liveness checks) and stop_all() on shutdown.
+# Router requests to an instance's local port then load it on demand (serve()).
+# Leave off when the instances are launched externally (bin/start_multi_model.sh).
+MODEL_MANAGER_AUTOSTART = os.getenv("MODEL_MANAGER_AUTOSTART", "false").lower() == "true"
+
+# Replica hosts whose ports map to this machine's instances
+_LOCAL_HOSTS = {"127.0.0.1", "localhost", "0.0.0.0"}
+
 
 @dataclass
 class ModelInstance:
@@ -20,7 +34,8 @@ class ModelInstance:
     gpu_id: int
     context_size: int
     gpu_layers: int
-    status: str = "stopped"  # stopped, starting, running, error
+    vram_gb: float = 0.0  # Weights + KV cache at context_size
+    status: str = "stopped"  # stopped, starting, running, draining, error
     pid: Optional[int] = None
     endpoint: Optional[str] = None
 
@@ -51,6 +66,7 @@ class MultiModelManager:
             gpu_id=0,
             context_size=8192,
             gpu_layers=99,
+            vram_gb=10.0,
         ),
         "documentation": ModelInstance(
             model_key="qwen-medical",
@@ -59,6 +75,7 @@ class MultiModelManager:
             gpu_id=0,
             context_size=4096,
             gpu_layers=99,
+            vram_gb=1.5,
         ),
         
         # GPU 1 (RTX 3060 - 12GB) - Fast Response Models
@@ -69,6 +86,7 @@ class MultiModelManager:
             gpu_id=1,
             context_size=4096,
             gpu_layers=99,
+            vram_gb=2.0,
         ),
         "insurance": ModelInstance(
             model_key="openins-llama3",
@@ -77,6 +95,7 @@ class MultiModelManager:
             gpu_id=1,
             context_size=8192,
             gpu_layers=99,
+            vram_gb=8.0,
         ),
         
         # GPU 0 (RTX 3090) - Clinical Specialist
@@ -87,6 +106,7 @@ class MultiModelManager:
             gpu_id=0,
             context_size=8192,
             gpu_layers=99,
+            vram_gb=9.0,
         ),
     }
     
@@ -101,19 +121,25 @@ class MultiModelManager:
         "Monitoring": "chat",
     }
     
-    def __init__(self):
+    def __init__(self, on_demand: bool = MODEL_ON_DEMAND):
         self.instances: Dict[str, ModelInstance] = {}
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.in_flight: Counter = Counter()  # Requests per instance, awaited when draining
+        self.managed = False  # Between start_all() and stop_all(): router traffic goes through serve()
         self._load_instances()
+        # Child processes: readiness gating, crash restarts, rotating logs, drain (see instance_supervisor)
+        self.supervisor = InstanceSupervisor(self)
+        # Start instances when requests need them and stop idle ones (see model_lifecycle)
+        self.scheduler: Optional[ModelLifecycleScheduler] = ModelLifecycleScheduler(self) if on_demand else None
     
     def _load_instances(self):
         """Load model instance configurations."""
-        self.instances = self.MODEL_INSTANCES.copy()
+        self.instances = {name: replace(inst) for name, inst in self.MODEL_INSTANCES.items()}
         logger.info(f"Loaded {len(self.instances)} model instance configurations")
     
     async def start_instance(self, instance_name: str) -> bool:
         """
-        Start a specific model instance.
+        Start a specific model instance and wait until /health reports it ready.
+        From then on it is supervised: restarted if it crashes or hangs.
         
         Args:
             instance_name: Name of the instance to start
@@ -136,92 +162,119 @@ class MultiModelManager:
             instance.status = "error"
             return False
         
-        # Build command
-        cmd = [
+        return await self.supervisor.start(instance_name)
+    
+    def command(self, instance_name: str) -> List[str]:
+        """llama-server command line for an instance."""
+        instance = self.instances[instance_name]
+        return [
             self.LLAMA_SERVER_BIN,
             "-m", instance.model_path,
             "-c", str(instance.context_size),
             "-ngl", str(instance.gpu_layers),
             "--port", str(instance.port),
             "--host", "0.0.0.0",
+            "--parallel", os.getenv("LLAMA_PARALLEL", "1"),  # Slots; see LLAMA_CPP_SLOTS
             "--api-key", "",
         ]
-        
-        # Set GPU
+    
+    def process_env(self, instance_name: str) -> Dict[str, str]:
+        """Environment pinning an instance to its GPU."""
         env = os.environ.copy()
-        env["CUDA_VISIBLE_DEVICES"] = str(instance.gpu_id)
+        env["CUDA_VISIBLE_DEVICES"] = str(self.instances[instance_name].gpu_id)
         env["PATH"] = "/usr/local/cuda/bin:" + env.get("PATH", "")
         env["LD_LIBRARY_PATH"] = "/usr/local/cuda/lib64:" + env.get("LD_LIBRARY_PATH", "")
-        
+        return env
+    
+    async def stop_instance(self, instance_name: str, drain: bool = True):
+        """Stop an instance (after in-flight requests finish) and free its VRAM."""
+        if instance_name in self.instances:
+            await self.supervisor.stop(instance_name, drain=drain)
+    
+    async def warm_up(self, instance_name: str):
+        """One-token completion so the first real request does not pay for CUDA graph / cache setup."""
+        instance = self.instances[instance_name]
         try:
-            import subprocess
-            
-            # Start process in background
-            process = subprocess.Popen(
-                cmd,
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-            )
-            
-            instance.pid = process.pid
-            instance.endpoint = f"http://127.0.0.1:{instance.port}"
-            instance.status = "starting"
-            
-            logger.info(
-                f"Started {instance_name} (PID: {instance.pid}, "
-                f"Port: {instance.port}, GPU: {instance.gpu_id})"
-            )
-            
-            # Wait for server to be ready
-            await self._wait_for_instance(instance, timeout=60)
-            
-            return instance.status == "running"
-            
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                await client.post(
+                    f"{instance.endpoint}/v1/chat/completions",
+                    json={"messages": [{"role": "user", "content": "ok"}], "max_tokens": 1},
+                )
         except Exception as e:
-            logger.error(f"Failed to start {instance_name}: {e}")
-            instance.status = "error"
-            return False
-    
-    async def _wait_for_instance(self, instance: ModelInstance, timeout: int = 60):
-        """Wait for instance to be ready."""
-        start_time = asyncio.get_event_loop().time()
-        
-        while (asyncio.get_event_loop().time() - start_time) < timeout:
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(
-                        f"{instance.endpoint}/health",
-                        timeout=2.0
-                    )
-                    if response.status_code == 200:
-                        instance.status = "running"
-                        logger.info(f"Instance ready: {instance.endpoint}")
-                        return
-            except:
-                pass
-            
-            await asyncio.sleep(1)
-        
-        logger.warning(f"Instance timeout: {instance.endpoint}")
-        instance.status = "error"
+            logger.warning(f"Warm-up of {instance_name} failed: {e}")
     
     async def start_all(self):
-        """Start all configured model instances for parallel execution."""
-        logger.info("Starting all model instances for parallel execution...")
+        """Start all configured model instances (only pinned ones when loading on demand)."""
+        names = list(self.instances.keys())
+        self.managed = True
+        self.supervisor.start_monitoring()
+        if self.scheduler:
+            names = [n for n in names if n in self.scheduler.pinned]
+            self.scheduler.start()
+            logger.info(f"On-demand model loading: starting pinned instances {names}")
+        else:
+            logger.info("Starting all model instances for parallel execution...")
         
         tasks = [
             self.start_instance(name)
-            for name in self.instances.keys()
+            for name in names
         ]
         
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
         running_count = sum(1 for r in results if r is True)
-        logger.info(f"Started {running_count}/{len(self.instances)} instances")
+        logger.info(f"Started {running_count}/{len(names)} instances")
         
-        return running_count > 0
+        return running_count > 0 or (self.scheduler is not None and not names)
+    
+    async def stop_all(self):
+        """Graceful shutdown: stop the reaper and health checks, drain and stop every instance."""
+        self.managed = False
+        if self.scheduler:
+            await self.scheduler.stop()
+        await self.supervisor.stop_monitoring()
+        await asyncio.gather(*(self.stop_instance(name) for name in self.supervisor.running()))
+    
+    def instance_for_url(self, url: str) -> Optional[str]:
+        """Name of the instance listening behind a router replica URL (local ports only)."""
+        parsed = urlparse(url)
+        if parsed.hostname not in _LOCAL_HOSTS:
+            return None
+        return next((name for name, inst in self.instances.items() if inst.port == parsed.port), None)
+    
+    @asynccontextmanager
+    async def serve(self, url: str):
+        """
+        Hold the instance behind a router replica URL for one request.
+        With on-demand loading this records demand and starts a stopped
+        instance (the request waits for the cold start instead of hitting a
+        dead port). The request counts as in flight, so stopping the instance
+        drains it first. Yields the instance, or None if the URL is not managed.
+        """
+        name = self.instance_for_url(url) if self.managed else None
+        if name is None:
+            yield None
+            return
+        if self.scheduler is None:
+            with self._count_in_flight(name):
+                yield self.instances[name]
+            return
+        async with self.scheduler.use(name) as instance:
+            with self._count_in_flight(name):
+                yield instance
+    
+    @contextmanager
+    def _count_in_flight(self, name: str):
+        self.in_flight[name] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[name] -= 1
+    
+    def accepting(self, url: str) -> bool:
+        """False while the managed instance behind `url` is draining or failed, so routing skips it."""
+        name = self.instance_for_url(url) if self.managed else None
+        return name is None or self.instances[name].status not in ("draining", "error")
     
     def get_instance_for_agent(self, agent_type: str) -> Optional[ModelInstance]:
         """Get the appropriate model instance for an agent type."""
@@ -237,7 +290,7 @@ class MultiModelManager:
     
     def get_status(self) -> Dict[str, Any]:
         """Get status of all model instances."""
-        return {
+        status = {
             "total_instances": len(self.instances),
             "running": sum(1 for i in self.instances.values() if i.status == "running"),
             "instances": {
@@ -251,6 +304,10 @@ class MultiModelManager:
                 for name, inst in self.instances.items()
             }
         }
+        status["processes"] = self.supervisor.get_stats()
+        if self.scheduler:
+            status["lifecycle"] = self.scheduler.get_stats()
+        return status
     
     async def generate(
         self,
@@ -262,12 +319,28 @@ class MultiModelManager:
         """
         Generate response using appropriate model instance.
         Supports parallel execution across multiple models.
+        With on-demand loading, a stopped instance is started first (the request waits for it).
         """
+        instance_name = self.AGENT_TO_INSTANCE.get(agent_type)
+        if self.scheduler and instance_name:
+            async with self.scheduler.use(instance_name) as instance:
+                return await self._generate_on(instance_name, instance, messages, max_tokens, temperature)
+        
         instance = self.get_instance_for_agent(agent_type)
         
         if not instance:
             raise RuntimeError(f"No running instance for agent: {agent_type}")
         
+        return await self._generate_on(instance_name, instance, messages, max_tokens, temperature)
+    
+    async def _generate_on(
+        self,
+        instance_name: str,
+        instance: ModelInstance,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+    ) -> Dict[str, Any]:
         payload = {
             "messages": messages,
             "temperature": temperature,
@@ -275,6 +348,7 @@ class MultiModelManager:
             "stream": False,
         }
         
+        self.in_flight[instance_name] += 1
         try:
             async with httpx.AsyncClient(timeout=120.0) as client:
                 response = await client.post(
@@ -294,3 +368,16 @@ class MultiModelManager:
         except Exception as e:
             logger.error(f"Generation failed on {instance.endpoint}: {e}")
             raise
+        finally:
+            self.in_flight[instance_name] -= 1
+
+
+# Global multi-model manager
+_multi_model_manager: Optional[MultiModelManager] = None
+
+
+def get_multi_model_manager() -> MultiModelManager:
+    global _multi_model_manager
+    if _multi_model_manager is None:
+        _multi_model_manager = MultiModelManager()
+    return _multi_model_manager
@@ -13,8 +13,26 @@ SPEED TIER OPTIMIZATION (from benchmark results):
   * Quality: ⭐⭐⭐⭐⭐ Medical accuracy
 
 Strategy: Use Tier 1 for parallel tasks, reserve Tier 2 for quality-critical clinical work
+
+SCHEDULING: tasks form a DAG. Each task starts as soon as its own dependencies
+have succeeded (no waves), highest priority / longest downstream chain first,
+limited per model by WORKFLOW_MODEL_CONCURRENCY (e.g. "bi-medix2=2",
+others WORKFLOW_DEFAULT_CONCURRENCY) across all running workflows. A task that
+fails or exceeds its timeout skips its dependents; when the workflow timeout
+expires, unfinished tasks are cancelled and the completed results returned.
+
+MEMOIZATION: successful task results are kept for WORKFLOW_MEMO_TTL_S, keyed by
+model, agent, the prompt with its resolved dependency outputs and sampling
+parameters. Re-running a workflow (a retry after a downstream failure, or the
+same discharge summary requested again) reuses finished sub-tasks and only
+recomputes what failed or changed.
 """
 import asyncio
+import hashlib
+import json
+import os
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import replace
 from typing import List, Dict, Any, Optional, Tuple, Callable
 from dataclasses import dataclass, field
 from enum import Enum
@@ -23,6 +41,16 @@ import time
 
 from .model_router import ModelRouter
 from .persona import get_system_prompt
+from .rate_limiter import parse_quotas
+
+
+WORKFLOW_MODEL_CONCURRENCY = parse_quotas(os.getenv("WORKFLOW_MODEL_CONCURRENCY", ""))
+WORKFLOW_DEFAULT_CONCURRENCY = int(os.getenv("WORKFLOW_DEFAULT_CONCURRENCY", "4"))
+WORKFLOW_TASK_TIMEOUT_S = float(os.getenv("WORKFLOW_TASK_TIMEOUT_S", "180"))
+WORKFLOW_TIMEOUT_S = float(os.getenv("WORKFLOW_TIMEOUT_S", "600"))
+# Memoized task results (0 disables)
+WORKFLOW_MEMO_TTL_S = float(os.getenv("WORKFLOW_MEMO_TTL_S", "3600"))
+WORKFLOW_MEMO_MAX_ENTRIES = int(os.getenv("WORKFLOW_MEMO_MAX_ENTRIES", "2048"))
 
 
 class WorkflowType(str, Enum):
@@ -47,6 +75,7 @@ class AgentTask:
     temperature: float = 0.7
     dependencies: List[str] = field(default_factory=list)  # Task IDs this depends on
     task_id: Optional[str] = None
+    timeout_s: Optional[float] = None  # Default WORKFLOW_TASK_TIMEOUT_S
     
     def __post_init__(self):
         if self.task_id is None:
@@ -65,6 +94,8 @@ class AgentResult:
     tokens: int
     error: Optional[str] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
+    started_ms: float = 0.0  # Offsets from workflow start
+    finished_ms: float = 0.0
 
 
 @dataclass
@@ -76,18 +107,122 @@ class WorkflowResult:
     aggregated_content: str
     total_latency_ms: float
     parallel_efficiency: float  # 0-1, how much parallelization helped
+    speedup: float = 1.0  # Sum of task latencies / workflow latency
+    critical_path: List[str] = field(default_factory=list)  # Longest dependency chain by task latency
+    critical_path_ms: float = 0.0
     metadata: Dict[str, Any] = field(default_factory=dict)
 
 
+class TaskMemo:
+    """
+    Bounded TTL store of successful AgentResults, least recently used evicted first.
+    
+    Per process; failed, timed-out and cancelled tasks are never stored, nor are
+    answers from a fallback model (the key names the primary model, and the next
+    run should get the primary's answer once it has recovered).
+    """
+    
+    def __init__(self, ttl_s: float = WORKFLOW_MEMO_TTL_S, max_entries: int = WORKFLOW_MEMO_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[AgentResult, float]]" = OrderedDict()  # key -> (result, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.saved_ms = 0.0
+        self.saved_tokens = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_s > 0 and self.max_entries > 0
+    
+    @staticmethod
+    def key(model_key: str, task: AgentTask, prompt: str) -> str:
+        """Model, agent, resolved prompt and sampling parameters; task ids are not part of it."""
+        payload = [model_key, task.agent_type, prompt, task.max_tokens, task.temperature]
+        return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+    
+    def get(self, key: str, task: AgentTask) -> Optional[AgentResult]:
+        """Copy of the memoized result relabelled for `task`, or None on miss/expiry."""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() >= entry[1]:
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        result = entry[0]
+        self.saved_ms += result.latency_ms
+        self.saved_tokens += result.tokens
+        return replace(
+            result,
+            task_id=task.task_id,
+            latency_ms=0.0,
+            metadata={**result.metadata, "memoized": True, "saved_ms": result.latency_ms},
+        )
+    
+    def put(self, key: str, result: AgentResult):
+        if not self.enabled or not result.success or result.metadata.get("fallback_used"):
+            return
+        self._entries[key] = (replace(result, metadata=dict(result.metadata)), time.monotonic() + self.ttl_s)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_s": self.ttl_s,
+            "max_entries": self.max_entries,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "saved_ms": round(self.saved_ms, 1),
+            "saved_tokens": self.saved_tokens,
+        }
+
+
 class LLMOrchestrator:
     """
     Orchestrates multiple LLM agents for complex workflows.
     Supports parallel execution, dependency management, and result aggregation.
     """
     
-    def __init__(self, model_router: ModelRouter):
+    def __init__(
+        self,
+        model_router: ModelRouter,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        default_concurrency: int = WORKFLOW_DEFAULT_CONCURRENCY,
+        task_timeout_s: float = WORKFLOW_TASK_TIMEOUT_S,
+        workflow_timeout_s: float = WORKFLOW_TIMEOUT_S,
+        memo: Optional[TaskMemo] = None,
+    ):
         self.router = model_router
         self.workflow_templates = self._initialize_workflows()
+        self.model_concurrency = dict(WORKFLOW_MODEL_CONCURRENCY if model_concurrency is None else model_concurrency)
+        self.default_concurrency = default_concurrency
+        self.task_timeout_s = task_timeout_s
+        self.workflow_timeout_s = workflow_timeout_s
+        # Per-model slots shared by all workflows
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight: Counter = Counter()
+        self.workflows = 0
+        self.timeouts = 0
+        self.memo = memo if memo is not None else TaskMemo()
     
     def _initialize_workflows(self) -> Dict[WorkflowType, Callable]:
         """Initialize predefined workflow templates."""
@@ -106,7 +241,9 @@ class LLMOrchestrator:
         self,
         workflow_type: WorkflowType,
         context: Dict[str, Any],
-        custom_tasks: Optional[List[AgentTask]] = None
+        custom_tasks: Optional[List[AgentTask]] = None,
+        timeout_s: Optional[float] = None,
+        refresh: bool = False,
     ) -> WorkflowResult:
         """
         Execute a predefined workflow or custom task list.
@@ -115,6 +252,8 @@ class LLMOrchestrator:
             workflow_type: Type of workflow to execute
             context: Context data for the workflow (patient info, medical data, etc.)
             custom_tasks: Optional custom task list (overrides template)
+            timeout_s: Workflow deadline (default WORKFLOW_TIMEOUT_S); partial results after it
+            refresh: Recompute every task instead of reusing memoized results (fresh ones are stored)
         
         Returns:
             WorkflowResult with aggregated outputs
@@ -131,9 +270,12 @@ class LLMOrchestrator:
             tasks = workflow_fn(context)
         
         logger.info(f"Executing workflow: {workflow_type.value} with {len(tasks)} tasks")
+        self.workflows += 1
         
         # Execute tasks with dependency resolution
-        results = await self._execute_tasks_with_dependencies(tasks, context)
+        results = await self._execute_tasks_with_dependencies(
+            tasks, context, timeout_s=timeout_s or self.workflow_timeout_s, refresh=refresh
+        )
         
         # Aggregate results
         aggregated = self._aggregate_results(workflow_type, results, context)
@@ -142,7 +284,9 @@ class LLMOrchestrator:
         
         # Calculate parallel efficiency
         sequential_time = sum(r.latency_ms for r in results)
-        parallel_efficiency = min(1.0, sequential_time / total_latency if total_latency > 0 else 1.0)
+        speedup = sequential_time / total_latency if total_latency > 0 else 1.0
+        parallel_efficiency = min(1.0, speedup)
+        critical_path, critical_path_ms = self._critical_path(tasks, results)
         
         return WorkflowResult(
             workflow_type=workflow_type.value,
@@ -151,85 +295,239 @@ class LLMOrchestrator:
             aggregated_content=aggregated,
             total_latency_ms=total_latency,
             parallel_efficiency=parallel_efficiency,
+            speedup=speedup,
+            critical_path=critical_path,
+            critical_path_ms=critical_path_ms,
             metadata={
                 "num_tasks": len(tasks),
                 "sequential_time_ms": sequential_time,
-                "speedup_factor": sequential_time / total_latency if total_latency > 0 else 1.0,
+                "speedup_factor": speedup,
+                "critical_path": critical_path,
+                "critical_path_ms": critical_path_ms,
+                "failed_tasks": [r.task_id for r in results if not r.success],
+                "memoized_tasks": [r.task_id for r in results if r.metadata.get("memoized")],
             }
         )
     
     async def _execute_tasks_with_dependencies(
         self,
         tasks: List[AgentTask],
-        context: Dict[str, Any]
+        context: Dict[str, Any],
+        timeout_s: Optional[float] = None,
+        refresh: bool = False,
     ) -> List[AgentResult]:
-        """Execute tasks respecting dependencies, parallelizing where possible."""
+        """
+        Execute tasks as a DAG: each starts as soon as its own dependencies succeed.
         
-        # Build dependency graph
+        Returns results in task order. Dependents of a failed task are skipped;
+        tasks still running when `timeout_s` expires are cancelled.
+        """
         task_map = {task.task_id: task for task in tasks}
-        completed = {}
-        results = []
-        
-        while len(completed) < len(tasks):
-            # Find tasks ready to execute (no pending dependencies)
-            ready_tasks = [
-                task for task in tasks
-                if task.task_id not in completed
-                and all(dep in completed for dep in task.dependencies)
-            ]
-            
-            if not ready_tasks:
-                # Circular dependency or error
-                remaining = [t for t in tasks if t.task_id not in completed]
-                logger.error(f"Cannot resolve dependencies for tasks: {[t.task_id for t in remaining]}")
-                break
-            
-            # Execute ready tasks in parallel
-            logger.info(f"Executing {len(ready_tasks)} tasks in parallel")
-            batch_results = await asyncio.gather(
-                *[self._execute_single_task(task, context, completed) for task in ready_tasks],
-                return_exceptions=True
+        dependents: Dict[str, List[str]] = defaultdict(list)
+        waiting = {task.task_id: set(task.dependencies) for task in tasks}
+        for task in tasks:
+            for dep in task.dependencies:
+                dependents[dep].append(task.task_id)
+        rank = self._downstream_tokens(tasks, dependents)
+        
+        completed: Dict[str, AgentResult] = {}
+        running: Dict[asyncio.Task, AgentTask] = {}
+        workflow_start = time.monotonic()
+        deadline = workflow_start + timeout_s if timeout_s else None
+        timed_out = False
+        
+        def fail(task_id: str, error: str):
+            """Record a task that will not run, and skip everything downstream of it."""
+            completed[task_id] = self._failed_result(task_map[task_id], error)
+            for child in dependents[task_id]:
+                if child not in completed:
+                    fail(child, f"skipped: dependency {task_id} failed")
+        
+        def launch(ready: List[str]):
+            # Highest priority, then longest downstream chain, queue first for a model slot
+            for task_id in sorted(ready, key=lambda t: (-task_map[t].priority, -rank[t])):
+                task = task_map[task_id]
+                running[asyncio.create_task(self._run_task(task, context, completed, workflow_start, refresh))] = task
+        
+        for task in tasks:
+            unknown = [dep for dep in task.dependencies if dep not in task_map]
+            if unknown and task.task_id not in completed:
+                fail(task.task_id, f"unknown dependencies: {unknown}")
+        launch([t.task_id for t in tasks if not waiting[t.task_id] and t.task_id not in completed])
+        
+        try:
+            while running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                done = set()
+                if remaining is None or remaining > 0:
+                    done, _ = await asyncio.wait(running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    timed_out = True
+                    break
+                ready = []
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Task {task.task_id} failed: {e}")
+                        result = self._failed_result(task, str(e))
+                    completed[task.task_id] = result
+                    if not result.success:
+                        for child in dependents[task.task_id]:
+                            if child not in completed:
+                                fail(child, f"skipped: dependency {task.task_id} failed")
+                        continue
+                    for child in dependents[task.task_id]:
+                        waiting[child].discard(task.task_id)
+                        if not waiting[child] and child not in completed:
+                            ready.append(child)
+                launch(ready)
+        finally:
+            for future in running:
+                future.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        
+        if timed_out:
+            self.timeouts += 1
+            logger.warning(
+                f"Workflow timeout after {timeout_s}s: cancelled {[t.task_id for t in running.values()]}, "
+                f"returning {sum(r.success for r in completed.values())}/{len(tasks)} completed tasks"
             )
-            
-            # Process results
-            for task, result in zip(ready_tasks, batch_results):
-                if isinstance(result, Exception):
-                    logger.error(f"Task {task.task_id} failed: {result}")
-                    result = AgentResult(
-                        task_id=task.task_id,
-                        agent_type=task.agent_type,
-                        success=False,
-                        content="",
-                        model="",
-                        latency_ms=0,
-                        tokens=0,
-                        error=str(result)
-                    )
-                
-                completed[task.task_id] = result
-                results.append(result)
-        
-        return results
-    
-    async def _execute_single_task(
+        for task in tasks:
+            if task.task_id in completed:
+                continue
+            if timed_out:
+                fail(task.task_id, f"cancelled: workflow timeout after {timeout_s}s")
+            else:
+                # Circular dependency
+                logger.error(f"Cannot resolve dependencies for task {task.task_id}: {sorted(waiting[task.task_id])}")
+                fail(task.task_id, f"unresolved dependencies: {sorted(waiting[task.task_id])}")
+        
+        return [completed[task.task_id] for task in tasks]
+    
+    async def _run_task(
         self,
         task: AgentTask,
         context: Dict[str, Any],
-        completed_tasks: Dict[str, AgentResult]
+        completed_tasks: Dict[str, AgentResult],
+        workflow_start: float,
+        refresh: bool = False,
     ) -> AgentResult:
-        """Execute a single agent task."""
+        """Run one task within its model's concurrency cap and its timeout, or reuse its memoized result."""
+        model_key = self.router.model_key_for(task.agent_type) or task.agent_type
+        prompt = self._resolved_prompt(task, completed_tasks)
+        memo_key = self.memo.key(model_key, task, prompt)
+        cached = None if refresh else self.memo.get(memo_key, task)
+        if cached is not None:
+            logger.debug(f"Task {task.task_id} memoized ({cached.metadata['saved_ms']:.0f}ms saved)")
+            cached.started_ms = cached.finished_ms = (time.monotonic() - workflow_start) * 1000
+            cached.metadata["queue_ms"] = 0.0
+            return cached
+        
+        timeout_s = task.timeout_s or self.task_timeout_s
+        queued = time.monotonic()
+        async with self._model_slot(model_key):
+            started = time.monotonic()
+            self.in_flight[model_key] += 1
+            try:
+                result = await asyncio.wait_for(self._execute_single_task(task, prompt), timeout_s)
+            except asyncio.TimeoutError:
+                logger.warning(f"Task {task.task_id} timed out after {timeout_s}s")
+                result = self._failed_result(task, f"timeout after {timeout_s}s")
+                result.latency_ms = (time.monotonic() - started) * 1000
+            finally:
+                self.in_flight[model_key] -= 1
+        result.started_ms = (started - workflow_start) * 1000
+        result.finished_ms = (time.monotonic() - workflow_start) * 1000
+        result.metadata["queue_ms"] = (started - queued) * 1000
+        self.memo.put(memo_key, result)
+        return result
+    
+    def _model_slot(self, model_key: str) -> asyncio.Semaphore:
+        if model_key not in self._slots:
+            self._slots[model_key] = asyncio.Semaphore(self.model_concurrency.get(model_key, self.default_concurrency))
+        return self._slots[model_key]
+    
+    @staticmethod
+    def _failed_result(task: AgentTask, error: str) -> AgentResult:
+        return AgentResult(
+            task_id=task.task_id,
+            agent_type=task.agent_type,
+            success=False,
+            content="",
+            model="",
+            latency_ms=0,
+            tokens=0,
+            error=error,
+        )
+    
+    @staticmethod
+    def _downstream_tokens(tasks: List[AgentTask], dependents: Dict[str, List[str]]) -> Dict[str, int]:
+        """max_tokens along each task's longest chain of dependents (scheduling rank)."""
+        task_map = {task.task_id: task for task in tasks}
+        rank: Dict[str, int] = {}
+        
+        def visit(task_id: str, path: frozenset) -> int:
+            if task_id not in rank:
+                children = [c for c in dependents[task_id] if c not in path]  # Cycles are reported later
+                rank[task_id] = task_map[task_id].max_tokens + max(
+                    (visit(c, path | {c}) for c in children), default=0
+                )
+            return rank[task_id]
+        
+        for task in tasks:
+            visit(task.task_id, frozenset({task.task_id}))
+        return rank
+    
+    @staticmethod
+    def _critical_path(tasks: List[AgentTask], results: List[AgentResult]) -> Tuple[List[str], float]:
+        """Longest dependency chain by task latency: the workflow's lower bound with unlimited slots."""
+        task_map = {task.task_id: task for task in tasks}
+        chains: Dict[str, Tuple[float, List[str]]] = {}
+        # A task only starts after its dependencies finished, so finish order is a topological order
+        for result in sorted((r for r in results if r.finished_ms > 0), key=lambda r: r.finished_ms):
+            dependencies = task_map[result.task_id].dependencies
+            longest, path = max((chains[d] for d in dependencies if d in chains), key=lambda c: c[0], default=(0.0, []))
+            chains[result.task_id] = (longest + result.latency_ms, path + [result.task_id])
+        if not chains:
+            return [], 0.0
+        length, path = max(chains.values(), key=lambda c: c[0])
+        return path, length
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workflows": self.workflows,
+            "timeouts": self.timeouts,
+            "task_timeout_s": self.task_timeout_s,
+            "workflow_timeout_s": self.workflow_timeout_s,
+            "models": {
+                key: {
+                    "limit": self.model_concurrency.get(key, self.default_concurrency),
+                    "in_flight": self.in_flight[key],
+                }
+                for key in sorted(set(self._slots) | set(self.model_concurrency))
+            },
+            "memo": self.memo.get_stats(),
+        }
+    
+    @staticmethod
+    def _resolved_prompt(task: AgentTask, completed_tasks: Dict[str, AgentResult]) -> str:
+        """Task prompt prefixed with its dependencies' outputs."""
+        if not task.dependencies:
+            return task.prompt
+        dependency_results = "\n\n".join([
+            f"[{dep} Result]:\n{completed_tasks[dep].content}"
+            for dep in task.dependencies if dep in completed_tasks
+        ])
+        return f"{dependency_results}\n\n{task.prompt}"
+    
+    async def _execute_single_task(self, task: AgentTask, prompt: str) -> AgentResult:
+        """Execute a single agent task with its resolved prompt."""
         start_time = time.time()
         
         try:
-            # Build prompt with dependency results if needed
-            prompt = task.prompt
-            if task.dependencies:
-                dependency_results = "\n\n".join([
-                    f"[{dep} Result]:\n{completed_tasks[dep].content}"
-                    for dep in task.dependencies if dep in completed_tasks
-                ])
-                prompt = f"{dependency_results}\n\n{prompt}"
-            
             # Create messages with Dr. iSHA persona
             messages = [
                 {"role": "system", "content": get_system_prompt(task.agent_type)},
@@ -243,6 +541,10 @@ class LLMOrchestrator:
                 max_tokens=task.max_tokens,
                 temperature=task.temperature,
             )
+            if response.get("stub"):
+                # Placeholder while every backend is down: fail the task so it is neither
+                # memoized nor fed to dependents, and a re-run recomputes it
+                raise RuntimeError("all model backends unavailable (stub response)")
             
             latency_ms = (time.time() - start_time) * 1000
             
@@ -257,6 +559,7 @@ class LLMOrchestrator:
                 metadata={
                     "backend": response["backend"],
                     "gpu_ids": response["gpu_ids"],
+                    "fallback_used": response.get("fallback_used", False),
                 }
             )
         
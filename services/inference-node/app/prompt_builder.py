@@ -0,0 +1,429 @@
+"""
+Token-budgeted prompt assembly.
+
+Requests are fitted to the target model's context window before they are sent,
+instead of letting llama.cpp truncate (or fail) after spending prompt eval:
+
+- Tokens are counted with the model's own vocabulary: llama-server's /tokenize
+  (the GGUF it has loaded), or an in-process tokenizer (vLLM/HF). Counts are
+  cached per text, so personas, RAG chunks and earlier turns are counted once.
+  If the tokenizer is unreachable a chars-per-token estimate is used,
+  calibrated from the real usage the backends report.
+- Budget = per-slot context - max_tokens - chat template overhead. The system
+  persona, client system messages and the latest user turn are always kept;
+  RAG context gets up to PROMPT_RAG_SHARE of the rest (more if history is
+  short), dropping lowest-ranked evidence first; history fills what remains,
+  newest turns first.
+- If even the fixed part does not fit, max_tokens is reduced (down to
+  PROMPT_MIN_OUTPUT_TOKENS) and then the latest user turn is cut in the middle.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from loguru import logger
+
+from .persona import get_system_prompt
+
+
+PROMPT_DEFAULT_CONTEXT_TOKENS = int(os.getenv("PROMPT_DEFAULT_CONTEXT_TOKENS", "4096"))  # Models outside ModelRegistry
+PROMPT_RAG_SHARE = float(os.getenv("PROMPT_RAG_SHARE", "0.5"))
+PROMPT_MIN_OUTPUT_TOKENS = int(os.getenv("PROMPT_MIN_OUTPUT_TOKENS", "128"))
+PROMPT_MESSAGE_OVERHEAD_TOKENS = int(os.getenv("PROMPT_MESSAGE_OVERHEAD_TOKENS", "8"))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4.0"))
+PROMPT_TOKEN_CACHE_SIZE = int(os.getenv("PROMPT_TOKEN_CACHE_SIZE", "4096"))
+PROMPT_TOKENIZE_TIMEOUT_S = float(os.getenv("PROMPT_TOKENIZE_TIMEOUT_S", "2"))
+PROMPT_TOKENIZE_RETRY_S = float(os.getenv("PROMPT_TOKENIZE_RETRY_S", "30"))
+
+# RAG context from RAGEngine.get_context_for_agent: a header line, then "[rank] ..." entries
+_RAG_ENTRY = re.compile(r"\n(?=\[\d+\])")
+_CUT_MARKER = "\n[...]\n"
+
+
+class TokenCounter(ABC):
+    """Counts tokens for one model; `exact` if it uses the model's vocabulary."""
+
+    exact = False
+
+    @abstractmethod
+    async def count_many(self, texts: Sequence[str]) -> List[int]:
+        ...
+
+    async def count(self, text: str) -> int:
+        return (await self.count_many([text]))[0]
+
+    async def message_overhead(self) -> int:
+        """Template tokens added per message (role markers, separators)."""
+        return PROMPT_MESSAGE_OVERHEAD_TOKENS
+
+    def calibrate(self, chars: int, tokens: int):
+        """Real usage reported by a backend (only estimators learn from it)."""
+
+
+class HeuristicTokenCounter(TokenCounter):
+    """chars / chars_per_token, with chars_per_token tracked from reported usage."""
+
+    def __init__(self, chars_per_token: float = PROMPT_CHARS_PER_TOKEN, alpha: float = 0.1):
+        self.chars_per_token = chars_per_token
+        self.alpha = alpha
+
+    async def count_many(self, texts: Sequence[str]) -> List[int]:
+        return [max(1, round(len(t) / self.chars_per_token)) if t else 0 for t in texts]
+
+    def calibrate(self, chars: int, tokens: int):
+        if chars > 0 and tokens > 0:
+            self.chars_per_token += self.alpha * (chars / tokens - self.chars_per_token)
+
+
+class _CachedCounter(TokenCounter):
+    """Exact counter with an LRU cache of text -> token count."""
+
+    exact = True
+
+    def __init__(self, cache_size: int = PROMPT_TOKEN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self.cache_hits = 0
+        self.tokenized = 0
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    @abstractmethod
+    async def _tokenize(self, texts: List[str]) -> List[int]:
+        ...
+
+    async def count_many(self, texts: Sequence[str]) -> List[int]:
+        counts: Dict[str, int] = {self._key(""): 0}
+        missing = []
+        for text in texts:
+            key = self._key(text)
+            if key in counts:
+                continue
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                counts[key] = self._cache[key]
+                self.cache_hits += 1
+            elif text not in missing:
+                missing.append(text)
+        if missing:
+            for text, n in zip(missing, await self._tokenize(missing)):
+                key = self._key(text)
+                counts[key] = self._cache[key] = n
+                self.tokenized += 1
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return [counts[self._key(t)] for t in texts]
+
+
+class LlamaCppTokenCounter(_CachedCounter):
+    """Exact counts from a llama-server's /tokenize (the GGUF vocabulary it has loaded).
+
+    Falls back to `fallback` (and stops asking for PROMPT_TOKENIZE_RETRY_S) when
+    the server is unreachable or too old to tokenize.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        fallback: Optional[HeuristicTokenCounter] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.transport = transport
+        self.fallback = fallback or HeuristicTokenCounter()
+        self._overhead: Optional[int] = None
+        self._retry_at = 0.0
+        self.errors = 0
+
+    @property
+    def exact(self) -> bool:
+        return time.monotonic() >= self._retry_at
+
+    def _client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=self.base_url, timeout=PROMPT_TOKENIZE_TIMEOUT_S, transport=self.transport)
+
+    async def _tokenize(self, texts: List[str]) -> List[int]:
+        async with self._client() as client:
+            async def one(text: str) -> int:
+                resp = await client.post("/tokenize", json={"content": text, "add_special": False})
+                resp.raise_for_status()
+                return len(resp.json()["tokens"])
+            return list(await asyncio.gather(*(one(t) for t in texts)))
+
+    async def count_many(self, texts: Sequence[str]) -> List[int]:
+        if not self.exact:
+            return await self.fallback.count_many(texts)
+        try:
+            return await super().count_many(texts)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            self.errors += 1
+            self._retry_at = time.monotonic() + PROMPT_TOKENIZE_RETRY_S
+            logger.warning(f"Tokenizer at {self.base_url} unavailable ({e}); estimating tokens for {PROMPT_TOKENIZE_RETRY_S:.0f}s")
+            return await self.fallback.count_many(texts)
+
+    async def message_overhead(self) -> int:
+        """Measured once from /apply-template: tokens of a templated one-message chat minus its content."""
+        if self._overhead is not None:
+            return self._overhead
+        if not self.exact:
+            return PROMPT_MESSAGE_OVERHEAD_TOKENS
+        probe = "ok"
+        try:
+            async with self._client() as client:
+                resp = await client.post("/apply-template", json={"messages": [{"role": "user", "content": probe}]})
+                resp.raise_for_status()
+                templated = resp.json()["prompt"]
+            full, bare = await self.count_many([templated, probe])
+        except httpx.TransportError:
+            return PROMPT_MESSAGE_OVERHEAD_TOKENS  # Server down: measure on a later request
+        except (httpx.HTTPError, KeyError, ValueError):
+            self._overhead = PROMPT_MESSAGE_OVERHEAD_TOKENS  # Older llama-server without /apply-template
+            return self._overhead
+        if not self.exact:
+            return PROMPT_MESSAGE_OVERHEAD_TOKENS  # /tokenize failed, counts above were estimates
+        self._overhead = max(1, full - bare)
+        return self._overhead
+
+    def calibrate(self, chars: int, tokens: int):
+        self.fallback.calibrate(chars, tokens)
+
+
+class TokenizerCounter(_CachedCounter):
+    """Exact counts from an in-process tokenizer with encode() (vLLM engine / HF tokenizers)."""
+
+    def __init__(self, tokenizer: Any, **kwargs):
+        super().__init__(**kwargs)
+        self.tokenizer = tokenizer
+        self._overhead: Optional[int] = None
+
+    def _encode(self, text: str):
+        try:
+            return self.tokenizer.encode(text, add_special_tokens=False)
+        except TypeError:  # Tokenizers without the keyword add no special tokens
+            return self.tokenizer.encode(text)
+
+    async def _tokenize(self, texts: List[str]) -> List[int]:
+        return [len(self._encode(t)) for t in texts]
+
+    async def message_overhead(self) -> int:
+        if self._overhead is None:
+            try:
+                templated = self.tokenizer.apply_chat_template(
+                    [{"role": "user", "content": "ok"}], tokenize=False, add_generation_prompt=True
+                )
+                full, bare = await self.count_many([templated, "ok"])
+                self._overhead = max(1, full - bare)
+            except Exception:
+                self._overhead = PROMPT_MESSAGE_OVERHEAD_TOKENS
+        return self._overhead
+
+
+@dataclass
+class BuiltPrompt:
+    """Messages fitted to the context window, with their token accounting."""
+    messages: List[Dict[str, str]]
+    prompt_tokens: int
+    max_tokens: int
+    budget_tokens: int
+    exact: bool
+    truncated: Dict[str, int] = field(default_factory=dict)
+
+
+def _split_rag(rag_context: str) -> List[str]:
+    """Header + entries, ranked best first."""
+    return _RAG_ENTRY.split(rag_context) if rag_context else []
+
+
+def _cut_middle(text: str, keep_ratio: float) -> str:
+    """Keep the head and tail of `text` (keep_ratio of its length)."""
+    keep = max(0, int(len(text) * keep_ratio) - len(_CUT_MARKER))
+    if keep >= len(text):
+        return text
+    head = keep * 2 // 3
+    return text[:head] + _CUT_MARKER + text[len(text) - (keep - head):]
+
+
+async def build_prompt(
+    counter: TokenCounter,
+    agent_type: str,
+    messages: List[Dict[str, str]],
+    context_tokens: int,
+    max_tokens: int,
+    rag_context: str = "",
+    use_persona: bool = False,
+) -> BuiltPrompt:
+    """
+    Fit persona, RAG context and conversation history into `context_tokens`.
+
+    Args:
+        counter: Token counter for the target model
+        agent_type: Selects the persona (get_system_prompt)
+        messages: Client messages (system messages are kept, other turns may be dropped)
+        context_tokens: Context available to this request (per llama.cpp slot)
+        max_tokens: Requested completion tokens (may be reduced to fit)
+        rag_context: Retrieved evidence; lowest-ranked entries are dropped first
+        use_persona: Prepend the agent persona as a system message
+    """
+    truncated: Dict[str, int] = {}
+    exact = counter.exact
+    overhead = await counter.message_overhead()
+    persona = get_system_prompt(agent_type) if use_persona else ""
+    client_system = [m for m in messages if m["role"] == "system"]
+    turns = [m for m in messages if m["role"] != "system"]
+    last, earlier = (turns[-1], turns[:-1]) if turns else (None, [])
+    rag_parts = _split_rag(rag_context)
+
+    # One batch of (cached) counts for every segment we might send
+    texts = [persona] + [m["content"] for m in client_system] + rag_parts + [m["content"] for m in turns]
+    counts = iter(await counter.count_many(texts))
+    persona_tokens = next(counts)
+    system_tokens = sum(next(counts) for _ in client_system)
+    rag_tokens = [next(counts) for _ in rag_parts]
+    turn_tokens = [next(counts) for _ in turns]
+
+    has_system = bool(persona or rag_parts)
+    fixed = (persona_tokens + overhead if has_system else 0) + system_tokens + overhead * len(client_system)
+    last_tokens = turn_tokens[-1] + overhead if last else 0
+    rag_heading = 4 if persona and rag_parts else 0  # "RELEVANT CONTEXT:" joiner
+
+    # Reserve output, shrinking it before touching the conversation
+    available = context_tokens - fixed - last_tokens
+    if available < max_tokens:
+        reduced = max(PROMPT_MIN_OUTPUT_TOKENS, min(max_tokens, available))
+        if reduced < max_tokens:
+            truncated["max_tokens_reduced_by"] = max_tokens - reduced
+            max_tokens = reduced
+    budget = context_tokens - max_tokens
+
+    # Latest user turn is kept, cut in the middle if it alone overflows
+    if last and fixed + last_tokens > budget:
+        room = max(overhead + 1, budget - fixed) - overhead
+        content, n, ratio = last["content"], last_tokens - overhead, 1.0
+        for _ in range(4):  # Chars are not tokens: re-count and tighten until it fits
+            if n <= room:
+                break
+            ratio *= room / max(1, n) * 0.98
+            content = _cut_middle(last["content"], ratio)
+            n = await counter.count(content)
+        last = {**last, "content": content}
+        truncated["user_chars_cut"] = len(turns[-1]["content"]) - len(content)
+        last_tokens = n + overhead
+    remaining = max(0, budget - fixed - last_tokens)
+
+    # RAG: its share of what is left (or everything history does not need), best entries first
+    history_wanted = sum(turn_tokens[:-1]) + overhead * len(earlier)
+    rag_cap = max(int(remaining * PROMPT_RAG_SHARE), remaining - history_wanted)
+    kept_rag: List[str] = []
+    rag_used = rag_heading
+    for i, (part, n) in enumerate(zip(rag_parts, rag_tokens)):
+        if rag_used + n <= rag_cap:
+            kept_rag.append(part)
+            rag_used += n
+        elif i <= 1 and rag_cap - rag_used > 32:
+            # Best entry too long on its own: keep its head rather than nothing
+            kept_rag.append(_cut_middle(part, (rag_cap - rag_used) / n))
+            rag_used = rag_cap
+            truncated["rag_chars_cut"] = len(part) - len(kept_rag[-1])
+        else:
+            break
+    if len(kept_rag) < len(rag_parts):
+        truncated["rag_entries_dropped"] = len(rag_parts) - len(kept_rag)
+    if kept_rag == rag_parts[:1]:
+        kept_rag = []  # Header only
+    if not kept_rag:
+        rag_used = 0
+
+    # History: newest turns that fit in what RAG left
+    history_budget = remaining - rag_used
+    kept_turns: List[Dict[str, str]] = []
+    for message, n in zip(reversed(earlier), reversed(turn_tokens[:-1])):
+        if n + overhead > history_budget:
+            break
+        kept_turns.insert(0, message)
+        history_budget -= n + overhead
+    while kept_turns and kept_turns[0]["role"] == "assistant":
+        kept_turns.pop(0)  # Templates expect the conversation to open with a user turn
+    if len(kept_turns) < len(earlier):
+        truncated["history_messages_dropped"] = len(earlier) - len(kept_turns)
+
+    # Assemble: persona (+ evidence) first, then client system messages, history, latest turn
+    system_text = "\n".join(kept_rag)
+    if persona:
+        system_text = get_system_prompt(agent_type, include_rag_context=system_text)
+    out: List[Dict[str, str]] = []
+    if system_text:
+        out.append({"role": "system", "content": system_text})
+    out.extend(client_system + kept_turns + ([last] if last else []))
+
+    prompt_tokens = sum(await counter.count_many([m["content"] for m in out])) + overhead * len(out)
+    if truncated:
+        logger.info(f"Prompt for {agent_type} fitted to {context_tokens} tokens: {truncated}")
+    return BuiltPrompt(
+        messages=out,
+        prompt_tokens=prompt_tokens,
+        max_tokens=max_tokens,
+        budget_tokens=budget,
+        exact=exact and counter.exact,
+        truncated=truncated,
+    )
+
+
+class TokenCounterRegistry:
+    """One exact counter per llama-server URL and per in-process engine."""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.counters: Dict[str, LlamaCppTokenCounter] = {}
+        self.engines: Dict[str, TokenizerCounter] = {}
+        self.heuristic = HeuristicTokenCounter()
+        self.transport = transport
+
+    def for_llama_cpp(self, base_url: str) -> LlamaCppTokenCounter:
+        if base_url not in self.counters:
+            self.counters[base_url] = LlamaCppTokenCounter(base_url, transport=self.transport)
+        return self.counters[base_url]
+
+    def for_tokenizer(self, model_key: str, tokenizer: Any) -> TokenCounter:
+        """Counter over an engine's tokenizer; heuristic until the engine has loaded it."""
+        if tokenizer is None:
+            return self.heuristic
+        if model_key not in self.engines:
+            self.engines[model_key] = TokenizerCounter(tokenizer)
+        return self.engines[model_key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            url: {
+                "exact": counter.exact,
+                "tokenized": counter.tokenized,
+                "cache_hits": counter.cache_hits,
+                "message_overhead": counter._overhead,
+                "errors": counter.errors,
+                "chars_per_token_estimate": round(counter.fallback.chars_per_token, 2),
+            }
+            for url, counter in self.counters.items()
+        }
+        for key, counter in self.engines.items():
+            stats[key] = {"exact": True, "tokenized": counter.tokenized, "cache_hits": counter.cache_hits}
+        return stats
+
+
+# Global token counter registry
+_token_counters: Optional[TokenCounterRegistry] = None
+
+
+def get_token_counters() -> TokenCounterRegistry:
+    global _token_counters
+    if _token_counters is None:
+        _token_counters = TokenCounterRegistry()
+    return _token_counters
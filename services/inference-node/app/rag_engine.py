@@ -19,7 +19,8 @@ except ImportError:
 
 # Import database functions
 try:
-    from app.database import search_medical_documents, search_patient_context, AsyncSessionLocal
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app.database import search_document_hits, search_patient_context, search_rag_context
     DB_AVAILABLE = True
 except ImportError:
     DB_AVAILABLE = False
@@ -211,7 +212,8 @@ class RAGEngine:
         query: str,
         limit: int = 5,
         specialty: Optional[str] = None,
-        document_type: Optional[str] = None
+        document_type: Optional[str] = None,
+        session: Optional["AsyncSession"] = None,
     ) -> List[Dict[str, Any]]:
         """
         Search medical knowledge base using pgvector.
@@ -221,6 +223,7 @@ class RAGEngine:
             limit: Number of results to return
             specialty: Filter by medical specialty
             document_type: Filter by document type (guideline, protocol, reference)
+            session: Request's DB session (a pooled connection is used if omitted)
             
         Returns:
             List of relevant documents with metadata
@@ -234,27 +237,17 @@ class RAGEngine:
             query_embedding = self.embeddings_engine.encode_single(query)
             
             # Search using pgvector (async)
-            from app.database import search_medical_documents
-            async with AsyncSessionLocal() as session:
-                results = await search_medical_documents(
-                    query_embedding=query_embedding,
-                    limit=limit,
-                    specialty=specialty,
-                    document_type=document_type
-                )
+            # Projected query: skips the embedding column and JSONB payload
+            results = await search_document_hits(
+                query_embedding=query_embedding,
+                limit=limit,
+                specialty=specialty,
+                document_type=document_type,
+                content_chars=None,
+                session=session,
+            )
             
-            # Format results
-            documents = []
-            for result in results:
-                documents.append({
-                    "id": result.document_id,
-                    "title": result.title,
-                    "content": result.content,
-                    "type": result.document_type,
-                    "specialty": result.specialty,
-                    "source": result.source_url,
-                    "metadata": result.metadata or {}
-                })
+            documents = [self._format_document(result) for result in results]
             
             logger.info(f"Retrieved {len(documents)} documents from pgvector")
             return documents
@@ -268,7 +261,8 @@ class RAGEngine:
         query: str,
         patient_id: str,
         limit: int = 3,
-        context_type: Optional[str] = None
+        context_type: Optional[str] = None,
+        session: Optional["AsyncSession"] = None,
     ) -> List[Dict[str, Any]]:
         """
         Search patient-specific context for personalized RAG.
@@ -278,6 +272,7 @@ class RAGEngine:
             patient_id: Patient identifier
             limit: Number of results
             context_type: Filter by context type (allergy, diagnosis, medication)
+            session: Request's DB session (a pooled connection is used if omitted)
             
         Returns:
             Patient-specific context items
@@ -289,25 +284,15 @@ class RAGEngine:
         try:
             query_embedding = self.embeddings_engine.encode_single(query)
             
-            from app.database import search_patient_context
-            async with AsyncSessionLocal() as session:
-                results = await search_patient_context(
-                    query_embedding=query_embedding,
-                    patient_id=patient_id,
-                    limit=limit,
-                    context_type=context_type
-                )
+            results = await search_patient_context(
+                query_embedding=query_embedding,
+                patient_id=patient_id,
+                limit=limit,
+                context_type=context_type,
+                session=session,
+            )
             
-            contexts = []
-            for result in results:
-                contexts.append({
-                    "id": result.id,
-                    "patient_id": result.patient_id,
-                    "type": result.context_type,
-                    "content": result.content,
-                    "location_id": result.location_id,
-                    "metadata": result.metadata or {}
-                })
+            contexts = [self._format_patient_context(result) for result in results]
             
             logger.info(f"Retrieved {len(contexts)} patient contexts")
             return contexts
@@ -316,6 +301,79 @@ class RAGEngine:
             logger.error(f"Patient context search failed: {e}")
             return []
     
+    async def search_with_patient_context(
+        self,
+        query: str,
+        patient_id: Optional[str] = None,
+        limit: int = 5,
+        patient_limit: int = 3,
+        specialty: Optional[str] = None,
+        document_type: Optional[str] = None,
+        context_type: Optional[str] = None,
+        session: Optional["AsyncSession"] = None,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Medical knowledge + patient context for one RAG call.
+        
+        Embeds the query once and runs both searches on a single connection.
+        
+        Returns:
+            {"documents": [...], "patient_context": [...]}
+        """
+        if not DB_AVAILABLE:
+            logger.warning("Database not available, using in-memory fallback")
+            return {"documents": self._fallback_search(query, limit), "patient_context": []}
+        
+        try:
+            query_embedding = self.embeddings_engine.encode_single(query)
+            
+            documents, contexts = await search_rag_context(
+                query_embedding=query_embedding,
+                patient_id=patient_id,
+                document_limit=limit,
+                patient_limit=patient_limit,
+                specialty=specialty,
+                document_type=document_type,
+                context_type=context_type,
+                session=session,
+            )
+            
+            logger.info(f"Retrieved {len(documents)} documents and {len(contexts)} patient contexts")
+            return {
+                "documents": [self._format_document(d) for d in documents],
+                "patient_context": [self._format_patient_context(c) for c in contexts],
+            }
+            
+        except Exception as e:
+            logger.error(f"RAG context search failed: {e}, falling back to in-memory")
+            return {"documents": self._fallback_search(query, limit), "patient_context": []}
+    
+    @staticmethod
+    def _format_document(hit) -> Dict[str, Any]:
+        """Format a DocumentSearchHit for prompts/API responses."""
+        return {
+            "id": hit.document_id,
+            "title": hit.title,
+            "content": hit.content,
+            "type": hit.document_type,
+            "specialty": hit.specialty,
+            "source": hit.source_url,
+            "score": hit.similarity,
+            "metadata": {"quality_score": hit.quality_score, "page_number": hit.page_number}
+        }
+    
+    @staticmethod
+    def _format_patient_context(result) -> Dict[str, Any]:
+        """Format a PatientContext row for prompts/API responses."""
+        return {
+            "id": result.id,
+            "patient_id": result.patient_id,
+            "type": result.context_type,
+            "content": result.content,
+            "location_id": result.location_id,
+            "metadata": result.extra_data or {}
+        }
+    
     def _fallback_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Fallback to in-memory vector store if database unavailable."""
         results = []
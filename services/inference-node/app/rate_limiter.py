@@ -0,0 +1,156 @@
+"""
+GCRA rate limiting for the request pipeline.
+
+The Generic Cell Rate Algorithm stores one float per key (the theoretical
+arrival time, TAT) instead of a list of timestamps: a key may burst up to
+`limit` requests, then one request every `period / limit` seconds.
+
+Backends:
+- MemoryRateLimiter: per process; idle keys are evicted once fully replenished
+- RedisRateLimiter: shared across workers via an atomic Lua script (optional,
+  needs the `redis` package; any Redis-protocol server works)
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+from loguru import logger
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# Backend: memory (per process) or redis (shared across workers)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Upper bound on tracked keys in memory; oldest keys are dropped beyond this
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+@dataclass
+class RateLimitDecision:
+    """Outcome of one rate limit check."""
+    allowed: bool
+    limit: int
+    retry_after: float = 0.0  # Seconds until the next request would be allowed
+
+
+def parse_quotas(value: str) -> Dict[str, int]:
+    """Parse "Chat=120,Claims=30" into {"Chat": 120, "Claims": 30}; non-positive limits are ignored."""
+    quotas: Dict[str, int] = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        agent, limit = item.split("=", 1)
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            # A zero limit would divide by zero in every check (period / limit)
+            logger.warning(f"Ignoring invalid rate limit quota: {item!r}")
+            continue
+        quotas[agent.strip()] = limit
+    return quotas
+
+
+class MemoryRateLimiter:
+    """In-process GCRA limiter with O(1) state per key and idle-key eviction."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[str, float]" = OrderedDict()  # key -> TAT, least recently used first
+        self.evictions = 0
+
+    async def check(self, key: str, limit: int, period: float) -> RateLimitDecision:
+        now = time.monotonic()
+        interval = period / limit
+
+        tat = max(self._tat.get(key, now), now)
+        allow_at = tat + interval - period
+        if now < allow_at:
+            self._tat.move_to_end(key)
+            return RateLimitDecision(False, limit, allow_at - now)
+
+        self._tat[key] = tat + interval
+        self._tat.move_to_end(key)
+        self._evict(now)
+        return RateLimitDecision(True, limit)
+
+    def _evict(self, now: float):
+        """Drop fully replenished keys from the LRU end (they hold no state), then enforce max_keys."""
+        while self._tat:
+            tat = next(iter(self._tat.values()))
+            if tat > now and len(self._tat) <= self.max_keys:
+                break
+            self._tat.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class RedisRateLimiter:
+    """GCRA limiter shared across workers; state lives in Redis with a TTL."""
+
+    # Uses the server clock so workers on different hosts agree on "now".
+    # Floats are returned as strings (Lua numbers are truncated to integers).
+    SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local interval = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    if tat < now then tat = now end
+    local allow_at = tat + interval - period
+    if now < allow_at then
+        return {0, tostring(allow_at - now)}
+    end
+    local new_tat = tat + interval
+    redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+    return {1, '0'}
+    """
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, prefix: str = "ratelimit:"):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("redis package not installed (pip install redis)")
+        self.client = aioredis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    async def check(self, key: str, limit: int, period: float) -> RateLimitDecision:
+        allowed, retry_after = await self._script(
+            keys=[self.prefix + key], args=[period / limit, period]
+        )
+        return RateLimitDecision(bool(int(allowed)), limit, float(retry_after))
+
+
+class RateLimiter:
+    """
+    Rate limiter facade used by the request pipeline.
+
+    Falls back to the in-memory backend (per process) if Redis is unreachable,
+    so a Redis outage degrades limits instead of rejecting traffic.
+    """
+
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND):
+        self.memory = MemoryRateLimiter()
+        self.shared: Optional[RedisRateLimiter] = None
+        if backend == "redis":
+            try:
+                self.shared = RedisRateLimiter()
+                logger.info(f"Rate limiting shared via Redis ({RATE_LIMIT_REDIS_URL})")
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable, using per-process limits: {e}")
+
+    async def check(self, key: str, limit: int, period: float) -> RateLimitDecision:
+        if self.shared is not None:
+            try:
+                return await self.shared.check(key, limit, period)
+            except Exception as e:
+                logger.warning(f"Redis rate limit check failed, using per-process limits: {e}")
+        return await self.memory.check(key, limit, period)
@@ -0,0 +1,271 @@
+"""
+Replica pools for llama.cpp model servers.
+
+Each model key (bi-medix2, qwen-0.6b-med, ...) maps to one or more
+llama-server replicas. Requests go to the replica with the fewest outstanding
+requests among two picked at random (power of two choices), or strictly the
+least outstanding replica with REPLICA_SELECTION=least_outstanding.
+
+Health:
+- Passive: a replica is ejected after REPLICA_EJECT_CONSECUTIVE_FAILURES
+  failures in a row, or when its error rate over the last REPLICA_ERROR_WINDOW
+  requests reaches REPLICA_EJECT_ERROR_RATE. Ejection time doubles for each
+  repeat ejection (capped at 8x REPLICA_EJECT_BASE_S).
+- Active: GET /health on every replica, run by the background health prober
+  (app.health) each HEALTH_PROBE_INTERVAL_S; llama-server answers 503 while
+  loading a model.
+If no replica of a pool is available, all of them are tried (panic mode)
+rather than failing the request outright.
+
+Configuration (later sources override earlier ones per model):
+1. ModelRouter.MODEL_PORTS, one local replica per model
+2. YAML file MODEL_REPLICAS_FILE:
+       bi-medix2:
+         - http://127.0.0.1:8080
+         - http://127.0.0.1:8090
+3. MODEL_REPLICAS="bi-medix2=127.0.0.1:8080,127.0.0.1:8090;qwen-0.6b-med=8082"
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+from loguru import logger
+
+
+REPLICA_SELECTION = os.getenv("REPLICA_SELECTION", "p2c").lower()  # p2c | least_outstanding
+MODEL_REPLICAS = os.getenv("MODEL_REPLICAS", "")
+MODEL_REPLICAS_FILE = os.getenv("MODEL_REPLICAS_FILE", "")
+REPLICA_ERROR_WINDOW = int(os.getenv("REPLICA_ERROR_WINDOW", "20"))
+REPLICA_EJECT_ERROR_RATE = float(os.getenv("REPLICA_EJECT_ERROR_RATE", "0.5"))
+REPLICA_EJECT_MIN_REQUESTS = int(os.getenv("REPLICA_EJECT_MIN_REQUESTS", "5"))
+REPLICA_EJECT_CONSECUTIVE_FAILURES = int(os.getenv("REPLICA_EJECT_CONSECUTIVE_FAILURES", "3"))
+REPLICA_EJECT_BASE_S = float(os.getenv("REPLICA_EJECT_BASE_S", "15"))
+REPLICA_HEALTH_TIMEOUT_S = float(os.getenv("REPLICA_HEALTH_TIMEOUT_S", "2"))
+
+
+def normalize_url(address: str) -> str:
+    """Accept "8080", "host:8080" or a full URL."""
+    address = str(address).strip().rstrip("/")
+    if address.isdigit():
+        return f"http://127.0.0.1:{address}"
+    if "://" not in address:
+        return f"http://{address}"
+    return address
+
+
+def parse_replicas(value: str) -> Dict[str, List[str]]:
+    """Parse "bi-medix2=127.0.0.1:8080,127.0.0.1:8090;qwen-0.6b-med=8082"."""
+    config: Dict[str, List[str]] = {}
+    for item in value.split(";"):
+        if "=" not in item:
+            continue
+        model, addresses = item.split("=", 1)
+        urls = [normalize_url(a) for a in addresses.split(",") if a.strip()]
+        if urls:
+            config[model.strip()] = urls
+    return config
+
+
+def load_replica_config(default_ports: Dict[str, int]) -> Dict[str, List[str]]:
+    """Replica URLs per model from MODEL_PORTS, MODEL_REPLICAS_FILE and MODEL_REPLICAS."""
+    config = {model: [normalize_url(port)] for model, port in default_ports.items()}
+    if MODEL_REPLICAS_FILE:
+        try:
+            import yaml
+            with open(MODEL_REPLICAS_FILE, "r", encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+            for model, addresses in (data.get("models", data)).items():
+                config[model] = [normalize_url(a) for a in addresses]
+        except Exception as e:
+            logger.error(f"Failed to load replica config {MODEL_REPLICAS_FILE}: {e}")
+    config.update(parse_replicas(MODEL_REPLICAS))
+    return config
+
+
+@dataclass
+class Replica:
+    """One llama-server instance and its load / health state."""
+    url: str
+    outstanding: int = 0
+    healthy: bool = True  # Last active probe
+    ejected_until: float = 0.0
+    ejections: int = 0
+    consecutive_failures: int = 0
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=REPLICA_ERROR_WINDOW))
+    requests: int = 0
+    failures: int = 0
+    latency_ewma_s: float = 0.0
+
+    @property
+    def port(self) -> int:
+        return urlparse(self.url).port or 80
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+
+class ReplicaPool:
+    """Load-balanced, outlier-ejecting set of replicas serving one model."""
+
+    def __init__(self, name: str, urls: Iterable[str], selection: str = REPLICA_SELECTION):
+        self.name = name
+        self.replicas = [Replica(url=normalize_url(u)) for u in urls]
+        self.selection = selection
+        self.panic_picks = 0
+
+    def pick(self, exclude: Iterable[Replica] = ()) -> Replica:
+        """Choose a replica; ejected and unhealthy replicas are skipped unless none is left."""
+        excluded = {id(r) for r in exclude}
+        candidates = [r for r in self.replicas if id(r) not in excluded] or self.replicas
+        now = time.monotonic()
+        available = [r for r in candidates if r.available(now)]
+        if not available:
+            self.panic_picks += 1
+            available = candidates
+        if len(available) == 1:
+            return available[0]
+        if self.selection == "least_outstanding":
+            return min(available, key=lambda r: (r.outstanding, r.latency_ewma_s))
+        a, b = random.sample(available, 2)
+        return a if (a.outstanding, a.latency_ewma_s) <= (b.outstanding, b.latency_ewma_s) else b
+
+    @contextmanager
+    def track(self, replica: Replica):
+        """Count a request as outstanding on the replica; an exception records a failure."""
+        replica.outstanding += 1
+        start = time.monotonic()
+        ok = False
+        cancelled = False
+        try:
+            yield replica
+            ok = True
+        except asyncio.CancelledError:
+            cancelled = True  # Caller gave up (e.g. lost a hedge): not the replica's fault
+            raise
+        finally:
+            replica.outstanding -= 1
+            if not cancelled:
+                self.record(replica, ok, time.monotonic() - start)
+
+    def record(self, replica: Replica, ok: bool, latency_s: float = 0.0):
+        replica.requests += 1
+        replica.outcomes.append(ok)
+        if ok:
+            replica.consecutive_failures = 0
+            replica.latency_ewma_s = (
+                latency_s if replica.latency_ewma_s == 0 else 0.8 * replica.latency_ewma_s + 0.2 * latency_s
+            )
+            if len(replica.outcomes) == replica.outcomes.maxlen and all(replica.outcomes):
+                replica.ejections = 0  # Stable again: next ejection starts from the base time
+            return
+
+        replica.failures += 1
+        replica.consecutive_failures += 1
+        errors = replica.outcomes.count(False)
+        if replica.consecutive_failures >= REPLICA_EJECT_CONSECUTIVE_FAILURES or (
+            len(replica.outcomes) >= REPLICA_EJECT_MIN_REQUESTS
+            and errors / len(replica.outcomes) >= REPLICA_EJECT_ERROR_RATE
+        ):
+            self.eject(replica)
+
+    def eject(self, replica: Replica):
+        duration = REPLICA_EJECT_BASE_S * min(2 ** replica.ejections, 8)
+        replica.ejected_until = time.monotonic() + duration
+        replica.ejections += 1
+        replica.consecutive_failures = 0
+        replica.outcomes.clear()
+        logger.warning(f"Replica {replica.url} ({self.name}) ejected for {duration:.0f}s")
+
+    async def probe(self, client: httpx.AsyncClient) -> Dict[str, bool]:
+        """Active health check: GET /health on each replica concurrently; returns url -> healthy."""
+        async def check(replica: Replica) -> bool:
+            try:
+                resp = await client.get(f"{replica.url}/health", timeout=REPLICA_HEALTH_TIMEOUT_S)
+                healthy = resp.status_code == 200
+            except Exception:
+                healthy = False
+            if healthy != replica.healthy:
+                logger.info(f"Replica {replica.url} ({self.name}) is {'healthy' if healthy else 'unhealthy'}")
+            replica.healthy = healthy
+            return healthy
+
+        results = await asyncio.gather(*(check(r) for r in self.replicas))
+        return {r.url: healthy for r, healthy in zip(self.replicas, results)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "selection": self.selection,
+            "available": sum(1 for r in self.replicas if r.available(now)),
+            "panic_picks": self.panic_picks,
+            "replicas": [
+                {
+                    "url": r.url,
+                    "outstanding": r.outstanding,
+                    "healthy": r.healthy,
+                    "ejected_for_s": round(max(0.0, r.ejected_until - now), 1),
+                    "ejections": r.ejections,
+                    "requests": r.requests,
+                    "failures": r.failures,
+                    "window_error_rate": (
+                        round(r.outcomes.count(False) / len(r.outcomes), 3) if r.outcomes else 0.0
+                    ),
+                    "latency_ewma_s": round(r.latency_ewma_s, 3),
+                }
+                for r in self.replicas
+            ],
+        }
+
+
+class ReplicaRegistry:
+    """Replica pools per model, plus ad-hoc single-replica pools for bare ports.
+
+    `default_ports` (ModelRouter.MODEL_PORTS) maps each model to the port it was
+    historically served on, so callers routing by port reach the model's
+    configured replicas wherever they run.
+    """
+
+    def __init__(self, config: Dict[str, List[str]], default_ports: Optional[Dict[str, int]] = None):
+        self.pools: Dict[str, ReplicaPool] = {model: ReplicaPool(model, urls) for model, urls in config.items()}
+        self.port_models: Dict[int, str] = {port: model for model, port in (default_ports or {}).items()}
+
+    def pool(self, model_key: str) -> Optional[ReplicaPool]:
+        return self.pools.get(model_key)
+
+    def pool_for_port(self, port: int) -> ReplicaPool:
+        """The pool serving the model that was historically on `port`."""
+        pool = self.pools.get(self.port_models.get(port))
+        if pool is not None:
+            return pool
+        key = f"port:{port}"
+        if key not in self.pools:
+            self.pools[key] = ReplicaPool(key, [str(port)])
+        return self.pools[key]
+
+    async def probe_all(self, client: httpx.AsyncClient) -> Dict[str, Dict[str, bool]]:
+        """Probe every pool concurrently; returns pool -> url -> healthy."""
+        names = list(self.pools)
+        results = await asyncio.gather(*(self.pools[name].probe(client) for name in names))
+        return dict(zip(names, results))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-pool replica load, health and ejection state."""
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
+
+# Global replica registry
+_replica_registry: Optional[ReplicaRegistry] = None
+
+
+def get_replica_registry(default_ports: Optional[Dict[str, int]] = None) -> ReplicaRegistry:
+    global _replica_registry
+    if _replica_registry is None:
+        _replica_registry = ReplicaRegistry(load_replica_config(default_ports or {}), default_ports)
+    return _replica_registry
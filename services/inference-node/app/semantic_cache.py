@@ -0,0 +1,243 @@
+"""
+Semantic response cache for FAQ-style agents.
+
+Near-duplicate questions ("what are your clinic timings?", "clinic hours?")
+are answered from a previous completion when the embedding of the last user
+turn is within SEMANTIC_CACHE_THRESHOLD cosine similarity of a cached one.
+
+PHI safety:
+- Entries are scoped per (location_id, agent_type); one location never sees
+  another location's answers
+- Only single-turn questions are cached (follow-ups depend on earlier turns)
+- Question text is never stored or logged, only its embedding and a hash
+- Opt-in per agent (SEMANTIC_CACHE_AGENTS), disabled without a real embedding model
+
+Each scope keeps a bounded matrix of normalized embeddings; nearest-neighbour
+lookup is one matrix-vector product, which at SEMANTIC_CACHE_MAX_ENTRIES per
+scope is faster than maintaining a graph index.
+"""
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+# Opt-in: agents whose answers may be served from the cache
+SEMANTIC_CACHE_AGENTS = {
+    a.strip() for a in os.getenv("SEMANTIC_CACHE_AGENTS", "").split(",") if a.strip()
+}
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "21600"))  # 6 hours
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))  # per location + agent
+
+# Similarity buckets for hit telemetry (used to tune the threshold)
+_SIMILARITY_BUCKETS = [0.90, 0.93, 0.95, 0.97, 0.99, 1.01]
+
+
+@dataclass
+class CachedAnswer:
+    """One cached completion (no question text)."""
+    entry_id: str
+    question_hash: str
+    answer: str
+    model: str
+    created_at: float
+    hits: int = 0
+
+
+@dataclass
+class _Scope:
+    """Cached answers for one (location_id, agent_type)."""
+    dimension: int
+    embeddings: np.ndarray = None  # (n, dimension), L2-normalized rows
+    entries: List[CachedAnswer] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.embeddings is None:
+            self.embeddings = np.zeros((0, self.dimension), dtype=np.float32)
+
+
+@dataclass
+class SemanticCacheHit:
+    entry: CachedAnswer
+    similarity: float
+    scope: Tuple[str, str]
+
+
+class SemanticCache:
+    """Per-location, per-agent semantic cache of completions."""
+
+    def __init__(
+        self,
+        agents=None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.agents = set(SEMANTIC_CACHE_AGENTS if agents is None else agents)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._scopes: Dict[Tuple[str, str], _Scope] = {}
+        # response id -> (scope, entry_id) for responses served from the cache
+        self._served: "OrderedDict[str, Tuple[Tuple[str, str], str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evictions = 0
+        self.false_hits = 0
+        self.hit_similarity_buckets = {str(b): 0 for b in _SIMILARITY_BUCKETS}
+
+    def enabled_for(self, agent_type: str, messages: List[Dict[str, str]]) -> bool:
+        """Opted-in agent and a single-turn question."""
+        if agent_type not in self.agents:
+            return False
+        return sum(1 for m in messages if m.get("role") != "system") == 1
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, location_id: str, agent_type: str, embedding: List[float]) -> Optional[SemanticCacheHit]:
+        """Best cached answer above the threshold, or None."""
+        scope_key = (location_id, agent_type)
+        scope = self._scopes.get(scope_key)
+        if scope is None or not scope.entries:
+            self.misses += 1
+            return None
+
+        self._expire(scope)
+        if not scope.entries:
+            self.misses += 1
+            return None
+
+        similarities = scope.embeddings @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.threshold:
+            self.misses += 1
+            return None
+
+        entry = scope.entries[best]
+        entry.hits += 1
+        self.hits += 1
+        for bucket in _SIMILARITY_BUCKETS:
+            if similarity < bucket:
+                self.hit_similarity_buckets[str(bucket)] += 1
+                break
+        return SemanticCacheHit(entry=entry, similarity=similarity, scope=scope_key)
+
+    def store(
+        self,
+        location_id: str,
+        agent_type: str,
+        embedding: List[float],
+        question: str,
+        answer: str,
+        model: str,
+    ) -> CachedAnswer:
+        """Cache an answer; the oldest entry in the scope is dropped when full."""
+        scope_key = (location_id, agent_type)
+        vector = self._normalize(embedding)
+        scope = self._scopes.get(scope_key)
+        if scope is None or scope.dimension != vector.shape[0]:
+            scope = self._scopes[scope_key] = _Scope(dimension=vector.shape[0])
+
+        entry = CachedAnswer(
+            entry_id=uuid.uuid4().hex[:16],
+            question_hash=hashlib.sha256(question.encode()).hexdigest()[:16],
+            answer=answer,
+            model=model,
+            created_at=time.time(),
+        )
+        scope.entries.append(entry)
+        scope.embeddings = np.vstack([scope.embeddings, vector[np.newaxis, :]])
+        self.stores += 1
+
+        overflow = len(scope.entries) - self.max_entries
+        if overflow > 0:
+            self._drop(scope, list(range(overflow)))
+            self.evictions += overflow
+        return entry
+
+    def record_served(self, response_id: str, hit: SemanticCacheHit, max_tracked: int = 10000):
+        """Remember which entry answered a response so feedback can flag it."""
+        self._served[response_id] = (hit.scope, hit.entry.entry_id)
+        while len(self._served) > max_tracked:
+            self._served.popitem(last=False)
+
+    def report_false_hit(self, response_id: str) -> bool:
+        """Flag a cached answer as wrong for its question; the entry is evicted."""
+        served = self._served.pop(response_id, None)
+        if served is None:
+            return False
+        scope_key, entry_id = served
+        self.false_hits += 1
+        scope = self._scopes.get(scope_key)
+        if scope is not None:
+            indexes = [i for i, e in enumerate(scope.entries) if e.entry_id == entry_id]
+            self._drop(scope, indexes)
+        logger.info(f"Semantic cache false hit reported for {scope_key[1]} (entry {entry_id})")
+        return True
+
+    def _expire(self, scope: _Scope):
+        now = time.time()
+        stale = [i for i, e in enumerate(scope.entries) if now - e.created_at > self.ttl_seconds]
+        if stale:
+            self._drop(scope, stale)
+            self.expired += len(stale)
+
+    @staticmethod
+    def _drop(scope: _Scope, indexes: List[int]):
+        if not indexes:
+            return
+        keep = np.ones(len(scope.entries), dtype=bool)
+        keep[indexes] = False
+        scope.embeddings = scope.embeddings[keep]
+        scope.entries = [e for e, k in zip(scope.entries, keep) if k]
+
+    def clear(self, location_id: Optional[str] = None):
+        """Drop all entries, or only those of one location."""
+        for key in list(self._scopes):
+            if location_id is None or key[0] == location_id:
+                del self._scopes[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit, false-hit and size statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "agents": sorted(self.agents),
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "hit_rate_percent": round(self.hits / lookups * 100, 2) if lookups else 0.0,
+            "false_hits": self.false_hits,
+            "false_hit_rate_percent": round(self.false_hits / self.hits * 100, 2) if self.hits else 0.0,
+            "hit_similarity_upper_bounds": self.hit_similarity_buckets,
+            "stores": self.stores,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "scopes": len(self._scopes),
+            "cache_size": sum(len(s.entries) for s in self._scopes.values()),
+        }
+
+
+# Global semantic cache
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> SemanticCache:
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache()
+    return _semantic_cache
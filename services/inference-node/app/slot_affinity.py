@@ -0,0 +1,204 @@
+"""
+llama.cpp slot affinity for prompt-prefix KV cache reuse.
+
+llama-server keeps the KV cache of the last prompt processed in each slot
+(`--parallel N` slots per server). With `cache_prompt` enabled, a request
+sent to a slot that already holds its prefix only evaluates the new tokens.
+Requests are pinned to slots by their prefix (agent + system prompt, plus the
+first user turn for multi-turn conversations), so the long Dr. iSHA persona
+and RAG context stay resident instead of being re-evaluated per request.
+
+Slot state is kept per replica URL, so replicas of different hosts serving on
+the same port never share slot ids or cached prefixes.
+
+Slot selection per replica:
+1. the idle slot that last served this prefix (affinity hit)
+2. otherwise the least recently used idle slot (the prefix is re-evaluated there)
+3. all slots busy: the prefix's own slot (queue behind it inside llama-server),
+   else let llama-server pick (id_slot -1)
+
+Prefix-hit tokens are read from the `timings.cache_n` field llama-server
+returns with each completion.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .replica_pool import normalize_url
+
+
+def _parse_replica_slots(value: str) -> Dict[str, int]:
+    """Parse "8080=4,10.0.0.2:8080=2" into {"http://127.0.0.1:8080": 4, "http://10.0.0.2:8080": 2}."""
+    slots: Dict[str, int] = {}
+    for item in value.split(","):
+        if "=" in item:
+            address, count = item.rsplit("=", 1)
+            slots[normalize_url(address)] = int(count)
+    return slots
+
+
+# Must match llama-server --parallel (LLAMA_PARALLEL in the launch scripts)
+LLAMA_CPP_SLOTS = int(os.getenv("LLAMA_CPP_SLOTS", os.getenv("LLAMA_PARALLEL", "1")))
+# Per replica: a bare port means a local server, "host:port" or a URL a remote one
+LLAMA_CPP_SLOTS_PER_PORT = _parse_replica_slots(os.getenv("LLAMA_CPP_SLOTS_PER_PORT", ""))
+LLAMA_CPP_CACHE_PROMPT = os.getenv("LLAMA_CPP_CACHE_PROMPT", "true").lower() in {"1", "true", "yes"}
+# Remembered prefix -> slot assignments per replica
+SLOT_AFFINITY_MAX_KEYS = int(os.getenv("SLOT_AFFINITY_MAX_KEYS", "1024"))
+
+
+@dataclass
+class SlotState:
+    slot_id: int
+    in_flight: int = 0
+    prefix_key: Optional[str] = None  # Prefix currently cached in the slot
+    last_used: float = 0.0
+
+
+@dataclass
+class ReplicaSlots:
+    """Slots and counters for one llama-server replica."""
+    slots: List[SlotState]
+    affinity: "OrderedDict[str, int]" = field(default_factory=OrderedDict)  # prefix -> slot
+    affinity_hits: int = 0
+    affinity_misses: int = 0
+    unpinned: int = 0  # All slots busy, llama-server picked
+    prompt_tokens: int = 0
+    prefix_hit_tokens: int = 0
+
+
+class SlotAffinity:
+    """Sticky prefix-to-slot assignment and slot occupancy per llama-server replica.
+
+    Replicas are identified by URL; a bare port ("8080" or 8080) means the local server.
+    """
+
+    def __init__(
+        self,
+        default_slots: int = LLAMA_CPP_SLOTS,
+        slots_per_replica: Optional[Dict[str, int]] = None,
+        cache_prompt: bool = LLAMA_CPP_CACHE_PROMPT,
+        max_keys: int = SLOT_AFFINITY_MAX_KEYS,
+    ):
+        self.default_slots = default_slots
+        self.slots_per_replica = slots_per_replica if slots_per_replica is not None else LLAMA_CPP_SLOTS_PER_PORT
+        self.cache_prompt = cache_prompt
+        self.max_keys = max_keys
+        self.replicas: Dict[str, ReplicaSlots] = {}
+
+    def _replica(self, replica: str) -> ReplicaSlots:
+        url = normalize_url(replica)
+        if url not in self.replicas:
+            count = max(1, self.slots_per_replica.get(url, self.default_slots))
+            self.replicas[url] = ReplicaSlots(slots=[SlotState(slot_id=i) for i in range(count)])
+        return self.replicas[url]
+
+    def slot_count(self, replica: str) -> int:
+        """Parallel slots of the llama-server replica (each gets n_ctx / slots of context)."""
+        return len(self._replica(replica).slots)
+
+    @staticmethod
+    def prefix_key(agent_type: str, messages: List[Dict[str, str]]) -> str:
+        """Key of the reusable prompt prefix: system messages, plus the first user turn of a conversation."""
+        system = [m["content"] for m in messages if m["role"] == "system"]
+        turns = [m["content"] for m in messages if m["role"] != "system"]
+        parts = [agent_type] + system
+        if len(turns) > 1:
+            parts.append(turns[0])  # Pin a conversation to one slot across turns
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()[:16]
+
+    def acquire(self, replica: str, prefix_key: str) -> int:
+        """Pick a slot for the request; returns the slot id, or -1 to let llama-server choose."""
+        state = self._replica(replica)
+        pinned = state.affinity.get(prefix_key)
+        if pinned is not None:
+            state.affinity.move_to_end(prefix_key)
+
+        idle = [s for s in state.slots if s.in_flight == 0]
+        if pinned is not None and state.slots[pinned].in_flight == 0 and state.slots[pinned].prefix_key == prefix_key:
+            slot = state.slots[pinned]
+            state.affinity_hits += 1
+        elif idle:
+            slot = min(idle, key=lambda s: s.last_used)
+            state.affinity_misses += 1
+        elif pinned is not None:
+            slot = state.slots[pinned]  # Wait for the slot that holds the prefix
+            state.affinity_hits += 1
+        else:
+            state.unpinned += 1
+            return -1
+
+        slot.in_flight += 1
+        slot.last_used = time.monotonic()
+        if slot.prefix_key != prefix_key:
+            if slot.prefix_key is not None and state.affinity.get(slot.prefix_key) == slot.slot_id:
+                del state.affinity[slot.prefix_key]  # Its prefix is about to be overwritten
+            slot.prefix_key = prefix_key
+        state.affinity[prefix_key] = slot.slot_id
+        state.affinity.move_to_end(prefix_key)
+        while len(state.affinity) > self.max_keys:
+            state.affinity.popitem(last=False)
+        return slot.slot_id
+
+    def release(self, replica: str, slot_id: int, response: Optional[Dict[str, Any]] = None):
+        """Free the slot and record prompt / prefix-hit tokens from the llama-server response."""
+        state = self._replica(replica)
+        if 0 <= slot_id < len(state.slots):
+            slot = state.slots[slot_id]
+            slot.in_flight = max(0, slot.in_flight - 1)
+        if response:
+            self.record_timings(replica, response)
+
+    def record_timings(self, replica: str, response: Dict[str, Any]):
+        timings = response.get("timings") or {}
+        cached = int(timings.get("cache_n") or 0)
+        evaluated = int(timings.get("prompt_n") or 0)
+        if not timings:
+            evaluated = int((response.get("usage") or {}).get("prompt_tokens") or 0)
+        state = self._replica(replica)
+        state.prefix_hit_tokens += cached
+        state.prompt_tokens += cached + evaluated
+
+    def request_fields(self, slot_id: int) -> Dict[str, Any]:
+        """llama-server request fields for the chosen slot."""
+        fields: Dict[str, Any] = {"cache_prompt": self.cache_prompt}
+        if slot_id >= 0:
+            fields["id_slot"] = slot_id
+        return fields
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Slot occupancy, affinity hit rate and prefix-hit tokens per replica URL."""
+        replicas = {}
+        for url, state in self.replicas.items():
+            assignments = state.affinity_hits + state.affinity_misses
+            replicas[url] = {
+                "slots": len(state.slots),
+                "busy_slots": sum(1 for s in state.slots if s.in_flight),
+                "in_flight": [s.in_flight for s in state.slots],
+                "affinity_hits": state.affinity_hits,
+                "affinity_misses": state.affinity_misses,
+                "affinity_hit_rate_percent": (
+                    round(state.affinity_hits / assignments * 100, 2) if assignments else 0.0
+                ),
+                "unpinned": state.unpinned,
+                "tracked_prefixes": len(state.affinity),
+                "prompt_tokens": state.prompt_tokens,
+                "prefix_hit_tokens": state.prefix_hit_tokens,
+                "prefix_hit_percent": (
+                    round(state.prefix_hit_tokens / state.prompt_tokens * 100, 2) if state.prompt_tokens else 0.0
+                ),
+            }
+        return {"cache_prompt": self.cache_prompt, "default_slots": self.default_slots, "replicas": replicas}
+
+
+# Global slot affinity
+_slot_affinity: Optional[SlotAffinity] = None
+
+
+def get_slot_affinity() -> SlotAffinity:
+    global _slot_affinity
+    if _slot_affinity is None:
+        _slot_affinity = SlotAffinity()
+    return _slot_affinity
@@ -1,127 +1,356 @@
 """
-vLLM Backend Integration Example
-Shows how to integrate vLLM for high-performance inference.
-Enable by setting USE_VLLM=1 env var and ensuring models are downloaded.
+vLLM Backend
+Continuous-batching inference through vLLM's AsyncLLMEngine.
+
+Every request is submitted to one shared engine per model; vLLM's scheduler
+batches all in-flight sequences on each decode step, so concurrent requests
+share the GPU instead of queueing behind each other. Prompts are built with
+the model's own chat template, and each request can be streamed.
+
+Enable with USE_VLLM=1 (models with backend=vllm in ModelRegistry are then
+registered in ModelRouter and started on first use). VLLM_ENGINE=mock swaps
+in MockAsyncLLMEngine for CPU-only development and tests.
 """
+import asyncio
+import importlib.util
 import os
-from typing import Dict, List, Any, Optional
+import uuid
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
 from loguru import logger
 
+from .generation_policy import ResponseCutoff
+from .vllm_config import vLLMEngineConfig, vLLMEngineRegistry
+
+VLLM_AVAILABLE = importlib.util.find_spec("vllm") is not None  # Imported lazily: pulls in torch/CUDA
+
+USE_VLLM = os.getenv("USE_VLLM", "").lower() in {"1", "true", "yes"}
+VLLM_ENGINE = os.getenv("VLLM_ENGINE", "vllm")  # vllm or mock
+VLLM_GPU_MEMORY_UTILIZATION = float(os.getenv("VLLM_GPU_MEMORY_UTILIZATION", "0.85"))
+VLLM_MAX_NUM_SEQS = int(os.getenv("VLLM_MAX_NUM_SEQS", "64"))
+
 
 class vLLMBackend:
-    """Wraps vLLM for inference (placeholder; requires vllm package)."""
-    
-    def __init__(self, model_path: str, max_model_len: int = 4096, dtype: str = "float16"):
-        self.model_path = model_path
-        self.max_model_len = max_model_len
-        self.dtype = dtype
-        self.engine = None
-        self._load_engine()
-    
-    def _load_engine(self):
-        """Load vLLM engine (requires 'pip install vllm')."""
+    """One AsyncLLMEngine (or a mock with the same interface) serving one model."""
+
+    def __init__(self, config: vLLMEngineConfig, engine: Any = None):
+        self.config = config
+        self.engine = engine
+        self.tokenizer = None
+        self._start_lock = asyncio.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.completed = 0
+        self.failed = 0
+        self.aborted = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def start(self):
+        """Create the engine (first call only) and load its tokenizer."""
+        async with self._start_lock:
+            if self.engine is None:
+                if not VLLM_AVAILABLE:
+                    raise RuntimeError("vLLM not installed; run 'pip install vllm'")
+                from vllm import AsyncEngineArgs, AsyncLLMEngine
+
+                logger.info(f"Loading vLLM engine for {self.config.model_path}...")
+                self.engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(**self.config.to_dict()))
+                logger.info(f"vLLM engine ready: {self.config.model_name}")
+            if self.tokenizer is None:
+                self.tokenizer = await self.engine.get_tokenizer()
+
+    def format_prompt(self, messages: List[Dict[str, str]]) -> str:
+        """Render messages with the model's chat template."""
+        template = getattr(self.tokenizer, "chat_template", None)
+        if not template:
+            return _chatml(messages)
         try:
-            from vllm import LLM, SamplingParams
-            
-            logger.info(f"Loading vLLM engine for {self.model_path}...")
-            self.engine = LLM(
-                model=self.model_path,
-                dtype=self.dtype,
-                gpu_memory_utilization=0.85,
-                max_model_len=self.max_model_len,
-                trust_remote_code=True,
-            )
-            logger.info("vLLM engine ready")
-        except ImportError:
-            logger.warning("vLLM not installed; run 'pip install vllm'")
-            self.engine = None
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
         except Exception as e:
-            logger.error(f"Failed to load vLLM engine: {e}")
-            self.engine = None
-    
-    def generate(
+            # Mistral-style templates reject the system role: fold it into the first user turn
+            if not any(m["role"] == "system" for m in messages):
+                raise
+            logger.debug(f"Chat template rejected system role ({e}); merging it into the first user message")
+            return self.tokenizer.apply_chat_template(
+                _merge_system(messages), tokenize=False, add_generation_prompt=True
+            )
+
+    def _sampling_params(self, max_tokens: int, temperature: float, top_p: float, stop: Optional[List[str]]):
+        if VLLM_AVAILABLE and not isinstance(self.engine, MockAsyncLLMEngine):
+            from vllm import SamplingParams
+            return SamplingParams(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+        return MockSamplingParams(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+
+    async def _outputs(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        stop: Optional[List[str]],
+    ) -> AsyncIterator[Any]:
+        """Engine outputs (cumulative) for one request; aborts it if the consumer stops early."""
+        await self.start()
+        prompt = self.format_prompt(messages)
+        request_id = uuid.uuid4().hex
+        finished = False
+        output = None
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            async for output in self.engine.generate(
+                prompt, self._sampling_params(max_tokens, temperature, top_p, stop), request_id
+            ):
+                finished = output.finished
+                yield output
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            if output is not None:
+                self.prompt_tokens += len(output.prompt_token_ids or [])
+                self.completion_tokens += len(output.outputs[0].token_ids)
+            if not finished:
+                # Consumer went away (client disconnect, cancelled hedge): free the sequence's KV cache
+                self.aborted += 1
+                await self.engine.abort(request_id)
+
+    async def stream(
         self,
         messages: List[Dict[str, str]],
         max_tokens: int = 512,
         temperature: float = 0.7,
         top_p: float = 0.95,
-    ) -> str:
-        """Generate text via vLLM."""
-        if not self.engine:
-            raise RuntimeError("vLLM engine not loaded")
-        
-        try:
-            from vllm import SamplingParams
-            
-            # Convert OpenAI-style messages to prompt
-            prompt = self._messages_to_prompt(messages)
-            
-            sampling_params = SamplingParams(
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-            )
-            
-            outputs = self.engine.generate([prompt], sampling_params)
-            return outputs[0].outputs[0].text
-        except Exception as e:
-            logger.error(f"vLLM generation failed: {e}")
-            raise
-    
-    def _messages_to_prompt(self, messages: List[Dict[str, str]]) -> str:
-        """Convert OpenAI messages to model prompt format."""
-        # Simple format for Mistral-like models
-        prompt = ""
-        for msg in messages:
-            role = msg["role"].upper()
-            content = msg["content"]
-            prompt += f"{role}: {content}\n"
-        prompt += "ASSISTANT:"
-        return prompt
-
-
-def use_vllm_if_available(agent_type: str, model_path: str) -> Optional[vLLMBackend]:
-    """
-    Instantiate vLLM backend if:
-    1. USE_VLLM=1 env var set
-    2. Model path exists
-    3. vllm package installed
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        """Yield text deltas as they are decoded (close the iterator to abort the request)."""
+        sent = 0
+        async for output in self._outputs(messages, max_tokens, temperature, top_p, stop):
+            text = output.outputs[0].text
+            if len(text) > sent:
+                yield text[sent:]
+                sent = len(text)
+
+    async def generate(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        stop: Optional[List[str]] = None,
+        cutoff: Optional[ResponseCutoff] = None,
+    ) -> Dict[str, Any]:
+        """
+        Full completion with finish reason and real token usage.
+
+        With a `cutoff`, the request is aborted as soon as the rest of the text
+        would be discarded by post-processing (finish_reason "early_stop").
+        """
+        final = None
+        finish_reason = None
+        sent = 0
+        async with aclosing(self._outputs(messages, max_tokens, temperature, top_p, stop)) as outputs:
+            async for final in outputs:
+                text = final.outputs[0].text
+                if cutoff is not None and len(text) > sent:
+                    stopped = cutoff.feed(text[sent:])
+                    sent = len(text)
+                    if stopped and not final.finished:
+                        finish_reason = "early_stop"
+                        break
+        completion = final.outputs[0]
+        prompt_tokens = len(final.prompt_token_ids or [])
+        return {
+            "text": completion.text,
+            "finish_reason": finish_reason or completion.finish_reason,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(completion.token_ids),
+                "total_tokens": prompt_tokens + len(completion.token_ids),
+            },
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.config.model_name,
+            "engine": "mock" if isinstance(self.engine, MockAsyncLLMEngine) else ("vllm" if self.engine else "not started"),
+            "max_num_seqs": self.config.max_num_seqs,
+            "active": self.active,
+            "peak_active": self.peak_active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "aborted": self.aborted,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+def _chatml(messages: List[Dict[str, str]]) -> str:
+    """ChatML prompt for tokenizers without a chat template."""
+    parts = [f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages]
+    return "".join(parts) + "<|im_start|>assistant\n"
+
+
+def _merge_system(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    rest = [dict(m) for m in messages if m["role"] != "system"]
+    for m in rest:
+        if m["role"] == "user":
+            m["content"] = f"{system}\n\n{m['content']}"
+            break
+    else:
+        rest.insert(0, {"role": "user", "content": system})
+    return rest
+
+
+def engine_config_for(model_key: str, model_config) -> vLLMEngineConfig:
+    """vLLMEngineRegistry entry for the model, else one derived from its ModelConfig."""
+    config = vLLMEngineRegistry.get_engine_config(model_key)
+    if config:
+        return config
+    return vLLMEngineConfig(
+        model_name=model_config.name,
+        model_path=model_config.path,
+        tensor_parallel_size=len(model_config.gpu_ids),
+        gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
+        max_model_len=model_config.max_context,
+        max_num_seqs=VLLM_MAX_NUM_SEQS,
+        dtype="float16" if model_config.quantization == "fp16" else "auto",
+    )
+
+
+def create_vllm_backend(model_key: str, model_config) -> vLLMBackend:
+    """Backend for a ModelRegistry model (engine starts on first request)."""
+    engine = MockAsyncLLMEngine() if VLLM_ENGINE == "mock" else None
+    return vLLMBackend(engine_config_for(model_key, model_config), engine=engine)
+
+
+# ─── Mock engine (CPU-only tests and development) ───────────────────────────────
+
+@dataclass
+class MockSamplingParams:
+    temperature: float = 0.7
+    top_p: float = 0.95
+    max_tokens: int = 512
+    stop: Optional[List[str]] = None
+
+
+@dataclass
+class MockCompletionOutput:
+    text: str = ""
+    token_ids: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+
+
+@dataclass
+class MockRequestOutput:
+    request_id: str
+    prompt: str
+    prompt_token_ids: List[int]
+    outputs: List[MockCompletionOutput]
+    finished: bool = False
+
+
+class MockTokenizer:
+    """Whitespace tokenizer with a ChatML chat template."""
+
+    chat_template = "chatml"
+
+    def encode(self, text: str) -> List[int]:
+        return [hash(word) % 32000 for word in text.split()]
+
+    def apply_chat_template(self, messages, tokenize: bool = False, add_generation_prompt: bool = True):
+        prompt = _chatml(messages) if add_generation_prompt else _chatml(messages).rsplit("<|im_start|>", 1)[0]
+        return self.encode(prompt) if tokenize else prompt
+
+
+class MockAsyncLLMEngine:
+    """Stand-in for AsyncLLMEngine with continuous batching.
+
+    A step loop runs while requests are active; each step (step_s) decodes one
+    word for up to max_num_seqs sequences, so concurrent requests share steps
+    the way vLLM batches them. The reply is `reply` (or, by default, the last
+    prompt line echoed back).
     """
-    if not os.getenv("USE_VLLM", "").lower() in {"1", "true", "yes"}:
-        return None
-    
-    if not os.path.isdir(model_path):
-        logger.warning(f"Model path not found, cannot use vLLM: {model_path}")
-        return None
-    
-    try:
-        return vLLMBackend(model_path=model_path)
-    except Exception as e:
-        logger.warning(f"vLLM initialization failed, falling back to llama.cpp: {e}")
-        return None
-
-
-# Integration example for model_router.py:
-# 
-# In ModelRouter.generate():
-#
-#   # Try vLLM first if available
-#   if model_config.backend == ModelBackend.VLLM:
-#       vllm_backend = use_vllm_if_available(agent_type, model_config.path)
-#       if vllm_backend:
-#           response_text = vllm_backend.generate(
-#               messages=messages,
-#               max_tokens=max_tokens,
-#               temperature=temperature,
-#           )
-#           return {
-#               "text": response_text,
-#               "model": model_config.name,
-#               "backend": "vllm",
-#               "gpu_ids": model_config.gpu_ids,
-#               "inference_time_s": elapsed,
-#           }
-#
-#   # Fallback to stub or llama.cpp
-#   response_text = self._stub_generate(agent_type, messages, model_config)
-#   ...
+
+    def __init__(self, step_s: float = 0.005, max_num_seqs: int = VLLM_MAX_NUM_SEQS, reply: Optional[str] = None):
+        self.step_s = step_s
+        self.max_num_seqs = max_num_seqs
+        self.reply = reply
+        self.tokenizer = MockTokenizer()
+        self.steps = 0
+        self.max_batch = 0
+        self.aborted: List[str] = []
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._step_task: Optional[asyncio.Task] = None
+
+    async def get_tokenizer(self):
+        return self.tokenizer
+
+    def _reply_words(self, prompt: str) -> List[str]:
+        if self.reply is not None:
+            return self.reply.split()
+        user = prompt.rsplit("<|im_start|>user\n", 1)[-1].split("<|im_end|>", 1)[0]
+        return f"echo: {user}".split()
+
+    async def generate(self, prompt: str, sampling_params, request_id: str) -> AsyncIterator[MockRequestOutput]:
+        queue: asyncio.Queue = asyncio.Queue()
+        output = MockRequestOutput(
+            request_id=request_id,
+            prompt=prompt,
+            prompt_token_ids=self.tokenizer.encode(prompt),
+            outputs=[MockCompletionOutput()],
+        )
+        self._active[request_id] = {
+            "output": output,
+            "words": self._reply_words(prompt),
+            "max_tokens": sampling_params.max_tokens,
+            "queue": queue,
+        }
+        if self._step_task is None or self._step_task.done():
+            self._step_task = asyncio.create_task(self._step_loop())
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            yield item
+            if item.finished:
+                return
+
+    async def _step_loop(self):
+        while self._active:
+            await asyncio.sleep(self.step_s)
+            batch = list(self._active.items())[: self.max_num_seqs]
+            self.steps += 1
+            self.max_batch = max(self.max_batch, len(batch))
+            for request_id, seq in batch:
+                output = seq["output"]
+                completion = output.outputs[0]
+                n = len(completion.token_ids)
+                word = seq["words"][n]
+                completion.text += word if n == 0 else f" {word}"
+                completion.token_ids.append(n)
+                if n + 1 >= len(seq["words"]):
+                    completion.finish_reason = "stop"
+                elif n + 1 >= seq["max_tokens"]:
+                    completion.finish_reason = "length"
+                output.finished = completion.finish_reason is not None
+                seq["queue"].put_nowait(MockRequestOutput(
+                    request_id=request_id,
+                    prompt=output.prompt,
+                    prompt_token_ids=output.prompt_token_ids,
+                    outputs=[MockCompletionOutput(completion.text, list(completion.token_ids), completion.finish_reason)],
+                    finished=output.finished,
+                ))
+                if output.finished:
+                    del self._active[request_id]
+
+    async def abort(self, request_id: str):
+        seq = self._active.pop(request_id, None)
+        if seq:
+            self.aborted.append(request_id)
+            seq["queue"].put_nowait(None)
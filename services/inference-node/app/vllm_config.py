@@ -17,6 +17,7 @@ class vLLMEngineConfig:
     pipeline_parallel_size: int = 1
     gpu_memory_utilization: float = 0.85
     max_model_len: Optional[int] = None
+    max_num_seqs: int = 64  # Sequences batched per decode step (continuous batching)
     enable_lora: bool = False
     trust_remote_code: bool = True
     dtype: str = "auto"  # auto, float16, float32, bfloat16
@@ -29,6 +30,7 @@ class vLLMEngineConfig:
             "pipeline_parallel_size": self.pipeline_parallel_size,
             "gpu_memory_utilization": self.gpu_memory_utilization,
             "max_model_len": self.max_model_len,
+            "max_num_seqs": self.max_num_seqs,
             "enable_lora": self.enable_lora,
             "trust_remote_code": self.trust_remote_code,
             "dtype": self.dtype,
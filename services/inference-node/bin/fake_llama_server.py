@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Fake llama-server
+Stand-in for llama.cpp's server binary so model lifecycle code (start, warm-up,
+eviction, restart) can be exercised without a GPU or model weights.
+
+Accepts llama-server's command line (only -m and --port are used), reports
+/health as 503 while "loading" for FAKE_LLAMA_LOAD_S seconds, then serves a
+canned /v1/chat/completions reply.
+
+    LLAMA_SERVER_BIN=bin/fake_llama_server.py FAKE_LLAMA_LOAD_S=2 python -m app.main
+"""
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOAD_S = float(os.getenv("FAKE_LLAMA_LOAD_S", "0.5"))
+REPLY_DELAY_S = float(os.getenv("FAKE_LLAMA_REPLY_DELAY_S", "0"))
+
+
+def make_handler(model_path: str, started: float):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            if time.monotonic() - started < LOAD_S:
+                return self._send(503, {"status": "loading model"})
+            self._send(200, {"status": "ok"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path != "/v1/chat/completions":
+                return self._send(404, {"error": "not found"})
+            if REPLY_DELAY_S:
+                time.sleep(REPLY_DELAY_S)
+            prompt = request.get("messages", [{}])[-1].get("content", "")
+            self._send(200, {
+                "model": os.path.basename(model_path),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"echo: {prompt}"}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 2},
+            })
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake llama-server")
+    parser.add_argument("-m", "--model", default="fake.gguf")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--host", default="127.0.0.1")
+    args, _ = parser.parse_known_args()  # Ignore -c, -ngl, --parallel, ...
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.model, time.monotonic()))
+    print(f"fake llama-server: {args.model} on {args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
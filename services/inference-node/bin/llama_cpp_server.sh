@@ -16,6 +16,8 @@ CTX=${LLAMA_CTX:-8192}
 GPU_LAYERS=${LLAMA_GPU_LAYERS:-9999}
 THREADS=${LLAMA_THREADS:-$(nproc)}
 FLASH=${LLAMA_FLASH:-true}
+# Slots (concurrent sequences); each slot gets CTX / PARALLEL tokens of context
+PARALLEL=${LLAMA_PARALLEL:-1}
 BUILD_DIR="${LLAMA_DIR}/build"
 CMD=${1:-run}
 
@@ -64,6 +66,7 @@ run_server() {
     "-t" "$THREADS"
     "--host" "$HOST"
     "--port" "$PORT"
+    "--parallel" "$PARALLEL"
     "--api-key" ""
   )
 
@@ -72,7 +75,7 @@ run_server() {
   fi
 
   echo "[INFO] Starting llama.cpp server on $HOST:$PORT with model $MODEL"
-  echo "[INFO] Context $CTX, GPU layers $GPU_LAYERS, threads $THREADS"
+  echo "[INFO] Context $CTX, slots $PARALLEL, GPU layers $GPU_LAYERS, threads $THREADS"
   exec "$BUILD_DIR/bin/server" "${ARGS[@]}"
 }
 
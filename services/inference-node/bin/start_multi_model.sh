@@ -45,6 +45,7 @@ start_model() {
         -ngl 99 \
         --port $port \
         --host 0.0.0.0 \
+        --parallel ${LLAMA_PARALLEL:-1} \
         --api-key "" \
         > "$logfile" 2>&1 &
     
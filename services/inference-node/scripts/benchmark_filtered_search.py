@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Filtered vector search benchmark (pgvector HNSW).
+
+Seeds a scratch table shaped like medical_documents with synthetic embeddings,
+then measures recall@k and latency of filtered queries for each search strategy:
+
+    post_filter     full HNSW index, default ef_search, no iterative scan
+    ef_tuned        full HNSW index, HNSW_FILTERED_EF_SEARCH
+    iterative_scan  full HNSW index, ef_tuned + hnsw.iterative_scan (pgvector >= 0.8)
+    partial_index   partial HNSW index on the filtered specialty
+
+Ground truth comes from an exact scan (index scans disabled).
+
+Usage:
+    python scripts/benchmark_filtered_search.py --rows 1000000 --dim 1024 --k 10
+    python scripts/benchmark_filtered_search.py --skip-seed --queries 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import DATABASE_URL, HNSW_EF_SEARCH, HNSW_FILTERED_EF_SEARCH, HNSW_MAX_SCAN_TUPLES
+
+TABLE = "bench_medical_documents"
+
+# Skewed specialty distribution: a few high-volume specialties, a long tail
+SPECIALTIES: List[Tuple[str, float]] = [
+    ("general_medicine", 0.30),
+    ("cardiology", 0.15),
+    ("oncology", 0.10),
+    ("pediatrics", 0.05),
+    ("nephrology", 0.01),
+    ("rheumatology", 0.005),
+]
+
+
+async def seed(engine, rows: int, dim: int):
+    """Create and populate the scratch table and its indexes."""
+    print(f"Seeding {rows:,} rows (dim={dim}) into {TABLE}...")
+
+    # Cumulative thresholds for the specialty CASE expression; remainder is "other"
+    cases, cumulative = [], 0.0
+    for name, share in SPECIALTIES:
+        cumulative += share
+        cases.append(f"WHEN r < {cumulative} THEN '{name}'")
+    specialty_case = "CASE " + " ".join(cases) + " ELSE 'other' END"
+
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        await conn.execute(text(
+            f"""
+            CREATE TABLE {TABLE} (
+                id bigserial PRIMARY KEY,
+                specialty varchar(100),
+                document_type varchar(50),
+                embedding vector({dim})
+            )
+            """
+        ))
+
+    batch = 20000
+    start = time.perf_counter()
+    for offset in range(0, rows, batch):
+        n = min(batch, rows - offset)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                f"""
+                INSERT INTO {TABLE} (specialty, document_type, embedding)
+                SELECT {specialty_case},
+                       CASE WHEN random() < 0.6 THEN 'clinical_guideline' ELSE 'reference' END,
+                       (SELECT array_agg(random() - 0.5) FROM generate_series(1, {dim}) WHERE g > 0)::vector
+                FROM (SELECT g, random() AS r FROM generate_series(1, {n}) AS g) s
+                """
+            ))
+        print(f"  {offset + n:,}/{rows:,} rows ({time.perf_counter() - start:.0f}s)", end="\r")
+    print()
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"CREATE INDEX ON {TABLE} (specialty)"))
+
+        start = time.perf_counter()
+        await conn.execute(text(
+            f"CREATE INDEX {TABLE}_hnsw ON {TABLE} "
+            "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        ))
+        print(f"Full HNSW index built in {time.perf_counter() - start:.0f}s")
+
+        for name, _ in SPECIALTIES[:3]:
+            start = time.perf_counter()
+            await conn.execute(text(
+                f"CREATE INDEX {TABLE}_hnsw_{name} ON {TABLE} "
+                "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64) "
+                f"WHERE specialty = '{name}'"
+            ))
+            print(f"Partial HNSW index ({name}) built in {time.perf_counter() - start:.0f}s")
+
+        await conn.execute(text(f"ANALYZE {TABLE}"))
+
+
+async def _run_query(
+    conn, settings: Dict[str, str], vector: str, predicate: str, k: int
+) -> Tuple[List[int], float]:
+    """Run one filtered query inside its own transaction with the given GUCs."""
+    async with conn.begin():
+        for name, value in settings.items():
+            await conn.execute(text("SELECT set_config(:n, :v, true)"), {"n": name, "v": value})
+        start = time.perf_counter()
+        result = await conn.execute(text(
+            f"SELECT id FROM {TABLE} WHERE {predicate} "
+            f"ORDER BY embedding <=> '{vector}' LIMIT {k}"
+        ))
+        ids = [row[0] for row in result]
+        return ids, (time.perf_counter() - start) * 1000
+
+
+async def benchmark(engine, k: int, queries: int, specialties: List[str]) -> Dict[str, Dict]:
+    """Measure recall@k and latency per strategy and specialty."""
+    async with engine.connect() as conn:
+        version = (await conn.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        )).scalar()
+        result = await conn.execute(text(
+            f"SELECT embedding::text FROM {TABLE} TABLESAMPLE SYSTEM (1) LIMIT {queries}"
+        ))
+        vectors = [row[0] for row in result]
+
+    strategies: Dict[str, Dict[str, str]] = {
+        "post_filter": {"hnsw.ef_search": str(HNSW_EF_SEARCH)},
+        "ef_tuned": {"hnsw.ef_search": str(HNSW_FILTERED_EF_SEARCH)},
+    }
+    if tuple(int(p) for p in version.split(".")[:2]) >= (0, 8):
+        strategies["iterative_scan"] = {
+            "hnsw.ef_search": str(HNSW_FILTERED_EF_SEARCH),
+            "hnsw.iterative_scan": "relaxed_order",
+            "hnsw.max_scan_tuples": str(HNSW_MAX_SCAN_TUPLES),
+        }
+    strategies["partial_index"] = {"hnsw.ef_search": str(HNSW_EF_SEARCH)}
+    partial_indexed = {name for name, _ in SPECIALTIES[:3]}
+
+    report: Dict[str, Dict] = {}
+    async with engine.connect() as conn:
+        for specialty in specialties:
+            # `specialty || ''` filters identically but cannot match a partial
+            # index predicate, so the full-index strategies measure the full index.
+            full_predicate = f"specialty || '' = '{specialty}'"
+            partial_predicate = f"specialty = '{specialty}'"
+
+            truth = []
+            for vector in vectors:
+                ids, _ = await _run_query(conn, {"enable_indexscan": "off"}, vector, partial_predicate, k)
+                truth.append(set(ids))
+
+            for name, settings in strategies.items():
+                if name == "partial_index" and specialty not in partial_indexed:
+                    continue
+                predicate = partial_predicate if name == "partial_index" else full_predicate
+
+                recalls, latencies, returned = [], [], []
+                for vector, expected in zip(vectors, truth):
+                    ids, latency = await _run_query(conn, settings, vector, predicate, k)
+                    returned.append(len(ids))
+                    latencies.append(latency)
+                    recalls.append(len(expected & set(ids)) / max(1, len(expected)))
+
+                latencies.sort()
+                report.setdefault(specialty, {})[name] = {
+                    "recall_at_k": round(statistics.mean(recalls), 4),
+                    "avg_rows_returned": round(statistics.mean(returned), 2),
+                    "p50_ms": round(latencies[len(latencies) // 2], 2),
+                    "p95_ms": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+                }
+    return report
+
+
+def print_report(report: Dict[str, Dict], k: int):
+    """Print a recall/latency table per specialty."""
+    print(f"\n{'specialty':<18}{'strategy':<16}{'recall@' + str(k):>10}{'rows':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    print("-" * 72)
+    for specialty, strategies in report.items():
+        for name, m in strategies.items():
+            print(
+                f"{specialty:<18}{name:<16}{m['recall_at_k']:>10.3f}{m['avg_rows_returned']:>8.1f}"
+                f"{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}"
+            )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark filtered pgvector search strategies")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=int(os.getenv("VECTOR_DIM", "1024")))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse an existing scratch table")
+    parser.add_argument("--output", help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        if not args.skip_seed:
+            await seed(engine, args.rows, args.dim)
+        specialties = ["cardiology", "pediatrics", "nephrology", "rheumatology"]
+        report = await benchmark(engine, args.k, args.queries, specialties)
+        print_report(report, args.k)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"rows": args.rows, "dim": args.dim, "k": args.k, "results": report}, f, indent=2)
+            print(f"\nReport written to {args.output}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
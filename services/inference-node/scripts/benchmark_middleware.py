@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Middleware overhead benchmark.
+
+Compares per-request latency of a minimal FastAPI app with:
+
+    none       no middleware (baseline)
+    legacy     the former five BaseHTTPMiddleware layers (reproduced below)
+    pipeline   RequestPipelineMiddleware (single pure-ASGI layer)
+
+for a JSON route, /healthz and a streaming route (time to first chunk).
+Requests are driven straight through the ASGI interface, so the numbers are
+middleware cost only (no sockets, no HTTP parsing).
+
+Usage:
+    python scripts/benchmark_middleware.py --requests 5000
+    python scripts/benchmark_middleware.py --output middleware_benchmark.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from loguru import logger
+
+from app.middleware import RequestPipelineMiddleware
+
+
+# ---------------------------------------------------------------------------
+# Legacy stack (BaseHTTPMiddleware), as it was before RequestPipelineMiddleware
+# ---------------------------------------------------------------------------
+
+class LegacyRateLimit(BaseHTTPMiddleware):
+    def __init__(self, app, max_requests: int = 100, window_seconds: int = 60):
+        super().__init__(app)
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.requests: Dict[str, list] = defaultdict(list)
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path == "/healthz":
+            return await call_next(request)
+        client_ip = request.client.host if request.client else "unknown"
+        key = f"{client_ip}:{request.headers.get('X-Agent-Type', 'default')}"
+        now = time.time()
+        self.requests[key] = [ts for ts in self.requests[key] if ts > now - self.window_seconds]
+        if len(self.requests[key]) >= self.max_requests:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit")
+        self.requests[key].append(now)
+        return await call_next(request)
+
+
+class LegacyPolicy(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path == "/healthz":
+            return await call_next(request)
+        if request.url.path == "/v1/chat/completions" and request.method == "POST":
+            agent_type = request.headers.get("X-Agent-Type", "")
+            request.state.max_tokens = RequestPipelineMiddleware.AGENT_TOKEN_LIMITS.get(agent_type, 1024)
+            request.state.agent_type = agent_type
+        return await call_next(request)
+
+
+class LegacyAudit(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path == "/healthz":
+            return await call_next(request)
+        request_id = request.headers.get("X-Request-ID")
+        if not request_id:
+            request_id = f"req-{int(time.time())}-{hashlib.sha256(str(time.time()).encode()).hexdigest()[:8]}"
+        request.state.request_id = request_id
+        request.state.timestamp = datetime.utcnow().isoformat()
+        request.state.client_ip = request.client.host if request.client else "unknown"
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        response.headers["X-Timestamp"] = request.state.timestamp
+        return response
+
+
+class LegacyErrorHandling(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        try:
+            return await call_next(request)
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(status_code=500, detail="Internal server error. Request logged for review.")
+
+
+class LegacySecurityHeaders(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Referrer-Policy"] = "no-referrer"
+        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        return response
+
+
+class UnlimitedPipeline(RequestPipelineMiddleware):
+    """Pipeline with agent quotas lifted so the limiter never rejects."""
+    AGENT_RATE_LIMITS = {}
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        return {"max_tokens": getattr(request.state, "max_tokens", 512)}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(20):
+                yield f"data: {i}\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    limit = 10**9  # never trip the limiter during the benchmark
+    if stack == "legacy":
+        app.add_middleware(LegacySecurityHeaders)
+        app.add_middleware(LegacyErrorHandling)
+        app.add_middleware(LegacyAudit)
+        app.add_middleware(LegacyPolicy)
+        app.add_middleware(LegacyRateLimit, max_requests=limit)
+    elif stack == "pipeline":
+        app.add_middleware(UnlimitedPipeline, max_requests=limit)
+    return app
+
+
+async def call(app, method: str, path: str) -> Dict[str, float]:
+    """Drive one request through the ASGI app; returns total and first-body-chunk times."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"x-agent-type", b"Chat"), (b"content-length", b"0")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    timings: Dict[str, float] = {}
+    body_sent = False
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # client stays connected
+
+    async def send(message):
+        if message["type"] == "http.response.body" and "first_chunk" not in timings and message.get("body"):
+            timings["first_chunk"] = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+async def run(requests: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    targets = [
+        ("chat", "POST", "/v1/chat/completions", "total"),
+        ("healthz", "GET", "/healthz", "total"),
+        ("stream_first_chunk", "GET", "/stream", "first_chunk"),
+    ]
+    report: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for stack in ("none", "legacy", "pipeline"):
+        app = build_app(stack)
+        for name, method, path, metric in targets:
+            for _ in range(min(200, requests)):  # warm-up
+                await call(app, method, path)
+            samples: List[float] = []
+            for _ in range(requests):
+                samples.append((await call(app, method, path))[metric] * 1e6)
+            samples.sort()
+            report.setdefault(name, {})[stack] = {
+                "mean_us": round(statistics.mean(samples), 1),
+                "p50_us": round(samples[len(samples) // 2], 1),
+                "p99_us": round(samples[max(0, int(len(samples) * 0.99) - 1)], 1),
+            }
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, Dict[str, float]]]):
+    print(f"\n{'route':<20}{'stack':<10}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'overhead us':>13}")
+    print("-" * 73)
+    for route, stacks in report.items():
+        base = stacks["none"]["mean_us"]
+        for stack, m in stacks.items():
+            print(
+                f"{route:<20}{stack:<10}{m['mean_us']:>10.1f}{m['p50_us']:>10.1f}"
+                f"{m['p99_us']:>10.1f}{m['mean_us'] - base:>13.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark middleware per-request overhead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--output", help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    # Per-request audit logging would dominate the measurement
+    logger.remove()
+    report = asyncio.run(run(args.requests))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"requests": args.requests, "results": report}, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Embedding storage benchmark (pgvector >= 0.7).
+
+Builds one HNSW index per storage/index mode on a scratch table and reports
+index build time, index size, recall@k and query latency:
+
+    vector       float32 embedding, cosine
+    halfvec      float16 expression index, cosine
+    binary       binary_quantize() bit index, Hamming, re-ranked on float32
+    matryoshka   first --matryoshka-dim dimensions, cosine, re-ranked on float32
+
+Ground truth comes from an exact scan (index scans disabled).
+
+Random embeddings carry no Matryoshka structure, so matryoshka recall on the
+default synthetic data is a lower bound. Use --source medical_documents to
+benchmark on real embeddings copied from the knowledge base.
+
+Usage:
+    python scripts/benchmark_vector_storage.py --rows 500000 --dim 1024 --k 10
+    python scripts/benchmark_vector_storage.py --source medical_documents --rerank-factor 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import DATABASE_URL, HNSW_EF_SEARCH, MATRYOSHKA_DIM, VECTOR_RERANK_FACTOR
+
+TABLE = "bench_vector_storage"
+
+
+async def seed(engine, rows: int, dim: int, source: Optional[str]):
+    """Create and populate the scratch table."""
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        if source:
+            print(f"Copying up to {rows:,} embeddings from {source}...")
+            await conn.execute(text(
+                f"CREATE TABLE {TABLE} AS "
+                f"SELECT id, embedding::vector({dim}) AS embedding FROM {source} LIMIT {rows}"
+            ))
+            await conn.execute(text(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)"))
+            return
+        await conn.execute(text(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, embedding vector({dim}))"))
+
+    print(f"Seeding {rows:,} rows (dim={dim}) into {TABLE}...")
+    batch = 20000
+    start = time.perf_counter()
+    for offset in range(0, rows, batch):
+        n = min(batch, rows - offset)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                f"""
+                INSERT INTO {TABLE} (embedding)
+                SELECT (SELECT array_agg(random() - 0.5) FROM generate_series(1, {dim}) WHERE g > 0)::vector
+                FROM generate_series(1, {n}) AS g
+                """
+            ))
+        print(f"  {offset + n:,}/{rows:,} rows ({time.perf_counter() - start:.0f}s)", end="\r")
+    print()
+
+
+def strategies(dim: int, matryoshka_dim: int) -> Dict[str, Dict[str, str]]:
+    """Index definition and ORDER BY expression (with :q placeholder) per mode."""
+    q = f"CAST(:q AS vector({dim}))"
+    return {
+        "vector": {
+            "index": "embedding vector_cosine_ops",
+            "order": f"embedding <=> {q}",
+            "rerank": False,
+        },
+        "halfvec": {
+            "index": f"(embedding::halfvec({dim})) halfvec_cosine_ops",
+            "order": f"(embedding::halfvec({dim})) <=> ({q})::halfvec({dim})",
+            "rerank": False,
+        },
+        "binary": {
+            "index": f"(binary_quantize(embedding)::bit({dim})) bit_hamming_ops",
+            "order": f"(binary_quantize(embedding)::bit({dim})) <~> binary_quantize({q})",
+            "rerank": True,
+        },
+        "matryoshka": {
+            "index": f"(subvector(embedding, 1, {matryoshka_dim})::vector({matryoshka_dim})) vector_cosine_ops",
+            "order": (
+                f"(subvector(embedding, 1, {matryoshka_dim})::vector({matryoshka_dim})) "
+                f"<=> subvector({q}, 1, {matryoshka_dim})"
+            ),
+            "rerank": True,
+        },
+    }
+
+
+async def build_index(engine, name: str, definition: str) -> Tuple[float, int]:
+    """Build one HNSW index; returns (seconds, bytes)."""
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {TABLE}_{name}"))
+        await conn.execute(text("SELECT set_config('maintenance_work_mem', '2GB', true)"))
+        start = time.perf_counter()
+        await conn.execute(text(
+            f"CREATE INDEX {TABLE}_{name} ON {TABLE} USING hnsw ({definition}) WITH (m = 16, ef_construction = 64)"
+        ))
+        elapsed = time.perf_counter() - start
+        size = (await conn.execute(text(f"SELECT pg_relation_size('{TABLE}_{name}')"))).scalar()
+    return elapsed, size
+
+
+async def _run_query(conn, settings: Dict[str, str], sql: str, vector: str) -> Tuple[List[int], float]:
+    """Run one query inside its own transaction with the given GUCs."""
+    async with conn.begin():
+        for name, value in settings.items():
+            await conn.execute(text("SELECT set_config(:n, :v, true)"), {"n": name, "v": value})
+        start = time.perf_counter()
+        result = await conn.execute(text(sql), {"q": vector})
+        ids = [row[0] for row in result]
+        return ids, (time.perf_counter() - start) * 1000
+
+
+async def benchmark(engine, dim: int, k: int, queries: int, matryoshka_dim: int, rerank_factor: int) -> Dict:
+    """Build each index and measure build cost, size, recall@k and latency."""
+    async with engine.connect() as conn:
+        result = await conn.execute(text(
+            f"SELECT embedding::text FROM {TABLE} TABLESAMPLE SYSTEM (1) LIMIT {queries}"
+        ))
+        vectors = [row[0] for row in result]
+
+    exact_sql = f"SELECT id FROM {TABLE} ORDER BY embedding <=> CAST(:q AS vector({dim})) LIMIT {k}"
+    async with engine.connect() as conn:
+        truth = []
+        for vector in vectors:
+            ids, _ = await _run_query(conn, {"enable_indexscan": "off"}, exact_sql, vector)
+            truth.append(set(ids))
+
+    report: Dict[str, Dict] = {}
+    settings = {"hnsw.ef_search": str(max(HNSW_EF_SEARCH, k * rerank_factor))}
+    for name, strategy in strategies(dim, matryoshka_dim).items():
+        build_s, size = await build_index(engine, name, strategy["index"])
+        print(f"{name:<12} index built in {build_s:.1f}s ({size / 2**20:.1f} MiB)")
+
+        if strategy["rerank"]:
+            sql = (
+                f"SELECT id FROM (SELECT id, embedding FROM {TABLE} "
+                f"ORDER BY {strategy['order']} LIMIT {k * rerank_factor}) c "
+                f"ORDER BY embedding <=> CAST(:q AS vector({dim})) LIMIT {k}"
+            )
+        else:
+            sql = f"SELECT id FROM {TABLE} ORDER BY {strategy['order']} LIMIT {k}"
+
+        recalls, latencies = [], []
+        async with engine.connect() as conn:
+            for vector, expected in zip(vectors, truth):
+                ids, latency = await _run_query(conn, settings, sql, vector)
+                latencies.append(latency)
+                recalls.append(len(expected & set(ids)) / max(1, len(expected)))
+
+        latencies.sort()
+        report[name] = {
+            "build_seconds": round(build_s, 2),
+            "index_mib": round(size / 2**20, 2),
+            "recall_at_k": round(statistics.mean(recalls), 4),
+            "p50_ms": round(latencies[len(latencies) // 2], 2),
+            "p95_ms": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+        }
+
+        # Keep only one graph resident at a time
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP INDEX IF EXISTS {TABLE}_{name}"))
+    return report
+
+
+def print_report(report: Dict[str, Dict], k: int):
+    """Print a build/size/recall/latency table per mode."""
+    print(f"\n{'mode':<12}{'build s':>10}{'MiB':>10}{'recall@' + str(k):>11}{'p50 ms':>10}{'p95 ms':>10}")
+    print("-" * 63)
+    for name, m in report.items():
+        print(
+            f"{name:<12}{m['build_seconds']:>10.1f}{m['index_mib']:>10.1f}{m['recall_at_k']:>11.3f}"
+            f"{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark pgvector embedding storage modes")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--dim", type=int, default=int(os.getenv("VECTOR_DIM", "1024")))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--matryoshka-dim", type=int, default=MATRYOSHKA_DIM)
+    parser.add_argument("--rerank-factor", type=int, default=VECTOR_RERANK_FACTOR)
+    parser.add_argument("--source", help="Copy embeddings from this table instead of random vectors")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse an existing scratch table")
+    parser.add_argument("--output", help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        if not args.skip_seed:
+            await seed(engine, args.rows, args.dim, args.source)
+        report = await benchmark(
+            engine, args.dim, args.k, args.queries, args.matryoshka_dim, args.rerank_factor
+        )
+        print_report(report, args.k)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({
+                    "rows": args.rows, "dim": args.dim, "k": args.k,
+                    "matryoshka_dim": args.matryoshka_dim, "rerank_factor": args.rerank_factor,
+                    "results": report,
+                }, f, indent=2)
+            print(f"\nReport written to {args.output}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -85,24 +85,25 @@ async def ingest_text(args):
 
 async def search_knowledge(args):
     """Search knowledge base."""
-    from app.database import search_medical_documents
+    from app.database import search_document_hits
     
-    results = await search_medical_documents(
-        query=args.query,
+    engine = get_attribution_engine()
+    hits = await search_document_hits(
+        query_embedding=engine.embedding_engine.encode_single(args.query),
         specialty=args.specialty,
         document_type=args.type,
         limit=args.limit
     )
     
-    print(f"\n🔍 Found {len(results)} results for: {args.query}\n")
+    print(f"\n🔍 Found {len(hits)} results for: {args.query}\n")
     
-    for i, result in enumerate(results, 1):
-        print(f"{i}. {result['title']} ({result['specialty']})")
-        print(f"   Similarity: {result['similarity']:.2%}")
-        print(f"   Type: {result['document_type']}")
-        if result.get('source_url'):
-            print(f"   Source: {result['source_url']}")
-        print(f"   Content: {result['content'][:200]}...")
+    for i, hit in enumerate(hits, 1):
+        print(f"{i}. {hit.title} ({hit.specialty})")
+        print(f"   Similarity: {hit.similarity:.2%}")
+        print(f"   Type: {hit.document_type}")
+        if hit.source_url:
+            print(f"   Source: {hit.source_url}")
+        print(f"   Content: {hit.content}...")
         print()
 
 
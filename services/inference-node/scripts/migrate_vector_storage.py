@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Migrate embedding storage to the configured VECTOR_STORAGE / VECTOR_INDEX_MODE.
+
+Steps:
+    1. Drop the HNSW indexes on medical_documents and patient_context
+    2. Convert the embedding columns (vector <-> halfvec), or with --reembed
+       re-encode every row into a shadow column and swap it in
+    3. Rebuild the HNSW indexes for the new mode, reporting build time and size
+
+--reembed is needed when the embedding model or VECTOR_DIM changes (e.g. moving
+to a Matryoshka-trained model). It is resumable: rows already written to the
+shadow column are skipped on the next run. Searches keep working on the old
+column until the swap, but run without an index while step 3 builds.
+
+Usage:
+    VECTOR_STORAGE=halfvec python scripts/migrate_vector_storage.py
+    VECTOR_INDEX_MODE=binary python scripts/migrate_vector_storage.py --indexes-only
+    EMBEDDING_MODEL=... VECTOR_DIM=768 python scripts/migrate_vector_storage.py --reembed
+    python scripts/migrate_vector_storage.py --dry-run
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from typing import List, Optional, Tuple
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from loguru import logger
+
+from app.database import (
+    engine,
+    hnsw_index_statements,
+    MATRYOSHKA_DIM,
+    VECTOR_DIM,
+    VECTOR_INDEX_MODE,
+    VECTOR_STORAGE,
+)
+
+TABLES = ["medical_documents", "patient_context"]
+SHADOW_COLUMN = "embedding_next"
+
+
+async def pgvector_version(conn) -> Tuple[int, ...]:
+    version = (await conn.execute(
+        text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    )).scalar() or "0"
+    return tuple(int(p) for p in re.findall(r"\d+", version))
+
+
+async def column_type(conn, table: str, column: str) -> Optional[str]:
+    """Formatted column type, e.g. 'vector(1024)' or 'halfvec(1024)' (None if missing)."""
+    return (await conn.execute(text(
+        """
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = CAST(:table AS regclass) AND attname = :column AND NOT attisdropped
+        """
+    ), {"table": table, "column": column})).scalar()
+
+
+async def hnsw_indexes(conn, table: str) -> List[str]:
+    result = await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexdef ILIKE '%USING hnsw%'"
+    ), {"table": table})
+    return [row[0] for row in result]
+
+
+async def drop_indexes(conn, dry_run: bool):
+    for table in TABLES:
+        for name in await hnsw_indexes(conn, table):
+            logger.info(f"DROP INDEX {name}")
+            if not dry_run:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+async def convert_columns(conn, dry_run: bool):
+    """Cast existing embeddings to the configured storage type in place."""
+    target = f"{VECTOR_STORAGE}({VECTOR_DIM})"
+    for table in TABLES:
+        current = await column_type(conn, table, "embedding")
+        if current == target:
+            logger.info(f"{table}.embedding already {target}")
+            continue
+        if current and not current.endswith(f"({VECTOR_DIM})"):
+            raise SystemExit(
+                f"{table}.embedding is {current}; changing dimension to {VECTOR_DIM} requires --reembed"
+            )
+        logger.info(f"ALTER {table}.embedding {current} -> {target}")
+        if not dry_run:
+            start = time.perf_counter()
+            await conn.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN embedding TYPE {target} USING embedding::{target}"
+            ))
+            logger.info(f"  rewritten in {time.perf_counter() - start:.1f}s")
+
+
+async def reembed(batch_size: int, dry_run: bool):
+    """Re-encode content into a shadow column in keyset-paginated batches."""
+    from app.rag_engine import EmbeddingEngine
+
+    embedder = EmbeddingEngine()
+    if embedder.dimension != VECTOR_DIM:
+        raise SystemExit(f"Embedding model dimension {embedder.dimension} != VECTOR_DIM {VECTOR_DIM}")
+
+    target = f"{VECTOR_STORAGE}({VECTOR_DIM})"
+    for table in TABLES:
+        async with engine.begin() as conn:
+            total = (await conn.execute(text(f"SELECT count(*) FROM {table}"))).scalar()
+            logger.info(f"{table}: re-embedding {total:,} rows into {SHADOW_COLUMN} {target}")
+            if dry_run:
+                continue
+            current = await column_type(conn, table, SHADOW_COLUMN)
+            if current and current != target:
+                await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {SHADOW_COLUMN}"))
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {SHADOW_COLUMN} {target}"))
+        if dry_run:
+            continue
+
+        last_id, done, start = 0, 0, time.perf_counter()
+        while True:
+            async with engine.begin() as conn:
+                rows = (await conn.execute(text(
+                    f"""
+                    SELECT id, content FROM {table}
+                    WHERE id > :last_id AND {SHADOW_COLUMN} IS NULL
+                    ORDER BY id LIMIT :batch
+                    """
+                ), {"last_id": last_id, "batch": batch_size})).all()
+                if not rows:
+                    break
+
+                embeddings = embedder.encode([row.content for row in rows], batch_size=batch_size)
+                await conn.execute(
+                    text(f"UPDATE {table} SET {SHADOW_COLUMN} = CAST(:embedding AS {target}) WHERE id = :id"),
+                    [
+                        {"id": row.id, "embedding": "[" + ",".join(map(str, emb)) + "]"}
+                        for row, emb in zip(rows, embeddings)
+                    ],
+                )
+            last_id = rows[-1].id
+            done += len(rows)
+            rate = done / max(time.perf_counter() - start, 1e-6)
+            logger.info(f"  {table}: {done:,}/{total:,} rows ({rate:.0f} rows/s)")
+
+        # Swap the shadow column in one transaction
+        async with engine.begin() as conn:
+            missing = (await conn.execute(
+                text(f"SELECT count(*) FROM {table} WHERE {SHADOW_COLUMN} IS NULL")
+            )).scalar()
+            if missing:
+                raise SystemExit(f"{table}: {missing} rows still lack embeddings (rows added mid-run?); re-run")
+            for name in await hnsw_indexes(conn, table):
+                await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN embedding"))
+            await conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {SHADOW_COLUMN} TO embedding"))
+            await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN embedding SET NOT NULL"))
+            logger.info(f"{table}: swapped in re-embedded column")
+
+
+async def build_indexes(dry_run: bool):
+    """Build the HNSW indexes for the configured mode, reporting time and size."""
+    maintenance_work_mem = os.getenv("HNSW_MAINTENANCE_WORK_MEM", "2GB")
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT set_config('maintenance_work_mem', :v, true)"), {"v": maintenance_work_mem})
+        for statement in hnsw_index_statements():
+            name = statement.split("IF NOT EXISTS ")[1].split()[0]
+            logger.info(f"Building {name}")
+            if dry_run:
+                logger.info(f"  {statement}")
+                continue
+            start = time.perf_counter()
+            await conn.execute(text(statement))
+            size = (await conn.execute(
+                text("SELECT pg_size_pretty(pg_relation_size(CAST(:name AS regclass)))"), {"name": name}
+            )).scalar()
+            logger.info(f"  built in {time.perf_counter() - start:.1f}s, size {size}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrate embedding storage / HNSW index mode")
+    parser.add_argument("--reembed", action="store_true", help="Re-encode all content with EMBEDDING_MODEL")
+    parser.add_argument("--indexes-only", action="store_true", help="Only rebuild HNSW indexes")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan without changing anything")
+    args = parser.parse_args()
+
+    mode = f"storage={VECTOR_STORAGE}({VECTOR_DIM}), index={VECTOR_INDEX_MODE}"
+    if VECTOR_INDEX_MODE == "matryoshka":
+        mode += f"({MATRYOSHKA_DIM})"
+    logger.info(f"Target: {mode}")
+
+    async with engine.begin() as conn:
+        version = await pgvector_version(conn)
+        if (VECTOR_STORAGE != "vector" or VECTOR_INDEX_MODE != "full") and version < (0, 7):
+            raise SystemExit(f"pgvector {'.'.join(map(str, version))} found; halfvec/binary/matryoshka need >= 0.7")
+
+    try:
+        if not args.indexes_only:
+            if args.reembed:
+                await reembed(args.batch_size, args.dry_run)
+            async with engine.begin() as conn:
+                await drop_indexes(conn, args.dry_run)
+                if not args.reembed:
+                    await convert_columns(conn, args.dry_run)
+        else:
+            async with engine.begin() as conn:
+                await drop_indexes(conn, args.dry_run)
+
+        await build_indexes(args.dry_run)
+        logger.info("✅ Vector storage migration complete")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
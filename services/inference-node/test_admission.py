@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test token-budget admission control (no model backends required).
+"""
+import asyncio
+
+from app.admission import AdmissionController, AdmissionRejected
+from app.task_queue import TaskPriority
+
+
+def test_requests_over_budget_wait_for_release():
+    async def scenario():
+        controller = AdmissionController(default_budget=1000, budgets={})
+        first = await controller.acquire("port:8080", 800)
+
+        waiter = asyncio.create_task(controller.acquire("port:8080", 400))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert controller.get_stats()["backends"]["port:8080"]["queue_depth"] == 1
+
+        controller.release(first)
+        second = await asyncio.wait_for(waiter, 1)
+        assert second.queue_wait_ms > 0
+        controller.release(second)
+        return controller.get_stats()["backends"]["port:8080"]
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight_tokens"] == 0
+    assert stats["admitted"] == 2 and stats["queued"] == 1
+
+
+def test_priority_order_and_critical_headroom():
+    async def scenario():
+        controller = AdmissionController(default_budget=1000, budgets={})
+        running = await controller.acquire("port:8080", 900)
+
+        # CRITICAL may use 25% headroom over the budget
+        critical = await asyncio.wait_for(controller.acquire("port:8080", 300, TaskPriority.CRITICAL), 1)
+
+        order = []
+
+        async def queued(name, priority):
+            ticket = await controller.acquire("port:8080", 600, priority)
+            order.append(name)
+            controller.release(ticket)
+
+        tasks = [
+            asyncio.create_task(queued("low", TaskPriority.LOW)),
+            asyncio.create_task(queued("high", TaskPriority.HIGH)),
+        ]
+        await asyncio.sleep(0.01)
+        controller.release(critical)
+        controller.release(running)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "low"]
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(default_budget=100, budgets={}, max_queue_depth=1)
+        await controller.acquire("port:8083", 100)
+        low = asyncio.create_task(controller.acquire("port:8083", 100, TaskPriority.LOW))
+        await asyncio.sleep(0.01)
+
+        # Same priority as the waiter: shed the newcomer with 429
+        try:
+            await controller.acquire("port:8083", 100, TaskPriority.LOW)
+            assert False, "expected shedding"
+        except AdmissionRejected as e:
+            assert e.status_code == 429 and int(e.retry_after_header) >= 1
+
+        # Higher priority evicts the queued LOW request instead
+        high = asyncio.create_task(controller.acquire("port:8083", 100, TaskPriority.CRITICAL))
+        await asyncio.sleep(0.01)
+        try:
+            await low
+            assert False, "low-priority waiter should have been shed"
+        except AdmissionRejected as e:
+            assert e.status_code == 429
+        high.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_sheds_with_503():
+    async def scenario():
+        controller = AdmissionController(default_budget=100, budgets={}, max_queue_wait_s=0.05)
+        await controller.acquire("port:8082", 100)
+        try:
+            await controller.acquire("port:8082", 50)
+            assert False, "expected timeout"
+        except AdmissionRejected as e:
+            assert e.status_code == 503
+        stats = controller.get_stats()["backends"]["port:8082"]
+        assert stats["shed_timeout"] == 1 and stats["queue_depth"] == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test the authenticated-principal cache in get_current_user (no PostgreSQL required).
+"""
+import asyncio
+from datetime import timedelta
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+import app.auth as auth
+from app.database import User as DBUser
+
+
+class FakeResult:
+    def __init__(self, user):
+        self.user = user
+
+    def scalar_one_or_none(self):
+        return self.user
+
+
+class FakeSession:
+    """Counts user lookups."""
+
+    def __init__(self, user):
+        self.user = user
+        self.queries = 0
+
+    async def execute(self, statement):
+        self.queries += 1
+        return FakeResult(self.user)
+
+
+def _setup(monkeypatch, ttl=30.0):
+    cache = auth.PrincipalCache(ttl_seconds=ttl, max_entries=100)
+    monkeypatch.setattr(auth, "principal_cache", cache)
+    db_user = DBUser(username="dr_rao", location_id="loc-1", is_active=True, is_admin=False)
+    token = auth.create_access_token({"sub": "dr_rao", "location_id": "loc-1"})
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return cache, FakeSession(db_user), creds, db_user
+
+
+def test_repeat_requests_skip_user_lookup(monkeypatch):
+    cache, db, creds, _ = _setup(monkeypatch)
+
+    for _ in range(3):
+        user = asyncio.run(auth.get_current_user(creds, db))
+
+    assert user.username == "dr_rao"
+    assert db.queries == 1
+    stats = cache.get_stats()
+    assert stats["cache_hits"] == 2 and stats["cache_misses"] == 1
+
+
+def test_deactivation_invalidates_cached_tokens(monkeypatch):
+    cache, db, creds, db_user = _setup(monkeypatch)
+    asyncio.run(auth.get_current_user(creds, db))
+
+    db_user.is_active = False  # ORM attribute change fires the invalidation listener
+
+    try:
+        asyncio.run(auth.get_current_user(creds, db))
+        assert False, "inactive user must be rejected"
+    except auth.HTTPException as e:
+        assert e.status_code == 400
+    assert db.queries == 2
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_password_change_invalidation_and_ttl(monkeypatch):
+    cache, db, creds, _ = _setup(monkeypatch)
+    asyncio.run(auth.get_current_user(creds, db))
+
+    auth.invalidate_cached_user("dr_rao")
+    asyncio.run(auth.get_current_user(creds, db))
+    assert db.queries == 2
+
+    # Disabled cache always goes to the database
+    cache.ttl_seconds = 0
+    asyncio.run(auth.get_current_user(creds, db))
+    assert db.queries == 3
+
+
+def test_entry_never_outlives_token(monkeypatch):
+    cache, _, _, _ = _setup(monkeypatch)
+    expired = auth.datetime.now() - timedelta(seconds=1)
+
+    cache.put("token", auth.User(username="dr_rao", location_id="loc-1"), expired)
+
+    assert cache.get("token") is None
+    assert cache.get_stats()["cache_size"] == 0
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test per-backend circuit breakers (no model backends required).
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, CircuitState
+from app.replica_pool import ReplicaRegistry
+
+
+def test_opens_after_threshold_and_half_opens_after_cooldown():
+    breaker = CircuitBreaker("port:8080", failure_threshold=3, cooldown_s=0.05)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # Only one trial request
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("port:8080", failure_threshold=1, cooldown_s=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.get_stats()["times_opened"] == 2
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker("port:8080", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+
+
+def _router(monkeypatch, breakers):
+    from app.model_router import ModelRouter
+
+    router = ModelRouter()
+    monkeypatch.setattr(router, "breakers", breakers)
+    monkeypatch.setattr(router, "replicas", ReplicaRegistry({k: [str(p)] for k, p in ModelRouter.MODEL_PORTS.items()}))
+    return router
+
+
+def test_open_breaker_fails_fast_without_retries(monkeypatch):
+    breakers = CircuitBreakerRegistry()
+    router = _router(monkeypatch, breakers)
+    breaker = breakers.get(8080)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    async def no_http(*args, **kwargs):
+        raise AssertionError("open backend must not be called")
+
+    monkeypatch.setattr(httpx.AsyncClient, "send", no_http)
+    start = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(router._llama_cpp_generate(
+            messages=[{"role": "user", "content": "hi"}],
+            model_config=router.registry.MODELS["bi-medix2"],
+            max_tokens=16,
+            temperature=0.0,
+        ))
+    assert time.monotonic() - start < 0.1
+    assert router.circuit_open("bi-medix2")
+    assert not router.circuit_open("qwen-0.6b-med")
+
+
+def test_fallback_chain_skips_open_breakers(monkeypatch):
+    breakers = CircuitBreakerRegistry()
+    router = _router(monkeypatch, breakers)
+    for port in (8080, 8081):
+        for _ in range(breakers.get(port).failure_threshold):
+            breakers.get(port).record_failure()
+
+    called = []
+
+    async def fake_send(self, request, stream=False, **kwargs):
+        called.append(str(request.url))
+        return httpx.Response(200, json={"model": "qwen", "choices": [{"message": {"content": "ok"}}]}, request=request)
+
+    monkeypatch.setattr(httpx.AsyncClient, "send", fake_send)
+    start = time.monotonic()
+    result = asyncio.run(router.generate("MedicalQA", [{"role": "user", "content": "hi"}], max_tokens=16))
+    assert time.monotonic() - start < 0.5
+    assert result["fallback_used"] and result["model"] == "qwen"
+    assert called == ["http://127.0.0.1:8082/v1/chat/completions"]
+
+
+def test_replicas_on_the_same_port_of_different_hosts_have_separate_breakers(monkeypatch):
+    breakers = CircuitBreakerRegistry()
+    router = _router(monkeypatch, breakers)
+    monkeypatch.setattr(router, "replicas", ReplicaRegistry({"bi-medix2": ["http://10.0.0.1:8080", "http://10.0.0.2:8080"]}))
+    for _ in range(breakers.get("http://10.0.0.1:8080").failure_threshold):
+        breakers.get("10.0.0.1:8080").record_failure()
+
+    called = []
+
+    async def fake_send(self, request, stream=False, **kwargs):
+        called.append(str(request.url))
+        return httpx.Response(200, json={"model": "bimedix", "choices": [{"message": {"content": "ok"}}]}, request=request)
+
+    monkeypatch.setattr(httpx.AsyncClient, "send", fake_send)
+    assert breakers.get("http://10.0.0.2:8080").state == CircuitState.CLOSED
+    assert not router.circuit_open("bi-medix2")
+    for _ in range(10):
+        text, _ = asyncio.run(router._llama_cpp_generate(
+            messages=[{"role": "user", "content": "hi"}],
+            model_config=router.registry.MODELS["bi-medix2"],
+            max_tokens=16,
+            temperature=0.0,
+        ))
+        assert text == "ok"
+    assert called == ["http://10.0.0.2:8080/v1/chat/completions"] * 10  # Only the failing host is skipped
+
+
+def test_healthz_reports_breakers(monkeypatch):
+    import app.main as main
+
+    breakers = CircuitBreakerRegistry()
+    for _ in range(breakers.get(8083).failure_threshold):
+        breakers.get(8083).record_failure()
+    monkeypatch.setattr(main, "circuit_breakers", breakers)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.get("/healthz")).json(), (await client.get("/metrics")).text
+
+    health, metrics = asyncio.run(scenario())
+    assert health["status"] == "degraded"
+    assert health["circuit_breakers"]["http://127.0.0.1:8083"]["state"] == "open"
+    assert 'llm_circuit_breaker_state{backend="http://127.0.0.1:8083"} 2.0' in metrics
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test single-flight coalescing of identical chat completions (no model backends required).
+"""
+import asyncio
+import json
+
+import httpx
+
+from app.coalescing import RequestCoalescer
+
+
+def test_concurrent_identical_calls_share_one_upstream():
+    async def scenario():
+        coalescer = RequestCoalescer(agents={"Claims"})
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "approved"
+
+        results = await asyncio.gather(*[coalescer.do("k", upstream) for _ in range(5)])
+        return coalescer, calls, results
+
+    coalescer, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["approved"] * 5
+    assert [shared for _, shared in results].count(False) == 1
+    stats = coalescer.get_stats()
+    assert stats["upstream_calls"] == 1 and stats["coalesced"] == 4 and stats["in_flight"] == 0
+
+
+def test_leader_cancellation_does_not_cancel_followers():
+    async def scenario():
+        coalescer = RequestCoalescer(agents={"Claims"})
+
+        async def upstream():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.create_task(coalescer.do("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(coalescer.do("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+def test_enablement_is_per_agent_and_deterministic_by_default():
+    coalescer = RequestCoalescer(agents={"Claims"})
+    assert coalescer.enabled_for("Claims", 0.0)
+    assert not coalescer.enabled_for("Claims", 0.7)
+    assert not coalescer.enabled_for("Chat", 0.0)
+    assert RequestCoalescer(agents={"Claims"}, deterministic_only=False).enabled_for("Claims", 0.7)
+
+
+def test_chat_completions_coalesce_end_to_end(monkeypatch):
+    import app.main as main
+
+    posts = []
+
+    async def llama_server(request):
+        posts.append(json.loads(request.content))
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"model": "qwen", "choices": [{"message": {"content": "Draft note"}}]})
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main, "request_coalescer", RequestCoalescer(agents={"Scribe"}))
+
+    body = {"agent_type": "Scribe", "temperature": 0, "messages": [{"role": "user", "content": "Summarize visit"}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[client.post("/v1/chat/completions", json=body) for _ in range(3)])
+
+    responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len(posts) == 1
+    assert posts[0]["temperature"] == 0
+    assert main.request_coalescer.get_stats()["coalesced"] == 2
+
+
+
+def test_agents_sharing_a_port_are_not_coalesced(monkeypatch):
+    import app.main as main
+
+    posts = []
+
+    async def llama_server(request):
+        posts.append(json.loads(request.content))
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"model": "openinsurance", "choices": [{"message": {"content": "Coded"}}]})
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main, "request_coalescer", RequestCoalescer(agents={"Claims", "Billing"}))
+
+    messages = [{"role": "user", "content": "Code this admission"}]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json={"agent_type": agent, "temperature": 0, "messages": messages})
+                for agent in ("Claims", "Billing", "Claims")
+            ])
+
+    responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [200] * 3
+    # Claims and Billing both go to port 8083 but with their own persona: one call each
+    assert len(posts) == 2
+    assert len({p["messages"][0]["content"] for p in posts}) == 2
+    assert main.request_coalescer.get_stats()["coalesced"] == 1
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
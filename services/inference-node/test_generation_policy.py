@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Test generation policies: adaptive max_tokens from observed completion lengths
+and early stop of streamed generations where _clean_response would truncate
+(mock llama-server SSE over httpx.MockTransport and MockAsyncLLMEngine).
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.generation_policy import GenerationPolicy, ResponseCutoff, clean_response, stream_chat_completion
+from app.model_router import ModelRouter
+from app.vllm_backend import MockAsyncLLMEngine, engine_config_for, vLLMBackend
+
+LOOPING = ["Rest and drink fluids.\n", "See a doctor if fever persists.\n"] + ["Take paracetamol.\n"] * 40
+
+
+def _sse_server(chunks, sent):
+    """llama-server streaming one chunk per token; `sent` records what was actually produced."""
+    def handler(request):
+        async def body():
+            for text in chunks:
+                sent.append(text)
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n".encode()
+            final = {"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": {"prompt_tokens": 12, "completion_tokens": len(chunks)}}
+            yield f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode()
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+    return httpx.MockTransport(handler)
+
+
+def test_cutoff_stops_where_clean_response_truncates():
+    repetitive = "".join(LOOPING)
+    cutoff = ResponseCutoff()
+    fed = ""
+    for chunk in LOOPING:
+        fed += chunk
+        if cutoff.feed(chunk):
+            break
+    assert cutoff.reason == "repetition" and len(fed) < len(repetitive) / 5
+    assert cutoff.result() == clean_response(repetitive) == ModelRouter()._clean_response(repetitive)
+
+    prose = " ".join(["The patient reports mild headache."] * 200)  # One long line, no repeats to detect
+    cutoff = ResponseCutoff()
+    words = prose.split(" ")
+    consumed = next(i for i, word in enumerate(words) if cutoff.feed(word + " "))
+    assert cutoff.reason == "max_chars" and consumed < len(words) / 3
+    assert cutoff.result() == clean_response(prose)
+
+
+def test_stream_is_closed_on_early_stop():
+    sent = []
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=_sse_server(LOOPING, sent)) as client:
+            return await stream_chat_completion(
+                client, "http://llama:8080/v1/chat/completions", {"messages": []}, cutoff=ResponseCutoff()
+            )
+
+    status, body = asyncio.run(scenario())
+    assert status == 200 and body["choices"][0]["finish_reason"] == "early_stop"
+    assert len(sent) <= 7 and body["usage"]["completion_tokens"] == 6  # Not the 42 chunks the model would emit
+    assert clean_response(body["choices"][0]["message"]["content"]) == (
+        "Rest and drink fluids.\nSee a doctor if fever persists.\nTake paracetamol."
+    )
+
+
+def test_max_tokens_follows_observed_lengths():
+    policy = GenerationPolicy(min_samples=10, quantile=0.9, headroom=1.25, min_tokens=64, max_capped_rate=0.1)
+    assert policy.max_tokens("Chat", 1024) == 1024  # Not enough samples yet
+    for tokens in range(100, 300, 20):
+        policy.observe("Chat", tokens, max_tokens=1024, finish_reason="stop")
+    assert policy.max_tokens("Chat", 1024) == 350  # p90 280 x 1.25
+    assert policy.max_tokens("Chat", 256) == 256  # Never above the agent ceiling
+    assert policy.max_tokens("Billing", 2048) == 2048
+
+    # Replies cut by the cap are censored: the cap widens instead of shrinking onto them
+    for _ in range(2):
+        policy.observe("Chat", 350, max_tokens=350, finish_reason="length")
+    assert policy.max_tokens("Chat", 1024) == 700
+    assert policy.get_stats()["agents"]["Chat"]["capped_rate"] == pytest.approx(2 / 12, abs=1e-4)
+
+    disabled = GenerationPolicy(adaptive=False, min_samples=1)
+    disabled.observe("Chat", 10, max_tokens=1024)
+    assert disabled.max_tokens("Chat", 1024) == 1024
+
+
+def test_vllm_generation_is_aborted_at_cutoff():
+    router = ModelRouter()
+    config = engine_config_for("biomistral-7b-fp16", router.registry.MODELS["biomistral-7b-fp16"])
+    backend = vLLMBackend(config, engine=MockAsyncLLMEngine(step_s=0.001, reply=" ".join(["Hydrate."] * 400)))
+    result = asyncio.run(backend.generate([{"role": "user", "content": "hi"}], max_tokens=400,
+                                          cutoff=ResponseCutoff(max_chars=200)))
+    assert result["finish_reason"] == "early_stop"
+    assert result["usage"]["completion_tokens"] < 40
+    assert len(backend.engine.aborted) == 1 and backend.aborted == 1
+
+
+def test_chat_completions_cancel_looping_generation(monkeypatch):
+    import app.main as main
+
+    sent = []
+    llm_client = httpx.AsyncClient(transport=_sse_server(LOOPING, sent))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    policy = GenerationPolicy()
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main, "generation_policy", policy)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "I have a fever"}]}
+            reply = (await client.post("/v1/chat/completions", json=body)).json()
+            return reply, (await client.get("/v1/generation/policy")).json()
+
+    reply, stats = asyncio.run(scenario())
+    assert reply["choices"][0]["message"]["content"] == (
+        "Rest and drink fluids.\nSee a doctor if fever persists.\nTake paracetamol."
+    )
+    assert reply["usage"]["completion_tokens"] == 6 and len(sent) <= 7
+    assert stats["agents"]["Chat"]["early_stops"] == {"repetition": 1}
+    assert stats["agents"]["Chat"]["tokens_saved"] == 1024 - 6
+
+
+
+def test_outage_stub_replies_are_not_observed(monkeypatch):
+    import app.main as main
+
+    async def backend_down(**kwargs):
+        raise httpx.ConnectError("connection refused")
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    policy = GenerationPolicy(min_samples=1)
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main.model_router, "_llama_cpp_generate", backend_down)
+    monkeypatch.setattr(main, "generation_policy", policy)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "I have a fever"}]}
+            return (await client.post("/v1/chat/completions", json=body)).json()
+
+    reply = asyncio.run(scenario())
+    assert reply["model"] == "fallback"
+    assert policy.get_stats()["agents"].get("Chat", {"samples": 0})["samples"] == 0
+    assert policy.max_tokens("Chat", 1024) == 1024
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test multi-GPU routing in SmartLoadBalancer: per-device monitors, fit checks on
+each model's own GPUs and per-device status (fake telemetry, no GPU required).
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.gpu_orchestrator import BackendType, SmartLoadBalancer
+from app.gpu_telemetry import FakeTelemetryProvider
+
+
+def _balancer(provider):
+    balancer = SmartLoadBalancer(telemetry=provider)
+    balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8081, gpu_ids=[0])
+    balancer.register_model("tiny-llama-1b", BackendType.LLAMA_CPP, 2.3, 8080, gpu_ids=[1])
+    balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084, gpu_ids=[1])
+    return balancer
+
+
+def _decide(balancer, **kwargs):
+    async def scenario():
+        await asyncio.gather(*(m.sample() for m in balancer.gpu_monitors.values()))
+        return await balancer.decide_model_and_backend("Claims", **kwargs)
+    return asyncio.run(scenario())
+
+
+def test_monitors_every_device():
+    provider = FakeTelemetryProvider(devices=2)
+    balancer = _balancer(provider)
+    assert sorted(balancer.gpu_monitors) == [0, 1]
+    assert balancer.gpu_monitor.gpu_id == 0
+
+
+def test_gpu1_model_judged_by_gpu1_memory():
+    provider = FakeTelemetryProvider(devices=2, used_memory_gb=2.0)
+    provider.set(1, total_memory_gb=12.0, used_memory_gb=5.0)  # 7GB free: 4GB after overhead
+    decision = _decide(_balancer(provider), preferred_model="openins-llama3-8b")
+    # GPU 0 has 22GB free, but the model lives on GPU 1 where it no longer fits
+    assert decision.model_name != "openins-llama3-8b"
+    assert decision.gpu_id == (0 if decision.model_name == "bi-medix2" else 1)
+
+
+def test_pressure_on_one_gpu_does_not_block_the_other():
+    provider = FakeTelemetryProvider(devices=2, used_memory_gb=4.0)
+    provider.set(0, used_memory_gb=23.5)  # GPU 0 critical
+    balancer = _balancer(provider)
+    assert _decide(balancer, preferred_model="bi-medix2").gpu_id == 1
+
+    provider.set(1, total_memory_gb=12.0, used_memory_gb=6.0, temperature_c=85.0)
+    decision = _decide(balancer, preferred_model="tiny-llama-1b")
+    assert decision.reason.startswith("FALLBACK")
+
+
+def test_model_split_across_gpus_needs_its_share_on_each():
+    provider = FakeTelemetryProvider(devices=2, used_memory_gb=10.0)
+    balancer = SmartLoadBalancer(telemetry=provider)
+    balancer.register_model("bimedix2-8b-fp16", BackendType.VLLM, 20.0, 9000, gpu_ids=[0, 1])
+    model = balancer.models["bimedix2-8b-fp16"]
+
+    async def states():
+        await asyncio.gather(*(m.sample() for m in balancer.gpu_monitors.values()))
+        return await balancer.get_device_states()
+
+    assert balancer.model_fits(model, asyncio.run(states()))  # 10GB per device, 11GB usable on each
+    provider.set(1, used_memory_gb=14.0)
+    assert not balancer.model_fits(model, asyncio.run(states()))
+
+
+def test_routes_report_per_device_pressure(monkeypatch):
+    import app.gpu_load_balancing_routes as routes
+    from fastapi import FastAPI
+
+    provider = FakeTelemetryProvider(devices=2, used_memory_gb=6.0)
+    provider.set(1, total_memory_gb=12.0, used_memory_gb=10.0)
+    balancer = _balancer(provider)
+    monkeypatch.setattr(routes, "get_load_balancer", lambda: balancer)
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def scenario():
+        await asyncio.gather(*(m.sample() for m in balancer.gpu_monitors.values()))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            status = (await client.get("/v1/gpu/status")).json()["gpu_status"]
+            forecast = (await client.get("/v1/gpu/memory-forecast")).json()["forecast"]
+            return status, forecast
+
+    status, forecast = asyncio.run(scenario())
+    assert status["gpus"]["0"]["pressure"] == "low"
+    assert status["gpus"]["1"]["pressure"] == "high"
+    assert status["gpus"]["1"]["models"] == ["openins-llama3-8b", "tiny-llama-1b"]
+    assert forecast["devices"]["1"]["total_gb"] == 12.0
+    assert forecast["devices"]["1"]["estimated_available_for_inference_gb"] == 0
+    assert forecast["projected_headroom_gb"] == 20.0
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test the background health prober and /healthz, /livez, /readyz
+(no model backends or database required).
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.health import HealthProber, llama_cpp_check
+from app.replica_pool import ReplicaRegistry
+
+
+def _client(handler=lambda request: httpx.Response(200)):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_checks_run_concurrently_and_slow_checks_time_out():
+    prober = HealthProber(timeout_s=0.2, readiness_checks=["fast"])
+
+    async def fast(client):
+        await asyncio.sleep(0.1)
+        return {"status": "ok"}
+
+    async def hung(client):
+        await asyncio.sleep(10)
+        return {"status": "ok"}
+
+    prober.register("fast", fast)
+    prober.register("fast_too", fast)
+    prober.register("hung", hung)
+
+    async def scenario():
+        async with _client() as client:
+            start = time.monotonic()
+            snapshot = await prober.probe_once(client)
+            return snapshot, time.monotonic() - start
+
+    snapshot, elapsed = asyncio.run(scenario())
+    assert elapsed < 0.5
+    assert snapshot["status"] == "degraded"
+    assert snapshot["backends"]["hung"]["status"] == "down"
+    assert "timed out" in snapshot["backends"]["hung"]["error"]
+    assert snapshot["ready"]  # Only "fast" gates readiness
+
+
+def test_readiness_requires_critical_checks_and_fresh_snapshot():
+    prober = HealthProber(stale_after_s=30, readiness_checks=["database"])
+
+    async def database(client):
+        raise ConnectionRefusedError("connection refused")
+
+    prober.register("database", database)
+    assert prober.snapshot()["status"] == "starting" and not prober.ready()
+
+    async def scenario():
+        async with _client() as client:
+            await prober.probe_once(client)
+
+    asyncio.run(scenario())
+    assert not prober.ready()
+    assert prober.snapshot()["backends"]["database"]["error"] == "connection refused"
+
+    prober.results["database"]["status"] = "ok"
+    assert prober.ready()
+    prober.last_probe_at -= 60
+    assert not prober.ready()
+
+
+def test_llama_cpp_check_covers_every_replica():
+    registry = ReplicaRegistry({"bi-medix2": ["http://a:8080", "http://b:8090"], "qwen-0.6b-med": ["http://c:8082"]})
+
+    def handler(request):
+        return httpx.Response(503 if request.url.host == "b" else 200)
+
+    async def scenario():
+        async with _client(handler) as client:
+            return await llama_cpp_check(registry)(client)
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "degraded"
+    assert result["healthy_replicas"] == 2 and result["replicas"] == 3
+    assert result["models"]["bi-medix2"] == {"healthy": 1, "replicas": 2}
+    assert registry.pool("bi-medix2").replicas[1].healthy is False
+
+
+def test_health_endpoints_serve_cached_snapshot(monkeypatch):
+    import app.main as main
+
+    prober = HealthProber(readiness_checks=["llama_cpp"])
+    calls = []
+
+    async def llama_cpp(client):
+        calls.append(1)
+        return {"status": "ok"}
+
+    prober.register("llama_cpp", llama_cpp)
+    monkeypatch.setattr(main, "health_prober", prober)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert (await client.get("/livez")).status_code == 200
+            assert (await client.get("/readyz")).status_code == 503
+            assert (await client.get("/healthz")).json()["status"] == "starting"
+
+            async with _client() as probe_client:
+                await prober.probe_once(probe_client)
+            ready = await client.get("/readyz")
+            health = (await client.get("/healthz")).json()
+            return ready, health
+
+    ready, health = asyncio.run(scenario())
+    assert ready.status_code == 200 and ready.json()["checks"] == {"llama_cpp": "ok"}
+    assert health["backends"]["llama_cpp"]["status"] == "ok"
+    assert "circuit_breakers" in health
+    assert len(calls) == 1  # Endpoints never probe themselves
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
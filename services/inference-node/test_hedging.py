@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test hedged requests in ModelRouter.generate (no model backends required).
+"""
+import asyncio
+
+import pytest
+
+from app.circuit_breaker import CircuitBreakerRegistry
+from app.hedging import HedgePolicy
+from app.model_router import ModelRouter
+
+
+def _router(monkeypatch, delays, policy):
+    """Router whose llama.cpp calls take `delays[model key]` seconds (None = fails)."""
+    router = ModelRouter()
+    monkeypatch.setattr(router, "hedging", policy)
+    monkeypatch.setattr(router, "breakers", CircuitBreakerRegistry())
+    calls, cancelled = [], []
+
+    async def fake_generate(messages, model_config, max_tokens, temperature, agent_type=""):
+        key = router._get_model_key(model_config)
+        calls.append(key)
+        try:
+            delay = delays[key]
+            await asyncio.sleep(delay or 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(key)
+            raise
+        if delay is None:
+            raise RuntimeError(f"{key} failed")
+        return f"answer from {key}", key
+
+    monkeypatch.setattr(router, "_llama_cpp_generate", fake_generate)
+    return router, calls, cancelled
+
+
+def _generate(router, agent="Chat"):
+    return asyncio.run(router.generate(agent, [{"role": "user", "content": "hi"}], max_tokens=16))
+
+
+def test_slow_primary_is_hedged_and_loser_cancelled(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.05)
+    router, calls, cancelled = _router(monkeypatch, {"bi-medix2": 1.0, "medpalm2-8b": 0.01}, policy)
+
+    result = _generate(router)
+    assert result["model"] == "medpalm2-8b" and result["fallback_used"]
+    assert result["inference_time_s"] < 0.5
+    assert calls == ["bi-medix2", "medpalm2-8b"]
+    assert cancelled == ["bi-medix2"]
+    stats = policy.get_stats()["per_agent"]["Chat"]
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.5)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": 0.01, "medpalm2-8b": 0.01}, policy)
+    result = _generate(router)
+    assert result["model"] == "bi-medix2" and not result["fallback_used"]
+    assert calls == ["bi-medix2"]
+    assert policy.get_stats()["per_agent"]["Chat"]["latency_samples"] == 1
+
+
+def test_hedge_budget_limits_hedges(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=50, default_delay_s=0.02)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": 0.1, "medpalm2-8b": 0.01}, policy)
+    for _ in range(4):
+        _generate(router)
+    stats = policy.get_stats()["per_agent"]["Chat"]
+    assert stats["requests"] == 4
+    assert stats["hedged"] == 2 and stats["budget_exhausted"] == 2
+
+
+def test_hedge_failure_falls_back_to_primary(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.02)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": 0.1, "medpalm2-8b": None}, policy)
+    result = _generate(router)
+    assert result["model"] == "bi-medix2" and not result["fallback_used"]
+
+
+def test_fast_primary_failure_still_tries_the_backup(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.5)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": None, "medpalm2-8b": 0.01, "qwen-0.6b-med": 0.01}, policy)
+    result = _generate(router)
+    # The primary failed before the hedge deadline: no hedge was sent, so the backup is next
+    assert calls == ["bi-medix2", "medpalm2-8b"]
+    assert result["model"] == "medpalm2-8b" and result["fallback_used"]
+
+
+def test_failed_hedge_is_not_retried_as_fallback(monkeypatch):
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.005)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": None, "medpalm2-8b": None, "qwen-0.6b-med": 0.01}, policy)
+    result = _generate(router)
+    assert calls == ["bi-medix2", "medpalm2-8b", "qwen-0.6b-med"]
+    assert result["model"] == "qwen-0.6b-med"
+
+
+def test_agents_not_opted_in_are_not_hedged(monkeypatch):
+    policy = HedgePolicy(agents={"Triage"}, budget_percent=100, default_delay_s=0.01)
+    router, calls, _ = _router(monkeypatch, {"bi-medix2": 0.1, "medpalm2-8b": 0.01}, policy)
+    _generate(router)
+    assert calls == ["bi-medix2"]
+
+
+def test_chat_completions_hedge_the_direct_replica_call(monkeypatch):
+    import time
+
+    import httpx
+
+    import app.main as main
+
+    cancelled = []
+
+    async def slow_replica(request):
+        try:
+            await asyncio.sleep(2)
+        except asyncio.CancelledError:
+            cancelled.append(str(request.url))
+            raise
+        return httpx.Response(200, json={"model": "bimedix", "choices": [{"message": {"content": "late"}}]})
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(slow_replica))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    async def hedge_backend(messages, model_config, max_tokens, temperature, agent_type=""):
+        return f"answer from {main.model_router._get_model_key(model_config)}", "medpalm2"
+
+    policy = HedgePolicy(agents={"Chat"}, budget_percent=100, default_delay_s=0.05)
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main.model_router, "hedging", policy)
+    monkeypatch.setattr(main.model_router, "_llama_cpp_generate", hedge_backend)
+
+    body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "clinic hours?"}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/v1/chat/completions", json=body)
+
+    start = time.monotonic()
+    response = asyncio.run(scenario())
+    assert time.monotonic() - start < 1.5  # Did not wait out the 2s replica
+    assert response.status_code == 200
+    assert response.json()["model"] == "medpalm2"
+    assert response.json()["choices"][0]["message"]["content"] == "answer from medpalm2-8b"
+    assert cancelled == ["http://127.0.0.1:8080/v1/chat/completions"]  # Direct call lost the race
+    stats = policy.get_stats()["per_agent"]["Chat"]
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_hedge_delay_tracks_p95():
+    policy = HedgePolicy(agents={"Chat"}, default_delay_s=8, min_delay_s=0.5, min_samples=20)
+    assert policy.hedge_delay("Chat") == 8
+    for i in range(100):
+        policy.observe("Chat", 1.0 + i / 100)
+    assert policy.hedge_delay("Chat") == pytest.approx(1.94)
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
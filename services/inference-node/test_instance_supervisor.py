@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test llama-server process supervision: readiness gating, crash and hang
+restarts with backoff, rotating per-instance logs and graceful drain
+(real subprocesses running bin/fake_llama_server.py, no GPU required).
+"""
+import asyncio
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+from app.instance_supervisor import InstanceSupervisor
+from app.multi_model_manager import MultiModelManager
+
+FAKE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin", "fake_llama_server.py")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_LLAMA_LOAD_S", "0.3")
+    manager = MultiModelManager(on_demand=False)
+    manager.LLAMA_SERVER_BIN = FAKE_SERVER
+    for name, instance in manager.instances.items():
+        instance.model_path = str(tmp_path / f"{name}.gguf")
+        open(instance.model_path, "w").close()
+        instance.port = _free_port()
+    manager.supervisor = InstanceSupervisor(
+        manager,
+        log_dir=str(tmp_path / "logs"),
+        backoff_s=0.05,
+        liveness_interval_s=0.1,
+        liveness_failures=2,
+        drain_timeout_s=5,
+        stop_timeout_s=2,
+    )
+    return manager
+
+
+def _run(manager, scenario):
+    async def wrapped():
+        try:
+            return await scenario()
+        finally:
+            await manager.stop_all()
+    return asyncio.run(wrapped())
+
+
+async def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.05)
+
+
+def test_instance_is_not_routable_until_healthy(manager):
+    async def scenario():
+        start = asyncio.create_task(manager.start_instance("chat"))
+        await _wait_for(lambda: manager.instances["chat"].status == "starting")
+        during = manager.get_instance_for_agent("Chat")
+        ready = await start
+        return during, ready, manager.get_instance_for_agent("Chat")
+
+    during, ready, after = _run(manager, scenario)
+    assert during is None
+    assert ready and after is manager.instances["chat"]
+
+
+def test_crashed_instance_is_restarted(manager):
+    async def scenario():
+        await manager.start_instance("chat")
+        first_pid = manager.instances["chat"].pid
+        os.kill(first_pid, signal.SIGKILL)
+        await _wait_for(lambda: manager.instances["chat"].status == "error")
+        routable_after_crash = manager.get_instance_for_agent("Chat")
+        await _wait_for(lambda: manager.instances["chat"].status == "running")
+        reply = await manager.generate("Chat", [{"role": "user", "content": "hi"}])
+        return first_pid, routable_after_crash, reply, manager.get_status()["processes"]["instances"]["chat"]
+
+    first_pid, routable_after_crash, reply, stats = _run(manager, scenario)
+    assert routable_after_crash is None
+    assert reply["text"] == "echo: hi"
+    assert stats["restarts"] == 1 and stats["last_exit_code"] == -signal.SIGKILL
+    assert stats["pid"] not in (None, first_pid)
+
+
+def test_request_during_restart_backoff_does_not_spawn_twice(manager):
+    manager.supervisor.backoff_s = 1.0
+
+    async def scenario():
+        await manager.start_instance("chat")
+        os.kill(manager.instances["chat"].pid, signal.SIGKILL)
+        await _wait_for(lambda: manager.supervisor.states["chat"].restart_task is not None)
+        # A request cold-starts the instance while the crash restart is still backing off
+        assert await manager.start_instance("chat")
+        pid = manager.instances["chat"].pid
+        await asyncio.sleep(1.5)  # Past the backoff: the pending restart must not spawn a second server
+        state = manager.supervisor.states["chat"]
+        return pid, manager.instances["chat"].pid, manager.instances["chat"].status, state.restarts
+
+    pid, pid_after_backoff, status, restarts = _run(manager, scenario)
+    assert pid_after_backoff == pid and status == "running" and restarts == 0
+    with socket.socket() as s:  # No orphaned server left listening on the port after stop_all()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # TIME_WAIT from health checks is fine
+        s.bind(("127.0.0.1", manager.instances["chat"].port))
+
+
+def test_hung_instance_is_killed_and_restarted(manager):
+    async def scenario():
+        await manager.start_all()
+        hung_pid = manager.instances["chat"].pid
+        os.kill(hung_pid, signal.SIGSTOP)  # Still alive, no longer answering /health
+        await _wait_for(lambda: manager.supervisor.states["chat"].restarts == 1)
+        await _wait_for(lambda: manager.instances["chat"].status == "running")
+        return hung_pid, manager.instances["chat"].pid
+
+    hung_pid, new_pid = _run(manager, scenario)
+    assert new_pid != hung_pid
+
+
+def test_process_output_goes_to_rotating_log(manager):
+    async def scenario():
+        await manager.start_instance("documentation")
+        return manager.supervisor.log_path("documentation")
+
+    path = _run(manager, scenario)
+    with open(path) as f:
+        assert "fake llama-server: " in f.read()
+
+
+def test_stop_drains_in_flight_requests(manager, monkeypatch):
+    monkeypatch.setenv("FAKE_LLAMA_REPLY_DELAY_S", "0.5")
+
+    async def scenario():
+        await manager.start_instance("chat")
+        request = asyncio.create_task(manager.generate("Chat", [{"role": "user", "content": "slow"}]))
+        await _wait_for(lambda: manager.in_flight["chat"] == 1)
+        stop = asyncio.create_task(manager.stop_instance("chat"))
+        await _wait_for(lambda: manager.instances["chat"].status == "draining")
+        routable = manager.get_instance_for_agent("Chat")
+        reply = await request
+        await stop
+        return routable, reply, manager.instances["chat"].status
+
+    routable, reply, status = _run(manager, scenario)
+    assert routable is None
+    assert reply["text"] == "echo: slow" and status == "stopped"
+
+
+def test_start_fails_fast_when_process_exits(manager):
+    manager.LLAMA_SERVER_BIN = "/bin/false"
+
+    async def scenario():
+        start = time.monotonic()
+        ok = await manager.start_instance("chat")
+        await asyncio.sleep(0.2)  # No restart for an instance that never became ready
+        return ok, time.monotonic() - start, manager.supervisor.states["chat"]
+
+    ok, elapsed, state = _run(manager, scenario)
+    assert not ok and elapsed < 5
+    assert manager.instances["chat"].status == "error"
+    assert state.restarts == 0 and state.last_exit_code == 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test the online latency model (EWMA + t-digest) and its use in routing,
+admission control and the benchmark route (no model backends required).
+"""
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected
+from app.gpu_orchestrator import BackendType, SmartLoadBalancer
+from app.gpu_telemetry import FakeTelemetryProvider
+from app.latency_estimator import LatencyEstimator, TDigest, prompt_bucket
+
+
+def test_tdigest_quantiles_track_exact_percentiles():
+    rng = random.Random(7)
+    samples = [rng.lognormvariate(0, 0.6) for _ in range(5000)]
+    digest = TDigest(compression=100)
+    for x in samples:
+        digest.add(x)
+    samples.sort()
+    for q in (0.5, 0.95, 0.99):
+        exact = samples[int(q * len(samples))]
+        assert digest.quantile(q) == pytest.approx(exact, rel=0.03)
+    assert len(digest.centroids) < 1000
+
+
+def test_prediction_falls_back_from_agent_to_model():
+    estimator = LatencyEstimator(min_samples=3)
+    for latency in (1.0, 1.2, 1.1, 5.0):
+        estimator.observe("bi-medix2", "Chat", 100, latency)
+    assert prompt_bucket(100) == "0-256"
+
+    exact = estimator.predict("bi-medix2", "Chat", 120)
+    assert exact.key == ("bi-medix2", "Chat", "0-256") and exact.samples == 4
+    assert 1.0 <= exact.p50_s <= 1.2 and exact.p95_s > 2.0
+
+    # Unknown agent and longer prompt: model-wide estimate
+    assert estimator.predict("bi-medix2", "Claims", 3000).key == ("bi-medix2", "*", "*")
+    assert estimator.predict("qwen-0.6b-med", "Chat", 100) is None
+
+
+def test_routing_prefers_model_with_lower_predicted_p95():
+    estimator = LatencyEstimator(min_samples=3)
+    balancer = SmartLoadBalancer(telemetry=FakeTelemetryProvider(), latency=estimator)
+    balancer.register_model("bi-medix2", BackendType.LLAMA_CPP, 6.5, 8080)
+    balancer.register_model("openins-llama3-8b", BackendType.LLAMA_CPP, 7.8, 8084)
+    # Similar medians, but openins has a slow tail for Claims-sized prompts
+    for _ in range(10):
+        estimator.observe("bi-medix2", "Claims", 2000, 2.0)
+        estimator.observe("openins-llama3-8b", "Claims", 2000, 1.8)
+    for _ in range(3):
+        estimator.observe("openins-llama3-8b", "Claims", 2000, 12.0)
+
+    decision = asyncio.run(balancer.decide_model_and_backend("Claims", prompt_tokens=2000))
+    assert decision.model_name == "bi-medix2"
+    assert decision.estimated_duration_ms == pytest.approx(2000)
+    assert decision.estimated_p95_ms == pytest.approx(2000)
+
+
+def test_admission_sheds_when_predicted_wait_exceeds_limit():
+    async def scenario():
+        controller = AdmissionController(default_budget=1000, budgets={}, max_queue_wait_s=5)
+        running = await controller.acquire("port:8080", 900, predicted_s=4.0)
+        # One 4s request ahead: expected wait fits
+        queued = asyncio.create_task(controller.acquire("port:8080", 500, predicted_s=4.0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as shed:
+            await controller.acquire("port:8080", 500, predicted_s=4.0)
+        assert shed.value.status_code == 503 and shed.value.retry_after >= 5
+        controller.release(running)
+        controller.release(await queued)
+        return controller.get_stats()["backends"]["port:8080"]
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_predicted"] == 1 and stats["admitted"] == 2
+
+
+def test_benchmark_route_seeds_estimator(monkeypatch):
+    import app.gpu_load_balancing_routes as routes
+    from fastapi import FastAPI
+
+    estimator = LatencyEstimator(min_samples=3)
+    balancer = SmartLoadBalancer(telemetry=FakeTelemetryProvider(), latency=estimator)
+    balancer.register_model("qwen-0.6b-med", BackendType.LLAMA_CPP, 1.5, 8082)
+    posts = []
+
+    def handler(request):
+        posts.append(str(request.url))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    monkeypatch.setattr(routes, "get_load_balancer", lambda: balancer)
+    monkeypatch.setattr(routes, "_benchmark_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            missing = await client.post("/v1/gpu/benchmark-model", params={"model_name": "nope"})
+            result = await client.post(
+                "/v1/gpu/benchmark-model", params={"model_name": "qwen-0.6b-med", "num_iterations": 4}
+            )
+            return missing, result.json()
+
+    missing, result = asyncio.run(scenario())
+    assert missing.status_code == 404
+    assert result["succeeded"] == 4 and result["predicted"]["samples"] == 4
+    assert posts == ["http://127.0.0.1:8082/v1/chat/completions"] * 4
+    assert estimator.predict("qwen-0.6b-med", "Scribe", 20) is not None
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
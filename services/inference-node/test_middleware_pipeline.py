@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test the pure-ASGI request pipeline middleware (no model backends required).
+"""
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.middleware import RequestPipelineMiddleware
+
+
+def _build_app(max_requests: int = 100) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        return {
+            "max_tokens": getattr(request.state, "max_tokens", 512),
+            "request_id": request.state.request_id,
+        }
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("database password is hunter2")
+
+    app.add_middleware(RequestPipelineMiddleware, max_requests=max_requests, window_seconds=60)
+    return app
+
+
+def test_policy_state_and_audit_headers():
+    client = TestClient(_build_app())
+
+    response = client.post("/v1/chat/completions", headers={"X-Agent-Type": "Documentation", "X-Request-ID": "abc"})
+
+    assert response.json() == {"max_tokens": 4096, "request_id": "abc"}
+    assert response.headers["X-Request-ID"] == "abc"
+    assert "X-Timestamp" in response.headers
+    assert response.headers["X-Frame-Options"] == "DENY"
+
+
+def test_rejections_are_json_responses():
+    client = TestClient(_build_app(max_requests=2))
+
+    bad_agent = client.post("/v1/chat/completions", headers={"X-Agent-Type": "Unknown"})
+    assert bad_agent.status_code == 400
+    assert "not allowed" in bad_agent.json()["detail"]
+
+    for _ in range(2):
+        client.get("/docs")
+    limited = client.get("/docs")
+    assert limited.status_code == 429
+    assert limited.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_healthz_fast_path_skips_limits_and_audit():
+    client = TestClient(_build_app(max_requests=1))
+
+    for _ in range(3):
+        response = client.get("/healthz")
+        assert response.status_code == 200
+
+    assert "X-Request-ID" not in response.headers
+    assert response.headers["Referrer-Policy"] == "no-referrer"
+
+
+def test_errors_are_sanitized():
+    client = TestClient(_build_app(), raise_server_exceptions=False)
+
+    response = client.get("/boom")
+
+    assert response.status_code == 500
+    assert "hunter2" not in response.text
+    assert "X-Request-ID" in response.headers
+
+
+def test_streaming_is_not_buffered():
+    """The first chunk must reach the client before the generator finishes."""
+    app = FastAPI()
+    release = asyncio.Event()
+    received = []
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            yield b"first"
+            await release.wait()
+            yield b"second"
+        return StreamingResponse(chunks())
+
+    app.add_middleware(RequestPipelineMiddleware)
+
+    async def drive():
+        scope = {
+            "type": "http", "method": "GET", "path": "/stream", "raw_path": b"/stream",
+            "query_string": b"", "root_path": "", "scheme": "http", "http_version": "1.1",
+            "headers": [], "client": ("127.0.0.1", 1234), "server": ("test", 80),
+        }
+
+        async def receive():
+            await asyncio.sleep(3600)  # client never disconnects
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                received.append(message["body"])
+                release.set()
+
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+
+    asyncio.run(drive())
+    assert received == [b"first", b"second"]
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
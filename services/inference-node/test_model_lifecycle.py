@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Test on-demand model loading in MultiModelManager: cold starts shared by
+concurrent requests, LRU eviction to fit VRAM, pinned instances and idle
+reaping (real subprocesses running bin/fake_llama_server.py, no GPU required).
+"""
+import asyncio
+import os
+import socket
+
+import pytest
+
+from app.model_lifecycle import ModelCapacityError, ModelLifecycleScheduler
+from app.multi_model_manager import MultiModelManager
+
+FAKE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin", "fake_llama_server.py")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def make_manager(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_LLAMA_LOAD_S", "0.2")
+
+    def make(capacity_gb, pinned=(), idle_ttl_s=900.0):
+        manager = MultiModelManager(on_demand=True)
+        manager.LLAMA_SERVER_BIN = FAKE_SERVER
+        manager.supervisor.log_dir = str(tmp_path / "logs")
+        for name, instance in manager.instances.items():
+            instance.model_path = str(tmp_path / f"{name}.gguf")
+            open(instance.model_path, "w").close()
+            instance.port = _free_port()
+        manager.scheduler = ModelLifecycleScheduler(
+            manager, capacity_gb=capacity_gb, pinned=pinned, idle_ttl_s=idle_ttl_s, cold_start_timeout_s=20
+        )
+        return manager
+
+    return make
+
+
+def _run(manager, scenario):
+    async def wrapped():
+        try:
+            return await scenario()
+        finally:
+            await manager.stop_all()
+    return asyncio.run(wrapped())
+
+
+def test_concurrent_requests_share_one_cold_start(make_manager):
+    manager = make_manager({0: 24.0, 1: 12.0})
+    messages = [{"role": "user", "content": "hello"}]
+
+    async def scenario():
+        results = await asyncio.gather(*(manager.generate("Chat", messages) for _ in range(5)))
+        return results, manager.scheduler.get_stats()["instances"]["chat"]
+
+    results, chat = _run(manager, scenario)
+    assert [r["text"] for r in results] == ["echo: hello"] * 5
+    assert chat["cold_starts"] == 1 and chat["requests"] == 5
+    assert chat["in_flight"] == 0 and chat["waiting"] == 0
+    assert manager.instances["chat"].status == "stopped"  # stop_all
+
+
+def test_lru_instance_evicted_to_fit_vram(make_manager):
+    manager = make_manager({0: 20.0})
+    scheduler = manager.scheduler
+
+    async def scenario():
+        async with scheduler.use("documentation"):  # 1.5GB, used first
+            pass
+        async with scheduler.use("medical_qa"):  # 10GB
+            pass
+        async with scheduler.use("clinical") as clinical:  # 9GB: only 8.5GB free
+            status = {name: inst.status for name, inst in manager.instances.items()}
+            return clinical.status, status, scheduler.headroom_gb(0)
+
+    clinical, status, headroom = _run(manager, scenario)
+    assert clinical == "running"
+    assert status["documentation"] == "stopped" and status["medical_qa"] == "running"
+    assert headroom == pytest.approx(1.0)
+    assert scheduler.demand["documentation"].evictions == 1
+
+
+def test_pinned_and_busy_instances_are_not_evicted(make_manager):
+    manager = make_manager({0: 12.0}, pinned=["medical_qa"])
+    scheduler = manager.scheduler
+
+    async def scenario():
+        assert await manager.start_all()  # Pinned instances only
+        started = {name for name, inst in manager.instances.items() if inst.status == "running"}
+        async with scheduler.use("documentation"):
+            # documentation is in use and medical_qa is pinned: no room for clinical
+            with pytest.raises(ModelCapacityError):
+                await scheduler.ensure_loaded("clinical")
+        return started
+
+    assert _run(manager, scenario) == {"medical_qa"}
+    assert manager.instances["clinical"].status == "stopped"
+
+
+def test_idle_instances_are_stopped_but_pinned_stay(make_manager):
+    manager = make_manager({0: 24.0, 1: 12.0}, pinned=["medical_qa"], idle_ttl_s=0.0)
+    scheduler = manager.scheduler
+
+    async def scenario():
+        await manager.start_all()
+        async with scheduler.use("chat"):
+            assert await scheduler.evict_idle() == []  # In flight
+        stopped = await scheduler.evict_idle()
+        return stopped, manager.instances["medical_qa"].status, manager.get_status()["lifecycle"]
+
+    stopped, pinned_status, lifecycle = _run(manager, scenario)
+    assert stopped == ["chat"] and pinned_status == "running"
+    assert lifecycle["instances"]["chat"]["idle_stops"] == 1
+    assert lifecycle["gpus"]["1"]["reserved_gb"] == 0
+
+
+def test_loaded_instance_is_not_reaped_before_its_idle_ttl(make_manager):
+    manager = make_manager({0: 24.0, 1: 12.0}, idle_ttl_s=60.0)
+    scheduler = manager.scheduler
+
+    async def scenario():
+        # Admin load route / cold start outside use(): no request has touched it yet
+        await scheduler.ensure_loaded("chat")
+        loaded = await scheduler.evict_idle()
+        manager.instances["documentation"].status = "running"  # Started outside the scheduler, never used
+        untouched = await scheduler.evict_idle()
+        manager.instances["documentation"].status = "stopped"
+        return loaded, untouched, scheduler.get_stats()["instances"]["chat"]["idle_s"]
+
+    loaded, untouched, idle_s = _run(manager, scenario)
+    assert loaded == [] and untouched == []
+    assert idle_s is not None and idle_s < 5
+
+
+def test_router_traffic_cold_starts_managed_instances(make_manager, monkeypatch):
+    from app.circuit_breaker import CircuitBreakerRegistry
+    from app.model_router import ModelRouter
+    from app.replica_pool import ReplicaRegistry
+
+    manager = make_manager({0: 24.0, 1: 12.0})
+    chat = manager.instances["chat"]
+    router = ModelRouter()
+    monkeypatch.setattr(router, "breakers", CircuitBreakerRegistry())
+    monkeypatch.setattr(router, "replicas", ReplicaRegistry({"qwen-0.6b-med": [f"127.0.0.1:{chat.port}"]}))
+    router.instance_manager = manager
+
+    async def generate():
+        return await router._llama_cpp_generate(
+            messages=[{"role": "user", "content": "hello"}],
+            model_config=router.registry.MODELS["qwen-0.6b-med"],
+            max_tokens=16,
+            temperature=0.0,
+        )
+
+    async def scenario():
+        await manager.start_all()  # Nothing pinned: every instance starts on demand
+        assert chat.status == "stopped"
+        results = await asyncio.gather(*(generate() for _ in range(3)))
+        return results, manager.scheduler.get_stats()["instances"]["chat"]
+
+    results, stats = _run(manager, scenario)
+    assert [text for text, _ in results] == ["echo: hello"] * 3
+    assert stats["cold_starts"] == 1 and stats["requests"] == 3 and stats["in_flight"] == 0
+    assert manager.instance_for_url(f"http://10.0.0.2:{chat.port}") is None  # Remote replicas are not managed
+
+
+def test_stop_drains_router_requests_and_routing_skips_draining_instances(make_manager, monkeypatch):
+    from app.circuit_breaker import CircuitBreakerRegistry
+    from app.model_router import ModelRouter
+    from app.replica_pool import ReplicaRegistry
+
+    monkeypatch.setenv("FAKE_LLAMA_REPLY_DELAY_S", "0.5")
+    manager = make_manager({0: 24.0, 1: 12.0}, pinned=["chat"])
+    chat = manager.instances["chat"]
+    url = f"http://127.0.0.1:{chat.port}"
+    router = ModelRouter()
+    monkeypatch.setattr(router, "breakers", CircuitBreakerRegistry())
+    monkeypatch.setattr(router, "replicas", ReplicaRegistry({"qwen-0.6b-med": [url]}))
+    router.instance_manager = manager
+
+    async def scenario():
+        await manager.start_all()
+        request = asyncio.create_task(router._llama_cpp_generate(
+            messages=[{"role": "user", "content": "hello"}],
+            model_config=router.registry.MODELS["qwen-0.6b-med"],
+            max_tokens=16,
+            temperature=0.0,
+        ))
+        for _ in range(200):
+            if manager.in_flight["chat"]:
+                break
+            await asyncio.sleep(0.01)
+        stop = asyncio.create_task(manager.stop_instance("chat"))
+        await asyncio.sleep(0.1)
+        draining = chat.status, router.accepting(url), router.accepting("http://10.0.0.2:8080")
+        text, _ = await request  # Finished before the server was terminated
+        await stop
+        return draining, text
+
+    (status, accepting, remote), text = _run(manager, scenario)
+    assert status == "draining" and not accepting and remote
+    assert text == "echo: hello"
+    assert manager.in_flight["chat"] == 0 and chat.status == "stopped"
+
+
+def test_failed_start_is_reported_and_retried(make_manager):
+    manager = make_manager({0: 24.0, 1: 12.0})
+    os.remove(manager.instances["chat"].model_path)
+
+    async def scenario():
+        with pytest.raises(ModelCapacityError):
+            await manager.scheduler.ensure_loaded("chat")
+        open(manager.instances["chat"].model_path, "w").close()
+        return (await manager.scheduler.ensure_loaded("chat")).status
+
+    assert _run(manager, scenario) == "running"
+    assert manager.scheduler.demand["chat"].failed_starts == 1
+
+
+
+def test_lifecycle_routes_require_admin():
+    import httpx
+    from fastapi import FastAPI
+
+    from app.auth import User, get_current_user
+    from app.gpu_load_balancing_routes import router
+
+    app = FastAPI()
+    app.include_router(router)
+
+    async def call(user, path):
+        app.dependency_overrides = {get_current_user: lambda: user} if user else {}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.post(path)).status_code
+
+    nurse = User(username="nurse", location_id="loc-1")
+    admin = User(username="ops", location_id="loc-1", is_admin=True)
+    for path in ("/v1/gpu/rebalance", "/v1/gpu/lifecycle/chat/load", "/v1/gpu/lifecycle/chat/unload"):
+        assert asyncio.run(call(None, path)) in (401, 403)
+        assert asyncio.run(call(nurse, path)) == 403
+    assert asyncio.run(call(admin, "/v1/gpu/lifecycle/no_such_instance/unload")) == 404
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
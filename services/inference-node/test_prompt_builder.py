@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test token-budgeted prompt assembly: exact counts from llama-server /tokenize,
+RAG / history truncation, max_tokens reduction and real usage in chat
+completions (mock llama-server over httpx.MockTransport, no model required).
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.persona import get_system_prompt
+from app.prompt_builder import (
+    LlamaCppTokenCounter,
+    TokenCounterRegistry,
+    TokenizerCounter,
+    build_prompt,
+)
+from app.vllm_backend import MockTokenizer
+
+
+def _tokenizer_transport(calls=None):
+    """llama-server /tokenize (whitespace tokens) and /apply-template (ChatML)."""
+    def handler(request):
+        body = json.loads(request.content)
+        if calls is not None:
+            calls.append(request.url.path)
+        if request.url.path == "/tokenize":
+            return httpx.Response(200, json={"tokens": list(range(len(body["content"].split())))})
+        if request.url.path == "/apply-template":
+            text = "".join(f"<|im_start|>{m['role']} {m['content']} <|im_end|> " for m in body["messages"])
+            return httpx.Response(200, json={"prompt": text + "<|im_start|>assistant"})
+        return httpx.Response(404)
+    return httpx.MockTransport(handler)
+
+
+def _words(n, word="word"):
+    return " ".join([word] * n)
+
+
+def _build(counter, messages, **kwargs):
+    return asyncio.run(build_prompt(counter, "MedicalQA", messages, **kwargs))
+
+
+def test_counts_are_exact_and_cached():
+    calls = []
+    counter = LlamaCppTokenCounter("http://llama:8080", transport=_tokenizer_transport(calls))
+
+    async def scenario():
+        first = await counter.count_many(["a b c", "d e", ""])
+        again = await counter.count_many(["a b c", "d e"])
+        return first, again, await counter.message_overhead()
+
+    first, again, overhead = asyncio.run(scenario())
+    assert first == [3, 2, 0] and again == [3, 2]
+    assert calls.count("/tokenize") == 2 + 2  # Two texts, then the template probe and its bare content
+    assert overhead == 3  # "<|im_start|>user", "<|im_end|>", "<|im_start|>assistant"
+    assert counter.exact and counter.cache_hits == 2
+
+
+def test_everything_fits_untouched():
+    counter = LlamaCppTokenCounter("http://llama:8080", transport=_tokenizer_transport())
+    messages = [{"role": "user", "content": "what is anaemia"}]
+    built = _build(counter, messages, context_tokens=4096, max_tokens=256,
+                   rag_context="Retrieved evidence:\n[1] (relevance: 0.90) iron deficiency", use_persona=True)
+    assert built.truncated == {} and built.max_tokens == 256 and built.exact
+    assert built.messages[0]["content"] == get_system_prompt(
+        "MedicalQA", include_rag_context="Retrieved evidence:\n[1] (relevance: 0.90) iron deficiency"
+    )
+    assert built.messages[1:] == messages
+
+
+def test_low_ranked_evidence_and_old_turns_are_dropped_first():
+    counter = LlamaCppTokenCounter("http://llama:8080", transport=_tokenizer_transport())
+    rag = "Retrieved evidence:\n" + "\n".join(f"[{i}] (relevance: 0.{9 - i}0) {_words(300, f'doc{i}')}" for i in (1, 2, 3))
+    history = []
+    for i in range(6):
+        history += [{"role": "user", "content": _words(200, f"q{i}")},
+                    {"role": "assistant", "content": _words(200, f"a{i}")}]
+    latest = {"role": "user", "content": "and the dose?"}
+    built = _build(counter, history + [latest], context_tokens=2048, max_tokens=256,
+                   rag_context=rag, use_persona=True)
+
+    system = built.messages[0]["content"]
+    assert "doc1" in system and "doc3" not in system
+    assert built.messages[-1] == latest
+    assert built.messages[1]["role"] == "user"  # History never opens with an assistant turn
+    assert built.messages[-2]["content"].startswith("a5")  # Newest turns survive
+    assert built.truncated["rag_entries_dropped"] >= 1 and built.truncated["history_messages_dropped"] >= 2
+    assert built.prompt_tokens + built.max_tokens <= 2048
+
+
+def test_oversized_turn_reduces_max_tokens_then_is_cut_in_the_middle():
+    counter = LlamaCppTokenCounter("http://llama:8080", transport=_tokenizer_transport())
+    note = "HEAD " + _words(3000, "vitals") + " TAIL"
+    built = _build(counter, [{"role": "user", "content": note}], context_tokens=2048, max_tokens=512)
+    content = built.messages[-1]["content"]
+    assert built.max_tokens == 128 and built.truncated["max_tokens_reduced_by"] == 384
+    assert content.startswith("HEAD") and content.endswith("TAIL") and "[...]" in content
+    assert built.prompt_tokens + built.max_tokens <= 2048
+
+
+def test_unreachable_tokenizer_falls_back_to_calibrated_estimate():
+    def refuse(request):
+        raise httpx.ConnectError("connection refused")
+
+    counter = LlamaCppTokenCounter("http://llama:8080", transport=httpx.MockTransport(refuse))
+    built = _build(counter, [{"role": "user", "content": "x" * 400}], context_tokens=4096, max_tokens=256)
+    assert not built.exact and built.prompt_tokens == 100 + 8
+    assert counter.errors == 1
+    counter.calibrate(chars=300, tokens=100)  # Backend reported 3 chars/token
+    assert counter.fallback.chars_per_token == pytest.approx(3.9)
+
+
+def test_in_process_tokenizer_counter():
+    counter = TokenizerCounter(MockTokenizer())
+    assert asyncio.run(counter.count_many(["one two three"])) == [3]
+    assert asyncio.run(counter.message_overhead()) == 2
+
+
+def test_chat_completions_report_backend_usage(monkeypatch):
+    import app.main as main
+
+    posts = []
+
+    def llama_server(request):
+        posts.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "model": "bi-medix2",
+            "choices": [{"message": {"content": "Rest and fluids."}}],
+            "usage": {"prompt_tokens": 321, "completion_tokens": 5},
+        })
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main, "token_counters", TokenCounterRegistry(transport=_tokenizer_transport()))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "I have a cold"}]}
+            return (await client.post("/v1/chat/completions", json=body)).json()
+
+    result = asyncio.run(scenario())
+    assert result["usage"] == {"prompt_tokens": 321, "completion_tokens": 5, "total_tokens": 326}
+    assert posts[0]["messages"] == [{"role": "user", "content": "I have a cold"}]
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
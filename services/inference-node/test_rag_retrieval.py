@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test RAG retrieval data-access layer (no PostgreSQL required).
+Uses a fake AsyncSession that records executed statements.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import app.database as database
+
+
+def _hit_row(document_id: str, distance: float = 0.2):
+    """Row shaped like the projected search_document_hits SELECT."""
+    return SimpleNamespace(
+        id=1,
+        document_id=document_id,
+        title="Hypertension guideline",
+        content="First-line therapy for stage 1 hypertension",
+        document_type="clinical_guideline",
+        specialty="cardiology",
+        source_url=None,
+        quality_score=0.9,
+        distance=distance,
+        page_number="12",
+        created_at=None,
+    )
+
+
+class FakeResult:
+    """Minimal stand-in for SQLAlchemy Result."""
+
+    def __init__(self, rows=None, scalar=None):
+        self.rows = rows or []
+        self.scalar = scalar
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self.rows)
+
+    def scalar_one_or_none(self):
+        return self.scalar
+
+    def one(self):
+        return self.rows[0]
+
+
+class FakeSession:
+    """Records statements; returns canned rows for vector queries and applies set_config()."""
+
+    def __init__(self, document_rows=None, patient_rows=None, settings=None):
+        self.statements = []
+        self.document_rows = document_rows or []
+        self.patient_rows = patient_rows or []
+        self.settings = dict(settings or {})
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        if "set_config" in sql:
+            names = [params[f"n{i}"] for i in range(len(params) // 2)]
+            priors = tuple(self.settings.get(name) for name in names)
+            self.settings.update({name: params[f"v{i}"] for i, name in enumerate(names)})
+            return FakeResult([priors + tuple(params[f"v{i}"] for i in range(len(names)))])
+        if "pg_extension" in sql:
+            return FakeResult(scalar="0.8.0")
+        if "FROM medical_documents" in sql:
+            return FakeResult(self.document_rows)
+        if "FROM patient_context" in sql:
+            return FakeResult(self.patient_rows)
+        return FakeResult()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _with_fake_pool(monkeypatch_target):
+    """Replace AsyncSessionLocal with a factory that counts checkouts."""
+    checkouts = []
+
+    def factory():
+        session = FakeSession(document_rows=[_hit_row(f"doc-{i}") for i in range(5)], patient_rows=["ctx"])
+        checkouts.append(session)
+        return session
+
+    monkeypatch_target.setattr(database, "AsyncSessionLocal", factory)
+    return checkouts
+
+
+def test_combined_search_uses_one_checkout(monkeypatch):
+    checkouts = _with_fake_pool(monkeypatch)
+
+    documents, contexts = asyncio.run(database.search_rag_context(
+        query_embedding=[0.1] * 4,
+        patient_id="P-1",
+    ))
+
+    assert len(checkouts) == 1, "both searches should share one pooled connection"
+    assert [d.document_id for d in documents] == [f"doc-{i}" for i in range(5)]
+    assert contexts == ["ctx"]
+
+
+def test_callers_session_is_reused(monkeypatch):
+    checkouts = _with_fake_pool(monkeypatch)
+    session = FakeSession(document_rows=["doc"] * 3)
+
+    documents = asyncio.run(database.search_medical_documents(
+        query_embedding=[0.1] * 4,
+        limit=3,
+        session=session,
+    ))
+
+    assert checkouts == [], "no pool checkout when the request's session is passed"
+    assert documents == ["doc"] * 3
+    assert any("medical_documents" in sql for sql in session.statements)
+
+
+def test_filtered_search_falls_back_to_exact_scan(monkeypatch):
+    _with_fake_pool(monkeypatch)
+    monkeypatch.setattr(database, "_pgvector_version", (0, 8, 0))
+    # Caller's own choices plus pgvector defaults
+    caller_settings = {"enable_indexscan": "off", "hnsw.ef_search": "40",
+                       "hnsw.iterative_scan": "off", "hnsw.max_scan_tuples": "20000"}
+    session = FakeSession(document_rows=["doc"], settings=caller_settings)  # fewer rows than limit
+
+    documents = asyncio.run(database.search_medical_documents(
+        query_embedding=[0.1] * 4,
+        limit=5,
+        specialty="nephrology",
+        session=session,
+    ))
+
+    vector_queries = [sql for sql in session.statements if "FROM medical_documents" in sql]
+    assert len(vector_queries) == 2, "short filtered ANN result should be re-run as exact scan"
+    assert documents == ["doc"]
+    # HNSW settings, enable_indexscan off, then the caller's values restored
+    assert sum("set_config" in sql for sql in session.statements) == 3
+    assert session.settings == caller_settings
+
+
+def test_hits_project_columns_and_slice_content(monkeypatch):
+    _with_fake_pool(monkeypatch)
+    session = FakeSession(document_rows=[_hit_row("doc-1", distance=0.25)])
+
+    hits = asyncio.run(database.search_document_hits(
+        query_embedding=[0.1] * 4,
+        limit=1,
+        content_chars=200,
+        session=session,
+    ))
+
+    sql = next(sql for sql in session.statements if "FROM medical_documents" in sql)
+    select_list = sql.split("FROM medical_documents")[0]
+    assert "medical_documents.embedding," not in select_list, "embedding must not be fetched"
+    assert "extra_data ->>" in select_list and "medical_documents.extra_data," not in select_list
+    assert "left(medical_documents.content" in select_list
+
+    hit = hits[0]
+    assert hit.similarity == 0.75
+    assert hit.page_number == 12
+    assert hit.to_dict()["similarity"] == 0.75
+
+
+
+def test_quantized_index_reranks_on_full_embedding(monkeypatch):
+    _with_fake_pool(monkeypatch)
+    monkeypatch.setattr(database, "VECTOR_INDEX_MODE", "binary")
+    session = FakeSession(document_rows=[_hit_row("doc-1")] * 5)
+
+    asyncio.run(database.search_document_hits(
+        query_embedding=[0.1] * 4,
+        limit=5,
+        session=session,
+    ))
+
+    sql = next(sql for sql in session.statements if "FROM medical_documents" in sql)
+    # Candidates come from the Hamming index expression, final order from exact cosine
+    assert f"CAST(binary_quantize(medical_documents.embedding) AS BIT({database.VECTOR_DIM})) <~>" in sql
+    assert "medical_documents.id IN (SELECT medical_documents.id" in sql
+    assert sql.rstrip().split("ORDER BY")[-1].strip().startswith("medical_documents.embedding <=>")
+    index_sql = database.hnsw_index_statements()[0]
+    assert f"(binary_quantize(embedding)::bit({database.VECTOR_DIM})) bit_hamming_ops" in index_sql
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
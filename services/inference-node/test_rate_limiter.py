@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Test GCRA rate limiting (no Redis required).
+"""
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.rate_limiter as rate_limiter
+from app.middleware import RequestPipelineMiddleware
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _limiter(monkeypatch, max_keys=100):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return rate_limiter.MemoryRateLimiter(max_keys=max_keys), clock
+
+
+def test_burst_then_steady_rate(monkeypatch):
+    limiter, clock = _limiter(monkeypatch)
+
+    results = [asyncio.run(limiter.check("ip:Chat", 5, 60)).allowed for _ in range(6)]
+    assert results == [True] * 5 + [False]
+
+    denied = asyncio.run(limiter.check("ip:Chat", 5, 60))
+    assert denied.retry_after == 12.0  # one request per 60/5 seconds
+
+    clock.now += 12
+    assert asyncio.run(limiter.check("ip:Chat", 5, 60)).allowed
+
+
+def test_idle_keys_are_evicted(monkeypatch):
+    limiter, clock = _limiter(monkeypatch)
+
+    for i in range(50):
+        asyncio.run(limiter.check(f"ip-{i}:Chat", 10, 60))
+    assert len(limiter) == 50
+
+    # Each key used 1/10 of its budget: fully replenished after 6 seconds
+    clock.now += 6
+    asyncio.run(limiter.check("new:Chat", 10, 60))
+    assert len(limiter) == 1
+
+
+def test_key_count_is_bounded(monkeypatch):
+    limiter, _ = _limiter(monkeypatch, max_keys=10)
+
+    for i in range(100):
+        asyncio.run(limiter.check(f"ip-{i}:Chat", 10, 60))
+
+    assert len(limiter) == 10
+
+
+def test_per_agent_quotas_and_retry_after():
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    class Pipeline(RequestPipelineMiddleware):
+        AGENT_RATE_LIMITS = {"Claims": 2, **rate_limiter.parse_quotas("Billing=1, bad, Chat=0, Triage=-5")}
+
+    app.add_middleware(Pipeline, max_requests=100, window_seconds=60)
+    client = TestClient(app)
+
+    claims = [client.get("/ping", headers={"X-Agent-Type": "Claims"}).status_code for _ in range(3)]
+    assert claims == [200, 200, 429]
+
+    billing = [client.get("/ping", headers={"X-Agent-Type": "Billing"}) for _ in range(2)]
+    assert billing[1].status_code == 429
+    assert billing[1].headers["Retry-After"] == "60"
+    assert billing[1].headers["X-RateLimit-Limit"] == "1"
+
+    # Other agents (and ones with a non-positive quota) fall back to max_requests
+    assert client.get("/ping", headers={"X-Agent-Type": "Chat"}).status_code == 200
+    assert client.get("/ping", headers={"X-Agent-Type": "Triage"}).status_code == 200
+    assert rate_limiter.parse_quotas("Chat=0,Triage=-1,Claims=30") == {"Claims": 30}
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
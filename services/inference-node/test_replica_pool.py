@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test replica pools: least-loaded selection, passive ejection and health probes
+(no model backends required).
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.replica_pool import ReplicaPool, ReplicaRegistry, parse_replicas
+
+
+def test_parse_replicas():
+    config = parse_replicas("bi-medix2=127.0.0.1:8080,127.0.0.1:8090;qwen-0.6b-med=8082")
+    assert config == {
+        "bi-medix2": ["http://127.0.0.1:8080", "http://127.0.0.1:8090"],
+        "qwen-0.6b-med": ["http://127.0.0.1:8082"],
+    }
+
+
+@pytest.mark.parametrize("selection", ["p2c", "least_outstanding"])
+def test_picks_replica_with_fewest_outstanding(selection):
+    pool = ReplicaPool("bi-medix2", ["8080", "8090"], selection=selection)
+    busy, idle = pool.replicas
+    busy.outstanding = 3
+    assert all(pool.pick() is idle for _ in range(20))
+
+
+def test_consecutive_failures_eject_replica():
+    pool = ReplicaPool("bi-medix2", ["8080", "8090"])
+    bad, good = pool.replicas
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            with pool.track(bad):
+                raise RuntimeError("connection refused")
+    assert bad.ejections == 1 and bad.outstanding == 0
+    assert all(pool.pick() is good for _ in range(20))
+    assert pool.get_stats()["available"] == 1
+
+
+def test_panic_mode_when_all_replicas_unavailable():
+    pool = ReplicaPool("bi-medix2", ["8080", "8090"])
+    for replica in pool.replicas:
+        pool.eject(replica)
+    assert pool.pick() in pool.replicas
+    assert pool.panic_picks == 1
+
+
+def test_active_probe_marks_loading_replica_unhealthy():
+    registry = ReplicaRegistry({"bi-medix2": ["http://a:8080", "http://b:8090"]})
+
+    def handler(request):
+        return httpx.Response(503 if request.url.host == "b" else 200)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await registry.probe_all(client)
+
+    asyncio.run(scenario())
+    pool = registry.pool("bi-medix2")
+    assert [r.healthy for r in pool.replicas] == [True, False]
+    assert all(pool.pick().url == "http://a:8080" for _ in range(10))
+
+
+def test_pool_for_port_finds_model_or_creates_single_replica_pool():
+    registry = ReplicaRegistry({"bi-medix2": ["8080", "8090"]}, {"bi-medix2": 8080})
+    assert registry.pool_for_port(8080) is registry.pool("bi-medix2")
+    assert [r.port for r in registry.pool_for_port(8083).replicas] == [8083]
+
+
+def test_pool_for_port_follows_the_model_when_its_replicas_move():
+    # MODEL_REPLICAS moved bi-medix2 off its historical port 8080
+    registry = ReplicaRegistry(
+        {"bi-medix2": ["http://10.0.0.2:8090", "http://10.0.0.3:8090"], "qwen-0.6b-med": ["8082"]},
+        {"bi-medix2": 8080, "qwen-0.6b-med": 8082},
+    )
+    assert registry.pool_for_port(8080) is registry.pool("bi-medix2")
+    assert registry.pool_for_port(8082) is registry.pool("qwen-0.6b-med")
+    assert "port:8080" not in registry.pools
+
+
+def test_chat_completions_spread_over_replicas(monkeypatch):
+    import app.main as main
+
+    posts = []
+
+    def llama_server(request):
+        posts.append(str(request.url))
+        if request.url.port == 8080:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"model": "bimedix", "choices": [{"message": {"content": "ok"}}]})
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    async def router_fallback(**kwargs):
+        return {"text": "fallback", "model": "router"}
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main.model_router, "generate", router_fallback)
+    monkeypatch.setattr(main, "replica_registry", ReplicaRegistry({"bi-medix2": ["8080", "8090"]}, {"bi-medix2": 8080}))
+
+    body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "dose?"}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # At most one success on 8090 before 8080 collects its 3 failures and is ejected
+            for _ in range(4):
+                await client.post("/v1/chat/completions", json=body)
+            for _ in range(5):
+                assert (await client.post("/v1/chat/completions", json=body)).json()["model"] == "bimedix"
+            return (await client.get("/v1/replicas")).json()
+
+    stats = asyncio.run(scenario())
+    replicas = {r["url"]: r for r in stats["bi-medix2"]["replicas"]}
+    assert replicas["http://127.0.0.1:8090"]["requests"] >= 5
+    assert replicas["http://127.0.0.1:8080"]["failures"] == 3
+    assert replicas["http://127.0.0.1:8080"]["ejections"] == 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test the semantic response cache (no embedding model or LLM backends required).
+"""
+import asyncio
+import json
+import time
+
+import httpx
+
+from app.semantic_cache import SemanticCache
+
+
+def test_near_duplicate_hits_and_distinct_question_misses():
+    cache = SemanticCache(agents={"Chat"}, threshold=0.95)
+    cache.store("loc-1", "Chat", [1.0, 0.0, 0.0], "clinic timings?", "9am-6pm", "bimedix")
+
+    hit = cache.lookup("loc-1", "Chat", [0.99, 0.05, 0.0])
+    assert hit is not None and hit.entry.answer == "9am-6pm"
+    assert hit.similarity > 0.95
+    assert cache.lookup("loc-1", "Chat", [0.0, 1.0, 0.0]) is None
+
+    stats = cache.get_stats()
+    assert stats["cache_hits"] == 1 and stats["cache_misses"] == 1
+    assert sum(stats["hit_similarity_upper_bounds"].values()) == 1
+
+
+def test_scoped_per_location_and_agent():
+    cache = SemanticCache(agents={"Chat", "Triage"})
+    cache.store("loc-1", "Chat", [1.0, 0.0], "q", "answer", "m")
+    assert cache.lookup("loc-2", "Chat", [1.0, 0.0]) is None
+    assert cache.lookup("loc-1", "Triage", [1.0, 0.0]) is None
+    assert cache.lookup("loc-1", "Chat", [1.0, 0.0]) is not None
+
+
+def test_question_text_is_not_stored():
+    cache = SemanticCache(agents={"Chat"})
+    entry = cache.store("loc-1", "Chat", [1.0, 0.0], "my MRN is 12345", "answer", "m")
+    assert "12345" not in repr(entry)
+
+
+def test_ttl_and_capacity():
+    cache = SemanticCache(agents={"Chat"}, ttl_seconds=60, max_entries=2)
+    old = cache.store("loc-1", "Chat", [1.0, 0.0, 0.0], "a", "A", "m")
+    old.created_at = time.time() - 120
+    assert cache.lookup("loc-1", "Chat", [1.0, 0.0, 0.0]) is None
+    assert cache.get_stats()["expired"] == 1
+
+    for i, vector in enumerate([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]):
+        cache.store("loc-1", "Chat", vector, str(i), str(i), "m")
+    assert cache.get_stats()["cache_size"] == 2
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.lookup("loc-1", "Chat", [1.0, 0.0, 0.0]) is None
+
+
+def test_false_hit_feedback_evicts_entry():
+    cache = SemanticCache(agents={"Chat"})
+    cache.store("loc-1", "Chat", [1.0, 0.0], "q", "answer", "m")
+    cache.record_served("cmpl-1", cache.lookup("loc-1", "Chat", [1.0, 0.0]))
+
+    assert cache.report_false_hit("cmpl-1")
+    assert not cache.report_false_hit("cmpl-1")
+    assert cache.lookup("loc-1", "Chat", [1.0, 0.0]) is None
+    assert cache.get_stats()["false_hits"] == 1
+
+
+def test_only_single_turn_questions_for_opted_in_agents():
+    cache = SemanticCache(agents={"Chat"})
+    single = [{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}]
+    follow_up = single + [{"role": "assistant", "content": "a"}, {"role": "user", "content": "and?"}]
+    assert cache.enabled_for("Chat", single)
+    assert not cache.enabled_for("Chat", follow_up)
+    assert not cache.enabled_for("Claims", single)
+
+
+def test_chat_completions_served_from_cache_end_to_end(monkeypatch):
+    import app.main as main
+    from app.auth import User, get_current_user
+
+    posts = []
+
+    def llama_server(request):
+        posts.append(json.loads(request.content))
+        return httpx.Response(200, json={"model": "bimedix", "choices": [{"message": {"content": "Open 9am-6pm"}}]})
+
+    class FakeEmbeddings:
+        model = object()
+
+        def encode_single(self, text):
+            return [1.0, 0.1] if "timing" in text else [0.0, 1.0]
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main.rag_engine, "embeddings_engine", FakeEmbeddings())
+    monkeypatch.setattr(main, "semantic_cache", SemanticCache(agents={"Chat"}))
+
+    def body(question):
+        return {"agent_type": "Chat", "messages": [{"role": "user", "content": question}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.post("/v1/chat/completions", json=body("clinic timings?"))
+            second = await client.post("/v1/chat/completions", json=body("what are the clinic timings"))
+            other = await client.post("/v1/chat/completions", json=body("is MRI covered?"))
+            anonymous = await client.post("/v1/semantic-cache/feedback", json={"response_id": second.json()["id"]})
+            main.app.dependency_overrides = {get_current_user: lambda: User(username="nurse", location_id="loc-1")}
+            try:
+                feedback = await client.post("/v1/semantic-cache/feedback", json={"response_id": second.json()["id"]})
+            finally:
+                main.app.dependency_overrides = {}
+            return first, second, other, anonymous, feedback
+
+    first, second, other, anonymous, feedback = asyncio.run(scenario())
+    assert len(posts) == 2
+    assert first.json()["policy"]["semantic_cache"] == {"hit": False}
+    assert second.json()["policy"]["semantic_cache"]["hit"] is True
+    assert second.json()["model"] == "semantic_cache:bimedix"
+    assert second.json()["choices"][0]["message"]["content"] == "Open 9am-6pm"
+    assert other.json()["policy"]["semantic_cache"] == {"hit": False}
+    assert anonymous.status_code in (401, 403)  # Evicting entries requires a logged-in user
+    assert feedback.status_code == 200
+    assert main.semantic_cache.get_stats()["false_hits"] == 1
+
+
+
+def test_stub_reply_during_outage_is_not_cached(monkeypatch):
+    import app.main as main
+
+    def replica_down(request):
+        return httpx.Response(503)
+
+    async def backend_down(**kwargs):
+        raise httpx.ConnectError("connection refused")
+
+    class FakeEmbeddings:
+        model = object()
+
+        def encode_single(self, text):
+            return [1.0, 0.1]
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(replica_down))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main.model_router, "_llama_cpp_generate", backend_down)
+    monkeypatch.setattr(main.rag_engine, "embeddings_engine", FakeEmbeddings())
+    monkeypatch.setattr(main, "semantic_cache", SemanticCache(agents={"Chat"}))
+
+    body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "clinic timings?"}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.post("/v1/chat/completions", json=body) for _ in range(2)]
+
+    first, second = asyncio.run(scenario())
+    assert first.json()["model"] == "fallback"
+    assert second.json()["policy"]["semantic_cache"] == {"hit": False}
+    assert main.semantic_cache.get_stats()["stores"] == 0
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test llama.cpp slot affinity for prompt-prefix reuse (no model backends required).
+"""
+import asyncio
+import json
+
+import httpx
+
+from app.admission import _parse_budgets
+from app.slot_affinity import SlotAffinity, _parse_replica_slots
+
+
+PERSONA = [{"role": "system", "content": "You are Dr. iSHA..."}]
+
+
+def test_same_prefix_returns_to_its_slot():
+    affinity = SlotAffinity(default_slots=2, slots_per_replica={})
+    key = affinity.prefix_key("Chat", PERSONA + [{"role": "user", "content": "hi"}])
+    assert key == affinity.prefix_key("Chat", PERSONA + [{"role": "user", "content": "clinic hours?"}])
+
+    first = affinity.acquire(8080, key)
+    affinity.release(8080, first)
+    other = affinity.acquire(8080, affinity.prefix_key("Claims", [{"role": "system", "content": "claims"}]))
+    affinity.release(8080, other)
+    assert other != first
+    assert affinity.acquire(8080, key) == first
+
+    stats = affinity.get_stats()["replicas"]["http://127.0.0.1:8080"]
+    assert stats["affinity_hits"] == 1 and stats["affinity_misses"] == 2
+    assert stats["busy_slots"] == 1
+
+
+def test_conversations_pin_on_first_user_turn():
+    affinity = SlotAffinity(default_slots=4, slots_per_replica={})
+    conversation = PERSONA + [
+        {"role": "user", "content": "I have a headache"},
+        {"role": "assistant", "content": "Since when?"},
+    ]
+    turn_2 = affinity.prefix_key("Chat", conversation + [{"role": "user", "content": "two days"}])
+    turn_3 = affinity.prefix_key("Chat", conversation + [
+        {"role": "user", "content": "two days"}, {"role": "assistant", "content": "..."},
+        {"role": "user", "content": "and fever"},
+    ])
+    assert turn_2 == turn_3
+    assert turn_2 != affinity.prefix_key("Chat", PERSONA + [{"role": "user", "content": "I have a headache"}])
+
+
+def test_busy_slots_and_overwritten_prefixes():
+    affinity = SlotAffinity(default_slots=1, slots_per_replica={})
+    slot = affinity.acquire(8082, "a")
+    assert affinity.acquire(8082, "a") == slot  # Queue behind the slot holding the prefix
+    assert affinity.acquire(8082, "b") == -1  # No idle slot, let llama-server choose
+    affinity.release(8082, slot)
+    affinity.release(8082, slot)
+
+    assert affinity.acquire(8082, "b") == slot
+    affinity.release(8082, slot)
+    assert "a" not in affinity.replicas["http://127.0.0.1:8082"].affinity  # Slot now caches "b"
+    assert affinity.request_fields(-1) == {"cache_prompt": True}
+    assert affinity.request_fields(0) == {"cache_prompt": True, "id_slot": 0}
+
+
+def test_replicas_on_the_same_port_of_different_hosts_keep_separate_slots():
+    affinity = SlotAffinity(default_slots=1, slots_per_replica=_parse_replica_slots("10.0.0.2:8080=2"))
+    slot = affinity.acquire("http://10.0.0.1:8080", "a")
+    assert affinity.acquire("http://10.0.0.2:8080", "b") == slot  # Idle slot on the other host
+    assert affinity.slot_count("http://10.0.0.2:8080") == 2 and affinity.slot_count("http://10.0.0.1:8080") == 1
+    assert affinity.slot_count(8080) == 1  # Bare port: the local server
+    assert set(affinity.get_stats()["replicas"]) == {"http://10.0.0.1:8080", "http://10.0.0.2:8080", "http://127.0.0.1:8080"}
+    assert _parse_budgets("8080=16384,10.0.0.2:8080=4096") == {
+        "http://127.0.0.1:8080": 16384, "http://10.0.0.2:8080": 4096,
+    }
+
+
+def test_prefix_hit_tokens_from_timings():
+    affinity = SlotAffinity(default_slots=1, slots_per_replica={})
+    affinity.record_timings(8080, {"timings": {"cache_n": 900, "prompt_n": 100}})
+    affinity.record_timings(8080, {"usage": {"prompt_tokens": 1000}})
+    stats = affinity.get_stats()["replicas"]["http://127.0.0.1:8080"]
+    assert stats["prompt_tokens"] == 2000
+    assert stats["prefix_hit_tokens"] == 900
+    assert stats["prefix_hit_percent"] == 45.0
+
+
+def test_chat_completions_send_slot_fields(monkeypatch):
+    import app.main as main
+
+    posts = []
+
+    def llama_server(request):
+        posts.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "model": "bimedix",
+            "choices": [{"message": {"content": "Hello"}}],
+            "timings": {"cache_n": 0 if len(posts) == 1 else 600, "prompt_n": 620 if len(posts) == 1 else 20},
+        })
+
+    llm_client = httpx.AsyncClient(transport=httpx.MockTransport(llama_server))
+
+    async def fake_client():
+        return llm_client
+
+    async def no_external():
+        return None
+
+    monkeypatch.setattr(main, "get_llm_client", fake_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setattr(main, "slot_affinity", SlotAffinity(default_slots=4, slots_per_replica={}))
+
+    body = {"agent_type": "Chat", "messages": PERSONA + [{"role": "user", "content": "hi"}]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for _ in range(2):
+                assert (await client.post("/v1/chat/completions", json=body)).status_code == 200
+            return (await client.get("/v1/llama/slots")).json()
+
+    stats = asyncio.run(scenario())
+    assert [p["cache_prompt"] for p in posts] == [True, True]
+    assert posts[0]["id_slot"] == posts[1]["id_slot"]
+    replica = stats["replicas"]["http://127.0.0.1:8080"]
+    assert replica["affinity_hits"] == 1 and replica["busy_slots"] == 0
+    assert replica["prefix_hit_tokens"] == 600
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-v"]))
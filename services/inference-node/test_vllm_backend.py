@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test the vLLM backend against MockAsyncLLMEngine: continuous batching,
+streaming with abort, chat templating, ModelRouter registration and
+/v1/chat/completions routing (CPU only).
+"""
+import asyncio
+import json
+from contextlib import aclosing
+
+import httpx
+import pytest
+
+from app.circuit_breaker import CircuitBreakerRegistry
+from app.model_router import ModelRouter
+from app.vllm_backend import MockAsyncLLMEngine, MockTokenizer, vLLMBackend, engine_config_for
+
+MESSAGES = [
+    {"role": "system", "content": "You are a clinical assistant."},
+    {"role": "user", "content": "one two three four five six seven eight"},
+]
+
+
+def _backend(**engine_kwargs):
+    config = engine_config_for("biomistral-7b-fp16", ModelRouter().registry.MODELS["biomistral-7b-fp16"])
+    return vLLMBackend(config, engine=MockAsyncLLMEngine(**engine_kwargs))
+
+
+def test_concurrent_requests_share_decode_steps():
+    backend = _backend(step_s=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(backend.generate(MESSAGES, max_tokens=6) for _ in range(8)))
+
+    results = asyncio.run(scenario())
+    assert all(r["text"] == "echo: one two three four five" for r in results)
+    assert all(r["finish_reason"] == "length" and r["usage"]["completion_tokens"] == 6 for r in results)
+    # 8 requests x 6 tokens decoded in 6 batched steps, not 48 sequential ones
+    assert backend.engine.max_batch == 8 and backend.engine.steps == 6
+    assert backend.get_stats()["peak_active"] == 8 and backend.completed == 8
+
+
+def test_stream_yields_deltas_and_close_aborts():
+    backend = _backend()
+
+    async def scenario():
+        deltas = [d async for d in backend.stream(MESSAGES, max_tokens=64)]
+        partial = []
+        async with aclosing(backend.stream(MESSAGES, max_tokens=64)) as stream:
+            async for delta in stream:
+                partial.append(delta)
+                if len(partial) == 2:
+                    break
+        return deltas, partial
+
+    deltas, partial = asyncio.run(scenario())
+    assert "".join(deltas) == "echo: one two three four five six seven eight"
+    assert partial == ["echo:", " one"]
+    assert len(backend.engine.aborted) == 1 and backend.aborted == 1 and backend.active == 0
+
+
+class MistralStyleTokenizer(MockTokenizer):
+    """Template that, like Mistral's, only accepts alternating user/assistant turns."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        if any(m["role"] == "system" for m in messages):
+            raise ValueError("Conversation roles must alternate user/assistant/user/assistant/...")
+        return "".join(f"[INST] {m['content']} [/INST]" for m in messages if m["role"] == "user")
+
+
+def test_chat_template_folds_system_prompt_when_unsupported():
+    backend = _backend()
+    backend.tokenizer = MistralStyleTokenizer()
+    assert backend.format_prompt(MESSAGES) == (
+        "[INST] You are a clinical assistant.\n\none two three four five six seven eight [/INST]"
+    )
+    backend.tokenizer = MockTokenizer()
+    assert backend.format_prompt(MESSAGES).endswith("<|im_start|>assistant\n")
+
+
+def _router(monkeypatch, backend):
+    router = ModelRouter()
+    monkeypatch.setattr(router, "breakers", CircuitBreakerRegistry())
+    router.register_backend("biomistral-7b-fp16", backend)
+    router.agent_overrides = {"Chat": "biomistral-7b-fp16"}
+
+    async def fake_llama(messages, model_config, max_tokens, temperature, agent_type=""):
+        key = router._get_model_key(model_config)
+        return f"answer from {key}", key
+
+    monkeypatch.setattr(router, "_llama_cpp_generate", fake_llama)
+    return router
+
+
+def test_router_serves_registered_agents_through_vllm(monkeypatch):
+    router = _router(monkeypatch, _backend())
+
+    async def scenario():
+        result = await router.generate("Chat", MESSAGES, max_tokens=3)
+        streamed = [d async for d in router.stream("Chat", MESSAGES, max_tokens=3)]
+        other = await router.generate("Triage", MESSAGES, max_tokens=3)
+        return result, streamed, other
+
+    result, streamed, other = asyncio.run(scenario())
+    assert result["backend"] == "vllm" and result["text"] == "echo: one two"
+    assert result["usage"]["completion_tokens"] == 3 and result["tokens_generated"] == 3
+    assert "".join(streamed) == "echo: one two"
+    assert other["text"] == "answer from qwen-0.6b-med"
+    assert router.get_model_info()["engines"]["biomistral-7b-fp16"]["completed"] == 2
+
+
+def test_vllm_failure_falls_back_to_llama_cpp_chain(monkeypatch):
+    class BrokenEngine(MockAsyncLLMEngine):
+        async def generate(self, prompt, sampling_params, request_id):
+            raise RuntimeError("CUDA out of memory")
+            yield
+
+    router = _router(monkeypatch, vLLMBackend(_backend().config, engine=BrokenEngine()))
+    result = asyncio.run(router.generate("Chat", MESSAGES, max_tokens=3))
+    assert result["fallback_used"] and result["model"] == "bi-medix2"
+    assert router.backends["biomistral-7b-fp16"].failed == 1
+
+
+def test_chat_completions_serve_vllm_agents_through_the_engine(monkeypatch):
+    import app.main as main
+
+    sent = []
+
+    async def llama_client():
+        async def handler(request):
+            sent.append(request.url)
+            return httpx.Response(500)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def no_external():
+        return None
+
+    backend = _backend()
+    monkeypatch.setattr(main, "get_llm_client", llama_client)
+    monkeypatch.setattr(main, "get_external_llm_client", no_external)
+    monkeypatch.setitem(main.model_router.backends, "biomistral-7b-fp16", backend)
+    monkeypatch.setattr(main.model_router, "agent_overrides", {"Chat": "biomistral-7b-fp16"})
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"agent_type": "Chat", "messages": [{"role": "user", "content": "one two three"}]}
+            reply = (await client.post("/v1/chat/completions", json=body)).json()
+            streamed = await client.post("/v1/chat/completions", json={**body, "stream": True})
+            return reply, streamed
+
+    reply, streamed = asyncio.run(scenario())
+    assert reply["model"] == main.model_router.registry.MODELS["biomistral-7b-fp16"].name
+    assert reply["choices"][0]["message"]["content"] == "echo: one two three"
+    assert reply["usage"]["completion_tokens"] == 4
+
+    assert streamed.headers["content-type"].startswith("text/event-stream")
+    events = [line[len("data: "):] for line in streamed.text.split("\n\n") if line]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(e) for e in events[:-1]]
+    assert all(c["object"] == "chat.completion.chunk" for c in chunks)
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks) == "echo: one two three"
+    assert len(chunks) > 3 and chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert backend.completed == 2 and sent == []
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Test the orchestrator's DAG scheduler: tasks start as soon as their own
+dependencies finish, per-model concurrency caps, timeouts with partial
+results, critical path / speedup reporting and memoized sub-tasks
+(fake router, no models).
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+
+from app.orchestrator import AgentResult, AgentTask, LLMOrchestrator, TaskMemo, WorkflowType
+
+
+class FakeRouter:
+    """Replies after the delay in the task prompt ("sleep=0.1"), tracking concurrency per model."""
+
+    def __init__(self, models=None):
+        self.models = models or {}
+        self.active = Counter()
+        self.peak = Counter()
+        self.calls = []
+        self.down = set()  # Agent types whose backend raises
+        self.stubbed = set()  # Agent types answered by ModelRouter's all-backends-down stub
+        self.fallback = set()  # Agent types answered by a fallback model ("qwen-0.6b-med")
+
+    def model_key_for(self, agent_type):
+        return self.models.get(agent_type, "bi-medix2")
+
+    async def generate(self, agent_type, messages, max_tokens=512, temperature=0.7):
+        key = self.model_key_for(agent_type)
+        prompt = messages[-1]["content"]
+        self.calls.append(prompt.rsplit("\n\n", 1)[-1].split()[0])
+        self.active[key] += 1
+        self.peak[key] = max(self.peak[key], self.active[key])
+        try:
+            await asyncio.sleep(float(prompt.rsplit("sleep=", 1)[1]))
+        finally:
+            self.active[key] -= 1
+        if "fail" in prompt.rsplit("\n\n", 1)[-1] or agent_type in self.down:
+            raise RuntimeError("backend down")
+        if agent_type in self.stubbed:
+            return {"text": "This is a stub response.", "model": key, "tokens_generated": 5,
+                    "backend": "llama_cpp", "gpu_ids": [0], "stub": True}
+        if agent_type in self.fallback:
+            return {"text": f"fallback {prompt[-20:]}", "model": "qwen-0.6b-med", "tokens_generated": 3,
+                    "backend": "llama_cpp", "gpu_ids": [0], "fallback_used": True}
+        return {"text": f"done {prompt[-20:]}", "model": key, "tokens_generated": 3, "backend": "llama_cpp", "gpu_ids": [0]}
+
+
+def _task(task_id, delay, agent="Chat", deps=(), **kwargs):
+    return AgentTask(agent_type=agent, prompt=f"{task_id} sleep={delay}", task_id=task_id, dependencies=list(deps), **kwargs)
+
+
+def _run(orchestrator, tasks, **kwargs):
+    return asyncio.run(orchestrator.execute_workflow(WorkflowType.PARALLEL_QA, {}, custom_tasks=tasks, **kwargs))
+
+
+def test_dependents_start_without_waiting_for_the_wave():
+    orchestrator = LLMOrchestrator(FakeRouter())
+    result = _run(orchestrator, [
+        _task("slow", 0.3),
+        _task("fast", 0.05),
+        _task("after_fast", 0.4, deps=["fast"]),
+    ])
+    by_id = {r.task_id: r for r in result.results}
+    assert result.success
+    # Waves would start after_fast at 300ms and finish at 700ms
+    assert by_id["after_fast"].started_ms < 150
+    assert result.total_latency_ms < 600
+    assert result.critical_path == ["fast", "after_fast"]
+    assert result.critical_path_ms == pytest.approx(450, abs=60)
+    assert result.speedup == pytest.approx(750 / result.total_latency_ms, rel=0.1) and result.speedup > 1.4
+
+
+def test_per_model_concurrency_caps():
+    router = FakeRouter({"Clinical": "biomistral-7b", "Chat": "qwen-0.6b-med"})
+    orchestrator = LLMOrchestrator(router, model_concurrency={"biomistral-7b": 1}, default_concurrency=4)
+    tasks = [_task(f"clinical_{i}", 0.05, agent="Clinical") for i in range(4)]
+    tasks += [_task(f"chat_{i}", 0.05) for i in range(2)]
+    result = _run(orchestrator, tasks)
+    assert result.success
+    assert router.peak["biomistral-7b"] == 1 and router.peak["qwen-0.6b-med"] == 2
+    assert max(r.metadata["queue_ms"] for r in result.results if r.agent_type == "Clinical") > 100
+    assert orchestrator.get_stats()["models"]["biomistral-7b"] == {"limit": 1, "in_flight": 0}
+
+
+def test_timeouts_skip_dependents_and_return_partial_results():
+    orchestrator = LLMOrchestrator(FakeRouter())
+    result = _run(orchestrator, [
+        _task("hung", 5, timeout_s=0.1),
+        _task("needs_hung", 0.01, deps=["hung"]),
+        _task("ok", 0.01),
+    ])
+    by_id = {r.task_id: r for r in result.results}
+    assert by_id["hung"].error == "timeout after 0.1s"
+    assert by_id["needs_hung"].error == "skipped: dependency hung failed"
+    assert by_id["ok"].success and not result.success
+
+    result = _run(orchestrator, [_task("long", 5), _task("quick", 0.01), _task("later", 0.01, deps=["long"])], timeout_s=0.2)
+    by_id = {r.task_id: r for r in result.results}
+    assert result.total_latency_ms < 1000
+    assert by_id["quick"].success and "done" in result.aggregated_content
+    assert by_id["long"].error == "cancelled: workflow timeout after 0.2s"
+    assert by_id["later"].error == "skipped: dependency long failed"
+    assert orchestrator.get_stats()["timeouts"] == 1
+
+
+def test_failed_and_unresolvable_dependencies():
+    orchestrator = LLMOrchestrator(FakeRouter())
+    result = _run(orchestrator, [
+        _task("fail", 0.01),
+        _task("after_fail", 0.01, deps=["fail"]),
+        _task("after_after", 0.01, deps=["after_fail"]),
+        _task("cycle_a", 0.01, deps=["cycle_b"]),
+        _task("cycle_b", 0.01, deps=["cycle_a"]),
+        _task("orphan", 0.01, deps=["missing"]),
+    ])
+    errors = {r.task_id: r.error for r in result.results}
+    assert errors["fail"] == "backend down"
+    assert errors["after_fail"] == "skipped: dependency fail failed"
+    assert errors["after_after"] == "skipped: dependency after_fail failed"
+    assert errors["cycle_a"] == "unresolved dependencies: ['cycle_b']"
+    assert errors["orphan"] == "unknown dependencies: ['missing']"
+    assert [r.task_id for r in result.results] == ["fail", "after_fail", "after_after", "cycle_a", "cycle_b", "orphan"]
+
+
+def test_rerun_after_downstream_failure_resumes_from_memo():
+    router = FakeRouter()
+    orchestrator = LLMOrchestrator(router)
+    tasks = lambda: [
+        _task("clinical", 0.2, agent="Clinical"),
+        _task("billing", 0.01, agent="Billing", deps=["clinical"]),
+    ]
+    router.down.add("Billing")
+    first = _run(orchestrator, tasks())
+    assert not first.success and first.metadata["failed_tasks"] == ["billing"]
+
+    router.down.clear()
+    second = _run(orchestrator, tasks())
+    assert second.success and second.metadata["memoized_tasks"] == ["clinical"]
+    assert router.calls == ["clinical", "billing", "billing"]  # Clinical summary not regenerated
+    assert second.total_latency_ms < 150
+    clinical = second.results[0]
+    assert clinical.latency_ms == 0 and clinical.metadata["saved_ms"] >= 200 and clinical.content == first.results[0].content
+
+    third = _run(orchestrator, tasks())
+    assert third.metadata["memoized_tasks"] == ["clinical", "billing"] and len(router.calls) == 3
+    refreshed = _run(orchestrator, tasks(), refresh=True)
+    assert refreshed.metadata["memoized_tasks"] == [] and len(router.calls) == 5
+    stats = orchestrator.get_stats()["memo"]
+    assert stats["hits"] == 3 and stats["misses"] == 3 and stats["saved_tokens"] == 9 and stats["size"] == 2
+
+
+def test_stub_replies_during_an_outage_are_not_memoized():
+    router = FakeRouter()
+    orchestrator = LLMOrchestrator(router)
+    tasks = lambda: [
+        _task("clinical", 0.01, agent="Clinical"),
+        _task("codes", 0.01, agent="Billing", deps=["clinical"]),
+    ]
+    router.stubbed.add("Billing")
+    outage = _run(orchestrator, tasks())
+    assert outage.results[1].error == "all model backends unavailable (stub response)"
+    assert "stub" not in outage.aggregated_content
+
+    router.stubbed.clear()
+    recovered = _run(orchestrator, tasks())
+    assert recovered.success and recovered.metadata["memoized_tasks"] == ["clinical"]
+    assert recovered.results[1].content.startswith("done") and router.calls == ["clinical", "codes", "codes"]
+
+
+def test_fallback_answers_are_not_memoized_under_the_primary_model():
+    router = FakeRouter()
+    orchestrator = LLMOrchestrator(router)
+    tasks = lambda: [_task("clinical", 0.01, agent="Clinical"), _task("codes", 0.01, agent="Billing")]
+    router.fallback.add("Billing")
+    degraded = _run(orchestrator, tasks())
+    codes = degraded.results[1]
+    assert degraded.success and codes.metadata["fallback_used"] and codes.model == "qwen-0.6b-med"
+    assert degraded.results[0].metadata["fallback_used"] is False
+
+    router.fallback.clear()
+    recovered = _run(orchestrator, tasks())
+    assert recovered.metadata["memoized_tasks"] == ["clinical"]
+    assert recovered.results[1].content.startswith("done") and router.calls == ["clinical", "codes", "codes"]
+
+
+def test_memo_keys_bounds_and_expiry():
+    task = _task("summary", 0.01, agent="Clinical")
+    key = TaskMemo.key("biomistral-7b", task, "[vitals Result]:\nBP 120/80\n\nsummarise")
+    assert key != TaskMemo.key("biomistral-7b", task, "[vitals Result]:\nBP 160/95\n\nsummarise")
+    assert key != TaskMemo.key("bi-medix2", task, "[vitals Result]:\nBP 120/80\n\nsummarise")
+    assert key != TaskMemo.key("biomistral-7b", _task("summary", 0.01, agent="Clinical", temperature=0.1),
+                               "[vitals Result]:\nBP 120/80\n\nsummarise")
+
+    def result(task_id, success=True):
+        return AgentResult(task_id=task_id, agent_type="Clinical", success=success, content="ok", model="m",
+                           latency_ms=50, tokens=4, error=None if success else "boom")
+
+    memo = TaskMemo(ttl_s=60, max_entries=2)
+    memo.put("failed", result("a", success=False))
+    for name in ("a", "b", "c"):
+        memo.put(name, result(name))
+    assert memo.get("failed", task) is None and memo.get("a", task) is None  # Never stored / evicted
+    hit = memo.get("c", task)
+    assert hit.task_id == "summary" and hit.metadata == {"memoized": True, "saved_ms": 50}
+    hit.metadata["queue_ms"] = 0.0
+    assert memo.get("c", task).metadata == {"memoized": True, "saved_ms": 50}  # Stored copy untouched
+
+    expiring = TaskMemo(ttl_s=0.01)
+    expiring.put("k", result("k"))
+    asyncio.run(asyncio.sleep(0.02))
+    assert expiring.get("k", task) is None and expiring.get_stats()["expired"] == 1
+    assert TaskMemo(ttl_s=0).get_stats()["enabled"] is False
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))